@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Benchmark: fast AMF0 codec against PyAMF on typical invoke messages.
+
+Usage: python benchmarks/amf0.py [iterations]
+
+Should be run from directory with fmspy.cfg.
+"""
+
+import sys
+import time
+
+import pyamf
+
+from fmspy.rtmp import amf0
+from fmspy.rtmp.status import Status
+
+messages = {
+        '_result' : ('_result', 1.0, None, Status('NetConnection.Connect.Success', 'status', 'Connect OK')),
+        'onStatus' : ('onStatus', 0.0, None, Status('NetStream.Play.Start', 'status', 'Started playing', details='stream')),
+        'message' : ('message', 5.0, None, u'Hello, world!', 'user12'),
+        'connect' : ('connect', 1.0, { 'app' : 'chat', 'flashVer' : 'MAC 10,0,32,18', 'tcUrl' : 'rtmp://localhost/chat',
+                                       'fpad' : False, 'capabilities' : 15.0, 'audioCodecs' : 3191.0,
+                                       'videoCodecs' : 252.0, 'videoFunction' : 1.0, 'objectEncoding' : 0.0 }),
+    }
+
+def measure(func, iterations, repeat=5):
+    """
+    Run function L{iterations} times, return calls per second (best of L{repeat} runs).
+    """
+    best = None
+    for r in xrange(repeat):
+        start = time.time()
+        for i in xrange(iterations):
+            func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return iterations / best
+
+def main(iterations):
+    print "%-10s %12s %12s %12s %12s" % ('message', 'pyamf enc/s', 'fast enc/s', 'pyamf dec/s', 'fast dec/s')
+
+    for (name, values) in sorted(messages.iteritems()):
+        data = amf0.encode(*values)
+
+        results = (
+                measure(lambda: pyamf.encode(*values, **{ 'encoding' : pyamf.AMF0 }).getvalue(), iterations),
+                measure(lambda: amf0.encode(*values), iterations),
+                measure(lambda: list(pyamf.decode(data, encoding=pyamf.AMF0)), iterations),
+                measure(lambda: amf0.decode(data), iterations),
+            )
+
+        print "%-10s %12.0f %12.0f %12.0f %12.0f" % ((name, ) + results)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Benchmark: RTMP handshakes per second on loopback.
+
+Usage: python benchmarks/handshake.py [connections] [concurrency]
+
+Should be run from directory with fmspy.cfg.
+"""
+
+import sys
+import time
+
+from twisted.internet import reactor, protocol
+from twisted.python import log
+
+from fmspy.rtmp.protocol.server import RTMPServerFactory
+from fmspy.rtmp.admission import AdmissionControl
+from fmspy.rtmp.protocol.client import RTMPClientProtocol
+
+class BenchmarkClientProtocol(RTMPClientProtocol):
+    """
+    Client, disconnecting right after handshake.
+    """
+
+    def _handshakeComplete(self):
+        RTMPClientProtocol._handshakeComplete(self)
+        self.transport.loseConnection()
+        self.factory.completed()
+
+class BenchmarkClientFactory(protocol.ClientFactory):
+    """
+    Keeps L{concurrency} handshakes in progress until L{total} completed.
+    """
+    protocol = BenchmarkClientProtocol
+
+    def __init__(self, port, total, concurrency):
+        self.port = port
+        self.total = total
+        self.started = 0
+        self.done = 0
+        self.start = time.time()
+
+        for i in xrange(min(concurrency, total)):
+            self.connect()
+
+    def connect(self):
+        self.started += 1
+        reactor.connectTCP('127.0.0.1', self.port, self)
+
+    def completed(self):
+        self.done += 1
+        if self.done == self.total:
+            elapsed = time.time() - self.start
+            print "%d handshakes in %.3f s: %.1f handshakes/sec" % (self.total, elapsed, self.total / elapsed)
+            reactor.stop()
+        elif self.started < self.total:
+            self.connect()
+
+    def clientConnectionFailed(self, connector, reason):
+        log.err(reason)
+        reactor.stop()
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    port = reactor.listenTCP(0, RTMPServerFactory(AdmissionControl()), backlog=concurrency, interface='127.0.0.1')
+    BenchmarkClientFactory(port.getHost().port, total, concurrency)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Benchmark: RTMP header bytes per second for live stream.
+
+Simulates live stream (30 fps video, 44.1 kHz AAC audio) on single
+NetStream and counts bytes of chunk headers sent by assembler, with
+media on shared object_id and on dedicated object_ids.
+
+Usage: python benchmarks/headers.py [seconds]
+
+Should be run from directory with fmspy.cfg.
+"""
+
+import sys
+
+from fmspy.rtmp import constants
+from fmspy.rtmp.assembly import RTMPAssembler
+from fmspy.rtmp.header import RTMPHeader
+from fmspy.rtmp.packets import DataPacket
+
+class SharedMediaAssembler(RTMPAssembler):
+    """
+    Assembler sending media over object_id of packet.
+    """
+
+    separateMedia = False
+
+class NullTransport(object):
+    """
+    Transport discarding all data.
+    """
+
+    def write(self, data):
+        pass
+
+def stream(seconds):
+    """
+    Generate media packets of live stream, ordered by timestamp.
+
+    @return: (timestamp, type, length)
+    @rtype: C{list}
+    """
+    packets = []
+
+    for frame in xrange(int(seconds * 44100 / 1024)):
+        packets.append((int(frame * 1024 * 1000 / 44100), constants.AUDIO_DATA, 372))
+
+    for frame in xrange(seconds * 30):
+        packets.append((int(frame * 1000 / 30), constants.VIDEO_DATA, 6000 if frame % 60 == 0 else 1500))
+
+    packets.sort()
+    return packets
+
+def measure(packets, separateMedia):
+    """
+    Send packets through assembler.
+
+    @return: total bytes of chunk headers
+    @rtype: C{int}
+    """
+    if separateMedia:
+        a = RTMPAssembler(constants.DEFAULT_CHUNK_SIZE, NullTransport())
+    else:
+        a = SharedMediaAssembler(constants.DEFAULT_CHUNK_SIZE, NullTransport())
+
+    payload = 0
+    for (timestamp, type, length) in packets:
+        a.push_packet(DataPacket(header=RTMPHeader(object_id=constants.DEFAULT_INVOKE_OBJECT_ID + 1, timestamp=timestamp,
+                                                   length=length, type=type, stream_id=1), data="\x00" * length))
+        payload += length
+
+    return a.bytes - payload
+
+def main(seconds):
+    packets = stream(seconds)
+
+    print "%-20s %14s" % ('media object_ids', 'header bytes/s')
+    for (name, separateMedia) in (('shared', False), ('dedicated', True)):
+        print "%-20s %14.1f" % (name, float(measure(packets, separateMedia)) / seconds)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 60)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Benchmark: memory footprint of idle chat connection.
+
+Creates connections (without sockets), completes handshake and
+connects them to chat application, then measures growth of process
+memory per connection. Memory of real transports (sockets, Twisted TCP
+objects) is not included.
+
+Usage: python benchmarks/memory.py [connections]
+
+Should be run from directory with fmspy.cfg. Linux only (uses /proc).
+"""
+
+import sys
+import gc
+import os
+
+from twisted.python import log
+
+from fmspy.rtmp import constants
+from fmspy.rtmp.assembly import RTMPAssembler
+from fmspy.rtmp.header import RTMPHeader
+from fmspy.rtmp.packets import Invoke
+from fmspy.rtmp.protocol.server import RTMPServerProtocol
+from fmspy.application import app_factory
+from fmspy.plugins.chat_application import ChatApplication
+
+class NullTransport(object):
+    """
+    Transport discarding all data.
+    """
+
+    disconnecting = False
+
+    def write(self, data):
+        pass
+
+    def writeSequence(self, data):
+        pass
+
+    def loseConnection(self):
+        self.disconnecting = True
+
+    def registerProducer(self, producer, streaming):
+        pass
+
+class BufferTransport(NullTransport):
+    """
+    Transport collecting written data.
+    """
+
+    def __init__(self):
+        self.data = []
+
+    def write(self, data):
+        self.data.append(data)
+
+def rss():
+    """
+    Resident set size of process (bytes).
+    """
+    return int(open('/proc/self/statm').read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def client_data():
+    """
+    Build data sent by client: handshake and connect invoke.
+    """
+    buf = BufferTransport()
+    a = RTMPAssembler(constants.DEFAULT_CHUNK_SIZE, buf)
+    a.push_packet(Invoke('connect', [{ 'app' : 'chat', 'flashVer' : 'LNX 10,0,32,18', 'objectEncoding' : 0 }], 1.0,
+                         RTMPHeader(timestamp=0, stream_id=0)))
+
+    handshake = "\x03" + "\x00" * constants.HANDSHAKE_SIZE
+    return [handshake, "\x00" * constants.HANDSHAKE_SIZE, ''.join(buf.data)]
+
+def main(count):
+    log.startLoggingWithObserver(lambda event: None, setStdout=False)
+    app_factory.apps['chat'] = ChatApplication()
+    data = client_data()
+
+    connections = []
+    gc.collect()
+    before = rss()
+
+    for i in xrange(count):
+        p = RTMPServerProtocol()
+        p.makeConnection(NullTransport())
+        for chunk in data:
+            p.dataReceived(chunk)
+        assert p.state == p.State.RUNNING and p.application is not None
+        connections.append(p)
+
+    gc.collect()
+    after = rss()
+
+    print "%d idle connections: %.0f bytes per connection" % (count, float(after - before) / count)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
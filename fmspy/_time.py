@@ -14,9 +14,20 @@ def seconds():
     """
     return int(time.time())
 
+def precise():
+    """
+    Current time in seconds with fractions (UTC).
+    """
+    return time.time()
+
 def milliseconds():
     """
     Current time in milliseconds (UTC).
     """
     return int(time.time() * 1000)
 
+def cpu():
+    """
+    Processor time used by server process so far (seconds).
+    """
+    return time.clock()
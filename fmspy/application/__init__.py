@@ -9,5 +9,7 @@ Basis Application class, Room (context).
 """
 
 from fmspy.application.application import Application
+from fmspy.application.offload import offload, THREAD, PROCESS
+from fmspy.application.cache import cached
 
 from fmspy.application.factory import factory as app_factory
@@ -6,13 +6,17 @@
 Base application class.
 """
 
+import os
 import ConfigParser
 
 from zope.interface import implements
 from twisted.internet import defer
 
 from fmspy.application.room import Room
+from fmspy.application.offload import Offloader
+from fmspy.application.cache import InvokeCache
 from fmspy.application.interfaces import IApplication
+from fmspy.stats import accounting
 from fmspy.config import config
 
 class Application(object):
@@ -23,6 +27,10 @@ class Application(object):
     @type hall: L{Room}
     @ivar rooms: named application rooms
     @type rooms: C{dict}
+    @ivar offloader: thread and process pools for offloaded invokes
+    @type offloader: L{Offloader}
+    @ivar invokeCache: cache of cacheable invoke results
+    @type invokeCache: L{InvokeCache}
     """
     implements(IApplication)
 
@@ -32,6 +40,28 @@ class Application(object):
         """
         self.hall = Room(self)
         self.rooms = {}
+        self.offloader = Offloader(self.__class__.__name__,
+                maxConcurrent=self._getint('offloadConcurrency', 4),
+                maxQueue=self._getint('offloadQueue', 100),
+                threads=self._getint('offloadThreads', 4),
+                processes=self._getint('offloadProcesses', 2),
+                processTimeout=self._getint('offloadTimeout', 60))
+        self.invokeCache = InvokeCache(maxBytes=self._getint('invokeCacheSize', 1048576))
+
+    def _getint(self, option, default):
+        """
+        Get integer option from application config section.
+
+        @param option: option name
+        @type option: C{str}
+        @param default: value if option is missing
+        @type default: C{int}
+        @rtype: C{int}
+        """
+        try:
+            return config.getint(self.__class__.__name__, option)
+        except ConfigParser.Error:
+            return default
 
     def room_empty(self, room):
         """
@@ -45,6 +75,7 @@ class Application(object):
 
         self.appDestroyRoom(room)
         del self.rooms[room.name]
+        accounting.forget_room(self, room)
         room.dismiss()
 
     def name(self):
@@ -79,6 +110,36 @@ class Application(object):
         """
         pass # nothing to do
 
+    def streamPath(self, name):
+        """
+        Find file of recorded stream.
+
+        Recorded streams are FLV files in option C{streamsDirectory} of
+        application section, by default it is subdirectory (named after
+        application) of C{streamsDirectory} in C{RTMP} section.
+
+        @param name: stream name (C{flv:} prefix and extension are optional)
+        @type name: C{str}
+        @return: path to file or C{None}, if there's no such stream
+        @rtype: C{str}
+        """
+        if name.startswith('flv:'):
+            name = name[4:]
+        if not name.endswith('.flv'):
+            name += '.flv'
+
+        try:
+            directory = config.get(self.__class__.__name__, 'streamsDirectory')
+        except ConfigParser.Error:
+            directory = os.path.join(config.get('RTMP', 'streamsDirectory'), self.name())
+
+        directory = os.path.abspath(directory)
+        path = os.path.abspath(os.path.join(directory, name))
+        if not path.startswith(directory + os.sep) or not os.path.isfile(path):
+            return None
+
+        return path
+
     def __repr__(self):
         return "<%s>" % self.__class__.__name__
 
@@ -135,6 +196,7 @@ class Application(object):
             def realEnterRoom(_):
                 room.enter(protocol)
                 protocol._app.room = room
+                accounting.enter(protocol, self, room)
 
             def cleanupRoom(f):
                 if room.empty() and room is not self.hall:
@@ -155,6 +217,7 @@ class Application(object):
         @type protocol: L{RTMPServerProtocol}
         """
         self.appLeaveRoom(protocol, protocol._app.room)
+        accounting.leave(protocol)
         protocol._app.room.leave(protocol)
         del protocol._app.room
 
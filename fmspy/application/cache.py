@@ -0,0 +1,193 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Caching results of idempotent invokes.
+
+Application marks C{invoke_*} method with L{cached} decorator,
+results of such invokes are cached by method name and arguments.
+"""
+
+import time
+import hashlib
+
+from collections import OrderedDict
+
+from twisted.internet import defer
+
+from fmspy.rtmp import amf0
+from fmspy.stats import metrics
+
+def cached(ttl=60):
+    """
+    Decorator, marking invoke handler as cacheable.
+
+    Handler result should depend only on invoke arguments
+    (not on calling client), it is shared by all clients
+    of application.
+
+    @param ttl: time to live of cached result (seconds)
+    @type ttl: C{float}
+    """
+    def decorator(func):
+        func.cache_ttl = ttl
+        return func
+
+    return decorator
+
+class CacheEntry(object):
+    """
+    Cached invoke result.
+
+    @ivar value: invoke result
+    @ivar expires: expiration time
+    @type expires: C{float}
+    @ivar size: approximate size of entry (bytes)
+    @type size: C{int}
+    """
+
+    def __init__(self, value, expires, size):
+        """
+        Constructor.
+        """
+        self.value = value
+        self.expires = expires
+        self.size = size
+
+class InvokeCache(object):
+    """
+    LRU cache of invoke results.
+
+    Results are cached by method name and hash of AMF-encoded arguments.
+    Concurrent calls with the same key are coalesced onto single
+    handler call. Cache size is limited by L{maxBytes} (sum of sizes
+    of AMF-encoded results), least recently used entries are evicted.
+
+    Cache reports C{invoke_cache.hits}, C{invoke_cache.misses},
+    C{invoke_cache.coalesced}, C{invoke_cache.evictions} counters and
+    C{invoke_cache.bytes} gauge.
+
+    @ivar maxBytes: maximum size of cache
+    @type maxBytes: C{int}
+    @ivar bytes: current size of cache
+    @type bytes: C{int}
+    @ivar entries: cached results in LRU order, key -> L{CacheEntry}
+    @type entries: C{OrderedDict}
+    @ivar inflight: waiters for calls in progress, key -> C{list} of C{Deferred}s
+    @type inflight: C{dict}
+    """
+
+    def __init__(self, maxBytes=1048576, clock=time.time):
+        """
+        Constructor.
+
+        @param maxBytes: maximum size of cache
+        @type maxBytes: C{int}
+        @param clock: time source
+        @type clock: C{callable}
+        """
+        self.maxBytes = maxBytes
+        self.clock = clock
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.inflight = {}
+
+    def key(self, name, args):
+        """
+        Build cache key for invoke.
+
+        @param name: invoke name
+        @type name: C{str}
+        @param args: invoke arguments
+        @type args: C{tuple}
+        @rtype: C{str}
+        """
+        return name + ':' + hashlib.sha1(amf0.encode(*args)).hexdigest()
+
+    def call(self, name, args, ttl, func, *callargs):
+        """
+        Get cached result of invoke or call handler.
+
+        @param name: invoke name
+        @type name: C{str}
+        @param args: invoke arguments (used as key)
+        @type args: C{tuple}
+        @param ttl: time to live of result (seconds)
+        @type ttl: C{float}
+        @param func: handler to call on cache miss
+        @param callargs: handler arguments
+        @return: Deferred invoke result
+        @rtype: C{Deferred}
+        """
+        key = self.key(name, args)
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            del self.entries[key]
+            if entry.expires > self.clock():
+                metrics.increment('invoke_cache.hits')
+                self.entries[key] = entry
+                return defer.succeed(entry.value)
+
+            self._forget(entry)
+
+        waiters = self.inflight.get(key)
+        if waiters is not None:
+            metrics.increment('invoke_cache.coalesced')
+            d = defer.Deferred()
+            waiters.append(d)
+            return d
+
+        metrics.increment('invoke_cache.misses')
+        self.inflight[key] = []
+
+        def gotResult(result):
+            self._store(key, result, ttl)
+            for d in self.inflight.pop(key):
+                d.callback(result)
+            return result
+
+        def gotError(fail):
+            for d in self.inflight.pop(key):
+                d.errback(fail)
+            return fail
+
+        return defer.maybeDeferred(func, *callargs).addCallbacks(gotResult, gotError)
+
+    def _store(self, key, value, ttl):
+        """
+        Store result in cache.
+        """
+        try:
+            size = len(key) + len(amf0.encode(value))
+        except Exception:
+            return
+
+        if size > self.maxBytes:
+            return
+
+        entry = CacheEntry(value, self.clock() + ttl, size)
+        self.entries[key] = entry
+        self.bytes += size
+        metrics.adjust('invoke_cache.bytes', size)
+
+        while self.bytes > self.maxBytes:
+            (_, oldest) = self.entries.popitem(last=False)
+            self._forget(oldest)
+            metrics.increment('invoke_cache.evictions')
+
+    def _forget(self, entry):
+        """
+        Entry was removed from cache.
+        """
+        self.bytes -= entry.size
+        metrics.adjust('invoke_cache.bytes', -entry.size)
+
+    def clear(self):
+        """
+        Drop all cached results.
+        """
+        for entry in self.entries.itervalues():
+            self._forget(entry)
+        self.entries.clear()
@@ -0,0 +1,268 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Time-shift (DVR) buffer of live streams.
+
+Tags of live stream are written as FLV tags into fixed-size ring file,
+which is memory-mapped. Only small time index (keyframe positions) is
+kept in memory, so memory usage doesn't depend on DVR window length.
+"""
+
+import os
+import mmap
+import tempfile
+
+from bisect import bisect_right
+from collections import deque
+
+from fmspy.rtmp.flv import encode_tag, decode_tag_header, decode_tag, TAG_HEADER_SIZE
+from fmspy.rtmp.packets import AudioData, VideoData
+
+class DVRRing(object):
+    """
+    Ring of live stream tags in memory-mapped file.
+
+    Tags are written one after another at absolute positions (bytes
+    written since start), position modulo L{size} is offset in file.
+    Tag never wraps around end of file: if it doesn't fit, zero byte
+    is written and tag goes to the beginning of file. Tag at absolute
+    position is valid while position is not older than L{size} bytes.
+
+    @ivar size: size of ring (bytes)
+    @type size: C{int}
+    @ivar path: path to ring file
+    @type path: C{str}
+    @ivar map: memory-mapped ring file (C{None} when closed)
+    @type map: C{mmap}
+    @ivar head: absolute position of next tag
+    @type head: C{int}
+    @ivar timestamps: timestamps of index entries
+    @type timestamps: C{deque} of C{int}
+    @ivar positions: absolute positions of index entries
+    @type positions: C{deque} of C{int}
+    @ivar hasVideo: were there any video tags?
+    @type hasVideo: C{bool}
+    """
+
+    indexInterval = 1000
+    """
+    Interval between index entries for audio-only streams (ms).
+    """
+
+    def __init__(self, size, directory=None):
+        """
+        Create ring file.
+
+        @param size: size of ring (bytes)
+        @type size: C{int}
+        @param directory: directory for ring file (default is system temporary directory)
+        @type directory: C{str}
+        """
+        self.size = size
+        (fd, self.path) = tempfile.mkstemp(suffix='.dvr', dir=directory or None)
+        try:
+            os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        self.head = 0
+        self.timestamps = deque()
+        self.positions = deque()
+        self.hasVideo = False
+
+    def __repr__(self):
+        return "<DVRRing(%r, %d entries)>" % (self.path, len(self.positions))
+
+    @property
+    def tail(self):
+        """
+        Absolute position of oldest valid byte.
+
+        @rtype: C{int}
+        """
+        return max(0, self.head - self.size)
+
+    def close(self):
+        """
+        Close and remove ring file.
+        """
+        if self.map is None:
+            return
+
+        self.map.close()
+        self.map = None
+        self.timestamps.clear()
+        self.positions.clear()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def write(self, packet):
+        """
+        Append packet to ring.
+
+        @param packet: packet of live stream
+        @type packet: L{MediaPacket} or L{Notify}
+        """
+        (header, segments) = encode_tag(packet)
+        length = len(header) + sum([len(segment) for segment in segments])
+        if length > self.size:
+            return
+
+        offset = self.head % self.size
+        if offset + length > self.size:
+            self.map[offset] = "\x00"
+            self.head += self.size - offset
+            offset = 0
+
+        cls = packet.__class__
+        timestamp = packet.header.timestamp
+        if cls is VideoData:
+            self.hasVideo = True
+            if packet.isKeyframe:
+                self._addIndex(timestamp)
+        elif cls is AudioData and not self.hasVideo:
+            if not self.timestamps or timestamp >= self.timestamps[-1] + self.indexInterval:
+                self._addIndex(timestamp)
+
+        self.map[offset:offset+len(header)] = header
+        offset += len(header)
+        for segment in segments:
+            self.map[offset:offset+len(segment)] = segment
+            offset += len(segment)
+        self.head += length
+
+        tail = self.tail
+        positions = self.positions
+        while positions and positions[0] < tail:
+            positions.popleft()
+            self.timestamps.popleft()
+
+    def _addIndex(self, timestamp):
+        """
+        Add index entry for tag being written.
+
+        @param timestamp: timestamp of tag
+        @type timestamp: C{int}
+        """
+        self.timestamps.append(timestamp)
+        self.positions.append(self.head)
+
+    def find(self, timestamp):
+        """
+        Find index entry to start playback from.
+
+        @param timestamp: requested timestamp
+        @type timestamp: C{int}
+        @return: timestamp and absolute position of last entry
+            not after requested timestamp (or of oldest entry), C{None}
+            if ring is empty
+        @rtype: (C{int}, C{int})
+        """
+        if not self.positions:
+            return None
+
+        i = max(0, bisect_right(self.timestamps, timestamp) - 1)
+        return (self.timestamps[i], self.positions[i])
+
+    def reader(self, timestamp):
+        """
+        Create reader starting at requested timestamp.
+
+        @param timestamp: requested timestamp
+        @type timestamp: C{int}
+        @rtype: L{DVRReader}
+        """
+        entry = self.find(timestamp)
+        if entry is None:
+            return DVRReader(self, self.head, timestamp)
+
+        return DVRReader(self, entry[1], entry[0])
+
+class DVRReader(object):
+    """
+    Sequential reader of L{DVRRing}.
+
+    Reader has the same interface as L{FLVReader}, but L{next} returns
+    C{None} also when reader caught up with live stream, playback should
+    be continued while L{growing}.
+
+    @ivar ring: ring
+    @type ring: L{DVRRing}
+    @ivar position: absolute position of next tag
+    @type position: C{int}
+    @ivar start: timestamp of first tag
+    @type start: C{int}
+    @ivar overrun: reader was moved forward, as its tags were overwritten
+    @type overrun: C{bool}
+    """
+
+    def __init__(self, ring, position, start):
+        """
+        Constructor.
+        """
+        self.ring = ring
+        self.position = position
+        self.start = start
+        self.overrun = False
+
+    @property
+    def growing(self):
+        """
+        Is ring still being written to?
+
+        @rtype: C{bool}
+        """
+        return self.ring.map is not None
+
+    def close(self):
+        """
+        Stop reading.
+        """
+        self.ring = _closedRing
+
+    def next(self):
+        """
+        Read next tag.
+
+        @return: next packet or C{None} if there's nothing to read yet
+        @rtype: L{MediaPacket} or L{Notify}
+        """
+        ring = self.ring
+        data = ring.map
+        if data is None:
+            return None
+
+        size = ring.size
+        while self.position < ring.head:
+            if self.position < ring.tail:
+                # tags were overwritten, jump to oldest index entry
+                self.overrun = True
+                self.position = ring.positions[0] if ring.positions else ring.head
+                continue
+
+            offset = self.position % size
+            if data[offset] == "\x00":
+                self.position += size - offset
+                continue
+
+            (type, length, timestamp) = decode_tag_header(data, offset)
+            self.position += TAG_HEADER_SIZE + length
+            packet = decode_tag(type, timestamp, data[offset+TAG_HEADER_SIZE:offset+TAG_HEADER_SIZE+length])
+            if packet is not None:
+                return packet
+
+        return None
+
+class _ClosedRing(object):
+    """
+    Placeholder for ring of closed reader.
+    """
+
+    map = None
+
+_closedRing = _ClosedRing()
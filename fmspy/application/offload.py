@@ -0,0 +1,310 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Offloading CPU-heavy invoke handlers from reactor.
+
+Application marks C{invoke_*} method with L{offload} decorator,
+such invokes are run in thread pool or process pool of application.
+"""
+
+import time
+import signal
+import cPickle
+
+from collections import deque
+
+from twisted.internet import defer, reactor, threads
+from twisted.python import threadpool, failure
+
+from fmspy.rtmp.constants import StatusCodes
+from fmspy.stats import metrics
+
+THREAD = 'thread'
+"""
+Run handler in thread pool.
+"""
+PROCESS = 'process'
+"""
+Run handler in process pool.
+"""
+
+def offload(kind=THREAD):
+    """
+    Decorator, marking invoke handler to be run outside of reactor.
+
+    Thread-offloaded handlers are called as usual (with application
+    and protocol), but they shouldn't touch protocol or other
+    reactor-owned objects.
+
+    Process-offloaded handlers should be module-level functions
+    (so that they could be pickled), they're called only with invoke
+    arguments::
+
+        @offload(PROCESS)
+        def compute(x, y):
+            return x ** y
+
+        class FooApplication(Application):
+            invoke_compute = compute
+
+    @param kind: L{THREAD} or L{PROCESS}
+    @type kind: C{str}
+    """
+    assert kind in (THREAD, PROCESS)
+
+    def decorator(func):
+        func.offload = kind
+        return func
+
+    return decorator
+
+class OffloadQueueFullError(Exception):
+    """
+    Too many offloaded invokes are waiting for execution.
+    """
+    code = StatusCodes.NC_CALL_FAILED
+
+class OffloadTimeoutError(Exception):
+    """
+    Process-offloaded invoke didn't complete in time.
+    """
+    code = StatusCodes.NC_CALL_FAILED
+
+def _initProcess():
+    """
+    Initialize process pool worker.
+
+    Workers are forked from server, signal handlers of reactor are
+    reset, so that workers could be terminated.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _callInProcess(func, args):
+    """
+    Run function in process pool worker.
+
+    Exceptions can't be delivered via C{apply_async} callback,
+    so result is wrapped. Result is pickled here: if it can't be
+    pickled, pool doesn't call callback at all.
+
+    @return: pickled (success, result or exception)
+    @rtype: C{str}
+    """
+    try:
+        result = (True, func(*args))
+    except Exception, e:
+        result = (False, e)
+
+    try:
+        return cPickle.dumps(result, 2)
+    except Exception, e:
+        return cPickle.dumps((False, cPickle.PicklingError(str(e))), 2)
+
+class Offloader(object):
+    """
+    Thread and process pools for offloaded invokes of application.
+
+    No more than L{maxConcurrent} invokes are executed at the same time,
+    other invokes wait in queue, no more than L{maxQueue} invokes
+    may wait. Time spent in queue is reported as timing C{offload.wait}.
+
+    Pools are created on first use. Process-offloaded invoke fails if
+    it doesn't complete in L{processTimeout} (e.g. worker died or hung),
+    process pool is recycled then (its workers are killed), so that
+    hung workers don't accumulate. Timeouts are counted as
+    C{offload.timeouts}.
+
+    @ivar name: owner name
+    @type name: C{str}
+    @ivar maxConcurrent: maximum number of invokes executed concurrently
+    @type maxConcurrent: C{int}
+    @ivar maxQueue: maximum number of waiting invokes
+    @type maxQueue: C{int}
+    @ivar threads: maximum number of threads in thread pool
+    @type threads: C{int}
+    @ivar processes: number of processes in process pool
+    @type processes: C{int}
+    @ivar processTimeout: timeout of process-offloaded invoke (seconds)
+    @type processTimeout: C{float}
+    @ivar running: number of invokes being executed
+    @type running: C{int}
+    @ivar queue: waiting invokes
+    @type queue: C{deque}
+    @ivar processCalls: timeouts of invokes running in process pool, by their C{Deferred}s
+    @type processCalls: C{dict}
+    """
+
+    def __init__(self, name, maxConcurrent=4, maxQueue=100, threads=4, processes=2, processTimeout=60):
+        """
+        Constructor.
+
+        @param name: owner name
+        @type name: C{str}
+        @param maxConcurrent: maximum number of invokes executed concurrently
+        @type maxConcurrent: C{int}
+        @param maxQueue: maximum number of waiting invokes
+        @type maxQueue: C{int}
+        @param threads: maximum number of threads in thread pool
+        @type threads: C{int}
+        @param processes: number of processes in process pool
+        @type processes: C{int}
+        @param processTimeout: timeout of process-offloaded invoke (seconds)
+        @type processTimeout: C{float}
+        """
+        self.name = name
+        self.maxConcurrent = maxConcurrent
+        self.maxQueue = maxQueue
+        self.threads = threads
+        self.processes = processes
+        self.processTimeout = processTimeout
+        self.running = 0
+        self.queue = deque()
+        self.threadPool = None
+        self.processPool = None
+        self.processCalls = {}
+
+    def run(self, kind, func, *args):
+        """
+        Run function outside of reactor.
+
+        @param kind: L{THREAD} or L{PROCESS}
+        @type kind: C{str}
+        @param func: function to call
+        @param args: function arguments
+        @return: Deferred result of function
+        @rtype: C{Deferred}
+        """
+        if self.running < self.maxConcurrent:
+            return self._start(time.time(), kind, func, args)
+
+        if len(self.queue) >= self.maxQueue:
+            metrics.increment('offload.rejected')
+            return defer.fail(OffloadQueueFullError(self.name))
+
+        d = defer.Deferred()
+        self.queue.append((time.time(), kind, func, args, d))
+        metrics.adjust('offload.queued', 1)
+        return d
+
+    def _start(self, queued, kind, func, args):
+        """
+        Start execution of function.
+        """
+        metrics.observe('offload.wait', time.time() - queued)
+
+        self.running += 1
+        metrics.adjust('offload.running', 1)
+
+        if kind == THREAD:
+            d = threads.deferToThreadPool(reactor, self._getThreadPool(), func, *args)
+        else:
+            d = self._deferToProcess(func, args)
+
+        return d.addBoth(self._finished)
+
+    def _finished(self, result):
+        """
+        Function execution finished, start next one from queue.
+        """
+        self.running -= 1
+        metrics.adjust('offload.running', -1)
+
+        if self.queue:
+            (queued, kind, func, args, d) = self.queue.popleft()
+            metrics.adjust('offload.queued', -1)
+            self._start(queued, kind, func, args).chainDeferred(d)
+
+        return result
+
+    def _getThreadPool(self):
+        """
+        Get thread pool, creating it if necessary.
+
+        @rtype: C{ThreadPool}
+        """
+        if self.threadPool is None:
+            self.threadPool = threadpool.ThreadPool(0, self.threads, 'offload-%s' % self.name)
+            self.threadPool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', self.threadPool.stop)
+
+        return self.threadPool
+
+    def _getProcessPool(self):
+        """
+        Get process pool, creating it if necessary.
+
+        @rtype: C{multiprocessing.Pool}
+        """
+        if self.processPool is None:
+            import multiprocessing
+
+            self.processPool = multiprocessing.Pool(self.processes, _initProcess)
+            reactor.addSystemEventTrigger('during', 'shutdown', self.processPool.close)
+
+        return self.processPool
+
+    def _deferToProcess(self, func, args):
+        """
+        Run function in process pool.
+
+        C{apply_async} callback is called in result thread of pool,
+        it is passed to reactor thread. Callback isn't called if worker
+        died or hung, so invoke is timed out in reactor.
+
+        @return: Deferred result of function
+        @rtype: C{Deferred}
+        """
+        try:
+            cPickle.dumps((func, args), 2)
+        except Exception:
+            return defer.fail()
+
+        pool = self._getProcessPool()
+        d = defer.Deferred()
+        self.processCalls[d] = reactor.callLater(self.processTimeout, self._processTimedOut, pool)
+
+        def gotResult(data):
+            if d not in self.processCalls:
+                # pool was recycled, invoke already failed
+                return
+
+            self.processCalls.pop(d).cancel()
+            try:
+                (success, result) = cPickle.loads(data)
+            except Exception:
+                d.errback()
+                return
+
+            if success:
+                d.callback(result)
+            else:
+                d.errback(failure.Failure(result))
+
+        pool.apply_async(_callInProcess, (func, args), callback=lambda data: reactor.callFromThread(gotResult, data))
+        return d
+
+    def _processTimedOut(self, pool):
+        """
+        Process-offloaded invoke timed out: kill workers of process pool
+        and fail all invokes running in it.
+
+        @param pool: process pool
+        @type pool: C{multiprocessing.Pool}
+        """
+        if pool is not self.processPool:
+            return
+
+        metrics.increment('offload.timeouts')
+
+        self.processPool = None
+        calls, self.processCalls = self.processCalls, {}
+        # terminating pool waits for its threads
+        reactor.callInThread(pool.terminate)
+
+        for (d, timeout) in calls.items():
+            if timeout.active():
+                timeout.cancel()
+            d.errback(OffloadTimeoutError(self.name))
@@ -6,6 +6,8 @@
 Application rooms.
 """
 
+from fmspy.application.stream import Stream, StreamGroup
+
 class Room(object):
     """
     Room (scope, context) is location inside application where clients meet.
@@ -19,6 +21,10 @@ class Room(object):
     @type name: C{str}
     @ivar application: application owning this room
     @type application: L{Application}
+    @ivar streams: live streams in room (by name)
+    @type streams: C{dict}
+    @ivar groups: stream groups in room (by name)
+    @type groups: C{dict}
     """
 
     def __init__(self, application, name='_'):
@@ -33,12 +39,16 @@ class Room(object):
         self.name = name
         self.application = application
         self.clients = set()
+        self.streams = {}
+        self.groups = {}
 
     def dismiss(self):
         """
         Close room.
         """
         self.clients = set()
+        self.streams = {}
+        self.groups = {}
         self.application = None
 
     def __eq__(self, other):
@@ -84,6 +94,34 @@ class Room(object):
         """
         return self.clients.__iter__()
 
+    def stream(self, name):
+        """
+        Get live stream by name, stream is created if necessary.
+
+        @param name: stream name
+        @type name: C{str}
+        @rtype: L{Stream}
+        """
+        if name not in self.streams:
+            self.streams[name] = Stream(self, name)
+
+        return self.streams[name]
+
+    def addGroup(self, name, renditions):
+        """
+        Create stream group (adaptive bitrate).
+
+        Renditions are live streams of this room, published as usual.
+
+        @param name: group name
+        @type name: C{str}
+        @param renditions: names and bitrates (bits per second) of renditions
+        @type renditions: C{list} of (C{str}, C{int})
+        @rtype: L{StreamGroup}
+        """
+        group = self.groups[name] = StreamGroup(self, name, renditions)
+        return group
+
     def empty(self):
         """
         Is this room empty?
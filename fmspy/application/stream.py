@@ -0,0 +1,727 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Live streams and stream groups (adaptive bitrate).
+"""
+
+from twisted.python import log
+
+from fmspy.application.dvr import DVRRing
+from fmspy.hls.segmenter import segmenter
+from fmspy.rtmp import constants, status
+from fmspy.rtmp.assembly import media_object_id
+from fmspy.rtmp.header import RTMPHeader
+from fmspy.rtmp.packets import MediaPacket, AudioData, VideoData, Notify
+from fmspy.config import config
+from fmspy import _time
+
+class StreamBusyError(Exception):
+    """
+    Stream is already published.
+    """
+
+    code = constants.StatusCodes.NS_PUBLISH_BADNAME
+
+class Subscription(object):
+    """
+    Subscription of client's NetStream to live stream (playback).
+
+    Client may pause playback or disable audio or video, packets
+    are dropped here, before they reach client protocol. Video is
+    resumed from next keyframe, codec configuration is sent before
+    first audio and video packet after resume. Playback starts
+    the same way, as client may join stream in the middle of GOP.
+
+    @ivar protocol: client protocol
+    @type protocol: L{RTMPServerProtocol}
+    @ivar stream_id: Stream ID of client's NetStream
+    @type stream_id: C{int}
+    @ivar stream: live stream
+    @type stream: L{Stream}
+    @ivar offset: added to timestamps of stream packets
+    @type offset: C{int}
+    @ivar paused: is playback paused?
+    @type paused: C{bool}
+    @ivar audio: does client receive audio?
+    @type audio: C{bool}
+    @ivar video: does client receive video?
+    @type video: C{bool}
+    @ivar syncAudio: send audio configuration before next audio packet?
+    @type syncAudio: C{bool}
+    @ivar syncVideo: wait for keyframe (and send video configuration before it)?
+    @type syncVideo: C{bool}
+    """
+
+    __slots__ = ('protocol', 'stream_id', 'stream', 'offset', 'paused', 'audio', 'video', 'syncAudio', 'syncVideo')
+
+    def __init__(self, protocol, stream_id):
+        """
+        Constructor.
+
+        @param protocol: client protocol
+        @type protocol: L{RTMPServerProtocol}
+        @param stream_id: Stream ID of client's NetStream
+        @type stream_id: C{int}
+        """
+        self.protocol = protocol
+        self.stream_id = stream_id
+        self.stream = None
+        self.offset = 0
+        self.paused = False
+        self.audio = self.video = True
+        self.syncAudio = self.syncVideo = True
+
+    def __repr__(self):
+        return "<%s(%r, stream_id=%d)>" % (self.__class__.__name__, self.protocol, self.stream_id)
+
+    @property
+    def name(self):
+        """
+        Name of stream being played.
+
+        @rtype: C{str}
+        """
+        return self.stream.name if self.stream is not None else None
+
+    seekable = False
+    """
+    Live stream could not be seeked.
+    """
+
+    def setBufferTime(self, bufferTime):
+        """
+        Client reported its buffer length.
+
+        Live streams are sent as they arrive, so it is ignored.
+
+        @param bufferTime: buffer length (ms)
+        @type bufferTime: C{int}
+        """
+        pass
+
+    def pause(self, paused):
+        """
+        Pause or resume playback.
+
+        @param paused: pause playback?
+        @type paused: C{bool}
+        """
+        if paused == self.paused:
+            return
+
+        self.paused = paused
+        if not paused:
+            self.syncAudio = self.syncVideo = True
+
+    def enableAudio(self, enabled):
+        """
+        Start or stop sending audio to client.
+
+        @param enabled: send audio?
+        @type enabled: C{bool}
+        """
+        if enabled and not self.audio:
+            self.syncAudio = True
+        self.audio = enabled
+
+    def enableVideo(self, enabled):
+        """
+        Start or stop sending video to client.
+
+        @param enabled: send video?
+        @type enabled: C{bool}
+        """
+        if enabled and not self.video:
+            self.syncVideo = True
+        self.video = enabled
+
+    def send(self, packet, timestamp=None):
+        """
+        Send packet of live stream to client.
+
+        Media packets share data (segments) with original packet.
+
+        @param packet: packet received from publisher
+        @type packet: L{MediaPacket} or L{Notify}
+        @param timestamp: timestamp to send packet with (default is
+            packet timestamp plus L{offset})
+        @type timestamp: C{int}
+        """
+        if self.paused:
+            return
+
+        cls = packet.__class__
+        if cls is VideoData:
+            if not self.video:
+                return
+            if self.syncVideo:
+                if not packet.isKeyframe:
+                    return
+                self.syncVideo = False
+                self._sync(self._configs().videoConfig, packet, timestamp)
+        elif cls is AudioData:
+            if not self.audio:
+                return
+            if self.syncAudio:
+                self.syncAudio = False
+                self._sync(self._configs().audioConfig, packet, timestamp)
+
+        self._push(packet, timestamp)
+
+    def _configs(self):
+        """
+        Source of codec configuration (C{videoConfig} and C{audioConfig}).
+
+        @rtype: L{Stream}
+        """
+        return self.stream
+
+    def _sync(self, config, packet, timestamp):
+        """
+        Send codec configuration before first packet after resume.
+
+        @param config: codec configuration (sequence header)
+        @type config: L{MediaPacket}
+        @param packet: first packet
+        @type packet: L{MediaPacket}
+        @param timestamp: timestamp of first packet (if overridden)
+        @type timestamp: C{int}
+        """
+        if config is None or config is packet:
+            return
+
+        if timestamp is None:
+            timestamp = packet.header.timestamp + self.offset
+        self._push(config, timestamp)
+
+    def _push(self, packet, timestamp):
+        """
+        Push packet of live stream to client protocol.
+
+        @param packet: packet received from publisher
+        @type packet: L{MediaPacket} or L{Notify}
+        @param timestamp: timestamp to send packet with (default is
+            packet timestamp plus L{offset})
+        @type timestamp: C{int}
+        """
+        source = packet.header
+        if timestamp is None:
+            timestamp = source.timestamp + self.offset
+
+        if isinstance(packet, MediaPacket):
+            packet = packet.__class__(RTMPHeader(media_object_id(source.type, self.stream_id), timestamp,
+                                                 source.length, source.type, self.stream_id), packet.segments)
+        else:
+            packet = Notify(packet.name, packet.argv, RTMPHeader(source.object_id, timestamp, None,
+                                                                 constants.NOTIFY, self.stream_id))
+
+        self.protocol.pushPacket(packet)
+
+    def notify(self, status):
+        """
+        Send status of live stream to client.
+
+        @param status: status
+        """
+        self.protocol.streamStatus(self.stream_id, status)
+
+    def published(self, stream):
+        """
+        Stream was published.
+
+        @param stream: stream
+        @type stream: L{Stream}
+        """
+        self.notify(status.playPublishNotify(description='%s is now published.' % stream.name, details=stream.name))
+
+    def unpublished(self, stream):
+        """
+        Stream was unpublished.
+
+        @param stream: stream
+        @type stream: L{Stream}
+        """
+        self.notify(status.playUnpublishNotify(description='%s is now unpublished.' % stream.name, details=stream.name))
+
+    def close(self):
+        """
+        Stop playback.
+        """
+        if self.stream is not None:
+            self.stream.unsubscribe(self)
+
+class Stream(object):
+    """
+    Live stream inside room.
+
+    Stream is published by single client, media and data messages of
+    publisher are relayed to all subscribers. Subscribers may start
+    playback before stream is published, they receive media as soon as
+    publisher appears.
+
+    Metadata and codec configuration (AVC sequence header, AAC config)
+    are kept to be sent to subscribers joining later.
+
+    @ivar room: room owning this stream
+    @type room: L{Room}
+    @ivar name: stream name
+    @type name: C{str}
+    @ivar publisher: protocol of publisher (or C{None})
+    @type publisher: L{RTMPServerProtocol}
+    @ivar subscribers: subscriptions to stream
+    @type subscribers: C{tuple} of L{Subscription}
+    @ivar metadata: stream metadata (C{onMetaData}), if any
+    @type metadata: L{Notify}
+    @ivar videoConfig: last AVC sequence header, if any
+    @type videoConfig: L{VideoData}
+    @ivar audioConfig: last AAC config, if any
+    @type audioConfig: L{AudioData}
+    @ivar dvr: time-shift buffer of published stream (if enabled)
+    @type dvr: L{DVRRing}
+    @ivar hls: HLS segmenter of published stream (if enabled)
+    @type hls: L{HLSSegmenter}
+    """
+
+    dvrSize = config.getint('RTMP', 'dvrSize')
+    """
+    Size of time-shift buffer of each published stream (bytes), zero disables it.
+    """
+
+    dvrDirectory = config.get('RTMP', 'dvrDirectory')
+    """
+    Directory for time-shift buffers (empty - system temporary directory).
+    """
+
+    hlsEnabled = config.getboolean('HLS', 'enabled')
+    """
+    Segment published streams for HLS?
+    """
+
+    def __init__(self, room, name):
+        """
+        Construct new stream.
+
+        @param room: room owning this stream
+        @type room: L{Room}
+        @param name: stream name
+        @type name: C{str}
+        """
+        self.room = room
+        self.name = name
+        self.publisher = None
+        self.subscribers = ()
+        self.metadata = None
+        self.videoConfig = None
+        self.audioConfig = None
+        self.dvr = None
+        self.hls = None
+
+    def __repr__(self):
+        return "<Stream %r (%d)>" % (self.name, len(self.subscribers))
+
+    def publish(self, protocol):
+        """
+        Client starts publishing this stream.
+
+        @param protocol: publisher protocol
+        @type protocol: L{RTMPServerProtocol}
+        @raise StreamBusyError: stream is already published
+        """
+        if self.publisher is not None:
+            raise StreamBusyError(self.name)
+
+        self.publisher = protocol
+        if self.dvrSize > 0:
+            self.dvr = DVRRing(self.dvrSize, self.dvrDirectory)
+        if self.hlsEnabled:
+            self.hls = segmenter(self)
+
+        for subscription in self.subscribers:
+            subscription.published(self)
+
+    def unpublish(self):
+        """
+        Publisher stops publishing this stream.
+        """
+        self.publisher = None
+        self.metadata = self.videoConfig = self.audioConfig = None
+        if self.dvr is not None:
+            self.dvr.close()
+            self.dvr = None
+        if self.hls is not None:
+            self.hls.close()
+            self.hls = None
+
+        for subscription in self.subscribers:
+            subscription.unpublished(self)
+
+        self._release()
+
+    def subscribe(self, subscription, timestamp=None):
+        """
+        Client starts playback of this stream.
+
+        Stream metadata is sent to subscriber right away, codec
+        configuration is sent by subscription before first keyframe
+        and first audio packet.
+
+        @param subscription: subscription
+        @type subscription: L{Subscription}
+        @param timestamp: timestamp to send metadata with
+        @type timestamp: C{int}
+        """
+        subscription.stream = self
+        # subscribers are replaced (not modified), so that packets
+        # are delivered to snapshot of subscribers
+        self.subscribers += (subscription, )
+
+        if self.metadata is not None:
+            subscription.send(self.metadata, timestamp)
+
+    def unsubscribe(self, subscription):
+        """
+        Client stops playback of this stream.
+
+        @param subscription: subscription
+        @type subscription: L{Subscription}
+        """
+        self.subscribers = tuple([s for s in self.subscribers if s is not subscription])
+        subscription.stream = None
+
+        self._release()
+
+    def deliver(self, packet):
+        """
+        Relay packet of publisher to subscribers.
+
+        @param packet: media packet or data message
+        @type packet: L{MediaPacket} or L{Notify}
+        """
+        cls = packet.__class__
+        if cls is VideoData:
+            if packet.isSequenceHeader:
+                self.videoConfig = packet
+        elif cls is AudioData:
+            if packet.isSequenceHeader:
+                self.audioConfig = packet
+        elif cls is Notify and packet.name == '@setDataFrame':
+            # metadata is stored and sent to subscribers as onMetaData
+            if not packet.argv:
+                return
+            packet = self.metadata = Notify(packet.argv[0], packet.argv[1:], packet.header)
+
+        if self.dvr is not None:
+            self.dvr.write(packet)
+        if self.hls is not None:
+            try:
+                self.hls.write(packet)
+            except Exception:
+                # malformed media of publisher stops segmenting, not the stream
+                log.err(None, "Error in HLS segmenter of %r, segmenting stopped" % self.name)
+                hls, self.hls = self.hls, None
+                hls.close()
+
+        for subscription in self.subscribers:
+            subscription.send(packet)
+
+    def _release(self):
+        """
+        Remove stream from room when it is not used anymore.
+        """
+        if self.publisher is None and not self.subscribers and self.room.streams.get(self.name) is self:
+            del self.room.streams[self.name]
+
+class StreamGroup(object):
+    """
+    Group of live streams: renditions of the same content
+    with different bitrates.
+
+    Client plays group by its name and receives one of renditions,
+    chosen by L{GroupSubscription}.
+
+    @ivar room: room owning this group
+    @type room: L{Room}
+    @ivar name: group name
+    @type name: C{str}
+    @ivar renditions: names and bitrates (bits per second) of renditions, highest bitrate first
+    @type renditions: C{list} of (C{str}, C{int})
+    """
+
+    upswitchInterval = config.getint('RTMP', 'switchUpInterval')
+    """
+    Time without congestion before switching to higher rendition (seconds).
+    """
+
+    downswitchRatio = config.getfloat('RTMP', 'switchDownRatio')
+    """
+    Switch to lower rendition, if peer acknowledges less than this
+    fraction of rendition bitrate.
+    """
+
+    def __init__(self, room, name, renditions):
+        """
+        Construct stream group.
+
+        @param room: room owning this group
+        @type room: L{Room}
+        @param name: group name
+        @type name: C{str}
+        @param renditions: names and bitrates (bits per second) of renditions
+        @type renditions: C{list} of (C{str}, C{int})
+        """
+        self.room = room
+        self.name = name
+        self.renditions = sorted(renditions, key=lambda (name, bitrate): -bitrate)
+
+    def __repr__(self):
+        return "<StreamGroup %r %r>" % (self.name, [name for (name, bitrate) in self.renditions])
+
+    def isPublished(self, index):
+        """
+        Is rendition published?
+
+        @param index: index of rendition
+        @type index: C{int}
+        @rtype: C{bool}
+        """
+        stream = self.room.streams.get(self.renditions[index][0])
+        return stream is not None and stream.publisher is not None
+
+    def lower(self, index):
+        """
+        Find published rendition with lower bitrate.
+
+        @param index: index of current rendition
+        @type index: C{int}
+        @return: index of rendition or C{None}
+        @rtype: C{int}
+        """
+        for i in xrange(index + 1, len(self.renditions)):
+            if self.isPublished(i):
+                return i
+
+        return None
+
+    def higher(self, index):
+        """
+        Find published rendition with higher bitrate.
+
+        @param index: index of current rendition
+        @type index: C{int}
+        @return: index of rendition or C{None}
+        @rtype: C{int}
+        """
+        for i in xrange(index - 1, -1, -1):
+            if self.isPublished(i):
+                return i
+
+        return None
+
+    def stream(self, index):
+        """
+        Get stream of rendition.
+
+        @param index: index of rendition
+        @type index: C{int}
+        @rtype: L{Stream}
+        """
+        return self.room.stream(self.renditions[index][0])
+
+class SwitchWatcher(object):
+    """
+    Waits for keyframe of rendition, L{GroupSubscription} is switching to.
+
+    @ivar owner: group subscription
+    @type owner: L{GroupSubscription}
+    @ivar index: index of rendition
+    @type index: C{int}
+    @ivar stream: stream of rendition
+    @type stream: L{Stream}
+    """
+
+    __slots__ = ('owner', 'index', 'stream')
+
+    def __init__(self, owner, index):
+        """
+        Constructor.
+
+        @param owner: group subscription
+        @type owner: L{GroupSubscription}
+        @param index: index of rendition
+        @type index: C{int}
+        """
+        self.owner = owner
+        self.index = index
+        self.stream = None
+
+    def send(self, packet, timestamp=None):
+        if packet.__class__ is VideoData and packet.isKeyframe:
+            self.owner._switch(packet)
+
+    def notify(self, status):
+        pass
+
+    def published(self, stream):
+        pass
+
+    def unpublished(self, stream):
+        self.owner._evaluate()
+
+class GroupSubscription(Subscription):
+    """
+    Subscription to stream group (adaptive bitrate playback).
+
+    Client receives one rendition of group at a time. On each keyframe of
+    current rendition output of client protocol is checked:
+
+     - if output is congested (transport send buffer full, media queued
+       waiting for acknowledgements, peer acknowledges less than
+       L{StreamGroup.downswitchRatio} of rendition bitrate), client is
+       switched to lower rendition;
+     - if output wasn't congested for L{StreamGroup.upswitchInterval},
+       client is switched to higher rendition.
+
+    Switch happens on next keyframe of new rendition, timestamps
+    are kept continuous.
+
+    @ivar group: stream group
+    @type group: L{StreamGroup}
+    @ivar index: index of current rendition
+    @type index: C{int}
+    @ivar watcher: pending switch (or C{None})
+    @type watcher: L{SwitchWatcher}
+    @ivar lastTimestamp: timestamp of last packet sent
+    @type lastTimestamp: C{int}
+    @ivar lastSwitch: time of last switch
+    @type lastSwitch: C{float}
+    """
+
+    __slots__ = ('group', 'index', 'watcher', 'lastTimestamp', 'lastSwitch')
+
+    maxTimestampGap = 1000
+    """
+    Maximum gap between timestamps of renditions at switch (ms), bigger
+    gaps are closed with L{offset}.
+    """
+
+    def __init__(self, protocol, stream_id, group):
+        """
+        Constructor.
+
+        @param protocol: client protocol
+        @type protocol: L{RTMPServerProtocol}
+        @param stream_id: Stream ID of client's NetStream
+        @type stream_id: C{int}
+        @param group: stream group
+        @type group: L{StreamGroup}
+        """
+        Subscription.__init__(self, protocol, stream_id)
+        self.group = group
+        self.index = None
+        self.watcher = None
+        self.lastTimestamp = None
+        self.lastSwitch = _time.seconds()
+
+    def start(self):
+        """
+        Start playback with highest published rendition.
+        """
+        self.index = 0
+        if not self.group.isPublished(0):
+            self.index = self.group.lower(0) or 0
+
+        self.group.stream(self.index).subscribe(self)
+
+    def send(self, packet, timestamp=None):
+        if packet.__class__ is VideoData and packet.isKeyframe:
+            self._evaluate()
+
+        Subscription.send(self, packet, timestamp)
+
+        if timestamp is None:
+            timestamp = packet.header.timestamp + self.offset
+        self.lastTimestamp = timestamp
+
+    def published(self, stream):
+        if stream is self.stream:
+            Subscription.published(self, stream)
+
+    def unpublished(self, stream):
+        # switch to any other published rendition
+        self._evaluate()
+        if self.watcher is None:
+            Subscription.unpublished(self, stream)
+
+    def close(self):
+        self._cancel()
+        Subscription.close(self)
+
+    def _evaluate(self):
+        """
+        Check output of client, start switch to other rendition if necessary.
+        """
+        group = self.group
+        protocol = self.protocol
+
+        if not group.isPublished(self.index):
+            # current rendition is gone, any other one would do
+            target = group.lower(self.index)
+            if target is None:
+                target = group.higher(self.index)
+        elif (protocol.writePaused or protocol.mediaQueueBytes > 0 or
+              (protocol.ackRate is not None and
+               protocol.ackRate * 8 < group.renditions[self.index][1] * group.downswitchRatio)):
+            target = group.lower(self.index)
+        elif _time.seconds() - max(self.lastSwitch, protocol.lastCongestion) >= group.upswitchInterval:
+            target = group.higher(self.index)
+        else:
+            target = None
+
+        if self.watcher is not None and self.watcher.index == target:
+            return
+
+        self._cancel()
+
+        if target is not None:
+            self.watcher = SwitchWatcher(self, target)
+            group.stream(target).subscribe(self.watcher)
+
+    def _cancel(self):
+        """
+        Cancel pending switch.
+        """
+        if self.watcher is not None:
+            self.watcher.stream.unsubscribe(self.watcher)
+            self.watcher = None
+
+    def _switch(self, keyframe):
+        """
+        Keyframe of new rendition arrived, switch to it.
+
+        @param keyframe: keyframe
+        @type keyframe: L{VideoData}
+        """
+        index = self.watcher.index
+        self._cancel()
+
+        if self.lastTimestamp is not None:
+            timestamp = keyframe.header.timestamp + self.offset
+            if not self.lastTimestamp <= timestamp <= self.lastTimestamp + self.maxTimestampGap:
+                self.offset = self.lastTimestamp - keyframe.header.timestamp
+        timestamp = keyframe.header.timestamp + self.offset
+
+        if self.stream is not None:
+            self.stream.unsubscribe(self)
+        self.index = index
+        self.lastSwitch = _time.seconds()
+
+        name = self.group.renditions[index][0]
+        self.notify(status.playSwitch(description='Switched to %s.' % name, details=name))
+
+        stream = self.group.stream(index)
+        stream.subscribe(self, timestamp)
+        self.syncAudio = self.syncVideo = True
+        Subscription.send(self, keyframe)
+        self.lastTimestamp = timestamp
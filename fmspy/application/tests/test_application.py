@@ -6,6 +6,8 @@
 Tests for L{fmspy.application.application}.
 """
 
+import os
+
 from twisted.trial import unittest
 
 from fmspy.application.application import Application
@@ -67,6 +69,22 @@ class ApplicationTestCase(unittest.TestCase):
     def test_repr(self):
         self.failUnlessEqual("<TestApplication>", repr(self.a))
 
+    def test_streamPath(self):
+        directory = self.mktemp()
+        os.makedirs(os.path.join(directory, 'test'))
+        open(os.path.join(directory, 'test', 'movie.flv'), 'wb').close()
+        open(os.path.join(directory, 'secret.flv'), 'wb').close()
+        config.set('TestApplication', 'streamsDirectory', os.path.join(directory, 'test'))
+
+        try:
+            path = os.path.abspath(os.path.join(directory, 'test', 'movie.flv'))
+            self.failUnlessEqual(path, self.a.streamPath('movie'))
+            self.failUnlessEqual(path, self.a.streamPath('flv:movie.flv'))
+            self.failUnlessEqual(None, self.a.streamPath('other'))
+            self.failUnlessEqual(None, self.a.streamPath('../secret'))
+        finally:
+            config.remove_option('TestApplication', 'streamsDirectory')
+
     def test_connect_hall(self):
         def checkIt(_):
             self.failUnlessEqual({}, self.a.rooms)
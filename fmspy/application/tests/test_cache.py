@@ -0,0 +1,96 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.application.cache}.
+"""
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from fmspy.application.cache import cached, InvokeCache
+
+class InvokeCacheTestCase(unittest.TestCase):
+    """
+    Testcase for L{fmspy.application.cache.InvokeCache}.
+    """
+
+    def setUp(self):
+        self.now = 0.0
+        self.calls = []
+        self.c = InvokeCache(maxBytes=200, clock=lambda: self.now)
+
+    def handler(self, *args):
+        self.calls.append(args)
+        return list(args)
+
+    def call(self, *args):
+        result = []
+        self.c.call('handler', args, 10, self.handler, *args).addCallback(result.append)
+        return result[0]
+
+    def test_decorator(self):
+        @cached(ttl=5)
+        def invoke_foo(self, protocol):
+            pass
+
+        self.failUnlessEqual(5, invoke_foo.cache_ttl)
+
+    def test_key(self):
+        self.failUnlessEqual(self.c.key('a', (1, u'b')), self.c.key('a', (1, 'b')))
+        self.failIfEqual(self.c.key('a', (1, )), self.c.key('a', (2, )))
+        self.failIfEqual(self.c.key('a', (1, )), self.c.key('b', (1, )))
+
+    def test_hit(self):
+        self.failUnlessEqual([1, 2], self.call(1, 2))
+        self.failUnlessEqual([1, 2], self.call(1, 2))
+        self.failUnlessEqual([3], self.call(3))
+        self.failUnlessEqual([(1, 2), (3, )], self.calls)
+
+    def test_ttl(self):
+        self.call(1)
+        self.now = 9.0
+        self.call(1)
+        self.now = 11.0
+        self.call(1)
+        self.failUnlessEqual([(1, ), (1, )], self.calls)
+        self.failUnlessEqual(1, len(self.c.entries))
+
+    def test_eviction(self):
+        for i in xrange(10):
+            self.call('x' * 20, i)
+
+        self.failUnless(self.c.bytes <= self.c.maxBytes)
+        self.failUnless(len(self.c.entries) < 10)
+
+        self.call('x' * 20, 9)
+        self.failUnlessEqual(10, len(self.calls))
+        self.call('x' * 20, 0)
+        self.failUnlessEqual(11, len(self.calls))
+
+        self.c.clear()
+        self.failUnlessEqual(0, self.c.bytes)
+
+    def test_coalesce(self):
+        pending = defer.Deferred()
+        results = []
+
+        for i in xrange(3):
+            self.c.call('slow', (1, ), 10, lambda: pending).addCallback(results.append)
+
+        self.failUnlessEqual([], results)
+        pending.callback('done')
+        self.failUnlessEqual(['done'] * 3, results)
+        self.failUnlessEqual({}, self.c.inflight)
+
+    def test_error(self):
+        pending = defer.Deferred()
+        errors = []
+
+        for i in xrange(2):
+            self.c.call('fail', (1, ), 10, lambda: pending).addErrback(errors.append)
+
+        pending.errback(ValueError())
+        self.failUnlessEqual(2, len(errors))
+        self.failUnlessEqual(0, len(self.c.entries))
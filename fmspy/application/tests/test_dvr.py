@@ -0,0 +1,169 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.application.dvr}.
+"""
+
+import os
+
+from twisted.trial import unittest
+from twisted.internet import task
+
+from fmspy.application import vod
+from fmspy.application.dvr import DVRRing
+from fmspy.application.stream import Stream
+from fmspy.application.vod import PlaylistSubscription
+from fmspy.application.tests.test_stream import RelayTestCase
+from fmspy.rtmp import constants
+from fmspy.rtmp.header import RTMPHeader
+from fmspy.rtmp.packets import AudioData, VideoData, Notify
+
+def video(timestamp, data):
+    return VideoData(RTMPHeader(object_id=8, timestamp=timestamp, length=len(data), type=constants.VIDEO_DATA, stream_id=1), [data])
+
+def keyframe(timestamp, tag):
+    return video(timestamp, '\x17\x01' + tag)
+
+def interframe(timestamp, tag):
+    return video(timestamp, '\x27\x01' + tag)
+
+class DVRRingTestCase(unittest.TestCase):
+    """
+    Test case for L{DVRRing}.
+    """
+
+    def setUp(self):
+        self.ring = DVRRing(200)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def read(self, reader):
+        result = []
+        while True:
+            packet = reader.next()
+            if packet is None:
+                return result
+            result.append((packet.header.timestamp, packet.data[2:]))
+
+    def test_read(self):
+        self.ring.write(Notify('onMetaData', ({'width' : 320}, ), RTMPHeader(timestamp=0)))
+        self.ring.write(keyframe(0, 'K0'))
+        self.ring.write(interframe(40, 'I1'))
+        self.ring.write(keyframe(80, 'K2'))
+
+        reader = self.ring.reader(0)
+        self.failUnless(reader.growing)
+        self.failUnlessEqual([(0, 'K0'), (40, 'I1'), (80, 'K2')], self.read(reader))
+
+        self.ring.write(interframe(120, 'I3'))
+        self.failUnlessEqual([(120, 'I3')], self.read(reader))
+
+        reader = self.ring.reader(100)
+        self.failUnlessEqual(80, reader.start)
+        self.failUnlessEqual([(80, 'K2'), (120, 'I3')], self.read(reader))
+
+        self.ring.close()
+        self.failIf(reader.growing)
+        self.failUnlessEqual(None, reader.next())
+
+    def test_wrap(self):
+        # each tag is 11 + 2 + 30 bytes, four fit into ring
+        reader = self.ring.reader(0)
+        for i in xrange(10):
+            if i % 2 == 0:
+                self.ring.write(keyframe(i * 40, 'K%d' % i + 'x' * 28))
+            else:
+                self.ring.write(interframe(i * 40, 'I%d' % i + 'x' * 28))
+            self.failUnless(self.ring.head - self.ring.tail <= self.ring.size)
+
+        self.failUnlessEqual([240, 320], list(self.ring.timestamps))
+        self.failUnlessEqual([240, 280, 320, 360], [timestamp for (timestamp, data) in self.read(self.ring.reader(0))])
+
+        # reader was overrun, it continues from oldest keyframe
+        self.failUnlessEqual([240, 280, 320, 360], [timestamp for (timestamp, data) in self.read(reader)])
+        self.failUnless(reader.overrun)
+
+    def test_audio(self):
+        ring = DVRRing(4096)
+        for i in xrange(100):
+            ring.write(AudioData(RTMPHeader(timestamp=i * 23, length=3, type=constants.AUDIO_DATA), ['\xaf\x01a']))
+        self.failUnlessEqual([0, 1012, 2024], list(ring.timestamps))
+        ring.close()
+
+    def test_close(self):
+        path = self.ring.path
+        self.failUnless(os.path.exists(path))
+        self.ring.close()
+        self.failIf(os.path.exists(path))
+
+class DVRPlaybackTestCase(RelayTestCase):
+    """
+    Test case for playback of live streams from time-shift buffer.
+    """
+
+    def setUp(self):
+        RelayTestCase.setUp(self)
+        self.patch(Stream, 'dvrSize', 65536)
+        self.clock = task.Clock()
+        self.patch(vod.pacer, 'clock', self.clock)
+
+        self.publisher = self.connect()
+        self.invoke(self.publisher, 'publish', 'live')
+        self.send(self.publisher, Notify('@setDataFrame', ['onMetaData', {'width' : 320}], RTMPHeader(object_id=8, timestamp=0, stream_id=1)),
+                  video(0, '\x17\x00config'))
+        self.send(self.publisher, *[(keyframe if i % 10 == 0 else interframe)(i * 40, '%d' % i) for i in xrange(50)])
+
+    def advance(self, seconds):
+        for i in xrange(int(seconds * 10)):
+            self.clock.advance(0.1)
+
+    def test_play(self):
+        player = self.connect()
+        self.invoke(player, 'play', 'live', 0.5)
+        self.failUnless(isinstance(player.subscriptions[1], PlaylistSubscription))
+
+        packets = self.received(player)
+        self.failUnlessEqual(['NetStream.Play.Reset', 'NetStream.Play.Start'], self.statuses(packets))
+        self.failUnlessEqual([(400, 'onMetaData')], [(p.header.timestamp, p.name) for p in packets if isinstance(p, Notify)])
+        frames = self.frames(packets)
+        self.failUnlessEqual((400, 'config'), frames[0])
+        self.failUnlessEqual(range(400, 1440, 40), [timestamp for (timestamp, data) in frames[1:]])
+
+        # playback continues with live stream delayed
+        self.advance(1.0)
+        self.send(self.publisher, keyframe(2000, '50'))
+        self.advance(1.0)
+        self.failUnlessEqual(range(1440, 2040, 40), [timestamp for (timestamp, data) in self.frames(self.received(player))])
+
+        self.invoke(self.publisher, 'closeStream')
+        self.advance(0.1)
+        self.failUnlessEqual(['NetStream.Play.Stop'], self.statuses(self.received(player)))
+
+    def test_seek(self):
+        player = self.connect()
+        self.invoke(player, 'play', 'live')
+        self.received(player)
+
+        self.invoke(player, 'seek', 1300.0)
+        packets = self.received(player)
+        self.failUnlessEqual(['NetStream.Seek.Notify', 'NetStream.Play.Start'], self.statuses(packets))
+        self.failUnlessEqual((1200, '30'), self.frames(packets)[1])
+
+        self.invoke(player, 'seek', 0.0)
+        packets = self.received(player)
+        self.failUnlessEqual(['NetStream.Seek.Notify', 'NetStream.Play.Start'], self.statuses(packets))
+        self.failUnlessEqual([(0, 'config'), (0, '0')], self.frames(packets)[:2])
+
+    def test_disabled(self):
+        self.patch(Stream, 'dvrSize', 0)
+        self.invoke(self.publisher, 'closeStream')
+        self.invoke(self.publisher, 'publish', 'live')
+
+        player = self.connect()
+        self.invoke(player, 'play', 'live')
+        self.received(player)
+        self.invoke(player, 'seek', 0.0)
+        self.failUnlessEqual(['NetStream.Seek.Failed'], self.statuses(self.received(player)))
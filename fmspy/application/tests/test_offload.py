@@ -0,0 +1,123 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.application.offload}.
+"""
+
+import time
+import threading
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from fmspy.application.offload import offload, Offloader, OffloadQueueFullError, OffloadTimeoutError, THREAD, PROCESS
+from fmspy.stats import metrics
+
+@offload(PROCESS)
+def power(x, y):
+    """
+    Process-offloaded function.
+    """
+    return x ** y
+
+def fail(x):
+    """
+    Process-offloaded function, failing.
+    """
+    raise ValueError(x)
+
+def unpicklable():
+    """
+    Process-offloaded function, result of which can't be pickled.
+    """
+    return lambda: None
+
+def sleep(seconds):
+    """
+    Process-offloaded function, running for a while.
+    """
+    time.sleep(seconds)
+
+class OffloadTestCase(unittest.TestCase):
+    """
+    Testcase for L{fmspy.application.offload}.
+    """
+
+    def setUp(self):
+        self.o = Offloader('test', maxConcurrent=1, maxQueue=1, threads=1, processes=1)
+
+    def tearDown(self):
+        if self.o.threadPool is not None:
+            self.o.threadPool.stop()
+        if self.o.processPool is not None:
+            self.o.processPool.close()
+            self.o.processPool.join()
+
+    def test_decorator(self):
+        self.failUnlessEqual(PROCESS, power.offload)
+        self.failUnlessEqual(THREAD, offload()(lambda: None).offload)
+
+    def test_thread(self):
+        def check(result):
+            self.failUnlessEqual(threading.currentThread().getName(), result[0])
+            self.failIfEqual(result[0], result[1])
+            self.failUnlessEqual(0, self.o.running)
+
+        return self.o.run(THREAD, lambda x: (x, threading.currentThread().getName()),
+                threading.currentThread().getName()).addCallback(check)
+
+    def test_process(self):
+        def check(result):
+            self.failUnlessEqual(1024, result)
+
+        return self.o.run(PROCESS, power, 2, 10).addCallback(check)
+
+    def test_process_error(self):
+        return self.failUnlessFailure(self.o.run(PROCESS, fail, 'x'), ValueError)
+
+    def test_process_unpickleable(self):
+        return self.failUnlessFailure(self.o.run(PROCESS, lambda: None), Exception)
+
+    def test_process_unpicklable_result(self):
+        d = self.failUnlessFailure(self.o.run(PROCESS, unpicklable), Exception)
+
+        def check(_):
+            self.failUnlessEqual(0, self.o.running)
+            return self.o.run(PROCESS, power, 2, 3)
+
+        return d.addCallback(check).addCallback(self.failUnlessEqual, 8)
+
+    def test_process_timeout(self):
+        self.o.processTimeout = 0.1
+        d = self.failUnlessFailure(self.o.run(PROCESS, sleep, 1), OffloadTimeoutError)
+
+        def check(_):
+            # pool is recycled
+            self.failUnlessEqual(0, self.o.running)
+            self.failUnlessEqual(None, self.o.processPool)
+            self.failUnlessEqual({}, self.o.processCalls)
+            return self.o.run(PROCESS, power, 2, 3)
+
+        return d.addCallback(check).addCallback(self.failUnlessEqual, 8)
+
+    def test_queue(self):
+        event = threading.Event()
+        queued = metrics.timings.get('offload.wait', None)
+        count = queued.count if queued is not None else 0
+
+        d1 = self.o.run(THREAD, event.wait)
+        d2 = self.o.run(THREAD, lambda: 'second')
+        self.failUnlessEqual(1, len(self.o.queue))
+
+        self.failUnlessFailure(self.o.run(THREAD, lambda: 'third'), OffloadQueueFullError)
+
+        event.set()
+
+        def check(result):
+            self.failUnlessEqual('second', result[1])
+            self.failUnlessEqual(0, len(self.o.queue))
+            self.failUnlessEqual(count + 2, metrics.timings['offload.wait'].count)
+
+        return defer.gatherResults([d1, d2]).addCallback(check)
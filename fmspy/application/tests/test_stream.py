@@ -0,0 +1,295 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.application.stream}.
+"""
+
+from twisted.trial import unittest
+from twisted.test.proto_helpers import StringTransport
+
+from fmspy.application.room import Room
+from fmspy.rtmp import constants
+from fmspy.rtmp.assembly import RTMPAssembler, RTMPDisassembler
+from fmspy.rtmp.header import RTMPHeader
+from fmspy.rtmp.packets import DataPacket, MediaPacket, AudioData, VideoData, Invoke, Notify
+from fmspy.rtmp.protocol.server import RTMPServerProtocol, AppStorage
+
+class ApplicationMock(object):
+    """
+    Mock for application.
+    """
+
+    def room_empty(self, room):
+        pass
+
+    def disconnect(self, protocol):
+        protocol._app.room.leave(protocol)
+
+    def streamPath(self, name):
+        return None
+
+class RelayTestCase(unittest.TestCase):
+    """
+    Base test case for media relayed between protocols.
+    """
+
+    def setUp(self):
+        self.application = ApplicationMock()
+        self.room = Room(self.application)
+        self.protocols = []
+        self.outputs = {}
+
+    def tearDown(self):
+        for p in self.protocols:
+            if p.application is not None:
+                p.connectionLost(None)
+
+    def connect(self):
+        p = RTMPServerProtocol()
+        p.makeConnection(StringTransport())
+        p._handshakeComplete()
+        p.transport.clear()
+        p.application = self.application
+        p._app = AppStorage()
+        p._app.room = self.room
+        self.room.enter(p)
+        self.protocols.append(p)
+        self.outputs[p] = RTMPDisassembler(constants.DEFAULT_CHUNK_SIZE)
+        return p
+
+    def invoke(self, p, name, *args):
+        p.handleInvoke(Invoke(name, (None, ) + args, 0.0, RTMPHeader(object_id=8, timestamp=0, stream_id=1)))
+
+    def send(self, p, *packets):
+        buf = StringTransport()
+        a = RTMPAssembler(constants.DEFAULT_CHUNK_SIZE, buf)
+        for packet in packets:
+            a.push_packet(packet)
+        p.dataReceived(buf.value())
+
+    def received(self, p):
+        packets = self.outputs[p].push_data(p.transport.value()).disassemble_packets()
+        p.transport.clear()
+        return packets
+
+    def statuses(self, packets):
+        return [p.argv[1]['code'] for p in packets if isinstance(p, Invoke) and p.name == 'onStatus']
+
+    def keyframe(self, timestamp, tag):
+        return self.video(timestamp, '\x17\x01' + tag)
+
+    def audio(self, timestamp, data):
+        return AudioData(RTMPHeader(object_id=8, timestamp=timestamp, length=len(data), type=constants.AUDIO_DATA, stream_id=1), [data])
+
+    def frames(self, packets):
+        return [(p.header.timestamp, p.data[2:]) for p in packets if isinstance(p, VideoData)]
+
+    def sounds(self, packets):
+        return [(p.header.timestamp, p.data[2:]) for p in packets if isinstance(p, AudioData)]
+
+class StreamTestCase(RelayTestCase):
+    """
+    Test case for live streams relayed between protocols.
+    """
+
+    def video(self, timestamp, data):
+        return DataPacket(header=RTMPHeader(object_id=8, timestamp=timestamp, length=0, type=constants.VIDEO_DATA, stream_id=1), data=data)
+
+    def test_relay(self):
+        publisher, player = self.connect(), self.connect()
+
+        self.invoke(player, 'play', 'live')
+        self.failUnlessEqual(['NetStream.Play.Reset', 'NetStream.Play.Start'], self.statuses(self.received(player)))
+
+        self.invoke(publisher, 'publish', 'live', 'live')
+        self.failUnlessEqual(['NetStream.Publish.Start'], self.statuses(self.received(publisher)))
+        self.failUnlessEqual(['NetStream.Play.PublishNotify'], self.statuses(self.received(player)))
+
+        self.send(publisher, Notify('@setDataFrame', ['onMetaData', {'width' : 320}], RTMPHeader(object_id=8, timestamp=0, stream_id=1)),
+                  self.video(0, '\x17' + 'k' * 999), self.video(40, '\x27' + 'i' * 299))
+
+        packets = self.received(player)
+        self.failUnlessEqual([('onMetaData', [{'width' : 320}])], [(p.name, list(p.argv)) for p in packets if isinstance(p, Notify)])
+        media = [p for p in packets if isinstance(p, MediaPacket)]
+        self.failUnlessEqual([(0, '\x17' + 'k' * 999), (40, '\x27' + 'i' * 299)], [(p.header.timestamp, p.data) for p in media])
+        self.failUnlessEqual([1, 1], [p.header.stream_id for p in media])
+
+        # late subscriber receives metadata
+        late = self.connect()
+        self.invoke(late, 'play', 'live')
+        self.failUnlessEqual(['onMetaData'], [p.name for p in self.received(late) if isinstance(p, Notify)])
+
+        publisher.connectionLost(None)
+        self.failUnlessEqual(['NetStream.Play.UnpublishNotify'], self.statuses(self.received(player)))
+
+    def test_hls_error(self):
+        class BrokenSegmenter(object):
+            closed = False
+            def write(self, packet):
+                raise IndexError()
+            def close(self):
+                self.closed = True
+
+        publisher, player = self.connect(), self.connect()
+        self.invoke(publisher, 'publish', 'live')
+        self.invoke(player, 'play', 'live')
+        stream = self.room.streams['live']
+        hls = stream.hls = BrokenSegmenter()
+
+        self.send(publisher, self.keyframe(0, 'K0'), self.keyframe(40, 'K1'))
+        self.failUnlessEqual([(0, 'K0'), (40, 'K1')], self.frames(self.received(player)))
+        self.failUnlessEqual(None, stream.hls)
+        self.failUnless(hls.closed)
+        self.failIf(publisher.transport.disconnecting)
+        self.failUnlessEqual(1, len(self.flushLoggedErrors(IndexError)))
+
+    def test_busy(self):
+        first, second = self.connect(), self.connect()
+
+        self.invoke(first, 'publish', 'live')
+        self.invoke(second, 'publish', 'live')
+        self.failUnlessEqual(['NetStream.Publish.BadName'], self.statuses(self.received(second)))
+        self.failUnless(self.room.streams['live'].publisher is first)
+
+    def test_release(self):
+        publisher, player = self.connect(), self.connect()
+
+        self.invoke(player, 'play', 'live')
+        self.invoke(publisher, 'publish', 'live')
+        self.failUnlessEqual(['live'], self.room.streams.keys())
+
+        self.invoke(publisher, 'closeStream')
+        self.failUnlessEqual(['NetStream.Unpublish.Success'], self.statuses(self.received(publisher))[1:])
+        self.failUnlessEqual(['live'], self.room.streams.keys())
+
+        player.handleInvoke(Invoke('deleteStream', (None, 1.0), 0.0, RTMPHeader(object_id=3, timestamp=0, stream_id=0)))
+        self.failUnlessEqual({}, self.room.streams)
+        self.failIf(player.subscriptions)
+
+    def test_pause(self):
+        publisher, player = self.connect(), self.connect()
+        self.invoke(publisher, 'publish', 'live')
+        self.invoke(player, 'play', 'live')
+        self.send(publisher, self.video(0, '\x17\x00config'), self.audio(0, '\xaf\x00aac'), self.keyframe(0, 'K0'))
+        self.received(player)
+
+        self.invoke(player, 'pause', True, 0.0)
+        self.failUnlessEqual(['NetStream.Pause.Notify'], self.statuses(self.received(player)))
+        self.send(publisher, self.audio(20, '\xaf\x01A1'), self.keyframe(40, 'K1'))
+        self.failIf(player.transport.value())
+
+        self.invoke(player, 'pause', False, 0.0)
+        self.failUnlessEqual(['NetStream.Unpause.Notify'], self.statuses(self.received(player)))
+        self.send(publisher, self.video(80, '\x27\x01I2'), self.audio(90, '\xaf\x01A2'), self.keyframe(120, 'K3'))
+
+        packets = self.received(player)
+        self.failUnlessEqual([(120, 'config'), (120, 'K3')], self.frames(packets))
+        self.failUnlessEqual([(90, 'aac'), (90, 'A2')], self.sounds(packets))
+
+    def test_join(self):
+        publisher, player = self.connect(), self.connect()
+        self.invoke(publisher, 'publish', 'live')
+        self.send(publisher, self.video(0, '\x17\x00config'), self.audio(0, '\xaf\x00aac'), self.keyframe(0, 'K0'),
+                  self.audio(20, '\xaf\x01A1'))
+
+        # player joins in the middle of GOP
+        self.invoke(player, 'play', 'live')
+        self.received(player)
+        self.send(publisher, self.video(40, '\x27\x01I1'), self.audio(60, '\xaf\x01A2'), self.keyframe(80, 'K2'))
+
+        packets = self.received(player)
+        self.failUnlessEqual([(80, 'config'), (80, 'K2')], self.frames(packets))
+        self.failUnlessEqual([(60, 'aac'), (60, 'A2')], self.sounds(packets))
+
+    def test_receive(self):
+        publisher, player = self.connect(), self.connect()
+        self.invoke(publisher, 'publish', 'live')
+        self.invoke(player, 'play', 'live')
+
+        self.invoke(player, 'receiveVideo', False)
+        self.send(publisher, self.keyframe(0, 'K0'), self.audio(0, '\xaf\x01A0'))
+        packets = self.received(player)
+        self.failUnlessEqual([], self.frames(packets))
+        self.failUnlessEqual([(0, 'A0')], self.sounds(packets))
+
+        self.invoke(player, 'receiveVideo', True)
+        self.invoke(player, 'receiveAudio', False)
+        self.send(publisher, self.video(40, '\x27\x01I1'), self.keyframe(80, 'K2'), self.audio(80, '\xaf\x01A2'))
+        packets = self.received(player)
+        self.failUnlessEqual([(80, 'K2')], self.frames(packets))
+        self.failUnlessEqual([], self.sounds(packets))
+
+class StreamGroupTestCase(RelayTestCase):
+    """
+    Test case for stream groups (adaptive bitrate).
+    """
+
+    def setUp(self):
+        RelayTestCase.setUp(self)
+        self.room.addGroup('abr', [('low', 500000), ('high', 2000000)])
+        self.high, self.low, self.player = self.connect(), self.connect(), self.connect()
+        self.invoke(self.high, 'publish', 'high')
+        self.invoke(self.low, 'publish', 'low')
+        self.invoke(self.player, 'play', 'abr')
+        self.subscription = self.player.subscriptions[1]
+        self.received(self.player)
+
+    def video(self, timestamp, data):
+        return VideoData(RTMPHeader(object_id=8, timestamp=timestamp, length=len(data), type=constants.VIDEO_DATA, stream_id=1), [data])
+
+    def test_start(self):
+        self.failUnless(self.subscription.stream is self.room.streams['high'])
+
+        self.send(self.high, self.video(0, '\x17\x00config'), self.keyframe(0, 'H0'))
+        self.send(self.low, self.keyframe(0, 'L0'))
+        self.failUnlessEqual([(0, 'config'), (0, 'H0')], self.frames(self.received(self.player)))
+
+    def test_downswitch(self):
+        self.send(self.low, self.video(0, '\x17\x00config'))
+        self.send(self.high, self.keyframe(1000, 'H1'))
+        self.player.pauseProducing()
+        self.send(self.high, self.keyframe(2000, 'H2'))
+        self.send(self.low, self.keyframe(2040, 'L2'), self.video(2080, '\x27\x01L3'))
+        self.send(self.high, self.video(2080, '\x27\x01H3'))
+
+        packets = self.received(self.player)
+        self.failUnlessEqual([(1000, 'H1'), (2000, 'H2'), (2040, 'config'), (2040, 'L2'), (2080, 'L3')], self.frames(packets))
+        self.failUnlessEqual(['NetStream.Play.Switch'], self.statuses(packets))
+        self.failUnless(self.subscription.stream is self.room.streams['low'])
+
+        # congestion is gone, but upswitch is delayed
+        self.player.resumeProducing()
+        self.send(self.low, self.keyframe(3000, 'L4'))
+        self.send(self.high, self.keyframe(3000, 'H4'))
+        self.failUnlessEqual([(3000, 'L4')], self.frames(self.received(self.player)))
+
+        self.subscription.lastSwitch -= self.subscription.group.upswitchInterval
+        self.player.lastCongestion = 0
+        self.send(self.low, self.keyframe(4000, 'L5'))
+        self.send(self.high, self.keyframe(4000, 'H5'))
+        self.failUnlessEqual([(4000, 'L5'), (4000, 'H5')], self.frames(self.received(self.player)))
+        self.failUnless(self.subscription.stream is self.room.streams['high'])
+
+    def test_timestamps(self):
+        self.send(self.high, self.keyframe(1000, 'H1'))
+        self.player.pauseProducing()
+        self.send(self.high, self.keyframe(2000, 'H2'))
+        self.send(self.low, self.keyframe(50000, 'L2'), self.video(50040, '\x27\x01L3'))
+
+        self.failUnlessEqual([(1000, 'H1'), (2000, 'H2'), (2000, 'L2'), (2040, 'L3')], self.frames(self.received(self.player)))
+
+    def test_unpublish(self):
+        self.invoke(self.high, 'closeStream')
+        self.send(self.low, self.keyframe(0, 'L0'))
+
+        packets = self.received(self.player)
+        self.failUnlessEqual([(0, 'L0')], self.frames(packets))
+        self.failUnlessEqual(['NetStream.Play.Switch'], self.statuses(packets))
+
+        self.invoke(self.low, 'closeStream')
+        self.failUnlessEqual(['NetStream.Play.UnpublishNotify'], self.statuses(self.received(self.player)))
+
+        self.player.connectionLost(None)
+        self.failUnlessEqual({}, self.room.streams)
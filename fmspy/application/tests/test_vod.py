@@ -0,0 +1,205 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.application.vod}.
+"""
+
+import os
+
+from collections import OrderedDict
+
+from twisted.internet import defer, task, threads
+
+from fmspy.application import vod
+from fmspy.application.tests.test_stream import RelayTestCase, ApplicationMock
+from fmspy.rtmp import constants
+from fmspy.rtmp.flv import FLVWriter
+from fmspy.rtmp.header import RTMPHeader
+from fmspy.rtmp.packets import VideoData, Notify, Ping
+
+deferToThread = threads.deferToThread
+
+class VODApplicationMock(ApplicationMock):
+    """
+    Mock for application with recorded streams.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def streamPath(self, name):
+        path = os.path.join(self.directory, name + '.flv')
+        return path if os.path.exists(path) else None
+
+class PlaylistTestCase(RelayTestCase):
+    """
+    Test case for playback of recorded streams and play-lists.
+    """
+
+    def setUp(self):
+        RelayTestCase.setUp(self)
+        directory = self.mktemp()
+        os.mkdir(directory)
+        self.application = VODApplicationMock(directory)
+        self.room.application = self.application
+
+        self.clock = task.Clock()
+        self.patch(vod.pacer, 'clock', self.clock)
+        self.patch(vod, 'indexes', OrderedDict())
+        self.patch(vod, 'building', {})
+        # indexes are built synchronously
+        self.patch(threads, 'deferToThread', lambda f, *args: defer.execute(f, *args))
+
+        # 2 seconds of 25 fps video, keyframe each 400 ms
+        w = FLVWriter(open(os.path.join(directory, 'vod.flv'), 'wb'), hasAudio=False)
+        w.write(Notify('onMetaData', ({'duration' : 2.0}, ), RTMPHeader(timestamp=0)))
+        w.write(self.video(0, '\x17\x00config'))
+        for i in xrange(50):
+            if i % 10 == 0:
+                w.write(self.keyframe(i * 40, 'K%d' % i))
+            else:
+                w.write(self.video(i * 40, '\x27\x01I%d' % i))
+        w.close()
+
+    def video(self, timestamp, data):
+        return VideoData(RTMPHeader(object_id=8, timestamp=timestamp, length=len(data), type=constants.VIDEO_DATA, stream_id=1), [data])
+
+    def advance(self, seconds):
+        for i in xrange(int(seconds * 10)):
+            self.clock.advance(0.1)
+
+    def test_pacing(self):
+        player = self.connect()
+        self.send(player, Ping(Ping.CLIENT_BUFFER, [1, 500]))
+        self.invoke(player, 'play', 'vod', 0)
+
+        packets = self.received(player)
+        self.failUnlessEqual(['NetStream.Play.Reset', 'NetStream.Play.Start'], self.statuses(packets))
+        self.failUnlessEqual(['onMetaData'], [p.name for p in packets if isinstance(p, Notify)])
+        frames = self.frames(packets)
+        self.failUnlessEqual((0, 'config'), frames[0])
+        self.failUnlessEqual(range(0, 520, 40), [timestamp for (timestamp, data) in frames[1:]])
+
+        self.advance(0.5)
+        self.failUnlessEqual(range(520, 1040, 40), [timestamp for (timestamp, data) in self.frames(self.received(player))])
+
+        self.advance(1.5)
+        packets = self.received(player)
+        self.failUnlessEqual(range(1040, 2000, 40), [timestamp for (timestamp, data) in self.frames(packets)])
+        self.failUnlessEqual(['onPlayStatus'], [p.name for p in packets if isinstance(p, Notify)])
+        self.failUnlessEqual(['NetStream.Play.Stop'], self.statuses(packets))
+        self.failIf(vod.pacer.playing)
+        self.failUnlessEqual(None, vod.pacer.task)
+
+    def test_seek(self):
+        player = self.connect()
+        self.invoke(player, 'play', 'vod', 1.0, 0.5)
+
+        # playback starts from keyframe before requested position
+        packets = self.received(player)
+        self.failUnlessEqual([800], [p.header.timestamp for p in packets if isinstance(p, Notify) and p.name == 'onMetaData'])
+        self.failUnlessEqual([(800, 'config')] + [(i * 40, ('K%d' if i % 10 == 0 else 'I%d') % i) for i in xrange(20, 33)], self.frames(packets))
+        self.failUnlessEqual(['NetStream.Play.Reset', 'NetStream.Play.Start'], self.statuses(packets))
+
+        self.advance(0.5)
+        self.failUnlessEqual(['NetStream.Play.Stop'], self.statuses(self.received(player)))
+
+        # index is built once
+        count = vod.metrics.counters.get('vod.indexes_built', 0)
+        self.invoke(player, 'play', 'vod', 1.7)
+        self.failUnlessEqual((1600, 'config'), self.frames(self.received(player))[0])
+        self.failUnlessEqual(count, vod.metrics.counters.get('vod.indexes_built', 0))
+
+    def test_index_thread(self):
+        self.patch(threads, 'deferToThread', deferToThread)
+        player = self.connect()
+        self.invoke(player, 'play', 'vod', 1.0)
+
+        # playback waits for index
+        path = os.path.join(self.application.directory, 'vod.flv')
+        self.failUnless(path in vod.building)
+        self.failUnlessEqual([], self.frames(self.received(player)))
+
+        def check(index):
+            self.failUnlessEqual(range(0, 2000, 400), index.times)
+            self.failUnlessEqual([(800, 'config'), (800, 'K20')], self.frames(self.received(player))[:2])
+            self.failIf(vod.building)
+
+        return vod.fileIndex(path, player.subscriptions[1].reader).addCallback(check)
+
+    def test_failed(self):
+        player = self.connect()
+        self.invoke(player, 'play', 'vod', 0)
+        self.received(player)
+
+        player.subscriptions[1].reader.next = lambda: 1 / 0
+        self.advance(0.1)
+        self.failUnlessEqual(['NetStream.Play.Failed', 'NetStream.Play.Stop'], self.statuses(self.received(player)))
+        self.failIf(1 in player.subscriptions)
+        self.failIf(vod.pacer.playing)
+        self.failUnlessEqual(1, len(self.flushLoggedErrors(ZeroDivisionError)))
+
+    def test_skip(self):
+        # no keyframe before start position: tags are skipped, but not all at once
+        self.patch(vod.PlaylistSubscription, 'maxSkip', 10)
+        w = FLVWriter(open(os.path.join(self.application.directory, 'gop.flv'), 'wb'), hasAudio=False)
+        for i in xrange(100):
+            if i == 90:
+                w.write(self.keyframe(i * 20, 'K%d' % i))
+            else:
+                w.write(self.video(i * 20, '\x27\x01I%d' % i))
+        w.close()
+
+        player = self.connect()
+        self.invoke(player, 'play', 'gop', 1.5)
+        self.advance(0.6)
+        self.failUnlessEqual([], self.frames(self.received(player)))
+        self.advance(0.1)
+        self.failUnlessEqual([(1800, 'K90')] + [(i * 20, 'I%d' % i) for i in xrange(91, 100)], self.frames(self.received(player)))
+
+    def test_not_found(self):
+        player = self.connect()
+        self.invoke(player, 'play', 'missing', 0)
+        self.failUnlessEqual(['NetStream.Play.StreamNotFound'], self.statuses(self.received(player)))
+
+        # live stream is played if there's no recorded one
+        self.invoke(player, 'play', 'missing')
+        self.failUnlessEqual(['NetStream.Play.Reset', 'NetStream.Play.Start'], self.statuses(self.received(player)))
+        self.failUnless(player.subscriptions[1].stream is self.room.streams['missing'])
+
+    def test_playlist(self):
+        publisher, player = self.connect(), self.connect()
+        self.invoke(publisher, 'publish', 'live')
+
+        self.invoke(player, 'play', 'vod', 1.6)
+        self.invoke(player, 'play', 'live', -1, -1, False)
+        self.failUnlessEqual(1960, self.frames(self.received(player))[-1][0])
+
+        self.advance(0.4)
+        self.failUnlessEqual(['NetStream.Play.Start'], self.statuses(self.received(player)))
+
+        self.send(publisher, self.video(50000, '\x27\x01L0'), self.keyframe(50040, 'L1'), self.video(50080, '\x27\x01L2'))
+        self.failUnlessEqual([(2000, 'L1'), (2040, 'L2')], self.frames(self.received(player)))
+
+        self.invoke(player, 'play', 'vod', 0, -1, False)
+        self.invoke(publisher, 'closeStream')
+        packets = self.received(player)
+        self.failUnlessEqual(['NetStream.Play.Start'], self.statuses(packets))
+        self.failUnlessEqual((2040, 'config'), self.frames(packets)[0])
+
+    def test_pause(self):
+        player = self.connect()
+        self.invoke(player, 'play', 'vod')
+        self.received(player)
+
+        self.invoke(player, 'pause', True, 0.0)
+        self.advance(5)
+        self.failUnlessEqual(['NetStream.Pause.Notify'], self.statuses(self.received(player)))
+
+        self.invoke(player, 'pause', False, 0.0)
+        self.advance(0.2)
+        packets = self.received(player)
+        self.failUnlessEqual(['NetStream.Unpause.Notify'], self.statuses(packets))
+        self.failUnlessEqual(range(1040, 1240, 40), [timestamp for (timestamp, data) in self.frames(packets)])
@@ -0,0 +1,627 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Playback of recorded (VOD) streams and play-lists.
+
+All playing files are paced by single L{PacingScheduler}: on each
+tick every playback sends tags which are due by wall clock, plus
+read-ahead of client's buffer length. There are no per-stream timers.
+
+Seeking in file jumps to keyframe found in file's keyframe index,
+indexes are built once (in thread, as whole file may be read)
+and kept in L{indexes}.
+"""
+
+import os
+
+from collections import deque, OrderedDict
+
+from twisted.internet import defer, reactor, task, threads
+from twisted.python import log
+
+from fmspy.application.stream import Subscription
+from fmspy.rtmp import constants, status
+from fmspy.rtmp.flv import FLVReader, FLVIndex, FLVError
+from fmspy.rtmp.header import RTMPHeader
+from fmspy.rtmp.packets import MediaPacket, AudioData, VideoData, Notify
+from fmspy.stats import metrics
+from fmspy.config import config
+
+class PacingScheduler(object):
+    """
+    Scheduler driving all file playbacks with single reactor timer.
+
+    Timer is running only while something is playing.
+
+    @ivar interval: tick interval (seconds)
+    @type interval: C{float}
+    @ivar playing: active playbacks
+    @type playing: C{set} of L{PlaylistSubscription}
+    """
+
+    def __init__(self, interval, clock=reactor):
+        """
+        Constructor.
+
+        @param interval: tick interval (seconds)
+        @type interval: C{float}
+        @param clock: clock used to schedule reactor timer
+        @type clock: C{IReactorTime}
+        """
+        self.interval = interval
+        self.clock = clock
+        self.playing = set()
+        self.task = None
+
+    def seconds(self):
+        """
+        Current time of scheduler clock.
+
+        @rtype: C{float}
+        """
+        return self.clock.seconds()
+
+    def add(self, playback):
+        """
+        Start pacing playback.
+
+        @param playback: playback
+        @type playback: L{PlaylistSubscription}
+        """
+        self.playing.add(playback)
+        if self.task is None:
+            self.task = task.LoopingCall(self._tick)
+            self.task.clock = self.clock
+            self.task.start(self.interval, now=False)
+
+    def remove(self, playback):
+        """
+        Stop pacing playback.
+
+        @param playback: playback
+        @type playback: L{PlaylistSubscription}
+        """
+        self.playing.discard(playback)
+        if not self.playing and self.task is not None:
+            self.task.stop()
+            self.task = None
+
+    def _tick(self):
+        """
+        Timer fired, send due tags of all playbacks.
+        """
+        now = self.clock.seconds()
+
+        for playback in list(self.playing):
+            try:
+                playback.pump(now)
+            except Exception:
+                log.err(None, "Error in playback %r" % playback)
+                playback.failed()
+
+pacer = PacingScheduler(config.getfloat('RTMP', 'vodInterval'))
+"""
+Scheduler shared by all file playbacks.
+"""
+
+indexes = OrderedDict()
+"""
+Keyframe indexes of recently played files: path -> (modification time, size, L{FLVIndex}).
+"""
+
+maxIndexes = 100
+"""
+Maximum number of indexes kept in L{indexes}.
+"""
+
+building = {}
+"""
+Indexes being built: path -> C{list} of C{Deferred}s waiting for index.
+"""
+
+def _buildIndex(path):
+    """
+    Build keyframe index of file (runs in thread).
+
+    @param path: path to file
+    @type path: C{str}
+    @rtype: L{FLVIndex}
+    """
+    reader = FLVReader(open(path, 'rb'))
+    try:
+        return FLVIndex(reader)
+    finally:
+        reader.close()
+
+def fileIndex(path, reader):
+    """
+    Get keyframe index of file, building it in thread if necessary.
+
+    @param path: path to file
+    @type path: C{str}
+    @param reader: reader of file
+    @type reader: L{FLVReader}
+    @return: Deferred L{FLVIndex}
+    @rtype: C{Deferred}
+    """
+    st = os.fstat(reader.file.fileno())
+    key = (st.st_mtime, st.st_size)
+
+    entry = indexes.pop(path, None)
+    if entry is not None and entry[:2] == key:
+        indexes[path] = entry
+        return defer.succeed(entry[2])
+
+    d = defer.Deferred()
+    if path in building:
+        # file is already being indexed for other playback
+        building[path].append(d)
+        return d
+    building[path] = [d]
+
+    def built(result):
+        waiting = building.pop(path)
+        if isinstance(result, FLVIndex):
+            indexes[path] = key + (result, )
+            metrics.increment('vod.indexes_built')
+            while len(indexes) > maxIndexes:
+                indexes.popitem(last=False)
+            for d in waiting:
+                d.callback(result)
+        else:
+            for d in waiting:
+                d.errback(result)
+
+    threads.deferToThread(_buildIndex, path).addBoth(built)
+    return d
+
+class PlaylistItem(object):
+    """
+    Item of play-list: recorded or live stream, or time-shift
+    buffer of live stream.
+
+    @ivar name: stream name
+    @type name: C{str}
+    @ivar path: path to FLV file (C{None} for live stream)
+    @type path: C{str}
+    @ivar start: start position in file or time-shift buffer (ms)
+    @type start: C{int}
+    @ivar length: length of playback (ms), C{None} - till the end
+    @type length: C{int}
+    @ivar stream: live stream to play from its time-shift buffer
+    @type stream: L{Stream}
+    """
+
+    __slots__ = ('name', 'path', 'start', 'length', 'stream')
+
+    def __init__(self, name, path, start=0, length=None, stream=None):
+        """
+        Constructor.
+        """
+        self.name = name
+        self.path = path
+        self.start = start
+        self.length = length
+        self.stream = stream
+
+    def __repr__(self):
+        return "<PlaylistItem(%r, start=%d, length=%r)>" % (self.name, self.start, self.length)
+
+class PlaylistSubscription(Subscription):
+    """
+    Playback of play-list: recorded and live streams one after another.
+
+    Recorded stream is read from FLV file by L{pacer}: tags are sent when
+    they are due by wall clock plus L{bufferTime}. Live stream ends when it
+    is unpublished. Timestamps are continuous across items.
+
+    Time-shift buffer of live stream is played the same way as recorded
+    stream, playback doesn't end when it catches up with live stream.
+
+    Recorded streams are paced only while client's output isn't
+    congested, pause stops pacing as well.
+
+    @ivar room: room of live streams
+    @type room: L{Room}
+    @ivar items: pending items
+    @type items: C{deque} of L{PlaylistItem}
+    @ivar item: current item
+    @type item: L{PlaylistItem}
+    @ivar reader: reader of current file
+    @type reader: L{FLVReader}
+    @ivar pending: tag read from file, but not sent yet
+    @type pending: L{MediaPacket} or L{Notify}
+    @ivar position: timestamp of last tag sent from file
+    @type position: C{int}
+    @ivar finish: timestamp of end of file, when whole file is sent (or C{None})
+    @type finish: C{int}
+    @ivar started: time of start of current file (adjusted for pauses and congestion)
+    @type started: C{float}
+    @ivar lastPump: time of last pump
+    @type lastPump: C{float}
+    @ivar bufferTime: read-ahead (ms)
+    @type bufferTime: C{int}
+    @ivar lastTimestamp: timestamp of last packet sent
+    @type lastTimestamp: C{int}
+    @ivar rebase: adjust offset on next live packet?
+    @type rebase: C{bool}
+    @ivar videoConfig: last AVC sequence header of file
+    @type videoConfig: L{VideoData}
+    @ivar audioConfig: last AAC config of file
+    @type audioConfig: L{AudioData}
+    @ivar scheduler: pacing scheduler
+    @type scheduler: L{PacingScheduler}
+    """
+
+    __slots__ = ('room', 'items', 'item', 'reader', 'pending', 'position', 'finish', 'started', 'lastPump', 'bufferTime',
+                 'lastTimestamp', 'rebase', 'videoConfig', 'audioConfig', 'scheduler')
+
+    defaultBufferTime = config.getint('RTMP', 'vodBufferTime')
+    """
+    Read-ahead till client reports its buffer length (ms).
+    """
+
+    maxBufferTime = config.getint('RTMP', 'vodMaxBufferTime')
+    """
+    Maximum read-ahead (ms).
+    """
+
+    maxSkip = 500
+    """
+    Maximum number of tags before start position skipped in one pump.
+    """
+
+    def __init__(self, protocol, stream_id, room, bufferTime=None, scheduler=None):
+        """
+        Constructor.
+
+        @param protocol: client protocol
+        @type protocol: L{RTMPServerProtocol}
+        @param stream_id: Stream ID of client's NetStream
+        @type stream_id: C{int}
+        @param room: room of live streams
+        @type room: L{Room}
+        @param bufferTime: client buffer length (ms), if known
+        @type bufferTime: C{int}
+        @param scheduler: pacing scheduler (default is L{pacer})
+        @type scheduler: L{PacingScheduler}
+        """
+        Subscription.__init__(self, protocol, stream_id)
+        self.room = room
+        self.items = deque()
+        self.item = None
+        self.reader = None
+        self.pending = None
+        self.position = self.finish = None
+        self.started = self.lastPump = None
+        self.bufferTime = self.defaultBufferTime
+        self.lastTimestamp = None
+        self.rebase = False
+        self.videoConfig = self.audioConfig = None
+        self.scheduler = scheduler if scheduler is not None else pacer
+
+        if bufferTime is not None:
+            self.setBufferTime(bufferTime)
+
+    @property
+    def name(self):
+        """
+        Name of current item.
+
+        @rtype: C{str}
+        """
+        return self.item.name if self.item is not None else None
+
+    @property
+    def seekable(self):
+        """
+        Could playback be moved to other position?
+
+        @rtype: C{bool}
+        """
+        return self.reader is not None
+
+    def seek(self, position):
+        """
+        Move playback of current item to other position.
+
+        @param position: new position (ms)
+        @type position: C{int}
+        """
+        item = self.item
+        self.items.appendleft(PlaylistItem(item.name, item.path, position, item.length, item.stream))
+        # timestamps follow position
+        self.lastTimestamp = None
+        self._next()
+
+    def setBufferTime(self, bufferTime):
+        """
+        Client reported its buffer length.
+
+        @param bufferTime: buffer length (ms)
+        @type bufferTime: C{int}
+        """
+        self.bufferTime = max(0, min(bufferTime, self.maxBufferTime))
+
+    def add(self, item):
+        """
+        Add item to play-list, start playback if nothing is playing.
+
+        @param item: play-list item
+        @type item: L{PlaylistItem}
+        """
+        self.items.append(item)
+        if self.item is None:
+            self._next()
+
+    def close(self):
+        self.items.clear()
+        self._stop()
+        self.item = None
+
+    def failed(self):
+        """
+        Playback failed (e.g. error reading file): stop it, notify
+        client and detach subscription from client's NetStream.
+        """
+        name = self.name
+        self.close()
+        self.notify(status.playFailed(description='Failed to play %s.' % name, details=name))
+        self.notify(status.playStop(description='Stopped playing.'))
+
+        subscriptions = self.protocol.subscriptions
+        if subscriptions and subscriptions.get(self.stream_id) is self:
+            del subscriptions[self.stream_id]
+
+    def pause(self, paused):
+        if self.reader is None:
+            Subscription.pause(self, paused)
+        else:
+            # file isn't read while paused, playback continues from the same tag
+            self.paused = paused
+
+    def send(self, packet, timestamp=None):
+        if self.rebase and timestamp is None:
+            self.rebase = False
+            if self.lastTimestamp is not None:
+                self.offset = self.lastTimestamp - packet.header.timestamp
+
+        if timestamp is None:
+            timestamp = packet.header.timestamp + self.offset
+
+        Subscription.send(self, packet, timestamp)
+        self.lastTimestamp = timestamp
+
+    def unpublished(self, stream):
+        if self.items:
+            self._next()
+        else:
+            Subscription.unpublished(self, stream)
+
+    def pump(self, now):
+        """
+        Send tags of current file which are due.
+
+        @param now: current time (seconds)
+        @type now: C{float}
+        """
+        if self.reader is None:
+            return
+
+        protocol = self.protocol
+        if self.paused or protocol.writePaused or protocol.mediaQueueBytes > 0:
+            # playback position doesn't move
+            self.started += now - self.lastPump
+            self.lastPump = now
+            return
+        self.lastPump = now
+
+        item = self.item
+        position = item.start + int(round((now - self.started) * 1000))
+
+        if self.finish is None:
+            due = position + self.bufferTime
+            end = item.start + item.length if item.length is not None else None
+            count = skipped = 0
+
+            while True:
+                packet = self.pending
+                if packet is None:
+                    packet = self.reader.next()
+                    if packet is None and self.reader.growing:
+                        # caught up with live stream
+                        break
+                    if packet is not None and self.reader.overrun:
+                        # time-shift buffer was overwritten, continue from its start
+                        self.reader.overrun = False
+                        self.started = now - (packet.header.timestamp - item.start) / 1000.0
+                        due = packet.header.timestamp + self.bufferTime
+                if packet is None or (end is not None and packet.header.timestamp >= end):
+                    # whole item is sent, it is over when client plays it
+                    self.pending = None
+                    self.finish = self.position
+                    break
+                if packet.header.timestamp > due:
+                    self.pending = packet
+                    break
+
+                self.pending = None
+                self.position = packet.header.timestamp
+                count += 1
+                self._deliver(packet)
+
+                if packet.header.timestamp < item.start:
+                    skipped += 1
+                    if skipped >= self.maxSkip:
+                        # continue skipping on next pump, not blocking reactor
+                        break
+
+            metrics.increment('vod.tags_sent', count)
+
+        if self.finish is not None and position >= self.finish:
+            self._next()
+
+    def _deliver(self, packet):
+        """
+        Send tag of file to client.
+
+        @param packet: tag
+        @type packet: L{MediaPacket} or L{Notify}
+        """
+        cls = packet.__class__
+        if cls is VideoData and packet.isSequenceHeader:
+            self.videoConfig = packet
+        elif cls is AudioData and packet.isSequenceHeader:
+            self.audioConfig = packet
+
+        if packet.header.timestamp < self.item.start:
+            # seeking: media before start position is skipped
+            if not isinstance(packet, MediaPacket):
+                self.send(packet, self.item.start + self.offset)
+            return
+
+        self.send(packet)
+
+    def _configs(self):
+        if self.reader is not None:
+            return self
+        return Subscription._configs(self)
+
+    def _stop(self):
+        """
+        Stop playing current item.
+        """
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = self.pending = None
+            self.videoConfig = self.audioConfig = None
+            self.scheduler.remove(self)
+
+        self.rebase = False
+        if self.stream is not None:
+            self.stream.unsubscribe(self)
+
+    def _next(self):
+        """
+        Start playing next item of play-list.
+        """
+        self._stop()
+
+        if not self.items:
+            if self.item is not None:
+                self.item = None
+                self._complete()
+            return
+
+        self.item = item = self.items.popleft()
+        self.notify(status.playStart(description='Started playing %s.' % item.name, details=item.name))
+
+        # media is resumed after transition as after pause
+        self.syncAudio = self.syncVideo = True
+
+        if item.stream is not None:
+            self._startDVR(item)
+            return
+
+        if item.path is None:
+            self.rebase = True
+            self.room.stream(item.name).subscribe(self, self.lastTimestamp or 0)
+            return
+
+        try:
+            self.reader = FLVReader(open(item.path, 'rb'))
+        except (IOError, FLVError), e:
+            log.msg("Unable to play %r: %s" % (item.path, e))
+            self.notify(status.playStreamNotFound(description='Failed to play %s.' % item.name, details=item.name))
+            self._next()
+            return
+
+        if item.start > 0:
+            fileIndex(item.path, self.reader).addCallbacks(self._seekIndex, self._indexFailed,
+                                                           callbackArgs=(self.reader, ), errbackArgs=(self.reader, ))
+            return
+
+        self._startReader()
+
+    def _seekIndex(self, index, reader):
+        """
+        Keyframe index of file is ready, start playback from keyframe
+        before requested position.
+
+        @param index: keyframe index
+        @type index: L{FLVIndex}
+        @param reader: reader of file index is built for
+        @type reader: L{FLVReader}
+        """
+        if self.reader is not reader:
+            # playback was stopped or moved meanwhile
+            return
+
+        metadata = None
+        entry = index.find(self.item.start)
+        if entry is not None:
+            (self.item.start, position) = entry
+            self.videoConfig = index.videoConfig
+            self.audioConfig = index.audioConfig
+            metadata = index.metadata
+            reader.seek(position)
+
+        self._startReader(metadata)
+
+    def _indexFailed(self, fail, reader):
+        """
+        Keyframe index of file couldn't be built, tags before
+        requested position are skipped.
+        """
+        log.err(fail, "Unable to index %r" % self.item)
+        if self.reader is reader:
+            self._startReader()
+
+    def _startDVR(self, item):
+        """
+        Start playing time-shift buffer of live stream.
+
+        Playback starts from keyframe before requested position.
+
+        @param item: play-list item
+        @type item: L{PlaylistItem}
+        """
+        stream = item.stream
+        if stream.dvr is None:
+            self.notify(status.playStreamNotFound(description='Failed to play %s.' % item.name, details=item.name))
+            self._next()
+            return
+
+        self.reader = stream.dvr.reader(item.start)
+        item.start = self.reader.start
+        self.videoConfig = stream.videoConfig
+        self.audioConfig = stream.audioConfig
+
+        self._startReader(stream.metadata)
+
+    def _startReader(self, metadata=None):
+        """
+        Start pacing of current item.
+
+        @param metadata: metadata to send before first tag
+        @type metadata: L{Notify}
+        """
+        item = self.item
+        self.offset = self.lastTimestamp - item.start if self.lastTimestamp is not None else 0
+        if metadata is not None:
+            self.send(metadata, item.start + self.offset)
+        self.position = item.start
+        self.finish = None
+        self.started = self.lastPump = self.scheduler.seconds()
+        self.scheduler.add(self)
+        self.pump(self.started)
+
+    def _complete(self):
+        """
+        Play-list is over.
+        """
+        self.protocol.pushPacket(Notify('onPlayStatus', ({'code' : constants.StatusCodes.NS_PLAY_COMPLETE, 'level' : 'status'}, ),
+                                        RTMPHeader(timestamp=self.lastTimestamp or 0, stream_id=self.stream_id)))
+        self.notify(status.playStop(description='Stopped playing.'))
@@ -0,0 +1,10 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+HTTP Live Streaming (HLS) output of live streams.
+
+Published streams are transmuxed into MPEG-TS segments for
+non-Flash clients, segments are served by bundled HTTP server.
+"""
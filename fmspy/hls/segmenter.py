@@ -0,0 +1,277 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+HLS segmenter of live streams.
+
+Published stream is cut into MPEG-TS segments on keyframes, segments
+and play-list are written to segment directory. Latest segments of
+each stream are kept in L{cache}, so HTTP clients are served from memory.
+
+Files are written in threads, so disk doesn't block reactor. Segment
+numbers keep growing when stream is published again, so clients
+don't see media sequence of play-list going backwards. Numbering of
+stream not published since server start begins with current time
+(in seconds), which is above numbers of segments written before.
+"""
+
+import os
+import re
+
+from collections import deque
+
+from twisted.internet import defer, threads
+from twisted.python import log
+
+from fmspy.hls.ts import TSMuxer
+from fmspy.rtmp.packets import AudioData, VideoData
+from fmspy.stats import metrics
+from fmspy.config import config
+from fmspy import _time
+
+cache = {}
+"""
+Latest segments and play-lists of all streams: path (relative to segment directory) -> data.
+"""
+
+sequences = {}
+"""
+Sequence number of next segment of streams (by path), kept after stream is unpublished.
+"""
+
+_safeName = re.compile(r'^[\w][\w.-]*$')
+
+class HLSSegmenter(object):
+    """
+    Segmenter of live stream.
+
+    @ivar path: path of stream (relative to segment directory)
+    @type path: C{str}
+    @ivar directory: directory of stream segments
+    @type directory: C{str}
+    @ivar muxer: MPEG-TS muxer
+    @type muxer: L{TSMuxer}
+    @ivar sequence: sequence number of current segment
+    @type sequence: C{int}
+    @ivar segments: finished segments in play-list: (sequence number, duration in seconds)
+    @type segments: C{deque}
+    @ivar current: data of current segment
+    @type current: C{list} of C{str}
+    @ivar start: timestamp of first packet of current segment
+    @type start: C{int}
+    @ivar last: timestamp of last packet
+    @type last: C{int}
+    @ivar writing: file operations in progress (they are run in order)
+    @type writing: C{Deferred}
+    """
+
+    directoryRoot = config.get('HLS', 'directory')
+    """
+    Segment directory.
+    """
+
+    segmentDuration = config.getint('HLS', 'segmentDuration')
+    """
+    Target duration of segment (seconds).
+    """
+
+    playlistSize = config.getint('HLS', 'playlistSize')
+    """
+    Number of segments in play-list (and in memory).
+    """
+
+    def __init__(self, path):
+        """
+        Constructor.
+
+        @param path: path of stream (relative to segment directory)
+        @type path: C{str}
+        """
+        self.path = path
+        self.directory = os.path.join(self.directoryRoot, path)
+
+        self.muxer = TSMuxer()
+        # segments are cut once per segmentDuration (a second or more),
+        # so numbers started from time stay below time of later restart
+        self.sequence = sequences.get(path)
+        if self.sequence is None:
+            self.sequence = _time.seconds()
+        self.segments = deque()
+        self.writing = defer.succeed(None)
+        self._io(self._makeDirectory)
+        self.current = None
+        self.start = self.last = None
+
+    def __repr__(self):
+        return "<HLSSegmenter(%r, #%d)>" % (self.path, self.sequence)
+
+    def write(self, packet):
+        """
+        Process packet of live stream.
+
+        @param packet: packet of live stream
+        @type packet: L{MediaPacket} or L{Notify}
+        """
+        cls = packet.__class__
+        if cls is VideoData:
+            if packet.isSequenceHeader:
+                self.muxer.configure(packet)
+                return
+            boundary = packet.isKeyframe
+        elif cls is AudioData:
+            if packet.isSequenceHeader:
+                self.muxer.configure(packet)
+                return
+            boundary = not self.muxer.hasVideo
+        else:
+            return
+
+        timestamp = packet.header.timestamp
+        if boundary and (self.current is None or timestamp - self.start >= self.segmentDuration * 1000):
+            self._flush(timestamp)
+            self.current = [self.muxer.header()]
+            self.start = timestamp
+
+        if self.current is not None:
+            self.current.append(self.muxer.mux(packet))
+            self.last = timestamp
+
+    def close(self):
+        """
+        Stream was unpublished: write last segment, finish play-list.
+        """
+        if self.last is not None:
+            self._flush(self.last)
+        self._writePlaylist(True)
+
+        for (sequence, duration) in self.segments:
+            cache.pop(self._segmentPath(sequence), None)
+        cache.pop(self._playlistPath(), None)
+
+    def _segmentPath(self, sequence):
+        return '%s/%d.ts' % (self.path, sequence)
+
+    def _playlistPath(self):
+        return '%s/index.m3u8' % self.path
+
+    def _flush(self, timestamp):
+        """
+        Finish current segment.
+
+        @param timestamp: timestamp of end of segment
+        @type timestamp: C{int}
+        """
+        if self.current is None:
+            return
+
+        data = "".join(self.current)
+        self.current = None
+        duration = max(timestamp - self.start, 1) / 1000.0
+
+        self._io(self._writeFile, '%d.ts' % self.sequence, data)
+        cache[self._segmentPath(self.sequence)] = data
+        self.segments.append((self.sequence, duration))
+        self.sequence += 1
+        sequences[self.path] = self.sequence
+        metrics.increment('hls.segments')
+
+        while len(self.segments) > self.playlistSize:
+            (sequence, duration) = self.segments.popleft()
+            cache.pop(self._segmentPath(sequence), None)
+            self._io(self._removeFile, '%d.ts' % sequence)
+
+        self._writePlaylist(False)
+
+    def _writePlaylist(self, ended):
+        """
+        Write play-list of stream.
+
+        @param ended: is stream over?
+        @type ended: C{bool}
+        """
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3',
+                 '#EXT-X-TARGETDURATION:%d' % max([int(duration + 0.999) for (sequence, duration) in self.segments] + [self.segmentDuration]),
+                 '#EXT-X-MEDIA-SEQUENCE:%d' % (self.segments[0][0] if self.segments else self.sequence)]
+        for (sequence, duration) in self.segments:
+            lines.append('#EXTINF:%.3f,' % duration)
+            lines.append('%d.ts' % sequence)
+        if ended:
+            lines.append('#EXT-X-ENDLIST')
+
+        data = "\n".join(lines) + "\n"
+        self._io(self._writeFile, 'index.m3u8', data)
+        if not ended:
+            cache[self._playlistPath()] = data
+
+    def _io(self, func, *args):
+        """
+        Run file operation in thread, after operations scheduled before it.
+
+        @param func: file operation
+        @param args: arguments of operation
+        """
+        def run(_):
+            return threads.deferToThread(func, *args).addErrback(log.err, "Error in HLS file operation")
+
+        self.writing.addCallback(run)
+
+    def _makeDirectory(self):
+        """
+        Create stream directory (runs in thread).
+        """
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+        except OSError, e:
+            log.msg("Unable to create %r: %s" % (self.directory, e))
+
+    def _removeFile(self, name):
+        """
+        Remove file from stream directory (runs in thread).
+
+        @param name: file name
+        @type name: C{str}
+        """
+        try:
+            os.unlink(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def _writeFile(self, name, data):
+        """
+        Write file into stream directory (atomically, runs in thread).
+
+        @param name: file name
+        @type name: C{str}
+        @param data: file contents
+        @type data: C{str}
+        """
+        path = os.path.join(self.directory, name)
+        try:
+            f = open(path + '.tmp', 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(path + '.tmp', path)
+        except (IOError, OSError), e:
+            log.msg("Unable to write %r: %s" % (path, e))
+
+def segmenter(stream):
+    """
+    Create segmenter for published live stream.
+
+    Stream is segmented under C{<application>/<room>/<stream>}.
+
+    @param stream: live stream
+    @type stream: L{Stream}
+    @return: segmenter or C{None}, if stream name couldn't be used as path
+    @rtype: L{HLSSegmenter}
+    """
+    parts = [stream.room.application.name(), stream.room.name, stream.name]
+    for part in parts:
+        if not _safeName.match(part):
+            return None
+
+    return HLSSegmenter('/'.join(parts))
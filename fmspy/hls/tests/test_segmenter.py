@@ -0,0 +1,155 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.hls.segmenter} and L{fmspy.hls.web}.
+"""
+
+import os
+
+from twisted.trial import unittest
+from twisted.web.test.requesthelper import DummyRequest
+
+from fmspy.hls import segmenter
+from fmspy.hls.segmenter import HLSSegmenter
+from fmspy.hls.tests.test_ts import avcConfig, avc, aacConfig, aac
+from fmspy.hls.web import HLSResource
+from fmspy import _time
+
+class HLSSegmenterTestCase(unittest.TestCase):
+    """
+    Test case for L{HLSSegmenter}.
+    """
+
+    def setUp(self):
+        self.root = self.mktemp()
+        self.patch(HLSSegmenter, 'directoryRoot', self.root)
+        self.patch(HLSSegmenter, 'segmentDuration', 2)
+        self.patch(HLSSegmenter, 'playlistSize', 2)
+        self.patch(segmenter, 'cache', {})
+        self.patch(segmenter, 'sequences', {})
+        self.patch(_time, 'seconds', lambda: 0)
+        self.s = HLSSegmenter('app/room/stream')
+        self.directory = os.path.join(self.root, 'app', 'room', 'stream')
+
+    def playlist(self):
+        return open(os.path.join(self.directory, 'index.m3u8')).read().split("\n")
+
+    def publish(self, s, start, count):
+        s.write(avcConfig())
+        s.write(aacConfig())
+        for i in xrange(start, start + count):
+            s.write(avc(i * 100, i % 10 == 0, ["\x65" if i % 10 == 0 else "\x41"]))
+            s.write(aac(i * 100, "a"))
+
+    def test_segments(self):
+        self.publish(self.s, 0, 100)
+
+        # segments are cut on every second keyframe
+        self.failUnlessEqual([(2, 2.0), (3, 2.0)], list(self.s.segments))
+        self.failUnlessEqual(['app/room/stream/2.ts', 'app/room/stream/3.ts', 'app/room/stream/index.m3u8'],
+                             sorted(segmenter.cache.keys()))
+
+        data = segmenter.cache['app/room/stream/3.ts']
+        self.failUnlessEqual(0, len(data) % 188)
+
+        def written(_):
+            self.failUnlessEqual(['2.ts', '3.ts', 'index.m3u8'], sorted(os.listdir(self.directory)))
+            self.failUnlessEqual(['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:2', '#EXT-X-MEDIA-SEQUENCE:2',
+                                  '#EXTINF:2.000,', '2.ts', '#EXTINF:2.000,', '3.ts', ''], self.playlist())
+            self.failUnlessEqual(data, open(os.path.join(self.directory, '3.ts'), 'rb').read())
+
+            self.s.close()
+            self.failUnlessEqual({}, segmenter.cache)
+            self.s.writing.addCallback(closed)
+
+        def closed(_):
+            self.failUnlessEqual(['#EXTINF:2.000,', '3.ts', '#EXTINF:1.900,', '4.ts', '#EXT-X-ENDLIST', ''], self.playlist()[4:])
+
+        return self.s.writing.addCallback(written)
+
+    def test_republish(self):
+        self.publish(self.s, 0, 50)
+        self.s.close()
+
+        # media sequence continues after stream is published again
+        s = HLSSegmenter('app/room/stream')
+        self.publish(s, 0, 50)
+        self.failUnlessEqual([(3, 2.0), (4, 2.0)], list(s.segments))
+        self.failUnlessEqual('#EXT-X-MEDIA-SEQUENCE:3', segmenter.cache['app/room/stream/index.m3u8'].split("\n")[3])
+        s.close()
+
+        # after restart numbering starts from current time
+        segmenter.sequences.clear()
+        self.patch(_time, 'seconds', lambda: 1000)
+        self.failUnlessEqual(1000, HLSSegmenter('app/room/stream').sequence)
+
+    def test_audio(self):
+        self.s.write(aacConfig())
+        for i in xrange(0, 50):
+            self.s.write(aac(i * 100, "a"))
+
+        self.failUnlessEqual([(0, 2.0), (1, 2.0)], list(self.s.segments))
+
+    def test_waitKeyframe(self):
+        self.s.write(avcConfig())
+        self.s.write(avc(0, False, ["\x41"]))
+        self.failUnlessEqual(None, self.s.current)
+        self.s.write(avc(40, True, ["\x65"]))
+        self.failUnlessEqual(40, self.s.start)
+
+class SegmenterTestCase(unittest.TestCase):
+    """
+    Test case for L{segmenter.segmenter}.
+    """
+
+    def stream(self, app, room, name):
+        class Mock(object):
+            pass
+        stream = Mock()
+        stream.name = name
+        stream.room = Mock()
+        stream.room.name = room
+        stream.room.application = Mock()
+        stream.room.application.name = lambda: app
+        return stream
+
+    def test_unsafe(self):
+        self.patch(HLSSegmenter, 'directoryRoot', self.mktemp())
+        self.failUnlessEqual('app/room/stream', segmenter.segmenter(self.stream('app', 'room', 'stream')).path)
+        self.failUnlessEqual(None, segmenter.segmenter(self.stream('app', '..', 'stream')))
+        self.failUnlessEqual(None, segmenter.segmenter(self.stream('app', 'room', 'a/b')))
+
+class HLSResourceTestCase(unittest.TestCase):
+    """
+    Test case for L{HLSResource}.
+    """
+
+    def setUp(self):
+        self.directory = self.mktemp()
+        os.makedirs(os.path.join(self.directory, 'app'))
+        open(os.path.join(self.directory, 'app', '1.ts'), 'wb').write('disk')
+        self.patch(segmenter, 'cache', {'app/index.m3u8' : '#EXTM3U\n'})
+        self.resource = HLSResource(self.directory)
+
+    def render(self, path):
+        request = DummyRequest(path.split('/'))
+        result = self.resource.render(request)
+        if isinstance(result, str):
+            request.write(result)
+        return request
+
+    def test_cache(self):
+        request = self.render('app/index.m3u8')
+        self.failUnlessEqual('#EXTM3U\n', ''.join(request.written))
+        self.failUnlessEqual(['application/vnd.apple.mpegurl'], request.responseHeaders.getRawHeaders('content-type'))
+
+    def test_file(self):
+        request = self.render('app/1.ts')
+        self.failUnlessEqual('disk', ''.join(request.written))
+
+    def test_notFound(self):
+        self.failUnlessEqual(404, self.render('app/2.ts').responseCode)
+        self.failUnlessEqual(404, self.render('app/1.txt').responseCode)
+        self.failUnlessEqual(404, self.render('../app/1.ts').responseCode)
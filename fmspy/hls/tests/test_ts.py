@@ -0,0 +1,120 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.hls.ts}.
+"""
+
+import struct
+import unittest
+
+from fmspy.hls import ts
+from fmspy.rtmp import constants
+from fmspy.rtmp.header import RTMPHeader
+from fmspy.rtmp.packets import AudioData, VideoData
+
+SPS = "\x67\x42\xc0\x1e\x95"
+PPS = "\x68\xce\x3c\x80"
+
+def avcConfig():
+    record = "\x01\x42\xc0\x1e\xff\xe1" + struct.pack('!H', len(SPS)) + SPS + "\x01" + struct.pack('!H', len(PPS)) + PPS
+    return VideoData(RTMPHeader(timestamp=0, length=5 + len(record), type=constants.VIDEO_DATA), ["\x17\x00\x00\x00\x00" + record])
+
+def avc(timestamp, keyframe, units, cts=0):
+    data = ("\x17" if keyframe else "\x27") + "\x01" + struct.pack('!l', cts)[1:] + "".join([struct.pack('!L', len(u)) + u for u in units])
+    return VideoData(RTMPHeader(timestamp=timestamp, length=len(data), type=constants.VIDEO_DATA), [data])
+
+def aacConfig():
+    # AAC LC, 44100 Hz, stereo
+    return AudioData(RTMPHeader(timestamp=0, length=4, type=constants.AUDIO_DATA), ["\xaf\x00\x12\x10"])
+
+def aac(timestamp, frame):
+    return AudioData(RTMPHeader(timestamp=timestamp, length=2 + len(frame), type=constants.AUDIO_DATA), ["\xaf\x01" + frame])
+
+def payload(packets, pid):
+    """
+    Join payloads of transport stream packets of PID.
+    """
+    result = []
+    for i in xrange(0, len(packets), ts.PACKET_SIZE):
+        packet = packets[i:i+ts.PACKET_SIZE]
+        if (ord(packet[1]) << 8 | ord(packet[2])) & 0x1fff != pid:
+            continue
+        start = 4
+        if ord(packet[3]) & 0x20:
+            start += 1 + ord(packet[4])
+        result.append(packet[start:])
+    return "".join(result)
+
+class TSMuxerTestCase(unittest.TestCase):
+    """
+    Test case for L{ts.TSMuxer}.
+    """
+
+    def setUp(self):
+        self.m = ts.TSMuxer()
+        self.m.configure(avcConfig())
+        self.m.configure(aacConfig())
+
+    def test_crc32(self):
+        self.failUnlessEqual(0x0376e6e7, ts.crc32('123456789'))
+
+    def test_header(self):
+        header = self.m.header()
+        self.failUnlessEqual(2 * ts.PACKET_SIZE, len(header))
+        self.failUnlessEqual("\x47\x40\x00", header[:3])
+        self.failUnlessEqual("\x00\x00\xb0\x0d\x00\x01\xc1\x00\x00\x00\x01\xf0\x00",
+                             payload(header, ts.PAT_PID)[:13])
+
+        pmt = payload(header, ts.PMT_PID)[1:]
+        length = struct.unpack('!H', pmt[1:3])[0] & 0x0fff
+        self.failUnlessEqual(0, ts.crc32(pmt[:3 + length]))
+        self.failUnlessEqual([(ts.STREAM_TYPE_H264, ts.VIDEO_PID), (ts.STREAM_TYPE_AAC, ts.AUDIO_PID)],
+                             [(ord(pmt[i]), struct.unpack('!H', pmt[i+1:i+3])[0] & 0x1fff) for i in (12, 17)])
+
+    def test_video(self):
+        data = self.m.mux(avc(1000, True, ["\x65" + "k" * 500], cts=40))
+        self.failUnlessEqual(0, len(data) % ts.PACKET_SIZE)
+        self.failUnlessEqual(ts.VIDEO_PID, struct.unpack('!H', data[1:3])[0] & 0x1fff)
+        # random access indicator and PCR
+        self.failUnlessEqual(0x50, ord(data[5]))
+
+        pes = payload(data, ts.VIDEO_PID)
+        self.failUnlessEqual("\x00\x00\x01\xe0", pes[:4])
+        self.failUnlessEqual(0xc0, ord(pes[7]))
+        self.failUnlessEqual("\x00\x00\x00\x01\x09\xf0\x00\x00\x00\x01" + SPS + "\x00\x00\x00\x01" + PPS + "\x00\x00\x00\x01\x65" + "k" * 500,
+                             pes[19:])
+
+        pes = payload(self.m.mux(avc(1040, False, ["\x41ab", "\x41cd"])), ts.VIDEO_PID)
+        self.failUnlessEqual(0x80, ord(pes[7]))
+        self.failUnlessEqual("\x00\x00\x00\x01\x09\xf0\x00\x00\x00\x01\x41ab\x00\x00\x00\x01\x41cd", pes[14:])
+
+    def test_malformed(self):
+        # empty NAL unit at the end of packet
+        data = "\x17\x01\x00\x00\x00" + "\x00\x00\x00\x02\x65\xaa" + "\x00\x00\x00\x00"
+        packet = VideoData(RTMPHeader(timestamp=0, length=len(data), type=constants.VIDEO_DATA), [data])
+        pes = payload(self.m.mux(packet), ts.VIDEO_PID)
+        self.failUnless(pes.endswith("\x00\x00\x00\x01\x65\xaa"))
+
+        # truncated NAL unit
+        data = "\x27\x01\x00\x00\x00" + "\x00\x00\x00\x02\x41\xaa" + "\x00\x00\x01\x00\x41\xbb"
+        packet = VideoData(RTMPHeader(timestamp=40, length=len(data), type=constants.VIDEO_DATA), [data])
+        pes = payload(self.m.mux(packet), ts.VIDEO_PID)
+        self.failUnless(pes.endswith("\x00\x00\x00\x01\x41\xaa\x00\x00\x00\x01\x41\xbb"))
+
+    def test_audio(self):
+        pes = payload(self.m.mux(aac(0, "f" * 10)), ts.AUDIO_PID)
+        self.failUnlessEqual("\x00\x00\x01\xc0", pes[:4])
+        self.failUnlessEqual(8 + 7 + 10, struct.unpack('!H', pes[4:6])[0])
+        self.failUnlessEqual("\xff\xf1\x50\x80\x02\x3f\xfc" + "f" * 10, pes[14:])
+
+    def test_continuity(self):
+        data = self.m.mux(avc(0, True, ["\x65" + "k" * 1000])) + self.m.mux(avc(40, False, ["\x41" + "i" * 300]))
+        counters = [ord(data[i + 3]) & 0x0f for i in xrange(0, len(data), ts.PACKET_SIZE)]
+        self.failUnlessEqual(range(len(counters)), counters)
+
+    def test_unconfigured(self):
+        m = ts.TSMuxer()
+        self.failUnlessEqual("", m.mux(avc(0, True, ["\x65k"])))
+        self.failUnlessEqual("", m.mux(aac(0, "f")))
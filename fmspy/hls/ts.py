@@ -0,0 +1,281 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+MPEG-TS muxer.
+
+Converts RTMP H.264 video (AVC in FLV format: length-prefixed NAL units)
+and AAC audio (raw frames) into MPEG transport stream: H.264 elementary
+stream in Annex B format and AAC with ADTS headers.
+"""
+
+import struct
+
+from fmspy.rtmp.packets import AudioData, VideoData
+
+PACKET_SIZE = 188
+"""
+Size of transport stream packet.
+"""
+
+PAT_PID = 0x0000
+PMT_PID = 0x1000
+VIDEO_PID = 0x0100
+AUDIO_PID = 0x0101
+
+STREAM_TYPE_H264 = 0x1b
+STREAM_TYPE_AAC = 0x0f
+
+_crcTable = []
+for _i in xrange(256):
+    _crc = _i << 24
+    for _j in xrange(8):
+        _crc = ((_crc << 1) ^ 0x04c11db7) if _crc & 0x80000000 else (_crc << 1)
+    _crcTable.append(_crc & 0xffffffff)
+del _i, _j, _crc
+
+def crc32(data):
+    """
+    CRC32 of PSI section (MPEG-2 variant).
+
+    @param data: section data
+    @type data: C{str}
+    @rtype: C{int}
+    """
+    crc = 0xffffffff
+    for c in data:
+        crc = ((crc << 8) & 0xffffffff) ^ _crcTable[(crc >> 24) ^ ord(c)]
+    return crc
+
+def _timestamp(prefix, ts):
+    """
+    Encode PTS or DTS of PES header.
+
+    @param prefix: 4-bit prefix
+    @type prefix: C{int}
+    @param ts: timestamp (90 kHz)
+    @type ts: C{int}
+    @rtype: C{str}
+    """
+    return struct.pack('!BHH', (prefix << 4) | (((ts >> 30) & 0x07) << 1) | 1,
+                       (((ts >> 15) & 0x7fff) << 1) | 1, ((ts & 0x7fff) << 1) | 1)
+
+_startCode = "\x00\x00\x00\x01"
+_accessUnitDelimiter = _startCode + "\x09\xf0"
+
+class TSMuxer(object):
+    """
+    MPEG-TS muxer of single program with H.264 video and AAC audio.
+
+    Codec configuration (AVC sequence header, AAC config) should be
+    passed to muxer before media. Packets of other codecs are ignored.
+
+    @ivar counters: continuity counters by PID
+    @type counters: C{dict}
+    @ivar sps: H.264 sequence parameter sets (Annex B)
+    @type sps: C{str}
+    @ivar lengthSize: size of NAL unit length in AVC packets
+    @type lengthSize: C{int}
+    @ivar adts: fixed part of ADTS header (profile, frequency, channels)
+    @type adts: (C{int}, C{int}, C{int})
+    """
+
+    delay = 63000
+    """
+    Offset of PTS/DTS against PCR (90 kHz), gives decoder time to buffer.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.counters = {PAT_PID : 0, PMT_PID : 0, VIDEO_PID : 0, AUDIO_PID : 0}
+        self.sps = None
+        self.lengthSize = 4
+        self.adts = None
+
+    @property
+    def hasVideo(self):
+        """
+        Was AVC configuration received?
+
+        @rtype: C{bool}
+        """
+        return self.sps is not None
+
+    def configure(self, packet):
+        """
+        Process codec configuration.
+
+        @param packet: AVC sequence header or AAC config
+        @type packet: L{VideoData} or L{AudioData}
+        """
+        data = packet.data
+        if packet.__class__ is VideoData:
+            if packet.codec != VideoData.AVC or len(data) < 11:
+                return
+            record = data[5:]
+            self.lengthSize = (ord(record[4]) & 0x03) + 1
+
+            units = []
+            pos = 5
+            for kind in (0, 1):
+                count = ord(record[pos]) & (0x1f if kind == 0 else 0xff)
+                pos += 1
+                for i in xrange(count):
+                    (length, ) = struct.unpack_from('!H', record, pos)
+                    units.append(_startCode + record[pos+2:pos+2+length])
+                    pos += 2 + length
+            self.sps = "".join(units)
+        else:
+            if packet.codec != AudioData.AAC or len(data) < 4:
+                return
+            config = ord(data[2]) << 8 | ord(data[3])
+            self.adts = ((config >> 11) - 1 & 0x03, (config >> 7) & 0x0f, (config >> 3) & 0x0f)
+
+    def header(self):
+        """
+        Program tables (PAT and PMT), start of each segment.
+
+        @rtype: C{str}
+        """
+        pat = struct.pack('!BHHBBBHH', 0x00, 0xb000 | 13, 0x0001, 0xc1, 0, 0, 0x0001, 0xe000 | PMT_PID)
+
+        streams = []
+        if self.hasVideo:
+            streams.append(struct.pack('!BHH', STREAM_TYPE_H264, 0xe000 | VIDEO_PID, 0xf000))
+        if self.adts is not None:
+            streams.append(struct.pack('!BHH', STREAM_TYPE_AAC, 0xe000 | AUDIO_PID, 0xf000))
+        streams = "".join(streams)
+        pcrPid = VIDEO_PID if self.hasVideo else AUDIO_PID
+        pmt = struct.pack('!BHHBBBHH', 0x02, 0xb000 | (13 + len(streams)), 0x0001, 0xc1, 0, 0,
+                          0xe000 | pcrPid, 0xf000) + streams
+
+        return "".join(self._packets(PAT_PID, "\x00" + pat + struct.pack('!L', crc32(pat))) +
+                       self._packets(PMT_PID, "\x00" + pmt + struct.pack('!L', crc32(pmt))))
+
+    def mux(self, packet):
+        """
+        Mux media packet.
+
+        @param packet: media packet
+        @type packet: L{VideoData} or L{AudioData}
+        @return: transport stream packets
+        @rtype: C{str}
+        """
+        if packet.__class__ is VideoData:
+            return self._video(packet)
+        return self._audio(packet)
+
+    def _video(self, packet):
+        """
+        Mux H.264 video packet.
+        """
+        if not self.hasVideo or packet.avcPacketType != VideoData.AVC_NALU:
+            return ""
+
+        data = packet.data
+        cts = struct.unpack('!l', data[1:5])[0] & 0xffffff
+        if cts & 0x800000:
+            cts -= 0x1000000
+
+        keyframe = packet.isKeyframe
+        units = [_accessUnitDelimiter]
+        if keyframe:
+            units.append(self.sps)
+
+        pos, size, lengthSize = 5, len(data), self.lengthSize
+        while pos + lengthSize < size:
+            length = 0
+            for i in xrange(lengthSize):
+                length = (length << 8) | ord(data[pos + i])
+            pos += lengthSize
+            # truncated NAL units are cut at the end of packet, empty ones are skipped
+            length = min(length, size - pos)
+            if length > 0 and ord(data[pos]) & 0x1f != 9:
+                units.append(_startCode)
+                units.append(data[pos:pos+length])
+            pos += length
+
+        dts = packet.header.timestamp * 90 + self.delay
+        pts = dts + cts * 90
+        if pts != dts:
+            header = "\x80\xc0\x0a" + _timestamp(0x3, pts) + _timestamp(0x1, dts)
+        else:
+            header = "\x80\x80\x05" + _timestamp(0x2, pts)
+
+        # video PES is of unbounded length
+        pes = "\x00\x00\x01\xe0\x00\x00" + header + "".join(units)
+        return "".join(self._packets(VIDEO_PID, pes, pcr=dts - self.delay, randomAccess=keyframe))
+
+    def _audio(self, packet):
+        """
+        Mux AAC audio packet.
+        """
+        if self.adts is None or packet.aacPacketType != AudioData.AAC_RAW:
+            return ""
+
+        frame = packet.data[2:]
+        length = len(frame) + 7
+        (profile, frequency, channels) = self.adts
+        adts = struct.pack('!BBBBBBB', 0xff, 0xf1, (profile << 6) | (frequency << 2) | (channels >> 2),
+                           ((channels & 0x03) << 6) | (length >> 11), (length >> 3) & 0xff, ((length & 0x07) << 5) | 0x1f, 0xfc)
+
+        pts = packet.header.timestamp * 90 + self.delay
+        header = "\x80\x80\x05" + _timestamp(0x2, pts)
+        pes = "\x00\x00\x01\xc0" + struct.pack('!H', len(header) + length) + header + adts + frame
+
+        pcr = None if self.hasVideo else pts - self.delay
+        return "".join(self._packets(AUDIO_PID, pes, pcr=pcr, randomAccess=pcr is not None))
+
+    def _packets(self, pid, data, pcr=None, randomAccess=False):
+        """
+        Split payload into transport stream packets.
+
+        @param pid: PID
+        @type pid: C{int}
+        @param data: payload (PES packet or PSI section)
+        @type data: C{str}
+        @param pcr: program clock reference (90 kHz) for the first packet
+        @type pcr: C{int}
+        @param randomAccess: set random access indicator in the first packet
+        @type randomAccess: C{bool}
+        @rtype: C{list} of C{str}
+        """
+        packets = []
+        pos, size = 0, len(data)
+        first = True
+
+        while first or pos < size:
+            counter = self.counters[pid]
+            self.counters[pid] = (counter + 1) & 0x0f
+
+            adaptation = None
+            if first and (pcr is not None or randomAccess):
+                adaptation = chr((0x40 if randomAccess else 0) | (0x10 if pcr is not None else 0))
+                if pcr is not None:
+                    adaptation += struct.pack('!LH', (pcr >> 1) & 0xffffffff, ((pcr & 1) << 15) | 0x7e00)
+
+            room = PACKET_SIZE - 4 - (len(adaptation) + 1 if adaptation is not None else 0)
+            chunk = data[pos:pos+room]
+            pos += room
+
+            stuffing = room - len(chunk)
+            if stuffing:
+                if adaptation is not None:
+                    adaptation += "\xff" * stuffing
+                elif stuffing == 1:
+                    adaptation = ""
+                else:
+                    adaptation = "\x00" + "\xff" * (stuffing - 2)
+
+            if adaptation is not None:
+                packets.append(struct.pack('!BHBB', 0x47, (0x4000 if first else 0) | pid, 0x30 | counter, len(adaptation)) +
+                               adaptation + chunk)
+            else:
+                packets.append(struct.pack('!BHB', 0x47, (0x4000 if first else 0) | pid, 0x10 | counter) + chunk)
+
+            first = False
+
+        return packets
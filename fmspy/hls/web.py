@@ -0,0 +1,70 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+HLS HTTP endpoint.
+
+Resource is attached to bundled HTTP server under C{/hls/},
+play-list of stream is C{/hls/<application>/<room>/<stream>/index.m3u8}.
+"""
+
+from twisted.python import filepath
+from twisted.web import resource, static
+
+from fmspy.hls import segmenter
+
+class HLSResource(resource.Resource):
+    """
+    Segments and play-lists of live streams.
+
+    Latest segments are served from memory, other files (e.g. of
+    finished streams) are read from segment directory.
+
+    @ivar directory: segment directory
+    @type directory: C{str}
+    """
+    isLeaf = True
+
+    contentTypes = {
+            '.m3u8' : 'application/vnd.apple.mpegurl',
+            '.ts' : 'video/MP2T',
+        }
+    """
+    Content types by extension.
+    """
+
+    def __init__(self, directory):
+        """
+        Constructor.
+
+        @param directory: segment directory
+        @type directory: C{str}
+        """
+        resource.Resource.__init__(self)
+        self.directory = directory
+
+    def render_GET(self, request):
+        """
+        Render segment or play-list.
+        """
+        path = '/'.join(request.postpath)
+        extension = path[path.rfind('.'):]
+        if extension not in self.contentTypes:
+            return resource.NoResource().render(request)
+
+        data = segmenter.cache.get(path)
+        if data is not None:
+            request.setHeader('content-type', self.contentTypes[extension])
+            # play-lists change, segments don't
+            request.setHeader('cache-control', 'no-cache' if extension == '.m3u8' else 'max-age=3600')
+            return data
+
+        try:
+            child = filepath.FilePath(self.directory).preauthChild(path)
+        except filepath.InsecurePath:
+            return resource.NoResource().render(request)
+
+        f = static.File(child.path)
+        f.contentTypes = self.contentTypes
+        return f.render(request)
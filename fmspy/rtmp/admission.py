@@ -0,0 +1,166 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Connection admission control.
+
+Server factory asks L{AdmissionControl} before building protocol
+for each incoming connection, rejected connections are closed
+immediately, without allocating any protocol state.
+"""
+
+import time
+
+from fmspy.stats import metrics
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter.
+
+    Bucket is refilled with L{rate} tokens per second,
+    up to L{burst} tokens.
+
+    @ivar rate: refill rate (tokens per second)
+    @type rate: C{float}
+    @ivar burst: bucket capacity
+    @type burst: C{float}
+    @ivar tokens: tokens available
+    @type tokens: C{float}
+    """
+
+    def __init__(self, rate, burst, clock=time.time):
+        """
+        Constructor.
+
+        @param rate: refill rate (tokens per second)
+        @type rate: C{float}
+        @param burst: bucket capacity
+        @type burst: C{float}
+        @param clock: time source
+        @type clock: C{callable}
+        """
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.last = clock()
+
+    def consume(self):
+        """
+        Try to take one token from bucket.
+
+        @return: token was available?
+        @rtype: C{bool}
+        """
+        now = self.clock()
+        tokens = self.tokens + (now - self.last) * self.rate
+        if tokens > self.burst:
+            tokens = self.burst
+        self.last = now
+
+        if tokens < 1:
+            self.tokens = tokens
+            return False
+
+        self.tokens = tokens - 1
+        return True
+
+class AdmissionControl(object):
+    """
+    Admission control for incoming connections.
+
+    Limits number of concurrent connections (globally and per source
+    address) and rate of new connections (handshakes per second).
+    Limit equal to zero means "no limit".
+
+    Rejected connections are counted as C{rtmp.rejected} and
+    C{rtmp.rejected.<reason>}, where reason is one of
+    L{REJECT_GLOBAL}, L{REJECT_HOST}, L{REJECT_RATE}.
+
+    @ivar maxConnections: maximum number of connections
+    @type maxConnections: C{int}
+    @ivar maxPerHost: maximum number of connections from one address
+    @type maxPerHost: C{int}
+    @ivar bucket: handshake rate limiter
+    @type bucket: L{TokenBucket}
+    @ivar connections: number of admitted connections
+    @type connections: C{int}
+    @ivar hosts: number of admitted connections per address
+    @type hosts: C{dict}
+    """
+
+    REJECT_GLOBAL = 'global'
+    REJECT_HOST = 'host'
+    REJECT_RATE = 'rate'
+
+    def __init__(self, maxConnections=0, maxPerHost=0, rate=0, burst=0, clock=time.time):
+        """
+        Constructor.
+
+        @param maxConnections: maximum number of connections
+        @type maxConnections: C{int}
+        @param maxPerHost: maximum number of connections from one address
+        @type maxPerHost: C{int}
+        @param rate: maximum rate of handshakes (per second)
+        @type rate: C{float}
+        @param burst: maximum burst of handshakes
+        @type burst: C{int}
+        @param clock: time source
+        @type clock: C{callable}
+        """
+        self.maxConnections = maxConnections
+        self.maxPerHost = maxPerHost
+        self.bucket = None
+        if rate > 0:
+            self.bucket = TokenBucket(rate, max(burst, 1), clock)
+        self.connections = 0
+        self.hosts = {}
+
+    def admit(self, host):
+        """
+        Check whether new connection should be accepted.
+
+        If connection is admitted, L{release} should be
+        called when it is closed.
+
+        @param host: source address
+        @type host: C{str}
+        @return: reject reason or C{None} if connection is admitted
+        @rtype: C{str}
+        """
+        if self.maxConnections and self.connections >= self.maxConnections:
+            return self._reject(self.REJECT_GLOBAL)
+
+        count = self.hosts.get(host, 0)
+        if self.maxPerHost and count >= self.maxPerHost:
+            return self._reject(self.REJECT_HOST)
+
+        if self.bucket is not None and not self.bucket.consume():
+            return self._reject(self.REJECT_RATE)
+
+        self.connections += 1
+        self.hosts[host] = count + 1
+        return None
+
+    def release(self, host):
+        """
+        Admitted connection was closed.
+
+        @param host: source address
+        @type host: C{str}
+        """
+        self.connections -= 1
+        count = self.hosts[host] - 1
+        if count:
+            self.hosts[host] = count
+        else:
+            del self.hosts[host]
+
+    def _reject(self, reason):
+        """
+        Count rejected connection.
+        """
+        metrics.increment('rtmp.rejected')
+        metrics.increment('rtmp.rejected.' + reason)
+        return reason
@@ -0,0 +1,451 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Fast AMF0 codec for RTMP commands.
+
+Invoke packets are mostly small command messages, built from
+simple types: numbers, booleans, strings, null, undefined, arrays and
+anonymous objects. This module encodes and decodes such messages
+directly with C{struct}, frequent strings (method names, status codes,
+object keys) are encoded once and cached.
+
+Anything else (typed objects, dates, XML, references, AMF3) is
+handled by falling back to PyAMF for the whole message.
+
+Values already encoded (see L{Encoded}) are spliced into messages as is.
+"""
+
+import struct
+
+import pyamf
+
+from fmspy.rtmp import constants
+
+class Unsupported(Exception):
+    """
+    Message contains data not supported by fast codec.
+    """
+
+NUMBER = 0x00
+BOOLEAN = 0x01
+STRING = 0x02
+OBJECT = 0x03
+NULL = 0x05
+UNDEFINED = 0x06
+ECMA_ARRAY = 0x08
+OBJECT_END = 0x09
+STRICT_ARRAY = 0x0A
+LONG_STRING = 0x0C
+
+MAX_DEPTH = 32
+"""
+Maximum nesting of encoded values (deeper values are passed to PyAMF,
+as they may be recursive).
+"""
+
+_number = struct.Struct("!Bd")
+_ushort = struct.Struct("!H")
+_ulong = struct.Struct("!L")
+_double = struct.Struct("!d")
+_stringHeader = struct.Struct("!BH")
+_longStringHeader = struct.Struct("!BL")
+_arrayHeader = struct.Struct("!BL")
+
+OBJECT_TERMINATOR = "\x00\x00\x09"
+"""
+End of object properties (empty key and L{OBJECT_END} marker).
+"""
+
+_objectEnd = OBJECT_TERMINATOR
+_null = chr(NULL)
+_undefined = chr(UNDEFINED)
+_true = chr(BOOLEAN) + "\x01"
+_false = chr(BOOLEAN) + "\x00"
+_objectStart = chr(OBJECT)
+
+_Undefined = pyamf.Undefined
+_ASObject = pyamf.ASObject
+_MixedArray = pyamf.MixedArray
+
+_encodedStrings = {}
+"""
+Cache of encoded strings: string -> AMF0 string (with type marker).
+"""
+_encodedKeys = {}
+"""
+Cache of encoded object keys: key -> AMF0 key (without type marker).
+"""
+_decodedStrings = {}
+"""
+Cache of decoded strings: bytes -> C{unicode}.
+"""
+
+_anonymousClasses = set()
+"""
+Classes encoded as anonymous objects (instance attributes).
+"""
+
+class Encoded(object):
+    """
+    Pre-encoded AMF0 value.
+
+    @ivar data: AMF0 encoding of value
+    @type data: C{str}
+    """
+
+    __slots__ = ('data', )
+
+    def __init__(self, data):
+        """
+        Constructor.
+
+        @param data: AMF0 encoding of value
+        @type data: C{str}
+        """
+        self.data = data
+
+    def __repr__(self):
+        return "Encoded(%r)" % self.data
+
+def register_anonymous(cls):
+    """
+    Encode instances of class as anonymous objects.
+
+    @param cls: class
+    @type cls: C{type}
+    """
+    _anonymousClasses.add(cls)
+
+def cache_strings(strings):
+    """
+    Add strings to cache of pre-encoded strings.
+
+    @param strings: frequently used strings (method names, codes, keys)
+    @type strings: C{iterable}
+    """
+    for s in strings:
+        u = unicode(s)
+        b = u.encode('utf-8')
+        if len(b) > 0xffff:
+            continue
+
+        _encodedStrings[s] = _encodedStrings[u] = _stringHeader.pack(STRING, len(b)) + b
+        _encodedKeys[s] = _encodedKeys[u] = _ushort.pack(len(b)) + b
+        _decodedStrings[b] = u
+
+cache_strings(['_result', '_error', 'onStatus', 'onBWDone', 'onMetaData', 'close',
+               constants.ACTION_CONNECT, constants.ACTION_DISCONNECT, constants.ACTION_CREATE_STREAM,
+               constants.ACTION_DELETE_STREAM, constants.ACTION_CLOSE_STREAM, constants.ACTION_RELEASE_STREAM,
+               constants.ACTION_PUBLISH, constants.ACTION_PAUSE, constants.ACTION_SEEK, constants.ACTION_PLAY,
+               constants.ACTION_RECEIVE_VIDEO, constants.ACTION_RECEIVE_AUDIO,
+               'code', 'level', 'description', 'details', 'clientid', 'status', 'error', 'warning',
+               'app', 'flashVer', 'swfUrl', 'tcUrl', 'fpad', 'audioCodecs', 'videoCodecs',
+               'videoFunction', 'pageUrl', 'objectEncoding', 'capabilities', 'fmsVer', 'mode',
+               'live', 'record', 'append'])
+cache_strings([value for (name, value) in vars(constants.StatusCodes).iteritems() if not name.startswith('_')])
+
+def _encodeString(s):
+    """
+    Encode string.
+
+    @rtype: C{str}
+    """
+    encoded = _encodedStrings.get(s)
+    if encoded is not None:
+        return encoded
+
+    if type(s) is unicode:
+        s = s.encode('utf-8')
+
+    l = len(s)
+    if l > 0xffff:
+        return _longStringHeader.pack(LONG_STRING, l) + s
+    return _stringHeader.pack(STRING, l) + s
+
+def _encodeKey(key, parts):
+    """
+    Encode object key.
+    """
+    encoded = _encodedKeys.get(key)
+    if encoded is not None:
+        parts.append(encoded)
+        return
+
+    if type(key) in (int, long):
+        key = str(key)
+    elif type(key) is unicode:
+        key = key.encode('utf-8')
+    elif type(key) is not str:
+        raise Unsupported(key)
+
+    if len(key) > 0xffff:
+        raise Unsupported(key)
+
+    parts.append(_ushort.pack(len(key)))
+    parts.append(key)
+
+def _encodeItems(items, parts, depth):
+    """
+    Encode object properties.
+    """
+    append = parts.append
+    for (key, value) in items:
+        encoded = _encodedKeys.get(key)
+        if encoded is not None:
+            append(encoded)
+        else:
+            _encodeKey(key, parts)
+
+        t = type(value)
+        if t is str or t is unicode:
+            encoded = _encodedStrings.get(value)
+            append(encoded if encoded is not None else _encodeString(value))
+        elif t is float or t is int:
+            append(_number.pack(NUMBER, value))
+        elif t is bool:
+            append(_true if value else _false)
+        else:
+            _encodeValue(value, parts, depth)
+    append(_objectEnd)
+
+def _encodeValue(value, parts, depth=0):
+    """
+    Encode single value.
+
+    @raise Unsupported: value couldn't be encoded by fast codec
+    """
+    t = type(value)
+
+    if t is str or t is unicode:
+        parts.append(_encodeString(value))
+    elif t is float or t is int or t is long:
+        parts.append(_number.pack(NUMBER, value))
+    elif t is bool:
+        parts.append(_true if value else _false)
+    elif value is None:
+        parts.append(_null)
+    elif value is _Undefined:
+        parts.append(_undefined)
+    elif t is Encoded:
+        parts.append(value.data)
+    else:
+        depth += 1
+        if depth > MAX_DEPTH:
+            raise Unsupported(value)
+
+        if t is list or t is tuple:
+            parts.append(_arrayHeader.pack(STRICT_ARRAY, len(value)))
+            for item in value:
+                _encodeValue(item, parts, depth)
+        elif t is dict or t is _ASObject:
+            parts.append(_objectStart)
+            _encodeItems(value.iteritems(), parts, depth)
+        elif t is _MixedArray:
+            indices = [key for key in value.iterkeys() if type(key) in (int, long)]
+            parts.append(_arrayHeader.pack(ECMA_ARRAY, max(max(indices), 0) if indices else 0))
+            _encodeItems(value.iteritems(), parts, depth)
+        elif t in _anonymousClasses:
+            parts.append(_objectStart)
+            _encodeItems(value.__dict__.iteritems(), parts, depth)
+        else:
+            raise Unsupported(value)
+
+def encode(*values):
+    """
+    Encode values as AMF0.
+
+    @return: encoded values
+    @rtype: C{str}
+    """
+    parts = []
+    append = parts.append
+    try:
+        for value in values:
+            t = type(value)
+            if t is str or t is unicode:
+                append(_encodeString(value))
+            elif t is float or t is int:
+                append(_number.pack(NUMBER, value))
+            elif value is None:
+                append(_null)
+            else:
+                _encodeValue(value, parts)
+    except (Unsupported, OverflowError):
+        return ''.join([value.data if type(value) is Encoded else
+                        pyamf.encode(value, encoding=pyamf.AMF0).getvalue() for value in values])
+
+    return ''.join(parts)
+
+def encode_properties(items):
+    """
+    Encode object properties (without object markers).
+
+    @param items: (key, value) pairs
+    @type items: C{iterable}
+    @rtype: C{str}
+    @raise Unsupported: value couldn't be encoded by fast codec
+    """
+    parts = []
+    _encodeItems(items, parts, 1)
+    parts.pop()
+    return ''.join(parts)
+
+def _decodeString(data, pos, size):
+    """
+    Decode string (with header of L{size} bytes).
+
+    @return: (string, new position)
+    """
+    if size == 2:
+        l = _ushort.unpack_from(data, pos)[0]
+    else:
+        l = _ulong.unpack_from(data, pos)[0]
+    pos += size
+    b = data[pos:pos+l]
+    if len(b) != l:
+        raise Unsupported(pos)
+
+    u = _decodedStrings.get(b)
+    if u is None:
+        u = b.decode('utf-8')
+    return (u, pos + l)
+
+def _decodeItems(data, pos, obj):
+    """
+    Decode object properties into L{obj}.
+
+    @return: new position
+    """
+    size = len(data)
+    while True:
+        l = _ushort.unpack_from(data, pos)[0]
+        pos += 2
+        if l == 0 and data[pos:pos+1] == '\x09':
+            return pos + 1
+
+        key = data[pos:pos+l]
+        pos += l
+        if pos >= size:
+            raise Unsupported(pos)
+
+        marker = data[pos]
+        if marker == '\x02':
+            l = _ushort.unpack_from(data, pos + 1)[0]
+            pos += 3
+            b = data[pos:pos+l]
+            pos += l
+            if pos > size:
+                raise Unsupported(pos)
+            u = _decodedStrings.get(b)
+            if u is None:
+                u = b.decode('utf-8')
+            obj[key] = u
+        elif marker == '\x00':
+            value = _double.unpack_from(data, pos + 1)[0]
+            if value.is_integer():
+                value = int(value)
+            obj[key] = value
+            pos += 9
+        elif marker == '\x01':
+            obj[key] = data[pos+1] != '\x00'
+            pos += 2
+        else:
+            (obj[key], pos) = _decodeValue(data, pos)
+
+def _decodeValue(data, pos):
+    """
+    Decode single value.
+
+    @return: (value, new position)
+    @raise Unsupported: value couldn't be decoded by fast codec
+    """
+    marker = ord(data[pos])
+    pos += 1
+
+    if marker == STRING:
+        return _decodeString(data, pos, 2)
+    elif marker == NUMBER:
+        value = _double.unpack_from(data, pos)[0]
+        if value.is_integer():
+            value = int(value)
+        return (value, pos + 8)
+    elif marker == NULL:
+        return (None, pos)
+    elif marker == BOOLEAN:
+        return (data[pos] != "\x00", pos + 1)
+    elif marker == OBJECT:
+        obj = _ASObject()
+        return (obj, _decodeItems(data, pos, obj))
+    elif marker == UNDEFINED:
+        return (_Undefined, pos)
+    elif marker == ECMA_ARRAY:
+        attrs = {}
+        pos = _decodeItems(data, pos + 4, attrs)
+        obj = _MixedArray()
+        for (key, value) in attrs.iteritems():
+            try:
+                key = int(key)
+            except ValueError:
+                pass
+            obj[key] = value
+        return (obj, pos)
+    elif marker == STRICT_ARRAY:
+        l = _ulong.unpack_from(data, pos)[0]
+        pos += 4
+        result = []
+        for i in xrange(l):
+            (value, pos) = _decodeValue(data, pos)
+            result.append(value)
+        return (result, pos)
+    elif marker == LONG_STRING:
+        return _decodeString(data, pos, 4)
+
+    raise Unsupported(marker)
+
+def decode(data):
+    """
+    Decode AMF0 values.
+
+    @param data: AMF0-encoded values
+    @type data: C{str}
+    @return: decoded values
+    @rtype: C{list}
+    """
+    result = []
+    append = result.append
+    pos, size = 0, len(data)
+    try:
+        while pos < size:
+            marker = data[pos]
+            if marker == '\x02':
+                l = _ushort.unpack_from(data, pos + 1)[0]
+                pos += 3
+                b = data[pos:pos+l]
+                pos += l
+                if pos > size:
+                    raise Unsupported(pos)
+                u = _decodedStrings.get(b)
+                if u is None:
+                    u = b.decode('utf-8')
+                append(u)
+            elif marker == '\x00':
+                value = _double.unpack_from(data, pos + 1)[0]
+                if value.is_integer():
+                    value = int(value)
+                append(value)
+                pos += 9
+            elif marker == '\x05':
+                append(None)
+                pos += 1
+            else:
+                (value, pos) = _decodeValue(data, pos)
+                append(value)
+    except (Unsupported, struct.error, IndexError):
+        return list(pyamf.decode(data, encoding=pyamf.AMF0))
+
+    if pos != size:
+        return list(pyamf.decode(data, encoding=pyamf.AMF0))
+
+    return result
@@ -0,0 +1,84 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+AMF3 support for Flex messages.
+
+Flex clients (C{objectEncoding} = 3) send commands and data messages
+as AMF0 streams, where values may switch to AMF3 encoding. Such
+messages are encoded and decoded with L{AMF3Codec}, one per
+connection and direction.
+"""
+
+import pyamf
+
+from fmspy.rtmp.amf0 import Encoded
+
+class AMF3Codec(object):
+    """
+    AMF3-enabled codec.
+
+    PyAMF encoder and decoder (with their contexts and class
+    alias caches) are created on first use and reused for all messages of
+    connection. String, object and trait reference tables are reset for each
+    message, as Flash Player starts new reference tables for each message:
+    repeated strings, objects and class traits are sent as back-references
+    within single message.
+
+    @ivar decoder: PyAMF decoder (or C{None})
+    @ivar encoder: PyAMF encoder (or C{None})
+    """
+
+    __slots__ = ('decoder', 'encoder')
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.decoder = None
+        self.encoder = None
+
+    def decode(self, data):
+        """
+        Decode values.
+
+        @param data: AMF0-encoded values (with AMF3 switches)
+        @type data: C{str}
+        @return: decoded values
+        @rtype: C{list}
+        """
+        if self.decoder is None:
+            self.decoder = pyamf.get_decoder(pyamf.AMF0)
+
+        decoder = self.decoder
+        decoder.context.clear()
+        decoder.stream.truncate()
+        decoder.stream.write(data)
+        decoder.stream.seek(0)
+
+        return list(decoder)
+
+    def encode(self, *values):
+        """
+        Encode values, switching to AMF3 for each value.
+
+        Pre-encoded values (L{Encoded}) are written as is (in AMF0).
+
+        @return: encoded values
+        @rtype: C{str}
+        """
+        if self.encoder is None:
+            self.encoder = pyamf.get_encoder(pyamf.AMF0, use_amf3=True)
+
+        encoder = self.encoder
+        encoder.context.clear()
+        encoder.stream.truncate()
+
+        for value in values:
+            if type(value) is Encoded:
+                encoder.stream.write(value.data)
+            else:
+                encoder.writeElement(value)
+
+        return encoder.stream.getvalue()
@@ -8,10 +8,111 @@ RTMP packet disassembly/assembly line.
 Cutting packets into chunks for transmission.
 """
 
+import copy
+
 from pyamf.util import BufferedByteStream
 
+from fmspy.rtmp import constants
 from fmspy.rtmp.header import RTMPHeader, NeedBytes
-from fmspy.rtmp.packets import packetFactory
+from fmspy.rtmp.packets import packetFactory, MediaPacket, mediaTypeMap
+from fmspy.rtmp.amf3 import AMF3Codec
+from fmspy.stats import metrics
+from fmspy.config import config
+
+class ReassemblyLimitError(Exception):
+    """
+    Packet is too large or partially received packets take too much memory.
+    """
+
+class ReassemblyMemory(object):
+    """
+    Memory held by partially received packets of all connections.
+
+    Current amount is reported as C{rtmp.reassembly_bytes} gauge.
+
+    @ivar limit: maximum amount of memory (bytes, 0 - unlimited)
+    @type limit: C{int}
+    @ivar bytes: current amount of memory (bytes)
+    @type bytes: C{int}
+    """
+
+    __slots__ = ('limit', 'bytes')
+
+    def __init__(self, limit=0):
+        """
+        Constructor.
+
+        @param limit: maximum amount of memory (bytes, 0 - unlimited)
+        @type limit: C{int}
+        """
+        self.limit = limit
+        self.bytes = 0
+
+    def allocate(self, size):
+        """
+        Account memory for partially received packet.
+
+        @param size: number of bytes
+        @type size: C{int}
+        @raise ReassemblyLimitError: limit exceeded
+        """
+        if self.limit and self.bytes + size > self.limit:
+            raise ReassemblyLimitError("total reassembly memory limit (%d bytes) exceeded" % self.limit)
+
+        self.bytes += size
+        metrics.adjust('rtmp.reassembly_bytes', size)
+
+    def free(self, size):
+        """
+        Memory held by partially received packet was released.
+
+        @param size: number of bytes
+        @type size: C{int}
+        """
+        self.bytes -= size
+        metrics.adjust('rtmp.reassembly_bytes', -size)
+
+reassemblyMemory = ReassemblyMemory(config.getint('RTMP', 'maxReassemblyTotal'))
+"""
+Reassembly memory shared by all connections.
+"""
+
+_emptyHeader = RTMPHeader()
+"""
+Previous header for object_ids without packets received.
+"""
+
+class SegmentBuffer(object):
+    """
+    Data of incomplete media packet: list of chunk payloads.
+
+    @ivar segments: chunk payloads
+    @type segments: C{list} of C{str}
+    @ivar size: total size of payloads
+    @type size: C{int}
+    """
+
+    __slots__ = ('segments', 'size')
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.segments = []
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def write(self, data):
+        """
+        Append chunk payload.
+
+        @param data: chunk payload
+        @type data: C{str}
+        """
+        self.segments.append(data)
+        self.size += len(data)
 
 class RTMPDisassembler(object):
     """
@@ -23,29 +124,68 @@ class RTMPDisassembler(object):
 
     Communication goes independently for each object_id. Last received
     headers are stored for each object_id in L{lastHeaders}. L{pool} holds
-    incomplete packet contents also for each object_id.
+    incomplete packet contents also for each object_id. L{pool} and L{buffer}
+    are allocated only while they hold some data.
+
+    Audio and video packets (L{passthroughTypes}) are not decoded: their
+    chunk payloads are collected into L{AudioData} or L{VideoData} as is,
+    without joining.
+
+    Size of packets is limited (by packet type), memory held by incomplete
+    packets is limited per disassembler and for all disassemblers
+    (L{ReassemblyMemory}). When limits are exceeded, L{ReassemblyLimitError}
+    is raised and connection should be closed.
 
     @ivar lastHeaders: last received header for object_id
     @type lastHeaders: C{dict}, object_id -> L{RTMPHeader}
-    @ivar pool: incomplete packet data for object_id
+    @ivar pool: incomplete packet data for object_id (or C{None})
     @type pool: C{dict}, object_id -> L{BufferedByteStream}
     @ivar chunkSize: size of chunk for this stream
     @type chunkSize: C{int}
-    @ivar buffer: incoming buffer with data received from protocol
+    @ivar buffer: incoming buffer with data received from protocol (or C{None})
     @type buffer: L{BufferedByteStream}
+    @ivar codec: AMF3 codec for Flex messages
+    @type codec: L{AMF3Codec}
+    @ivar poolBytes: memory held by incomplete packets in L{pool}
+    @type poolBytes: C{int}
+    @ivar closed: disassembler was released, input is ignored
+    @type closed: C{bool}
     """
 
-    def __init__(self, chunkSize):
+    __slots__ = ('lastHeaders', 'pool', 'chunkSize', 'buffer', 'codec', 'maxPoolBytes',
+                 'maxPacketSize', 'maxPacketSizes', 'memory', 'poolBytes', 'closed')
+
+    passthroughTypes = (constants.AUDIO_DATA, constants.VIDEO_DATA)
+    """
+    Types of packets passed through without decoding.
+    """
+
+    def __init__(self, chunkSize, maxPoolBytes=0, maxPacketSize=0, maxPacketSizes=None, memory=reassemblyMemory):
         """
         Constructor.
 
         @param chunkSize: initial size of chunk
         @type chunkSize: C{int}
+        @param maxPoolBytes: maximum memory held by incomplete packets (bytes, 0 - unlimited)
+        @type maxPoolBytes: C{int}
+        @param maxPacketSize: maximum size of packet (bytes, 0 - unlimited)
+        @type maxPacketSize: C{int}
+        @param maxPacketSizes: maximum size of packet by type (overrides L{maxPacketSize})
+        @type maxPacketSizes: C{dict}, type -> C{int}
+        @param memory: memory accounting shared with other disassemblers
+        @type memory: L{ReassemblyMemory}
         """
         self.lastHeaders = {}
-        self.pool = {}
+        self.pool = None
         self.chunkSize = chunkSize
-        self.buffer = BufferedByteStream()
+        self.buffer = None
+        self.codec = AMF3Codec()
+        self.maxPoolBytes = maxPoolBytes
+        self.maxPacketSize = maxPacketSize
+        self.maxPacketSizes = maxPacketSizes or {}
+        self.memory = memory
+        self.poolBytes = 0
+        self.closed = False
 
     def push_data(self, data):
         """
@@ -54,8 +194,14 @@ class RTMPDisassembler(object):
         @param data: data received
         @type data: C{str}
         """
-        self.buffer.seek(0, 2)
-        self.buffer.write(data)
+        if self.closed:
+            return self
+
+        if self.buffer is None:
+            self.buffer = BufferedByteStream(data)
+        else:
+            self.buffer.seek(0, 2)
+            self.buffer.write(data)
 
         return self
 
@@ -68,56 +214,126 @@ class RTMPDisassembler(object):
 
         @return: decoded packet
         @rtype: L{Packet}
+        @raise ReassemblyLimitError: packet is too large or reassembly memory limit exceeded
         """
-        self.buffer.seek(0)
-        
-        while self.buffer.remaining() > 0:
-            try:
-                # try to parse header from stream
-                header = RTMPHeader.read(self.buffer)
-            except NeedBytes, (bytes, ):
-                # not enough bytes, return what we've already parsed
-                return None
+        buffer = self.buffer
+        if buffer is None:
+            return None
 
-            # fill header with extra data from previous headers received
-            # with same object_id
-            header.fill(self.lastHeaders.get(header.object_id, RTMPHeader()))
-
-            # get buffer for data of this packet
-            buf = self.pool.get(header.object_id, BufferedByteStream())
+        buffer.seek(0)
+        
+        while buffer.remaining() > 0:
+            first = ord(buffer.peek(1))
+
+            if first >= 0xc0 and self.pool and (first & 0x3f) in self.pool:
+                # one-byte header of continuation chunk: packet header
+                # stays the same as for previous chunk
+                buffer.read(1)
+                header = self.lastHeaders[first & 0x3f]
+                buf = self.pool[header.object_id]
+            else:
+                try:
+                    # try to parse header from stream
+                    header = RTMPHeader.read(buffer)
+                except NeedBytes, (bytes, ):
+                    # not enough bytes, return what we've already parsed
+                    return None
+
+                # get buffer for data of this packet
+                buf = self.pool.get(header.object_id) if self.pool is not None else None
+
+                # fill header with extra data from previous headers received
+                # with same object_id
+                header.fill(self.lastHeaders.get(header.object_id, _emptyHeader), continuation=buf is not None)
+
+            if buf is None:
+                # first chunk of packet, check packet size
+                limit = self.maxPacketSizes.get(header.type, self.maxPacketSize)
+                if limit and header.length > limit:
+                    raise ReassemblyLimitError("packet of type 0x%02x is too large: %d bytes (limit %d)" %
+                            (header.type, header.length, limit))
+
+                if header.type in self.passthroughTypes:
+                    buf = SegmentBuffer()
+                else:
+                    buf = BufferedByteStream()
+
+            # bytes of this packet already held in pool
+            pooled = len(buf)
 
             # this chunk size is minimum of regular chunk size in this
             # disassembler and what we have left here
-            thisChunk = min(header.length - len(buf), self.chunkSize)
-            if self.buffer.remaining() < thisChunk:
+            thisChunk = min(header.length - pooled, self.chunkSize)
+            if buffer.remaining() < thisChunk:
                 # we have not enough bytes to read this chunk of data
                 return None
 
+            # this chunk completes full packet?
+            complete = pooled + thisChunk >= header.length
+
+            if not complete:
+                # packet stays in pool, account memory
+                if self.maxPoolBytes and self.poolBytes + thisChunk > self.maxPoolBytes:
+                    raise ReassemblyLimitError("reassembly memory limit (%d bytes) exceeded" % self.maxPoolBytes)
+
+                self.memory.allocate(thisChunk)
+                self.poolBytes += thisChunk
+
             # we got complete chunk
-            buf.write(self.buffer.read(thisChunk))
+            buf.write(buffer.read(thisChunk))
 
             # store packet header for this object_id
             self.lastHeaders[header.object_id] = header
 
             # skip data left in input buffer
-            self.buffer.consume()
+            buffer.consume()
 
-            # this chunk completes full packet?
-            if len(buf) < header.length:
-                # no, store buffer for further chunks
+            if not complete:
+                # store buffer for further chunks
+                if self.pool is None:
+                    self.pool = {}
                 self.pool[header.object_id] = buf
             else:
-                # parse packet from header and data
-                buf.seek(0, 0)
-                
                 # delete stored data for this packet
-                if header.object_id in self.pool:
+                if pooled:
                     del self.pool[header.object_id]
+                    self._free(pooled)
+
+                if buf.__class__ is SegmentBuffer:
+                    return mediaTypeMap.get(header.type, MediaPacket)(header, buf.segments)
+
+                # parse packet from header and data
+                buf.seek(0, 0)
 
                 return self._decode_packet(header, buf)
 
+        # input buffer is empty, release it
+        self.buffer = None
         return None
 
+    def _free(self, size):
+        """
+        Incomplete packet was removed from pool.
+
+        @param size: number of bytes held by packet
+        @type size: C{int}
+        """
+        self.poolBytes -= size
+        self.memory.free(size)
+
+    def release(self):
+        """
+        Drop all incomplete packets and buffered input.
+
+        Disassembler ignores any further input.
+        """
+        self.closed = True
+        self.pool = None
+        self.buffer = None
+
+        if self.poolBytes:
+            self._free(self.poolBytes)
+
     def disassemble_packets(self):
         """
         Disassemble L{buffer} into packets, return all packets decoded so far.
@@ -149,21 +365,40 @@ class RTMPDisassembler(object):
         @return: decoded packet
         @rtype: L{Packet}
         """
-        return packetFactory(header, buf)
+        return packetFactory(header, buf, self.codec)
 
 class RTMPAssembler(object):
     """
     Transform stream of RTMP packets into stream of RTMP chunks.
 
-    We "compress" RTMP headers, saving previous sent headers for each object_id.
+    We "compress" RTMP headers, saving previous sent headers and timestamp
+    deltas for each object_id: packets with same length, type and timestamp
+    delta as previous packet are sent with 1 byte header.
     Packet data is sliced into chunks of L{chunkSize}.
 
+    Audio and video packets are sent over dedicated object_ids (one pair
+    per stream), so that headers of interleaved media packets
+    could be compressed.
+
     @ivar chunkSize: size of chunk
     @type chunkSize: C{int}
     @ivar transport: transport used to transmit bytes
     @type transport: C{twisted.internet.interfaces.ITransport}
     @ivar lastHeaders: last sent header for object_id
     @type lastHeaders: C{dict}, object_id -> L{RTMPHeader}
+    @ivar lastDeltas: last sent timestamp delta for object_id
+    @type lastDeltas: C{dict}, object_id -> C{int}
+    @ivar bytes: number of bytes sent so far
+    @type bytes: C{int}
+    @ivar codec: AMF3 codec for Flex messages
+    @type codec: L{AMF3Codec}
+    """
+
+    __slots__ = ('chunkSize', 'transport', 'lastHeaders', 'lastDeltas', 'bytes', 'codec')
+
+    separateMedia = True
+    """
+    Send audio and video over dedicated object_ids?
     """
 
     def __init__(self, chunkSize, transport):
@@ -178,6 +413,9 @@ class RTMPAssembler(object):
         self.chunkSize = chunkSize
         self.transport = transport
         self.lastHeaders = {}
+        self.lastDeltas = {}
+        self.bytes = 0
+        self.codec = AMF3Codec()
 
     def push_packet(self, packet):
         """
@@ -186,18 +424,128 @@ class RTMPAssembler(object):
         @param packet: RTMP packet
         @type packet: L{Packet}
         """
-        previous = self.lastHeaders.get(packet.header.object_id, None)
-
         # calling write() on packet may fill header.length
-        data = packet.write()
-        self.transport.write(packet.header.write(previous=previous))
-        
-        firstChunk = min(self.chunkSize, packet.header.length)
-        
-        self.transport.write(data[:firstChunk])
+        if packet.usesCodec:
+            data = packet.write(self.codec)
+        elif isinstance(packet, MediaPacket):
+            data = None
+        else:
+            data = packet.write()
+
+        header = packet.header
+
+        if self.separateMedia and (header.type == constants.AUDIO_DATA or header.type == constants.VIDEO_DATA):
+            object_id = media_object_id(header.type, header.stream_id)
+            if header.object_id != object_id:
+                header = copy.copy(header)
+                header.object_id = object_id
+
+        object_id = header.object_id
+        previous = self.lastHeaders.get(object_id, None)
+
+        if previous is None:
+            diff = 3
+        else:
+            diff = header.diff(previous, self.lastDeltas.get(object_id, 0))
+
+        if diff == 3:
+            self.lastDeltas[object_id] = header.timestamp
+        elif diff > 0:
+            self.lastDeltas[object_id] = header.timestamp - previous.timestamp
+
+        encoded = header.pack(diff, previous)
+        self.transport.write(encoded)
+        self.bytes += len(encoded) + header.length
+
+        if data is None:
+            self._push_segments(packet.segments, header)
+        else:
+            firstChunk = min(self.chunkSize, header.length)
+
+            self.transport.write(data[:firstChunk])
+
+            if header.length > firstChunk:
+                continuation = header.pack(0)
+                for pos in xrange(firstChunk, header.length, self.chunkSize):
+                    self.transport.write(continuation)
+                    self.bytes += 1
+                    self.transport.write(data[pos:pos+self.chunkSize])
+
+        self.lastHeaders[object_id] = header
+
+    def _push_segments(self, segments, header):
+        """
+        Write data of L{MediaPacket} as chunks (after first chunk header).
+
+        Segments are cut at chunk boundaries, segments (or parts of them)
+        are written to transport without joining.
 
-        for pos in xrange(firstChunk, packet.header.length, self.chunkSize):
-            self.transport.write(packet.header.write(previous=packet.header))
-            self.transport.write(data[pos:pos+self.chunkSize])
+        @param segments: packet data
+        @type segments: C{list} of C{str}
+        @param header: packet header
+        @type header: L{RTMPHeader}
+        """
+        write = self.transport.write
+        chunkSize = self.chunkSize
+        continuation = header.pack(0)
+        # space left in current chunk
+        left = chunkSize
+        chunks = 0
+
+        for segment in segments:
+            size = len(segment)
+            if size <= left:
+                write(segment)
+                left -= size
+                continue
+
+            pos = left
+            if pos:
+                write(segment[:pos])
+
+            for pos in xrange(pos, size, chunkSize):
+                write(continuation)
+                write(segment[pos:pos+chunkSize])
+                chunks += 1
+
+            left = chunkSize - (size - pos)
+
+        self.bytes += chunks
+
+    def push_control(self, template, *values):
+        """
+        Push control message into stream.
+
+        Message is sent with one-byte header, if previous message
+        with same object_id was sent with same template.
+
+        @param template: message template
+        @type template: L{ControlTemplate}
+        @param values: message body values
+        """
+        header = template.header
+        object_id = header.object_id
+
+        encoded = template.pack(self.lastHeaders.get(object_id, None) is header, *values)
+        self.transport.write(encoded)
+        self.bytes += len(encoded)
+
+        self.lastHeaders[object_id] = header
+        self.lastDeltas[object_id] = 0
+
+def media_object_id(type, stream_id):
+    """
+    Find object_id for media packets of stream.
+
+    @param type: packet type (L{constants.AUDIO_DATA} or L{constants.VIDEO_DATA})
+    @type type: C{int}
+    @param stream_id: Stream ID
+    @type stream_id: C{int}
+    @rtype: C{int}
+    """
+    if type == constants.AUDIO_DATA:
+        base = constants.DEFAULT_AUDIO_OBJECT_ID
+    else:
+        base = constants.DEFAULT_VIDEO_OBJECT_ID
 
-        self.lastHeaders[packet.header.object_id] = packet.header
+    return base + 2 * (stream_id % constants.MEDIA_OBJECT_ID_STREAMS)
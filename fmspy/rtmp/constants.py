@@ -28,9 +28,14 @@ STREAM_METADATA =           0x12
 SO =                        0x13
 INVOKE =                    0x14
 
+DEFAULT_CHUNK_SIZE_OBJECT_ID =  0x02
 DEFAULT_BYTES_READ_OBJECT_ID =  0x02
 DEFAULT_PING_OBJECT_ID =  0x02
+DEFAULT_BW_OBJECT_ID =  0x02
 DEFAULT_INVOKE_OBJECT_ID =  0x03
+DEFAULT_AUDIO_OBJECT_ID =  0x04
+DEFAULT_VIDEO_OBJECT_ID =  0x05
+MEDIA_OBJECT_ID_STREAMS =  30
 #
 ACTION_CONNECT =            "connect"
 ACTION_DISCONNECT =         "disconnect"
@@ -0,0 +1,103 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Pre-built control messages.
+
+Control messages (pings, acknowledgements, window and chunk sizes)
+have fixed layout and are sent often (each ping interval, each
+acknowledgement window). Instead of building L{Packet} and L{RTMPHeader}
+objects for each of them, complete chunk (header and body) is kept in
+L{ControlTemplate}, only body values are patched in for each message.
+"""
+
+import struct
+
+from fmspy.rtmp import constants
+from fmspy.rtmp.header import RTMPHeader
+
+class ControlTemplate(object):
+    """
+    Template of control message.
+
+    Control messages are sent on object_id 2, stream 0 with zero
+    timestamp. First message of this template goes with full header,
+    while following ones (if no other message was sent with same object_id
+    in between) go with one-byte header, as all header fields match.
+
+    @ivar name: name of message (for logging)
+    @type name: C{str}
+    @ivar header: header of message
+    @type header: L{RTMPHeader}
+    @ivar body: layout of message body
+    @type body: C{struct.Struct}
+    @ivar full: chunk with full header
+    @type full: C{bytearray}
+    @ivar compact: chunk with one-byte header
+    @type compact: C{bytearray}
+    """
+
+    __slots__ = ('name', 'header', 'body', 'full', 'compact')
+
+    def __init__(self, name, type, format):
+        """
+        Constructor.
+
+        @param name: name of message (for logging)
+        @type name: C{str}
+        @param type: packet type
+        @type type: C{int}
+        @param format: layout of message body (for C{struct})
+        @type format: C{str}
+        """
+        self.name = name
+        self.body = struct.Struct(format)
+        self.header = RTMPHeader(constants.DEFAULT_PING_OBJECT_ID, 0, self.body.size, type, 0)
+        self.full = bytearray(self.header.pack(3) + "\x00" * self.body.size)
+        self.compact = bytearray(self.header.pack(0) + "\x00" * self.body.size)
+
+    def __repr__(self):
+        return "<ControlTemplate(%s)>" % self.name
+
+    def pack(self, compact, *values):
+        """
+        Build message chunk.
+
+        @param compact: use one-byte header?
+        @type compact: C{bool}
+        @param values: body values
+        @return: encoded chunk (header and body)
+        @rtype: C{str}
+        """
+        chunk = self.compact if compact else self.full
+        self.body.pack_into(chunk, len(chunk) - self.body.size, *values)
+        return str(chunk)
+
+chunkSize = ControlTemplate('ChunkSize', constants.CHUNK_SIZE, '!L')
+"""
+Set chunk size: chunk size.
+"""
+
+bytesRead = ControlTemplate('BytesRead', constants.BYTES_READ, '!L')
+"""
+Acknowledgement: number of bytes received so far.
+"""
+
+serverBW = ControlTemplate('ServerBW', constants.SERVER_BW, '!L')
+"""
+Window acknowledgement size: window size.
+"""
+
+clientBW = ControlTemplate('ClientBW', constants.CLIENT_BW, '!LB')
+"""
+Set peer bandwidth: window size, limit type.
+"""
+
+pings = (None,
+         ControlTemplate('Ping', constants.PING, '!HL'),
+         ControlTemplate('Ping', constants.PING, '!HLL'),
+         ControlTemplate('Ping', constants.PING, '!HLLL'))
+"""
+Ping (user control message): event and 1..3 values, indexed by number of values.
+"""
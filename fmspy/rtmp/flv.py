@@ -0,0 +1,354 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+FLV files.
+
+FLV tags have the same payload as RTMP audio, video and data messages,
+so tags are read directly into L{AudioData}, L{VideoData} and L{Notify}
+packets.
+"""
+
+import struct
+
+from bisect import bisect_right
+
+from fmspy.rtmp import constants, amf0
+from fmspy.rtmp.header import RTMPHeader
+from fmspy.rtmp.packets import Notify, AudioData, VideoData, mediaTypeMap
+
+class FLVError(Exception):
+    """
+    File is not valid FLV file.
+    """
+
+_fileHeader = struct.Struct('!3sBBL')
+_tagHeader = struct.Struct('!BBHBHBBH')
+
+TAG_HEADER_SIZE = _tagHeader.size
+"""
+Size of FLV tag header.
+"""
+
+def encode_tag(packet):
+    """
+    Encode packet as FLV tag (without trailing tag size).
+
+    @param packet: packet
+    @type packet: L{MediaPacket} or L{Notify}
+    @return: tag header and tag data
+    @rtype: (C{str}, C{list} of C{str})
+    """
+    if isinstance(packet, Notify):
+        segments = [amf0.encode(packet.name, *packet.argv)]
+        type = constants.NOTIFY
+    else:
+        segments = packet.segments
+        type = packet.header.type
+
+    size = sum([len(segment) for segment in segments])
+    timestamp = packet.header.timestamp
+
+    return (_tagHeader.pack(type, size >> 16, size & 0xffff, (timestamp >> 16) & 0xff,
+                            timestamp & 0xffff, (timestamp >> 24) & 0xff, 0, 0), segments)
+
+def decode_tag_header(data, offset=0):
+    """
+    Decode FLV tag header.
+
+    @param data: buffer
+    @type data: C{str} or C{mmap}
+    @param offset: offset of tag header in buffer
+    @type offset: C{int}
+    @return: tag type, data size and timestamp
+    @rtype: (C{int}, C{int}, C{int})
+    """
+    (type, sizeHigh, sizeLow, tsHigh, tsLow, tsExt, streamHigh, streamLow) = _tagHeader.unpack_from(data, offset)
+    return (type & 0x1f, sizeHigh << 16 | sizeLow, tsExt << 24 | tsHigh << 16 | tsLow)
+
+def decode_tag(type, timestamp, payload):
+    """
+    Build packet from FLV tag.
+
+    @param type: tag type
+    @type type: C{int}
+    @param timestamp: tag timestamp
+    @type timestamp: C{int}
+    @param payload: tag data
+    @type payload: C{str}
+    @return: packet or C{None} if tag is of unknown type or couldn't be decoded
+    @rtype: L{MediaPacket} or L{Notify}
+    """
+    header = RTMPHeader(None, timestamp, len(payload), type, 0)
+
+    if type in mediaTypeMap:
+        return mediaTypeMap[type](header, [payload])
+
+    if type == constants.NOTIFY:
+        try:
+            values = amf0.decode(payload)
+        except Exception:
+            return None
+        if values:
+            return Notify(values[0], tuple(values[1:]), header)
+
+    return None
+
+class FLVReader(object):
+    """
+    Sequential reader of FLV file.
+
+    Tags are read one by one, as they are requested, so file
+    of any size could be played without loading it into memory.
+
+    @ivar file: FLV file
+    @type file: C{file}
+    @ivar hasAudio: file contains audio (according to file header)?
+    @type hasAudio: C{bool}
+    @ivar hasVideo: file contains video (according to file header)?
+    @type hasVideo: C{bool}
+    """
+
+    growing = False
+    """
+    File isn't written to while being read.
+    """
+
+    overrun = False
+    """
+    Tags are never skipped.
+    """
+
+    def __init__(self, file):
+        """
+        Constructor, reads file header.
+
+        @param file: FLV file
+        @type file: C{file}
+        @raise FLVError: file is not FLV file
+        """
+        self.file = file
+
+        data = file.read(_fileHeader.size)
+        if len(data) < _fileHeader.size:
+            raise FLVError('truncated header')
+
+        (signature, version, flags, offset) = _fileHeader.unpack(data)
+        if signature != 'FLV' or offset < _fileHeader.size:
+            raise FLVError('bad signature')
+
+        self.hasAudio = bool(flags & 0x04)
+        self.hasVideo = bool(flags & 0x01)
+
+        # skip rest of header and PreviousTagSize0
+        self.dataOffset = offset + 4
+        file.seek(self.dataOffset)
+
+    def close(self):
+        """
+        Close file.
+        """
+        self.file.close()
+
+    def seek(self, position):
+        """
+        Continue reading from tag at file position.
+
+        @param position: offset of tag in file (e.g. from L{FLVIndex})
+        @type position: C{int}
+        """
+        self.file.seek(position)
+
+    def next(self):
+        """
+        Read next tag.
+
+        Tags of unknown types are skipped, script data tags which
+        couldn't be decoded are skipped as well.
+
+        @return: next packet or C{None} at the end of file
+        @rtype: L{MediaPacket} or L{Notify}
+        """
+        while True:
+            data = self.file.read(_tagHeader.size)
+            if len(data) < _tagHeader.size:
+                return None
+
+            (type, size, timestamp) = decode_tag_header(data)
+
+            payload = self.file.read(size)
+            if len(payload) < size:
+                return None
+            self.file.read(4)
+
+            packet = decode_tag(type, timestamp, payload)
+            if packet is not None:
+                return packet
+
+class FLVIndex(object):
+    """
+    Keyframe index of FLV file.
+
+    Index is taken from C{keyframes} of C{onMetaData}, if file has it,
+    otherwise it is built by reading tag headers (tag payloads are
+    skipped). Audio-only files are indexed every L{audioInterval}.
+
+    Metadata and codec configurations found at the beginning of file
+    are kept, as they should be sent when playback starts from the
+    middle of file.
+
+    @ivar times: timestamps of index entries
+    @type times: C{list} of C{int}
+    @ivar positions: file positions of index entries
+    @type positions: C{list} of C{int}
+    @ivar metadata: C{onMetaData} of file (or C{None})
+    @type metadata: L{Notify}
+    @ivar videoConfig: first AVC sequence header (or C{None})
+    @type videoConfig: L{VideoData}
+    @ivar audioConfig: first AAC config (or C{None})
+    @type audioConfig: L{AudioData}
+    """
+
+    audioInterval = 1000
+    """
+    Interval between index entries of audio-only file (ms).
+    """
+
+    def __init__(self, reader):
+        """
+        Build index, file position of reader is changed.
+
+        @param reader: reader of file
+        @type reader: L{FLVReader}
+        """
+        self.times = []
+        self.positions = []
+        self.metadata = self.videoConfig = self.audioConfig = None
+
+        f = reader.file
+        position = reader.dataOffset
+        audio = []
+        fromMetadata = False
+
+        while True:
+            f.seek(position)
+            data = f.read(TAG_HEADER_SIZE)
+            if len(data) < TAG_HEADER_SIZE:
+                break
+            (type, size, timestamp) = decode_tag_header(data)
+
+            if type == constants.VIDEO_DATA:
+                header = RTMPHeader(None, timestamp, size, type, 0)
+                packet = VideoData(header, [f.read(min(size, 2))])
+                if packet.isSequenceHeader:
+                    if self.videoConfig is None:
+                        self.videoConfig = VideoData(header, [packet.data + f.read(size - 2)])
+                elif packet.isKeyframe:
+                    if fromMetadata:
+                        # metadata has index, configs are at the beginning of file
+                        break
+                    self.times.append(timestamp)
+                    self.positions.append(position)
+            elif type == constants.AUDIO_DATA:
+                header = RTMPHeader(None, timestamp, size, type, 0)
+                packet = AudioData(header, [f.read(min(size, 2))])
+                if packet.isSequenceHeader:
+                    if self.audioConfig is None:
+                        self.audioConfig = AudioData(header, [packet.data + f.read(size - 2)])
+                elif not fromMetadata and (not audio or timestamp >= audio[-1][0] + self.audioInterval):
+                    audio.append((timestamp, position))
+            elif type == constants.NOTIFY and self.metadata is None:
+                packet = decode_tag(type, timestamp, f.read(size))
+                if packet is not None and packet.name == 'onMetaData':
+                    self.metadata = packet
+                    fromMetadata = self._fromMetadata(packet)
+
+            position += TAG_HEADER_SIZE + size + 4
+
+        if not self.times and not fromMetadata:
+            self.times = [timestamp for (timestamp, position) in audio]
+            self.positions = [position for (timestamp, position) in audio]
+
+    def _fromMetadata(self, metadata):
+        """
+        Take index from C{keyframes} of metadata.
+
+        @param metadata: C{onMetaData}
+        @type metadata: L{Notify}
+        @return: was index found?
+        @rtype: C{bool}
+        """
+        try:
+            keyframes = metadata.argv[0]['keyframes']
+            times = [int(round(t * 1000)) for t in keyframes['times']]
+            positions = [int(p) for p in keyframes['filepositions']]
+        except (IndexError, KeyError, TypeError, ValueError):
+            return False
+
+        if not times or len(times) != len(positions):
+            return False
+
+        self.times = times
+        self.positions = positions
+        return True
+
+    def find(self, timestamp):
+        """
+        Find index entry to start playback from.
+
+        @param timestamp: requested timestamp
+        @type timestamp: C{int}
+        @return: timestamp and file position of last entry
+            not after requested timestamp, C{None} if there's none
+        @rtype: (C{int}, C{int})
+        """
+        i = bisect_right(self.times, timestamp) - 1
+        if i < 0:
+            return None
+        return (self.times[i], self.positions[i])
+
+class FLVWriter(object):
+    """
+    Writer of FLV file.
+
+    @ivar file: FLV file
+    @type file: C{file}
+    """
+
+    def __init__(self, file, hasAudio=True, hasVideo=True):
+        """
+        Constructor, writes file header.
+
+        @param file: FLV file
+        @type file: C{file}
+        @param hasAudio: file contains audio?
+        @type hasAudio: C{bool}
+        @param hasVideo: file contains video?
+        @type hasVideo: C{bool}
+        """
+        self.file = file
+        file.write(_fileHeader.pack('FLV', 1, (0x04 if hasAudio else 0) | (0x01 if hasVideo else 0), _fileHeader.size))
+        file.write("\x00" * 4)
+
+    def close(self):
+        """
+        Close file.
+        """
+        self.file.close()
+
+    def write(self, packet):
+        """
+        Write packet as FLV tag.
+
+        @param packet: packet
+        @type packet: L{MediaPacket} or L{Notify}
+        """
+        (header, segments) = encode_tag(packet)
+
+        self.file.write(header)
+        size = len(header)
+        for segment in segments:
+            self.file.write(segment)
+            size += len(segment)
+        self.file.write(struct.pack('!L', size))
@@ -0,0 +1,181 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Digest-based RTMP handshake (Flash Player 9+).
+
+First handshake packet (C1/S1) contains HMAC-SHA256 digest of its
+contents, placed at offset derived from handshake bytes. Second handshake
+packet (C2/S2) is signed with key derived from peer's digest. Flash Player
+requires this handshake for H.264/AAC playback.
+
+HMAC objects keyed with well-known keys are created once and copied
+for each digest calculation.
+
+@see: U{http://lkcl.net/rtmp/RTMPE.txt}
+"""
+
+import hmac
+import hashlib
+import struct
+import os
+
+from fmspy.rtmp import constants
+
+DIGEST_SIZE = 32
+"""
+Size of HMAC-SHA256 digest.
+"""
+
+_keySuffix = "\xf0\xee\xc2\x4a\x80\x68\xbe\xe8\x2e\x00\xd0\xd1\x02\x9e\x7e\x57" \
+             "\x6e\xec\x5d\x2d\x29\x80\x6f\xab\x93\xb8\xe6\x36\xcf\xeb\x31\xae"
+
+SERVER_KEY = "Genuine Adobe Flash Media Server 001" + _keySuffix
+"""
+Server key, first 36 bytes are used to sign S1.
+"""
+CLIENT_KEY = "Genuine Adobe Flash Player 001" + _keySuffix
+"""
+Client key, first 30 bytes are used to sign C1.
+"""
+
+def _hmac(key):
+    """
+    Build keyed HMAC-SHA256 object.
+    """
+    return hmac.new(key, digestmod=hashlib.sha256)
+
+serverDigestKey = _hmac(SERVER_KEY[:36])
+"""
+HMAC for S1 digest.
+"""
+serverResponseKey = _hmac(SERVER_KEY)
+"""
+HMAC for deriving key of S2 signature.
+"""
+clientDigestKey = _hmac(CLIENT_KEY[:30])
+"""
+HMAC for C1 digest.
+"""
+clientResponseKey = _hmac(CLIENT_KEY)
+"""
+HMAC for deriving key of C2 signature.
+"""
+
+SCHEMES = (0, 1)
+"""
+Digest placement schemes: offset based on bytes 8-11 (0)
+or on bytes 772-775 (1).
+"""
+
+def digest_offset(data, scheme):
+    """
+    Calculate offset of digest in handshake.
+
+    @param data: handshake (C1 or S1)
+    @type data: C{bytearray}
+    @param scheme: one of L{SCHEMES}
+    @type scheme: C{int}
+    @rtype: C{int}
+    """
+    base = 8 if scheme == 0 else 772
+    return (data[base] + data[base+1] + data[base+2] + data[base+3]) % 728 + base + 4
+
+def calculate_digest(data, offset, key):
+    """
+    Calculate digest of handshake (excluding digest itself).
+
+    @param data: handshake (C1 or S1)
+    @type data: C{bytearray}
+    @param offset: digest offset
+    @type offset: C{int}
+    @param key: keyed HMAC object
+    @rtype: C{str}
+    """
+    h = key.copy()
+    h.update(buffer(data, 0, offset))
+    h.update(buffer(data, offset + DIGEST_SIZE))
+    return h.digest()
+
+def find_digest(data, key):
+    """
+    Find and validate digest in handshake.
+
+    @param data: handshake (C1 or S1)
+    @type data: C{bytearray}
+    @param key: keyed HMAC object
+    @return: (scheme, digest) or C{None} if there is no valid digest
+    @rtype: C{tuple}
+    """
+    for scheme in SCHEMES:
+        offset = digest_offset(data, scheme)
+        digest = str(data[offset:offset+DIGEST_SIZE])
+        if calculate_digest(data, offset, key) == digest:
+            return (scheme, digest)
+
+    return None
+
+def make_handshake(key, scheme, version):
+    """
+    Build signed handshake (C1 or S1).
+
+    @param key: keyed HMAC object
+    @param scheme: one of L{SCHEMES}
+    @type scheme: C{int}
+    @param version: version of peer software (4 bytes)
+    @type version: C{str}
+    @return: (handshake, digest)
+    @rtype: C{tuple}
+    """
+    data = bytearray(struct.pack("!L", 0) + version + os.urandom(constants.HANDSHAKE_SIZE - 8))
+    offset = digest_offset(data, scheme)
+    digest = calculate_digest(data, offset, key)
+    data[offset:offset+DIGEST_SIZE] = digest
+    return (str(data), digest)
+
+def response_signature(data, key, peerDigest):
+    """
+    Calculate signature of handshake response (C2 or S2).
+
+    @param data: response (without signature)
+    @type data: C{str}
+    @param key: keyed HMAC object (key derivation)
+    @param peerDigest: digest of peer's handshake
+    @type peerDigest: C{str}
+    @rtype: C{str}
+    """
+    h = key.copy()
+    h.update(peerDigest)
+    return hmac.new(h.digest(), data, hashlib.sha256).digest()
+
+def make_response(key, peerDigest):
+    """
+    Build signed handshake response (C2 or S2).
+
+    @param key: keyed HMAC object (key derivation)
+    @param peerDigest: digest of peer's handshake
+    @type peerDigest: C{str}
+    @rtype: C{str}
+    """
+    data = _responseBody
+    return data + response_signature(data, key, peerDigest)
+
+def verify_response(data, key, digest):
+    """
+    Verify handshake response (C2 or S2).
+
+    @param data: response
+    @type data: C{bytearray}
+    @param key: keyed HMAC object (key derivation)
+    @param digest: digest of our handshake
+    @type digest: C{str}
+    @rtype: C{bool}
+    """
+    size = len(data) - DIGEST_SIZE
+    return response_signature(buffer(data, 0, size), key, digest) == str(data[size:])
+
+_responseBody = os.urandom(constants.HANDSHAKE_SIZE - DIGEST_SIZE)
+"""
+Random part of handshake responses, shared by all connections.
+"""
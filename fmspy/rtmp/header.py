@@ -35,6 +35,12 @@ class RTMPHeader(object):
     that the information that is excluded is the same as the last time that 
     information was explicitly included in the header.
 
+    Timestamp in full (12 byte) header is absolute, timestamp in 8 and 4 byte
+    headers is a delta to timestamp of previous packet with same object_id.
+    1 byte header, starting new packet, repeats previous timestamp delta
+    (timestamp delta of full header is its timestamp), 1 byte header of
+    packet continuation chunk doesn't change timestamp.
+
     In a full 12 byte header is broken down as follows:
 
      - The first byte has the header size and the object id. The first 
@@ -65,8 +71,12 @@ class RTMPHeader(object):
     @type type: C{int}
     @ivar stream_id: Stream ID
     @type stream_id: C{int}
+    @ivar delta: timestamp delta (set by L{fill})
+    @type delta: C{int}
     """
 
+    __slots__ = ('object_id', 'timestamp', 'length', 'type', 'stream_id', 'delta')
+
     def __init__(self, object_id=None, timestamp=None, length=None, type=None, stream_id=None):
         """
         Construct header.
@@ -83,6 +93,7 @@ class RTMPHeader(object):
         @type stream_id: C{int}
         """
         self.object_id, self.timestamp, self.length, self.type, self.stream_id = object_id, timestamp, length, type, stream_id
+        self.delta = None
 
     def __repr__(self):
         return "<RTMPHeader(object_id=%r, timestamp=%r, length=%r, type=0x%02x, stream_id=%r)>" % (self.object_id,
@@ -99,17 +110,22 @@ class RTMPHeader(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
-    def fill(self, other):
+    def fill(self, other, continuation=False):
         """
         Refill incomplete header with other header's data.
 
         This header (self) can be incomplete right-to-left, for example,
-        if it was read from shortened format.
+        if it was read from shortened format. Timestamp of shortened
+        header is converted from delta to absolute value.
 
         @param other: source header (where we take values)
         @type other: L{RTMPHeader}
+        @param continuation: header of packet continuation chunk?
+        @type continuation: C{bool}
         """
-        if self.stream_id is None:
+        if self.stream_id is not None:
+            self.delta = self.timestamp
+        else:
             self.stream_id = other.stream_id
 
             if self.type is None:
@@ -118,8 +134,13 @@ class RTMPHeader(object):
                 if self.length is None:
                     self.length = other.length
 
-                    if self.timestamp is None:
-                        self.timestamp = other.timestamp
+            if other.timestamp is not None:
+                if self.timestamp is None:
+                    self.delta = other.delta if other.delta is not None else other.timestamp
+                    self.timestamp = other.timestamp if continuation else other.timestamp + self.delta
+                else:
+                    self.delta = self.timestamp
+                    self.timestamp += other.timestamp
 
         assert self.stream_id is not None
         assert self.type is not None
@@ -127,24 +148,26 @@ class RTMPHeader(object):
         assert self.timestamp is not None
         assert self.object_id is not None
 
-    def diff(self, other):
+    def diff(self, other, delta=0):
         """
-        Find difference between this header and other header (how many fields differ).
+        Find difference between this header and previous header (how many fields differ).
 
-        @param other: other header
+        @param other: previous header
         @type other: L{RTMPHeader}
+        @param delta: timestamp delta of previous header (as known to receiver)
+        @type delta: C{int}
         @return: difference
         @rtype: C{int}
         """
-        if self is other or self == other:
-            # headers are equal, we need 1 byte
-            return 0
-
         # difference should be computed for packets with same object_id
         assert self.object_id == other.object_id
 
-        if self.stream_id == other.stream_id:
+        if self.stream_id == other.stream_id and self.timestamp >= other.timestamp:
             if self.type == other.type and self.length == other.length:
+                if self.timestamp - other.timestamp == delta:
+                    # same timestamp delta, we need 1 byte
+                    return 0
+
                 # difference only in timestamp, 4 bytes
                 return 1
 
@@ -191,20 +214,35 @@ class RTMPHeader(object):
 
         return RTMPHeader(object_id, timestamp, length, type, stream_id)
 
-    def write(self, previous=None):
+    def write(self, previous=None, delta=0):
         """
         Write (encoder) header to byte string.
 
         @param previous: previous header (used to compress header)
         @type previous: L{RTMPHeader}
+        @param delta: timestamp delta of previous header (as known to receiver)
+        @type delta: C{int}
         @return: encoded header
         @rtype: C{str}
         """
         if previous is None:
             diff = 3
         else:
-            diff = self.diff(previous)
+            diff = self.diff(previous, delta)
+
+        return self.pack(diff, previous)
 
+    def pack(self, diff, previous=None):
+        """
+        Write (encode) header with given difference to previous header.
+
+        @param diff: difference (see L{diff})
+        @type diff: C{int}
+        @param previous: previous header (required if C{diff} is 1 or 2)
+        @type previous: L{RTMPHeader}
+        @return: encoded header
+        @rtype: C{str}
+        """
         first = self.object_id & 0x3f | ((diff ^ 3) << 6)
 
         if diff == 0:
@@ -213,7 +251,10 @@ class RTMPHeader(object):
         buf = BufferedByteStream()
         buf.write_uchar(first)
 
-        buf.write_24bit_uint(self.timestamp)
+        if diff == 3:
+            buf.write_24bit_uint(self.timestamp)
+        else:
+            buf.write_24bit_uint(self.timestamp - previous.timestamp)
 
         if diff > 1:
             buf.write_24bit_uint(self.length)
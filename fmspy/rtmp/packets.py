@@ -6,11 +6,11 @@
 Different RTMP packets.
 """
 
-import pyamf
 from pyamf.util import BufferedByteStream
 
 from fmspy.rtmp.header import RTMPHeader
-from fmspy.rtmp import constants
+from fmspy.rtmp import constants, amf0
+from fmspy.rtmp.amf3 import AMF3Codec
 
 class Packet(object):
     """
@@ -20,6 +20,13 @@ class Packet(object):
     @type header: L{RTMPHeader}
     """
 
+    __slots__ = ('header', )
+
+    usesCodec = False
+    """
+    Packet is encoded with connection's L{AMF3Codec} (passed to L{write}).
+    """
+
     def __init__(self, header):
         """
         Create RTMP Packet.
@@ -67,6 +74,8 @@ class DataPacket(Packet):
     @type data: C{str}
     """
 
+    __slots__ = ('data', )
+
     def __init__(self, header, data):
         """
         Create RTMP Packet.
@@ -113,6 +122,229 @@ class DataPacket(Packet):
         """
         return self.data
 
+class MediaPacket(DataPacket):
+    """
+    Audio or video packet, relayed without looking into payload.
+
+    Packet data is held as list of chunk payloads, as they were
+    received. Payloads are never joined: L{RTMPAssembler} re-chunks
+    them on output, so the same segments can be sent to any number
+    of peers.
+
+    @ivar segments: packet data
+    @type segments: C{list} of C{str}
+    """
+
+    __slots__ = ('segments', )
+
+    def __init__(self, header, segments):
+        """
+        Create media packet.
+
+        @param header: packet header (with length set)
+        @type header: L{RTMPHeader}
+        @param segments: packet data
+        @type segments: C{list} of C{str}
+        """
+        Packet.__init__(self, header)
+        self.segments = segments
+
+    def __repr__(self):
+        return "<%s(header=%r, segments=%d)>" % (self.__class__.__name__, self.header, len(self.segments))
+
+    @property
+    def data(self):
+        """
+        Packet data (joined).
+
+        @rtype: C{str}
+        """
+        return "".join(self.segments)
+
+    @classmethod
+    def read(cls, header, buf):
+        """
+        Read (decode) packet from stream.
+
+        @param header: packet header
+        @type header: L{RTMPHeader}
+        @param buf: buffer holding packet data
+        @type buf: C{BufferedByteStream}
+        """
+        return cls(header, [buf.read()])
+
+    def byte(self, pos):
+        """
+        Get byte of packet data (without joining segments).
+
+        @param pos: offset in packet data
+        @type pos: C{int}
+        @return: byte value or C{None}, if packet is shorter
+        @rtype: C{int}
+        """
+        for segment in self.segments:
+            if pos < len(segment):
+                return ord(segment[pos])
+            pos -= len(segment)
+
+        return None
+
+class AudioData(MediaPacket):
+    """
+    Audio packet (FLV audio tag body).
+
+    Codec and AAC packet type are read from first bytes of data
+    on access, payload is never copied.
+    """
+
+    __slots__ = ()
+
+    MP3 = 2
+    """ MP3 codec """
+    SPEEX = 11
+    """ Speex codec """
+    AAC = 10
+    """ AAC codec """
+
+    AAC_SEQUENCE_HEADER = 0
+    """ AAC packet: AudioSpecificConfig """
+    AAC_RAW = 1
+    """ AAC packet: raw frame data """
+
+    @property
+    def codec(self):
+        """
+        Audio codec (sound format), e.g. L{AAC}.
+
+        @rtype: C{int}
+        """
+        first = self.byte(0)
+        if first is None:
+            return None
+
+        return first >> 4
+
+    @property
+    def aacPacketType(self):
+        """
+        AAC packet type (L{AAC_SEQUENCE_HEADER} or L{AAC_RAW}), C{None} for other codecs.
+
+        @rtype: C{int}
+        """
+        if self.codec != self.AAC:
+            return None
+
+        return self.byte(1)
+
+    @property
+    def isSequenceHeader(self):
+        """
+        Is this AAC config (AudioSpecificConfig)?
+
+        @rtype: C{bool}
+        """
+        return self.aacPacketType == self.AAC_SEQUENCE_HEADER
+
+class VideoData(MediaPacket):
+    """
+    Video packet (FLV video tag body).
+
+    Frame type, codec and AVC packet type are read from first bytes
+    of data on access, payload is never copied.
+    """
+
+    __slots__ = ()
+
+    KEYFRAME = 1
+    """ Frame type: keyframe """
+    INTERFRAME = 2
+    """ Frame type: inter frame """
+    DISPOSABLE_INTERFRAME = 3
+    """ Frame type: disposable inter frame (H.263 only) """
+    GENERATED_KEYFRAME = 4
+    """ Frame type: generated keyframe (server use only) """
+    COMMAND_FRAME = 5
+    """ Frame type: video info/command frame """
+
+    H263 = 2
+    """ Sorenson H.263 codec """
+    VP6 = 4
+    """ On2 VP6 codec """
+    AVC = 7
+    """ AVC (H.264) codec """
+
+    AVC_SEQUENCE_HEADER = 0
+    """ AVC packet: AVCDecoderConfigurationRecord """
+    AVC_NALU = 1
+    """ AVC packet: NAL units """
+    AVC_END_OF_SEQUENCE = 2
+    """ AVC packet: end of sequence """
+
+    @property
+    def frameType(self):
+        """
+        Frame type, e.g. L{KEYFRAME}.
+
+        @rtype: C{int}
+        """
+        first = self.byte(0)
+        if first is None:
+            return None
+
+        return first >> 4
+
+    @property
+    def codec(self):
+        """
+        Video codec, e.g. L{AVC}.
+
+        @rtype: C{int}
+        """
+        first = self.byte(0)
+        if first is None:
+            return None
+
+        return first & 0x0f
+
+    @property
+    def avcPacketType(self):
+        """
+        AVC packet type (L{AVC_SEQUENCE_HEADER}, L{AVC_NALU} or
+        L{AVC_END_OF_SEQUENCE}), C{None} for other codecs.
+
+        @rtype: C{int}
+        """
+        if self.codec != self.AVC:
+            return None
+
+        return self.byte(1)
+
+    @property
+    def isKeyframe(self):
+        """
+        Is this keyframe (not AVC sequence header)?
+
+        @rtype: C{bool}
+        """
+        return self.frameType == self.KEYFRAME and not self.isSequenceHeader
+
+    @property
+    def isSequenceHeader(self):
+        """
+        Is this AVC sequence header (AVCDecoderConfigurationRecord)?
+
+        @rtype: C{bool}
+        """
+        return self.avcPacketType == self.AVC_SEQUENCE_HEADER
+
+mediaTypeMap = {
+            constants.AUDIO_DATA : AudioData,
+            constants.VIDEO_DATA : VideoData,
+        }
+"""
+Classes of media packets by packet type.
+"""
+
 class Invoke(Packet):
     """
     Invoke RTMP Packet (RPC).
@@ -120,6 +352,9 @@ class Invoke(Packet):
     Invoke packet invokes procedure named L{name} with arguments
     L{argv}. Calls-replies are matched using L{id}.
 
+    Invokes of type C{FLEX_MESSAGE} (from Flex clients) are prefixed with
+    zero byte, arguments are encoded with AMF3.
+
     @ivar name: procedure name
     @type name: C{str}
     @ivar id: request ID
@@ -128,6 +363,10 @@ class Invoke(Packet):
     @type argv: C{list}
     """
 
+    __slots__ = ('name', 'argv', 'id')
+
+    usesCodec = True
+
     def __init__(self, name, argv, id, header):
         """
         Construct Invoke packet.
@@ -164,6 +403,185 @@ class Invoke(Packet):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    @classmethod
+    def read(self, header, buf, codec=None):
+        """
+        Read (decode) packet from stream.
+
+        @param header: packet header
+        @type header: L{RTMPHeader}
+        @param buf: buffer holding packet data
+        @type buf: C{BufferedByteStream}
+        @param codec: AMF3 codec of connection
+        @type codec: L{AMF3Codec}
+        """
+        values = _decode(header, buf, codec)
+        return Invoke(values[0], tuple(values[2:]), values[1], header)
+
+    def write(self, codec=None):
+        """
+        Encode packet into bytes.
+
+        @param codec: AMF3 codec of connection
+        @type codec: L{AMF3Codec}
+        @return: representation of packet
+        @rtype: C{str}
+        """
+        if self.header.type == constants.FLEX_MESSAGE:
+            if codec is None:
+                codec = AMF3Codec()
+            data = "\x00" + amf0.encode(self.name, self.id) + codec.encode(*self.argv)
+        else:
+            data = amf0.encode(self.name, self.id, *self.argv)
+        self.header.length = len(data)
+        return data
+
+class Notify(Packet):
+    """
+    Notify RTMP Packet (data message).
+
+    Notify is a one-way call (without reply) of L{name} with arguments
+    L{argv}, e.g. stream metadata.
+
+    Notifies of type C{FLEX_STREAM} (from Flex clients) are prefixed with
+    zero byte, arguments are encoded with AMF3.
+
+    @ivar name: handler name
+    @type name: C{str}
+    @ivar argv: call arguments
+    @type argv: C{list}
+    """
+
+    __slots__ = ('name', 'argv')
+
+    usesCodec = True
+
+    def __init__(self, name, argv, header):
+        """
+        Construct Notify packet.
+
+        @param name: handler name
+        @type name: C{str}
+        @param argv: call arguments
+        @type argv: C{list}
+        @param header: packet header
+        @type header: L{RTMPHeader}
+        """
+        if header.type is None:
+            header.type = constants.NOTIFY
+        if header.object_id is None:
+            header.object_id = constants.DEFAULT_INVOKE_OBJECT_ID
+
+        super(Notify, self).__init__(header)
+
+        self.name = name
+        self.argv = argv
+
+    def __repr__(self):
+        return "<%s(name=%r, argv=%r, header=%r)>" % (self.__class__.__name__, self.name, self.argv, self.header)
+
+    def __eq__(self, other):
+        if not isinstance(other, Notify):
+            return NotImplemented
+
+        return self.name == other.name and self.argv == other.argv and self.header == other.header
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    @classmethod
+    def read(self, header, buf, codec=None):
+        """
+        Read (decode) packet from stream.
+
+        @param header: packet header
+        @type header: L{RTMPHeader}
+        @param buf: buffer holding packet data
+        @type buf: C{BufferedByteStream}
+        @param codec: AMF3 codec of connection
+        @type codec: L{AMF3Codec}
+        """
+        values = _decode(header, buf, codec)
+        return Notify(values[0], tuple(values[1:]), header)
+
+    def write(self, codec=None):
+        """
+        Encode packet into bytes.
+
+        @param codec: AMF3 codec of connection
+        @type codec: L{AMF3Codec}
+        @return: representation of packet
+        @rtype: C{str}
+        """
+        if self.header.type == constants.FLEX_STREAM:
+            if codec is None:
+                codec = AMF3Codec()
+            data = "\x00" + amf0.encode(self.name) + codec.encode(*self.argv)
+        else:
+            data = amf0.encode(self.name, *self.argv)
+        self.header.length = len(data)
+        return data
+
+def _decode(header, buf, codec):
+    """
+    Decode AMF values of L{Invoke} or L{Notify} packet.
+
+    @return: decoded values
+    @rtype: C{list}
+    """
+    data = buf.read()
+    if header.type in (constants.FLEX_MESSAGE, constants.FLEX_STREAM):
+        if codec is None:
+            codec = AMF3Codec()
+        return codec.decode(data[1:])
+
+    return amf0.decode(data)
+
+class ChunkSize(Packet):
+    """
+    Set chunk size packet.
+
+    Sender uses new chunk size for all chunks following this packet.
+
+    @ivar size: chunk size (bytes)
+    @type size: C{int}
+    """
+
+    __slots__ = ('size', )
+
+    def __init__(self, size, header=None):
+        """
+        Construct ChunkSize packet.
+
+        @param size: chunk size (bytes)
+        @type size: C{int}
+        @param header: packet header
+        @type header: L{RTMPHeader}
+        """
+        if header is None:
+            header = RTMPHeader(constants.DEFAULT_CHUNK_SIZE_OBJECT_ID, 0, 0, constants.CHUNK_SIZE, 0)
+        else:
+            if header.type is None:
+                header.type = constants.CHUNK_SIZE
+            if header.object_id is None:
+                header.object_id = constants.DEFAULT_CHUNK_SIZE_OBJECT_ID
+
+        super(ChunkSize, self).__init__(header)
+
+        self.size = size
+
+    def __repr__(self):
+        return "<%s(size=%r, header=%r)>" % (self.__class__.__name__, self.size, self.header)
+
+    def __eq__(self, other):
+        if not isinstance(other, ChunkSize):
+            return NotImplemented
+
+        return self.size == other.size and self.header == other.header
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
     @classmethod
     def read(self, header, buf):
         """
@@ -174,11 +592,7 @@ class Invoke(Packet):
         @param buf: buffer holding packet data
         @type buf: C{BufferedByteStream}
         """
-        amf = pyamf.decode(buf, encoding=pyamf.AMF0)
-        name = amf.next()
-        id = amf.next()
-        argv = tuple(amf)
-        return Invoke(name, argv, id, header)
+        return ChunkSize(buf.read_ulong(), header)
 
     def write(self):
         """
@@ -187,8 +601,10 @@ class Invoke(Packet):
         @return: representation of packet
         @rtype: C{str}
         """
-        buf = pyamf.encode(self.name, self.id, *self.argv, encoding=pyamf.AMF0)
+        buf = BufferedByteStream()
+        buf.write_ulong(self.size)
         self.header.length = len(buf)
+        buf.seek(0, 0)
         return buf.read()
 
 class BytesRead(Packet):
@@ -201,6 +617,8 @@ class BytesRead(Packet):
     @type bytes: C{int}
     """
 
+    __slots__ = ('bytes', )
+
     def __init__(self, bytes, header=None):
         """
         Construct BytesRead packet.
@@ -259,6 +677,165 @@ class BytesRead(Packet):
         buf.seek(0, 0)
         return buf.read()
 
+class ServerBW(Packet):
+    """
+    Window acknowledgement size packet.
+
+    Sender expects peer to acknowledge (with L{BytesRead})
+    every L{bandwidth} bytes received.
+
+    @ivar bandwidth: acknowledgement window size (bytes)
+    @type bandwidth: C{int}
+    """
+
+    __slots__ = ('bandwidth', )
+
+    def __init__(self, bandwidth, header=None):
+        """
+        Construct ServerBW packet.
+
+        @param bandwidth: acknowledgement window size (bytes)
+        @type bandwidth: C{int}
+        @param header: packet header
+        @type header: L{RTMPHeader}
+        """
+        if header is None:
+            header = RTMPHeader(constants.DEFAULT_BW_OBJECT_ID, 0, 0, constants.SERVER_BW, 0)
+        else:
+            if header.type is None:
+                header.type = constants.SERVER_BW
+            if header.object_id is None:
+                header.object_id = constants.DEFAULT_BW_OBJECT_ID
+
+        super(ServerBW, self).__init__(header)
+
+        self.bandwidth = bandwidth
+
+    def __repr__(self):
+        return "<%s(bandwidth=%r, header=%r)>" % (self.__class__.__name__, self.bandwidth, self.header)
+
+    def __eq__(self, other):
+        if not isinstance(other, ServerBW):
+            return NotImplemented
+
+        return self.bandwidth == other.bandwidth and self.header == other.header
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    @classmethod
+    def read(self, header, buf):
+        """
+        Read (decode) packet from stream.
+
+        @param header: packet header
+        @type header: L{RTMPHeader}
+        @param buf: buffer holding packet data
+        @type buf: C{BufferedByteStream}
+        """
+        return ServerBW(buf.read_ulong(), header)
+
+    def write(self):
+        """
+        Encode packet into bytes.
+
+        @return: representation of packet
+        @rtype: C{str}
+        """
+        buf = BufferedByteStream()
+        buf.write_ulong(self.bandwidth)
+        self.header.length = len(buf)
+        buf.seek(0, 0)
+        return buf.read()
+
+class ClientBW(Packet):
+    """
+    Set peer bandwidth packet.
+
+    Receiver should limit amount of sent, but not yet
+    acknowledged data to L{bandwidth} bytes.
+
+    @ivar bandwidth: output window size (bytes)
+    @type bandwidth: C{int}
+    @ivar limit: limit type (L{LIMIT_HARD}, L{LIMIT_SOFT} or L{LIMIT_DYNAMIC})
+    @type limit: C{int}
+    """
+
+    __slots__ = ('bandwidth', 'limit')
+
+    LIMIT_HARD = 0
+    """ Peer should limit output to this window """
+    LIMIT_SOFT = 1
+    """ Peer should limit output to this window or smaller one """
+    LIMIT_DYNAMIC = 2
+    """ Hard, if previous limit was hard, ignored otherwise """
+
+    def __init__(self, bandwidth, limit=LIMIT_DYNAMIC, header=None):
+        """
+        Construct ClientBW packet.
+
+        @param bandwidth: output window size (bytes)
+        @type bandwidth: C{int}
+        @param limit: limit type
+        @type limit: C{int}
+        @param header: packet header
+        @type header: L{RTMPHeader}
+        """
+        if header is None:
+            header = RTMPHeader(constants.DEFAULT_BW_OBJECT_ID, 0, 0, constants.CLIENT_BW, 0)
+        else:
+            if header.type is None:
+                header.type = constants.CLIENT_BW
+            if header.object_id is None:
+                header.object_id = constants.DEFAULT_BW_OBJECT_ID
+
+        super(ClientBW, self).__init__(header)
+
+        self.bandwidth = bandwidth
+        self.limit = limit
+
+    def __repr__(self):
+        return "<%s(bandwidth=%r, limit=%r, header=%r)>" % (self.__class__.__name__, self.bandwidth, self.limit, self.header)
+
+    def __eq__(self, other):
+        if not isinstance(other, ClientBW):
+            return NotImplemented
+
+        return self.bandwidth == other.bandwidth and self.limit == other.limit and self.header == other.header
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    @classmethod
+    def read(self, header, buf):
+        """
+        Read (decode) packet from stream.
+
+        @param header: packet header
+        @type header: L{RTMPHeader}
+        @param buf: buffer holding packet data
+        @type buf: C{BufferedByteStream}
+        """
+        bandwidth = buf.read_ulong()
+        limit = ClientBW.LIMIT_DYNAMIC
+        if buf.remaining() >= 1:
+            limit = buf.read_uchar()
+        return ClientBW(bandwidth, limit, header)
+
+    def write(self):
+        """
+        Encode packet into bytes.
+
+        @return: representation of packet
+        @rtype: C{str}
+        """
+        buf = BufferedByteStream()
+        buf.write_ulong(self.bandwidth)
+        buf.write_uchar(self.limit)
+        self.header.length = len(buf)
+        buf.seek(0, 0)
+        return buf.read()
+
 class Ping(Packet):
     """
     Ping packet is used (?) to check as connection keep-alive.
@@ -268,7 +845,9 @@ class Ping(Packet):
     @ivar data: ping data, 1..3 longs (4 bytes * 1..3)
     @type data: C{list(int)}
     """
-    
+
+    __slots__ = ('event', 'data')
+
     STREAM_CLEAR = 0
     """ Stream clear event """
     STREAM_PLAYBUFFER_CLEAR = 1
@@ -362,7 +941,7 @@ class Ping(Packet):
         buf.seek(0, 0)
         return buf.read()
 
-def packetFactory(header, buf):
+def packetFactory(header, buf, codec=None):
     """
     Find approriate class for packet decoding.
 
@@ -370,13 +949,29 @@ def packetFactory(header, buf):
     @type header: L{RTMPHeader}
     @param buf: buffer holding packet data
     @type buf: C{BufferedByteStream}
+    @param codec: AMF3 codec of connection
+    @type codec: L{AMF3Codec}
     @return: decoded packet
     @rtype: L{Packet}
     """
-    typeMap = {
+    amfTypeMap = {
                 constants.INVOKE : Invoke,
+                constants.FLEX_MESSAGE : Invoke,
+                constants.NOTIFY : Notify,
+                constants.FLEX_STREAM : Notify,
+              }
+
+    if header.type in amfTypeMap:
+        return amfTypeMap[header.type].read(header, buf, codec)
+
+    typeMap = {
+                constants.CHUNK_SIZE : ChunkSize,
                 constants.BYTES_READ : BytesRead,
                 constants.PING : Ping,
+                constants.SERVER_BW : ServerBW,
+                constants.CLIENT_BW : ClientBW,
+                constants.AUDIO_DATA : AudioData,
+                constants.VIDEO_DATA : VideoData,
               }
 
     if header.type in typeMap:
@@ -8,15 +8,21 @@ Base RTMP protocol.
 
 import copy
 
-from twisted.internet import protocol, reactor, task, defer
+from collections import deque
+
+from zope.interface import implements
+from twisted.internet import protocol, defer, interfaces
 from twisted.python import log
-from pyamf.util import BufferedByteStream
 
-from fmspy.rtmp.assembly import RTMPAssembler, RTMPDisassembler
-from fmspy.rtmp import constants
-from fmspy.rtmp.packets import Ping, BytesRead, Invoke
+from fmspy.rtmp.assembly import RTMPAssembler, RTMPDisassembler, ReassemblyLimitError
+from fmspy.rtmp import constants, control, status
+from fmspy.rtmp.packets import Ping, Invoke, ClientBW, AudioData, VideoData
 from fmspy.rtmp.header import RTMPHeader
 from fmspy.rtmp.status import Status
+from fmspy.rtmp.timer import timers
+from fmspy.stats import metrics
+from fmspy.stats.profiler import spans
+from fmspy.stats.watchdog import invoke_watchdog
 from fmspy.config import config
 from fmspy import _time
 
@@ -30,13 +36,27 @@ class RTMPBaseProtocol(protocol.Protocol):
     """
     Basis RTMP protocol implementation.
 
+    Initial values of connection state are class attributes, so that
+    instance dictionary holds only state changed since connection start
+    (keeps memory footprint of idle connections small).
+
     @ivar state: internal state of protocol
     @ivar input: input packet disassebmbler 
     @type input: L{RTMPDisassembler}
     @ivar output: output packet assembler
     @type output: L{RTMPAssembler}
-    @ivar handshakeBuf: buffer, holding input data during handshake
-    @type handshakeBuf: C{BufferedByteStream}
+    @ivar handshakeBuf: preallocated buffer, holding input data during handshake
+    @type handshakeBuf: C{bytearray}
+    @ivar handshakeNeed: number of bytes expected in current handshake phase
+    @type handshakeNeed: C{int}
+    @ivar handshakeLen: number of bytes received in current handshake phase
+    @type handshakeLen: C{int}
+    @ivar handshakeKeep: should received bytes be stored in L{handshakeBuf}?
+    @type handshakeKeep: C{bool}
+    @ivar usage: resource accounting entries this connection is attributed to
+    @type usage: C{tuple} of L{Usage}
+    @ivar handshakeTimeout: handshake timeout timer
+    @type handshakeTimeout: L{TimerWheelEntry}
     """
 
     class State:
@@ -57,25 +77,79 @@ class RTMPBaseProtocol(protocol.Protocol):
         Usual state of protocol: receiving-sending RTMP packets.
         """
 
-    def __init__(self):
-        """
-        Constructor.
-        """
-        self.state = self.State.CONNECTING
-        self.handshakeTimeout = None
+    state = State.CONNECTING
+    handshakeTimeout = None
+    usage = ()
+    input = None
+    output = None
+
+    handshakeBufSize = constants.HANDSHAKE_SIZE + 1
+    """
+    Size of handshake buffer (maximum handshake portion stored).
+    """
+
+    timers = timers
+    """
+    Timer wheel for connection timers.
+    """
+
+    handshakeTimeoutDelay = config.getint('RTMP', 'handshakeTimeout')
+    """
+    Timeout for handshake completion (seconds).
+    """
+
+    maxReassemblyBytes = config.getint('RTMP', 'maxReassemblyBytes')
+    """
+    Maximum memory held by partially received packets (bytes).
+    """
+
+    maxPacketSize = config.getint('RTMP', 'maxMessageSize')
+    """
+    Maximum size of received packet (bytes).
+    """
+
+    maxPacketSizes = dict(dict.fromkeys((constants.INVOKE, constants.NOTIFY, constants.FLEX_MESSAGE,
+                                         constants.FLEX_STREAM, constants.SO, constants.FLEX_SHARED_OBJECT),
+                                        config.getint('RTMP', 'maxCommandSize')).items() +
+                          dict.fromkeys((constants.CHUNK_SIZE, constants.BYTES_READ, constants.PING,
+                                         constants.SERVER_BW, constants.CLIENT_BW), 1024).items())
+    """
+    Maximum size of received packet by packet type (bytes), overrides L{maxPacketSize}.
+    """
 
     def connectionMade(self):
         """
         Successfully connected to peer.
         """
-        self.input = RTMPDisassembler(constants.DEFAULT_CHUNK_SIZE)
+        metrics.adjust('rtmp.connections', 1)
+
+        self.input = RTMPDisassembler(constants.DEFAULT_CHUNK_SIZE, self.maxReassemblyBytes,
+                                      self.maxPacketSize, self.maxPacketSizes)
         self.output = RTMPAssembler(constants.DEFAULT_CHUNK_SIZE, self.transport)
 
         self.state = self.State.HANDSHAKE_SEND
-        self.handshakeTimeout = reactor.callLater(config.getint('RTMP', 'handshakeTimeout'), self._handshakeTimedout)
-        self.handshakeBuf = BufferedByteStream()
+        self.handshakeTimeout = self.timers.schedule(self.handshakeTimeoutDelay, self._handshakeTimedout)
+        self.handshakeBuf = bytearray(self.handshakeBufSize)
         self._beginHandshake()
 
+    def _expectHandshake(self, size, keep=True):
+        """
+        Wait for next portion of handshake.
+
+        When L{size} bytes are received, C{_handshake*Received}
+        is called for current state.
+
+        @param size: number of bytes to wait for
+        @type size: C{int}
+        @param keep: store bytes in L{handshakeBuf} (or just skip them)?
+        @type keep: C{bool}
+        """
+        assert not keep or size <= self.handshakeBufSize
+
+        self.handshakeNeed = size
+        self.handshakeLen = 0
+        self.handshakeKeep = keep
+
     def _beginHandshake(self):
         """
         Begin handshake procedures.
@@ -106,10 +180,9 @@ class RTMPBaseProtocol(protocol.Protocol):
         """
         if self.handshakeTimeout is not None:
             self.handshakeTimeout.cancel()
-            self.handshakeTimeout = None
+            del self.handshakeTimeout
         self.state = self.State.RUNNING
-        self._regularInput(self.handshakeBuf.read())
-        del self.handshakeBuf
+        del self.handshakeBuf, self.handshakeNeed, self.handshakeLen, self.handshakeKeep
 
     def _handshakeTimedout(self):
         """
@@ -122,10 +195,16 @@ class RTMPBaseProtocol(protocol.Protocol):
         """
         Connection with peer was lost for some reason.
         """
+        metrics.adjust('rtmp.connections', -1)
+
+        if self.input is not None:
+            self.input.release()
+
         if self.handshakeTimeout is not None:
             self.handshakeTimeout.cancel()
             self.handshakeTimeout = None
 
+    @spans.timed('regularInput')
     def _regularInput(self, data):
         """
         Regular RTMP dataflow: stream of RTMP packets.
@@ -138,7 +217,15 @@ class RTMPBaseProtocol(protocol.Protocol):
         self.input.push_data(data)
 
         while True:
-            packet = self.input.disassemble()
+            try:
+                packet = self.input.disassemble()
+            except ReassemblyLimitError, e:
+                log.msg("Closing connection: %s" % e)
+                metrics.increment('rtmp.reassembly_exceeded')
+                self.input.release()
+                self.transport.loseConnection()
+                return
+
             if packet is None:
                 return
 
@@ -153,14 +240,50 @@ class RTMPBaseProtocol(protocol.Protocol):
         """
         if self.state == self.State.RUNNING:
             self._regularInput(data)
-        else: # handshake
-            self.handshakeBuf.seek(0, 2)
-            self.handshakeBuf.write(data)
-            if self.state == self.State.HANDSHAKE_SEND:
-                self._handshakeSendReceived()
-            elif self.state == self.State.HANDSHAKE_VERIFY:
-                self._handshakeVerifyReceived()
+        else:
+            self._handshakeInput(data)
+
+    def _handshakeInput(self, data):
+        """
+        Some bytes received during handshake.
+
+        Data is split into handshake portions, data left after
+        handshake completion is processed as regular input.
 
+        @param data: bytes received
+        @type data: C{str}
+        """
+        pos, size = 0, len(data)
+
+        while pos < size:
+            if self.state == self.State.RUNNING:
+                self._regularInput(data[pos:])
+                return
+
+            have = self.handshakeLen
+            take = self.handshakeNeed - have
+            if take == 0:
+                # handshake failed, connection is being closed
+                return
+            if take > size - pos:
+                take = size - pos
+
+            if self.handshakeKeep:
+                if take == size:
+                    self.handshakeBuf[have:have+take] = data
+                else:
+                    self.handshakeBuf[have:have+take] = buffer(data, pos, take)
+
+            self.handshakeLen = have = have + take
+            pos += take
+
+            if have == self.handshakeNeed:
+                if self.state == self.State.HANDSHAKE_SEND:
+                    self._handshakeSendReceived()
+                else:
+                    self._handshakeVerifyReceived()
+
+    @spans.timed('handlePacket')
     def _handlePacket(self, packet):
         """
         Dispatch received packet to some handler.
@@ -169,12 +292,36 @@ class RTMPBaseProtocol(protocol.Protocol):
         @type packet: L{Packet}
         """
         log.msg("<- %r" % packet)
+
+        metrics.increment('rtmp.packets_in')
+        for usage in self.usage:
+            usage.received(packet.header.length)
+
         handler = 'handle' + packet.__class__.__name__
         try:
             getattr(self, handler)(packet)
         except AttributeError:
             log.msg("Unhandled packet: %r" % packet)
 
+    def handleChunkSize(self, packet):
+        """
+        Handle incoming L{ChunkSize} packets.
+
+        Peer changes size of chunks it sends (encoders usually
+        do that before publishing).
+
+        @param packet: packet
+        @type packet: L{ChunkSize}
+        """
+        size = packet.size & 0x7fffffff
+        if size == 0:
+            log.msg("Closing connection: invalid chunk size")
+            self.transport.loseConnection()
+            return
+
+        self.input.chunkSize = size
+
+    @spans.timed('pushPacket')
     def pushPacket(self, packet):
         """
         Push outgoing RTMP packet.
@@ -185,6 +332,25 @@ class RTMPBaseProtocol(protocol.Protocol):
         log.msg("-> %r" % packet)
         self.output.push_packet(packet)
 
+        metrics.increment('rtmp.packets_out')
+        for usage in self.usage:
+            usage.sent(packet.header.length)
+
+    def pushControl(self, template, *values):
+        """
+        Push outgoing control message.
+
+        @param template: message template
+        @type template: L{ControlTemplate}
+        @param values: message body values
+        """
+        log.msg("-> %s%r" % (template.name, values))
+        self.output.push_control(template, *values)
+
+        metrics.increment('rtmp.packets_out')
+        for usage in self.usage:
+            usage.sent(template.header.length)
+
 class RTMPCoreProtocol(RTMPBaseProtocol):
     """
     RTMP Protocol: core features for all protocols.
@@ -193,24 +359,119 @@ class RTMPCoreProtocol(RTMPBaseProtocol):
     @type lastReceived: C{int}
     @ivar bytesReceived: number of bytes received so far
     @type bytesReceived: C{int}
-    @ivar pingTask: periodic ping task
-    @type pingTask: C{task.LoopingCall}
+    @ivar pingTimer: timer of next keep-alive check
+    @type pingTimer: L{TimerWheelEntry}
     @ivar nextInvokeId: next Invoke id to use in this connection
     @type nextInvokeId: C{float}
-    @ivar invokeReplies: collection of C{Deferred}s for each L{Invoke} id we sent
+    @ivar invokeReplies: collection of C{Deferred}s for each L{Invoke} id we sent (or C{None})
     @type invokeReplies: C{dict}
+    @ivar ackWindow: acknowledge received bytes every L{ackWindow} bytes (as requested by peer)
+    @type ackWindow: C{int}
+    @ivar ackSent: value of L{bytesReceived} when last acknowledgement was sent
+    @type ackSent: C{int}
+    @ivar announcedWindow: acknowledgement window announced to peer
+    @type announcedWindow: C{int}
+    @ivar outputWindow: maximum amount of sent, but not acknowledged data
+    @type outputWindow: C{int}
+    @ivar bytesAcked: last acknowledgement from peer (or C{None}, if peer never acknowledged)
+    @type bytesAcked: C{int}
+    @ivar mediaQueue: media packets waiting for output window to open (or C{None})
+    @type mediaQueue: C{deque}
+    @ivar mediaQueueBytes: size of packets in L{mediaQueue}
+    @type mediaQueueBytes: C{int}
+    @ivar skipVideo: Stream IDs, video of which is dropped till next keyframe (or C{None})
+    @type skipVideo: C{set}
+    @ivar ackRate: rate of acknowledgements from peer (bytes per second, or C{None})
+    @type ackRate: C{float}
+    @ivar ackSampleStart: start of current sample of L{ackRate} (or C{None})
+    @type ackSampleStart: C{float}
+    @ivar ackSampleBytes: bytes acknowledged since L{ackSampleStart}
+    @type ackSampleBytes: C{int}
+    @ivar writePaused: transport asked to pause writing (send buffer is full)
+    @type writePaused: C{bool}
+    @ivar lastCongestion: last time output was congested (writing paused, media throttled)
+    @type lastCongestion: C{float}
+    """
+    implements(interfaces.IPushProducer)
+
+    pingInterval = config.getint('RTMP', 'pingInterval')
+    """
+    Interval between keep-alive checks and pings (seconds).
+    """
+
+    keepAliveTimeout = config.getint('RTMP', 'keepAliveTimeout')
+    """
+    Inactivity timeout (seconds).
     """
 
+    windowAckSize = config.getint('RTMP', 'windowAckSize')
+    """
+    Acknowledgement window size, requested from peer (bytes).
+    """
+
+    throttledTypes = (constants.AUDIO_DATA, constants.VIDEO_DATA)
+    """
+    Types of packets subject to output flow control.
+    """
+
+    ackSampleInterval = 0.5
+    """
+    Minimum duration of acknowledgement rate sample (seconds).
+    """
+
+    bytesReceived = 0
+    pingTimer = None
+    nextInvokeId = 2.0
+    invokeReplies = None
+    ackWindow = None
+    ackSent = 0
+    announcedWindow = None
+    outputWindow = 2 * windowAckSize
+    bytesAcked = None
+    mediaQueue = None
+    mediaQueueBytes = 0
+    skipVideo = None
+    ackRate = None
+    ackSampleStart = None
+    ackSampleBytes = 0
+    writePaused = False
+    lastCongestion = 0
+
     def __init__(self):
         """
         Constructor.
         """
-        RTMPBaseProtocol.__init__(self)
-        self.bytesReceived = 0
         self.lastReceived = _time.seconds()
-        self.pingTask = None
-        self.nextInvokeId = 2.0
-        self.invokeReplies = {}
+
+    def connectionMade(self):
+        """
+        Successfully connected to peer.
+
+        Protocol is registered as producer with transport to learn
+        when send buffer of transport is full.
+        """
+        RTMPBaseProtocol.connectionMade(self)
+
+        self.transport.registerProducer(self, True)
+
+    def pauseProducing(self):
+        """
+        Send buffer of transport is full.
+        """
+        self.writePaused = True
+        self.lastCongestion = _time.seconds()
+        metrics.increment('rtmp.write_paused')
+
+    def resumeProducing(self):
+        """
+        Send buffer of transport was drained.
+        """
+        self.writePaused = False
+
+    def stopProducing(self):
+        """
+        Transport is closing.
+        """
 
     def dataReceived(self, data):
         """
@@ -224,17 +485,24 @@ class RTMPCoreProtocol(RTMPBaseProtocol):
 
         RTMPBaseProtocol.dataReceived(self, data)
 
+        if self.ackWindow is not None and self.bytesReceived - self.ackSent >= self.ackWindow:
+            self.ackSent = self.bytesReceived
+            self.pushControl(control.bytesRead, self.bytesReceived & 0xffffffff)
+
     def connectionLost(self, reason):
         """
         Connection with peer was lost for some reason.
         """
         RTMPBaseProtocol.connectionLost(self, reason)
 
-        self.invokeReplies = {}
+        self.invokeReplies = None
+        self.mediaQueue = None
+        self.mediaQueueBytes = 0
+        self.skipVideo = None
 
-        if self.pingTask is not None:
-            self.pingTask.stop()
-            self.pingTask = None
+        if self.pingTimer is not None:
+            self.pingTimer.cancel()
+            self.pingTimer = None
 
     def _handshakeComplete(self):
         """
@@ -244,8 +512,7 @@ class RTMPCoreProtocol(RTMPBaseProtocol):
         """
         RTMPBaseProtocol._handshakeComplete(self)
 
-        self.pingTask = task.LoopingCall(self._pinger)
-        self.pingTask.start(config.getint('RTMP', 'pingInterval'), now=False)
+        self.pingTimer = self.timers.schedule(self.pingInterval, self._pinger)
 
     def handlePing(self, packet):
         """
@@ -256,10 +523,12 @@ class RTMPCoreProtocol(RTMPBaseProtocol):
         """
         # stream buffer length, sending it to router, and sending buffer clear ping message
         if packet.event == Ping.CLIENT_BUFFER:
-            self.pushPacket(Ping(Ping.STREAM_CLEAR, [packet.data[0]]))
+            self.pushControl(control.pings[1], Ping.STREAM_CLEAR, packet.data[0])
+            if len(packet.data) > 1:
+                self.setBufferTime(packet.data[0], packet.data[1])
         # normal ping request
         elif packet.event == Ping.PING_CLIENT:
-            self.pushPacket(Ping(Ping.PONG_SERVER, packet.data))
+            self.pushControl(control.pings[len(packet.data)], Ping.PONG_SERVER, *packet.data)
         # normal pong
         elif packet.event == Ping.PONG_SERVER:
             pass # we control last received time in L{dataReceived}
@@ -269,14 +538,168 @@ class RTMPCoreProtocol(RTMPBaseProtocol):
         else:
             log.msg("Unknown ping: %r" % packet)
 
+    def setBufferTime(self, stream_id, bufferTime):
+        """
+        Client reported buffer length of NetStream.
+
+        Hook for subclasses.
+
+        @param stream_id: Stream ID of NetStream
+        @type stream_id: C{int}
+        @param bufferTime: buffer length (ms)
+        @type bufferTime: C{int}
+        """
+        pass
+
     def handleBytesRead(self, packet):
         """
         Handle incoming L{BytesRead} packets.
 
+        Peer acknowledged received bytes, output window
+        is moved forward, sending queued media packets.
+
+        Acknowledged bytes are accumulated, L{ackRate} is updated
+        once sample spans at least L{ackSampleInterval}.
+
         @param packet: packet
         @type packet: L{BytesRead}
         """
-        pass # we do nothing
+        now = _time.precise()
+        if self.ackSampleStart is None:
+            self.ackSampleStart = now
+        else:
+            self.ackSampleBytes += (packet.bytes - self.bytesAcked) & 0xffffffff
+            elapsed = now - self.ackSampleStart
+            if elapsed >= self.ackSampleInterval:
+                rate = self.ackSampleBytes / elapsed
+                if self.ackRate is None:
+                    self.ackRate = rate
+                else:
+                    self.ackRate += (rate - self.ackRate) / 2.0
+                self.ackSampleStart = now
+                self.ackSampleBytes = 0
+
+        self.bytesAcked = packet.bytes
+
+        while self.mediaQueue and not self._outputWindowFull():
+            packet = self.mediaQueue.popleft()
+            self.mediaQueueBytes -= packet.header.length
+            RTMPBaseProtocol.pushPacket(self, packet)
+
+    def handleServerBW(self, packet):
+        """
+        Handle incoming L{ServerBW} packets.
+
+        Peer requests acknowledgements every C{packet.bandwidth}
+        bytes received.
+
+        @param packet: packet
+        @type packet: L{ServerBW}
+        """
+        self.ackWindow = packet.bandwidth
+
+    def handleClientBW(self, packet):
+        """
+        Handle incoming L{ClientBW} packets.
+
+        Peer limits our output window. If our acknowledgement window
+        is too large for new output window, smaller one is announced.
+
+        @param packet: packet
+        @type packet: L{ClientBW}
+        """
+        if packet.limit == ClientBW.LIMIT_SOFT:
+            self.outputWindow = min(self.outputWindow, packet.bandwidth)
+        else:
+            self.outputWindow = packet.bandwidth
+
+        if self.announcedWindow is not None and 2 * self.announcedWindow > self.outputWindow:
+            self._announceWindow(self.outputWindow // 2)
+
+    def _announceWindow(self, size):
+        """
+        Request peer to acknowledge every L{size} bytes.
+
+        @param size: acknowledgement window size (bytes)
+        @type size: C{int}
+        """
+        self.announcedWindow = size
+        self.pushControl(control.serverBW, size)
+
+    def _outputWindowFull(self):
+        """
+        Is output window full?
+
+        Output is never throttled before peer sends first acknowledgement
+        (peer might not acknowledge at all).
+
+        @rtype: C{bool}
+        """
+        return self.bytesAcked is not None and \
+                ((self.output.bytes - self.bytesAcked) & 0xffffffff) >= self.outputWindow
+
+    def pushPacket(self, packet):
+        """
+        Push outgoing RTMP packet.
+
+        Media packets are queued while output window is full. If queue
+        grows over output window, media packets are dropped, except for
+        codec configurations. Once video frame is dropped, the rest of
+        its group of pictures is dropped as well, new keyframe replaces
+        video waiting in queue.
+
+        @param packet: outgoing packet
+        @type packet: L{Packet}.
+        """
+        cls = packet.__class__
+        video = cls is VideoData and not packet.isSequenceHeader
+        stream_id = packet.header.stream_id
+
+        if video and self.skipVideo and stream_id in self.skipVideo:
+            if not packet.isKeyframe:
+                metrics.increment('rtmp.media_dropped')
+                return
+            self.skipVideo.discard(stream_id)
+
+        if packet.header.type in self.throttledTypes and (self.mediaQueue or self._outputWindowFull()):
+            self.lastCongestion = _time.seconds()
+
+            if self.mediaQueueBytes >= self.outputWindow and not ((cls is VideoData or cls is AudioData) and packet.isSequenceHeader):
+                if video and packet.isKeyframe:
+                    self._dropQueuedVideo(stream_id)
+                else:
+                    metrics.increment('rtmp.media_dropped')
+                    if video:
+                        if self.skipVideo is None:
+                            self.skipVideo = set()
+                        self.skipVideo.add(stream_id)
+                    return
+
+            metrics.increment('rtmp.media_throttled')
+            if self.mediaQueue is None:
+                self.mediaQueue = deque()
+            self.mediaQueue.append(packet)
+            self.mediaQueueBytes += packet.header.length
+            return
+
+        RTMPBaseProtocol.pushPacket(self, packet)
+
+    def _dropQueuedVideo(self, stream_id):
+        """
+        Drop video frames of stream waiting in media queue (codec
+        configurations are kept), as they're superseded by new keyframe.
+
+        @param stream_id: Stream ID
+        @type stream_id: C{int}
+        """
+        queue = deque()
+        for queued in self.mediaQueue:
+            if queued.__class__ is VideoData and queued.header.stream_id == stream_id and not queued.isSequenceHeader:
+                self.mediaQueueBytes -= queued.header.length
+                metrics.increment('rtmp.media_dropped')
+            else:
+                queue.append(queued)
+        self.mediaQueue = queue
 
     def _pinger(self):
         """
@@ -287,34 +710,40 @@ class RTMPCoreProtocol(RTMPBaseProtocol):
         of protocol doesn't send anything in reply to our 'ping' for some timeout,
         we disconnect connection.
         """
+        self.pingTimer = None
         noDataInterval = _time.seconds() - self.lastReceived
 
-        if noDataInterval > config.getint('RTMP', 'keepAliveTimeout'):
+        if noDataInterval > self.keepAliveTimeout:
             log.msg('Closing connection due too much inactivity (%d)' % noDataInterval)
             self.transport.loseConnection()
             return
 
-        if noDataInterval > config.getint('RTMP', 'pingInterval'):
-            self.pushPacket(Ping(Ping.PING_CLIENT, [int(_time.seconds()*1000) & 0x7fffffff]))
+        if noDataInterval > self.pingInterval:
+            self.pushControl(control.pings[1], Ping.PING_CLIENT, int(_time.seconds()*1000) & 0x7fffffff)
 
-        self.pushPacket(BytesRead(self.bytesReceived))
+        self.pingTimer = self.timers.schedule(self.pingInterval, self._pinger)
 
     def _first_ping(self):
         """
         Send first ping, usually after first connect.
         """
-        self.pushPacket(Ping(Ping.UNKNOWN_8, [0, 1, int(_time.seconds()*1000) & 0x7fffffff]))
+        self.pushControl(control.pings[3], Ping.UNKNOWN_8, 0, 1, int(_time.seconds()*1000) & 0x7fffffff)
 
     def handleInvoke(self, packet):
         """
         Handle incoming L{Invoke} packets.
 
+        Result of invoke is sent back as C{_result} or C{_error}, except
+        for invokes with transaction id 0 (e.g. C{publish}, C{play}):
+        peer doesn't expect reply to them, status is reported with
+        C{onStatus} instead.
+
         @param packet: packet
         @type packet: L{Invoke}
         """
         if packet.name in ["_result", "_error"]:
             # we got result for some our invoke
-            if packet.id not in self.invokeReplies:
+            if self.invokeReplies is None or packet.id not in self.invokeReplies:
                 log.msg("Got reply %r for unsent (?) Invoke" % packet)
             else:
                 d = self.invokeReplies.pop(packet.id)
@@ -341,9 +770,17 @@ class RTMPCoreProtocol(RTMPBaseProtocol):
             Invoke resulted in some error.
             """
             log.err(failure, "Error while handling invoke")
-            self.pushPacket(Invoke(header=copy.copy(packet.header), id=packet.id, name="_error", argv=[None, Status.from_failure(failure)]))
+            self.pushPacket(Invoke(header=copy.copy(packet.header), id=packet.id, name="_error", argv=[None, status.encode_failure(failure)]))
+
+        start = invoke_watchdog.start()
+        d = defer.maybeDeferred(handler, packet, *packet.argv)
+        invoke_watchdog.finish(start, packet.name, packet.argv[1:])
+
+        if packet.id == 0:
+            d.addErrback(log.err, "Error while handling invoke")
+            return
 
-        defer.maybeDeferred(handler, packet, *packet.argv).addCallbacks(gotResult, gotError)
+        d.addCallbacks(gotResult, gotError)
 
     def invoke(self, name, *args):
         """
@@ -355,6 +792,8 @@ class RTMPCoreProtocol(RTMPBaseProtocol):
         @type args: C{list}
         """
         packet = Invoke(name, (None, ) + args, self.nextInvokeId, RTMPHeader(timestamp=0, stream_id=0))
+        if self.invokeReplies is None:
+            self.invokeReplies = {}
         d = self.invokeReplies[self.nextInvokeId] = defer.Deferred()
         self.nextInvokeId += 1
         self.pushPacket(packet)
@@ -6,48 +6,79 @@
 Client RTMP protocol.
 """
 
+from twisted.python import log
+
 from fmspy.rtmp.protocol.base import RTMPCoreProtocol
-from fmspy.rtmp import constants
+from fmspy.rtmp import constants, handshake
+
+_clientVersion = "\x80\x00\x07\x02"
+"""
+Client version reported in digest handshake.
+"""
+
+(_clientHandshake, _clientDigest) = handshake.make_handshake(handshake.clientDigestKey, 0, _clientVersion)
+_clientHandshake = "\x03" + _clientHandshake
+"""
+Version byte and signed client handshake, shared by all connections.
+"""
 
 class RTMPClientProtocol(RTMPCoreProtocol):
     """
     RTMP client-side protocol implementation.
+
+    @ivar digestHandshake: server supports digest handshake
+    @type digestHandshake: C{bool}
     """
 
+    digestHandshake = False
+
     def _beginHandshake(self):
         """
         Begin handshake procedures.
 
-        Clients sends initial handshake.
+        Clients sends initial handshake (signed with digest),
+        waits for version byte and server handshake.
         """
-        self.transport.write("\x03")
-        self.transport.write("\x00" * constants.HANDSHAKE_SIZE)
+        self.transport.write(_clientHandshake)
+        self._expectHandshake(constants.HANDSHAKE_SIZE + 1)
 
     def _handshakeSendReceived(self):
         """
-        Data received in HANDSHAKE_SEND state.
+        Server handshake received in HANDSHAKE_SEND state.
 
-        Server sends handshake data two times, we return handshake back.
+        If server handshake carries valid digest, we reply
+        with response signed with key derived from server digest and
+        wait for server response to our handshake. Otherwise we return
+        server handshake back, and wait for server to return our handshake.
         """
-        if len(self.handshakeBuf) < 2*constants.HANDSHAKE_SIZE + 1:
+        buf = self.handshakeBuf
+        if buf[0] != 0x03:
+            log.msg("Unsupported RTMP version: %d" % buf[0])
+            self.transport.loseConnection()
             return
 
-        self.handshakeBuf.seek(0)
-        assert self.handshakeBuf.read_uchar() == 0x03
-        self.handshakeBuf.seek(constants.HANDSHAKE_SIZE + 1, 0)
-        serverHandshake = self.handshakeBuf.read(constants.HANDSHAKE_SIZE)
+        found = None
+        if buf[5] or buf[6] or buf[7] or buf[8]:
+            found = handshake.find_digest(buf[1:], handshake.serverDigestKey)
 
-        self.transport.write("\x03")
-        self.transport.write(serverHandshake)
+        if found is not None:
+            self.digestHandshake = True
+            self.transport.write(handshake.make_response(handshake.clientResponseKey, found[1]))
+        else:
+            self.transport.write(str(buffer(buf, 1)))
 
-        self.handshakeBuf.consume()
-        self._handshakeComplete()
+        self.state = self.State.HANDSHAKE_VERIFY
+        self._expectHandshake(constants.HANDSHAKE_SIZE, keep=self.digestHandshake)
 
     def _handshakeVerifyReceived(self):
         """
-        Data received in HANDSHAKE_VERIFY state.
+        Server returned our handshake in HANDSHAKE_VERIFY state.
 
-        Shouldn't get here in client mode.
+        In digest handshake, server response signature is verified
+        (mismatch is only logged), otherwise contents are not verified.
         """
-        assert False
+        if self.digestHandshake and not handshake.verify_response(
+                buffer(self.handshakeBuf, 0, constants.HANDSHAKE_SIZE), handshake.serverResponseKey, _clientDigest):
+            log.msg("Server handshake response signature mismatch")
 
+        self._handshakeComplete()
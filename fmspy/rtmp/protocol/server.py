@@ -6,21 +6,46 @@
 Server RTMP protocol.
 """
 
+import os
+import struct
+
 from twisted.internet import protocol, defer
 from twisted.python import log
 
 from fmspy.rtmp.protocol.base import RTMPCoreProtocol, UnhandledInvokeError
-from fmspy.rtmp import constants
-from fmspy.rtmp.status import Status
-from fmspy.application import app_factory
+from fmspy.rtmp import constants, control, handshake, status
+from fmspy.rtmp.admission import AdmissionControl
+from fmspy.rtmp.header import RTMPHeader
+from fmspy.rtmp.packets import ClientBW, Invoke, Ping
+from fmspy.application import app_factory, PROCESS
+from fmspy.application.stream import Subscription, GroupSubscription, StreamBusyError
+from fmspy.application.vod import PlaylistSubscription, PlaylistItem
+from fmspy.config import config
+from fmspy import _time
+
+_serverHandshake = "\x03" + struct.pack("!LL", 0, 0) + os.urandom(constants.HANDSHAKE_SIZE - 8)
+"""
+Version byte and server handshake (timestamp, zero, random bytes), shared by all connections.
+"""
+
+_serverVersion = "\x03\x05\x01\x01"
+"""
+Server version reported in digest handshake.
+"""
+
+_serverDigestHandshakes = dict([(scheme, "\x03" + handshake.make_handshake(handshake.serverDigestKey, scheme, _serverVersion)[0])
+                                for scheme in handshake.SCHEMES])
+"""
+Version byte and signed server handshake for each digest scheme, shared by all connections.
+"""
 
 class AppStorage(object):
     """
     Class represents are for application to store
     data, associated with client.
 
-    Each L{RTMPServerProtocol} holds instance of L{AppStorage} in
-    property C{_app}.
+    Each L{RTMPServerProtocol} connected to application holds instance
+    of L{AppStorage} in property C{_app}.
 
     @ivar room: application room
     @type room: L{Room}
@@ -30,70 +55,94 @@ class RTMPServerProtocol(RTMPCoreProtocol):
     """
     RTMP server-side protocol implementation.
 
-    @ivar application: application bound to this protocol
+    @ivar application: application bound to this protocol (or C{None})
     @type application: L{Application}
+    @ivar _app: application data of client (or C{None})
+    @type _app: L{AppStorage}
+    @ivar peerHost: address of peer, admitted by factory
+    @type peerHost: C{str}
+    @ivar nextStreamId: next Stream ID to allocate in C{createStream}
+    @type nextStreamId: C{int}
+    @ivar published: live streams published by client, by Stream ID (or C{None})
+    @type published: C{dict}
+    @ivar subscriptions: playbacks of client (live streams, play-lists), by Stream ID (or C{None})
+    @type subscriptions: C{dict}
+    @ivar bufferTimes: buffer lengths reported by client, by Stream ID (or C{None})
+    @type bufferTimes: C{dict}
     """
 
-    def __init__(self):
-        """
-        Constructor.
-        """
-        RTMPCoreProtocol.__init__(self)
-        
-        self.application = None
-        self._app = AppStorage()
+    peerHost = None
+    application = None
+    _app = None
+    nextStreamId = 1
+    published = None
+    subscriptions = None
+    bufferTimes = None
 
     def connectionLost(self, reason):
         """
         Connection with peer was lost for some reason.
         """
+        for stream_id in self._streamIds():
+            self._closeStream(stream_id)
+
         if self.application is not None:
             self.application.disconnect(self)
             self.application = None
             self._app = None
 
+        if self.peerHost is not None:
+            self.factory.connectionClosed(self)
+            self.peerHost = None
+
         RTMPCoreProtocol.connectionLost(self, reason)
 
     def _beginHandshake(self):
         """
         Begin handshake procedures.
 
-        Server does nothing - it waits for handshake from client.
+        Server waits for handshake from client: version byte and
+        client handshake.
         """
-        pass
+        self._expectHandshake(constants.HANDSHAKE_SIZE + 1)
 
     def _handshakeSendReceived(self):
         """
-        Data received in HANDSHAKE_SEND state.
-
-        Server waits for handshake from client, then sends it back to 
-        client two times.
+        Client handshake received in HANDSHAKE_SEND state.
+
+        If client handshake carries valid digest (Flash Player 9+),
+        server replies with version byte, signed server handshake
+        (precomputed, same digest scheme as client's) and response
+        signed with key derived from client digest. Otherwise server
+        replies with version byte, server handshake (precomputed)
+        and client handshake echoed back.
         """
-        if len(self.handshakeBuf) < constants.HANDSHAKE_SIZE + 1:
+        buf = self.handshakeBuf
+        if buf[0] != 0x03:
+            log.msg("Unsupported RTMP version: %d" % buf[0])
+            self.transport.loseConnection()
             return
 
-        self.handshakeBuf.seek(0)
-        assert self.handshakeBuf.read_uchar() == 0x03
-        clientHandshake = self.handshakeBuf.read(constants.HANDSHAKE_SIZE)
+        found = None
+        if buf[5] or buf[6] or buf[7] or buf[8]:
+            found = handshake.find_digest(buf[1:], handshake.clientDigestKey)
 
-        self.transport.write("\x03")
-        self.transport.write(clientHandshake * 2)
+        if found is not None:
+            (scheme, digest) = found
+            self.transport.writeSequence([_serverDigestHandshakes[scheme],
+                                          handshake.make_response(handshake.serverResponseKey, digest)])
+        else:
+            self.transport.writeSequence([_serverHandshake, str(buffer(buf, 1))])
 
-        self.handshakeBuf.consume()
         self.state = self.State.HANDSHAKE_VERIFY
+        self._expectHandshake(constants.HANDSHAKE_SIZE, keep=False)
 
     def _handshakeVerifyReceived(self):
         """
-        Data received in HANDSHAKE_VERIFY state.
+        Client sent back our handshake in HANDSHAKE_VERIFY state.
 
-        Client should send back our handshake.
+        Contents are not verified.
         """
-        if len(self.handshakeBuf) < constants.HANDSHAKE_SIZE + 1:
-            return
-
-        self.handshakeBuf.seek(constants.HANDSHAKE_SIZE, 0)
-        self.handshakeBuf.consume()
-
         self._handshakeComplete()
 
     def invoke_connect(self, packet, connect_params, *args):
@@ -107,6 +156,8 @@ class RTMPServerProtocol(RTMPCoreProtocol):
         """
         log.msg("Connect to %r, Flash %s" % (connect_params['app'], connect_params['flashVer']))
 
+        self._announceWindow(self.windowAckSize)
+        self.pushControl(control.clientBW, self.windowAckSize, ClientBW.LIMIT_DYNAMIC)
         self._first_ping()
 
         connect_path = connect_params['app'].split('/')
@@ -114,15 +165,282 @@ class RTMPServerProtocol(RTMPCoreProtocol):
         del connect_path[0]
 
         self.application = app_factory.get_application(app_name)
+        self._app = AppStorage()
 
         def connectOk(_):
             """
             Connection was successful, send message to client.
             """
-            return [None, Status(constants.StatusCodes.NC_CONNECT_SUCCESS, "success", "Connect OK")]
+            return [None, status.connectSuccess(objectEncoding=connect_params.get('objectEncoding', 0))]
 
         return self.application.connect(self, connect_path, *args).addCallback(connectOk)
 
+    def invoke_createstream(self, packet, *args):
+        """
+        Client creates NetStream.
+
+        @return: Stream ID for NetStream
+        """
+        stream_id = self.nextStreamId
+        self.nextStreamId += 1
+
+        return [None, stream_id]
+
+    def invoke_deletestream(self, packet, command, stream_id):
+        """
+        Client deletes NetStream.
+
+        @param stream_id: Stream ID of NetStream
+        @type stream_id: C{float}
+        """
+        self._closeStream(int(stream_id))
+
+    def invoke_closestream(self, packet, *args):
+        """
+        Client stops publishing or playback on NetStream.
+        """
+        stream_id = packet.header.stream_id
+
+        if self.published and stream_id in self.published:
+            self.streamStatus(stream_id, status.unpublishSuccess(description='%s is now unpublished.' % self.published[stream_id].name,
+                                                                 details=self.published[stream_id].name))
+
+        self._closeStream(stream_id)
+
+    def invoke_publish(self, packet, command, name, kind='live'):
+        """
+        Client starts publishing live stream on NetStream.
+
+        @param name: stream name
+        @type name: C{str}
+        @param kind: publishing type (only C{live} is supported)
+        @type kind: C{str}
+        """
+        assert self.application is not None
+
+        stream_id = packet.header.stream_id
+        self._closeStream(stream_id)
+
+        stream = self._app.room.stream(name)
+        try:
+            stream.publish(self)
+        except StreamBusyError:
+            self.streamStatus(stream_id, status.publishBadName(description='%s is already published.' % name, details=name))
+            return
+
+        if self.published is None:
+            self.published = {}
+        self.published[stream_id] = stream
+
+        self.streamStatus(stream_id, status.publishStart(description='%s is now published.' % name, details=name))
+
+    def invoke_play(self, packet, command, name, start=-2, length=-1, reset=True):
+        """
+        Client starts playback on NetStream: live stream, stream group,
+        recorded stream or play-list of them.
+
+        @param name: stream (or stream group) name
+        @type name: C{str}
+        @param start: start position of recorded stream or time-shift buffer
+            of live stream (seconds), C{-1} - live stream only, C{-2} - live
+            stream if it is published, recorded otherwise
+        @type start: C{float}
+        @param length: length of recorded stream playback (seconds), C{-1} - till the end
+        @type length: C{float}
+        @param reset: start new play-list (otherwise stream is added to current one)
+        @type reset: C{bool}
+        """
+        assert self.application is not None
+
+        stream_id = packet.header.stream_id
+        room = self._app.room
+        group = room.groups.get(name)
+
+        path = dvr = None
+        if group is None and start != -1:
+            live = room.streams.get(name)
+            if start >= 0 and live is not None and live.dvr is not None:
+                dvr = live
+            elif start >= 0 or live is None or live.publisher is None:
+                path = self.application.streamPath(name)
+            if path is None and dvr is None and start >= 0:
+                self.streamStatus(stream_id, status.playStreamNotFound(description='Failed to play %s; stream not found.' % name,
+                                                                       details=name))
+                return
+
+        item = PlaylistItem(name, path, int(start * 1000) if start > 0 else 0,
+                            int(length * 1000) if length >= 0 else None, dvr)
+
+        current = self.subscriptions.get(stream_id) if self.subscriptions else None
+        if not reset and isinstance(current, PlaylistSubscription):
+            current.add(item)
+            return
+
+        self._closeStream(stream_id)
+
+        self.pushControl(control.pings[1], Ping.STREAM_CLEAR, stream_id)
+        if reset:
+            self.streamStatus(stream_id, status.playReset(description='Playing and resetting %s.' % name, details=name))
+
+        if group is not None:
+            subscription = GroupSubscription(self, stream_id, group)
+        elif path is not None or dvr is not None or not reset:
+            subscription = PlaylistSubscription(self, stream_id, room, (self.bufferTimes or {}).get(stream_id))
+        else:
+            subscription = Subscription(self, stream_id)
+        if self.subscriptions is None:
+            self.subscriptions = {}
+        self.subscriptions[stream_id] = subscription
+
+        if isinstance(subscription, PlaylistSubscription):
+            subscription.add(item)
+            return
+
+        self.streamStatus(stream_id, status.playStart(description='Started playing %s.' % name, details=name))
+        if group is not None:
+            subscription.start()
+        else:
+            room.stream(name).subscribe(subscription)
+
+    def invoke_pause(self, packet, command, pause, milliseconds=0):
+        """
+        Client pauses or resumes playback on NetStream.
+
+        Live stream is resumed from next keyframe.
+
+        @param pause: pause playback?
+        @type pause: C{bool}
+        @param milliseconds: stream position (ignored for live streams)
+        @type milliseconds: C{float}
+        """
+        stream_id = packet.header.stream_id
+        subscription = self.subscriptions.get(stream_id) if self.subscriptions else None
+        if subscription is None or subscription.name is None:
+            return
+
+        name = subscription.name
+        subscription.pause(pause)
+        if pause:
+            self.streamStatus(stream_id, status.pauseNotify(description='Pausing %s.' % name, details=name))
+        else:
+            self.streamStatus(stream_id, status.unpauseNotify(description='Unpausing %s.' % name, details=name))
+
+    def invoke_seek(self, packet, command, milliseconds):
+        """
+        Client moves playback on NetStream to other position.
+
+        Recorded streams and time-shift buffers of live streams could be
+        seeked, playback of live stream with time-shift buffer is switched
+        to the buffer.
+
+        @param milliseconds: new position (ms)
+        @type milliseconds: C{float}
+        """
+        stream_id = packet.header.stream_id
+        position = max(0, int(milliseconds))
+        subscription = self.subscriptions.get(stream_id) if self.subscriptions else None
+        if subscription is None or subscription.name is None:
+            return
+
+        name = subscription.name
+        stream = subscription.stream
+        if not subscription.seekable and (stream is None or stream.dvr is None or isinstance(subscription, GroupSubscription)):
+            self.streamStatus(stream_id, status.seekFailed(description='Failed to seek %s.' % name, details=name))
+            return
+
+        self.pushControl(control.pings[1], Ping.STREAM_CLEAR, stream_id)
+        self.streamStatus(stream_id, status.seekNotify(description='Seeking %d (stream ID: %d).' % (position, stream_id), details=name))
+
+        if subscription.seekable:
+            subscription.seek(position)
+            return
+
+        self._closeStream(stream_id)
+        subscription = self.subscriptions[stream_id] = PlaylistSubscription(self, stream_id, self._app.room,
+                                                                            (self.bufferTimes or {}).get(stream_id))
+        subscription.add(PlaylistItem(name, None, position, None, stream))
+
+    def invoke_receiveaudio(self, packet, command, flag):
+        """
+        Client starts or stops receiving audio on NetStream.
+
+        @param flag: receive audio?
+        @type flag: C{bool}
+        """
+        if self.subscriptions and packet.header.stream_id in self.subscriptions:
+            self.subscriptions[packet.header.stream_id].enableAudio(flag)
+
+    def invoke_receivevideo(self, packet, command, flag):
+        """
+        Client starts or stops receiving video on NetStream.
+
+        @param flag: receive video?
+        @type flag: C{bool}
+        """
+        if self.subscriptions and packet.header.stream_id in self.subscriptions:
+            self.subscriptions[packet.header.stream_id].enableVideo(flag)
+
+    def handleMediaPacket(self, packet):
+        """
+        Handle incoming L{AudioData}, L{VideoData} or L{Notify}: relay it to subscribers.
+
+        @param packet: packet
+        @type packet: L{MediaPacket} or L{Notify}
+        """
+        if self.published:
+            stream = self.published.get(packet.header.stream_id)
+            if stream is not None:
+                stream.deliver(packet)
+
+    handleAudioData = handleVideoData = handleNotify = handleMediaPacket
+
+    def setBufferTime(self, stream_id, bufferTime):
+        """
+        Client reported buffer length of NetStream.
+
+        @param stream_id: Stream ID of NetStream
+        @type stream_id: C{int}
+        @param bufferTime: buffer length (ms)
+        @type bufferTime: C{int}
+        """
+        if self.bufferTimes is None:
+            self.bufferTimes = {}
+        self.bufferTimes[stream_id] = bufferTime
+
+        if self.subscriptions and stream_id in self.subscriptions:
+            self.subscriptions[stream_id].setBufferTime(bufferTime)
+
+    def streamStatus(self, stream_id, status):
+        """
+        Send status (C{onStatus}) for NetStream.
+
+        @param stream_id: Stream ID of NetStream
+        @type stream_id: C{int}
+        @param status: status
+        """
+        self.pushPacket(Invoke('onStatus', (None, status), 0.0, RTMPHeader(timestamp=0, stream_id=stream_id)))
+
+    def _streamIds(self):
+        """
+        Stream IDs of NetStreams publishing or playing something.
+
+        @rtype: C{list}
+        """
+        return (self.published or {}).keys() + (self.subscriptions or {}).keys()
+
+    def _closeStream(self, stream_id):
+        """
+        Stop publishing or playback on NetStream.
+
+        @param stream_id: Stream ID of NetStream
+        @type stream_id: C{int}
+        """
+        if self.published and stream_id in self.published:
+            self.published.pop(stream_id).unpublish()
+
+        if self.subscriptions and stream_id in self.subscriptions:
+            self.subscriptions.pop(stream_id).close()
+
     def defaultInvokeHandler(self, packet,  *args):
         """
         Dispatch invokes to current application.
@@ -137,10 +455,83 @@ class RTMPServerProtocol(RTMPCoreProtocol):
         def gotResult(result):
             return [None, result]
 
-        return defer.maybeDeferred(handler, self, *args[1:]).addCallback(gotResult)
+        start = _time.cpu()
+        ttl = getattr(handler, 'cache_ttl', None)
+        if ttl is None:
+            d = self._callHandler(handler, args[1:])
+        else:
+            d = self.application.invokeCache.call(packet.name.lower(), args[1:], ttl, self._callHandler, handler, args[1:])
+        cpu_time = _time.cpu() - start
+
+        for usage in self.usage:
+            usage.invoked(cpu_time)
+
+        return d.addCallback(gotResult)
+
+    def _callHandler(self, handler, args):
+        """
+        Call application invoke handler, in reactor or offloaded.
+
+        @param handler: application invoke handler
+        @param args: invoke arguments
+        @type args: C{tuple}
+        @return: Deferred result of handler
+        @rtype: C{Deferred}
+        """
+        kind = getattr(handler, 'offload', None)
+        if kind is None:
+            return defer.maybeDeferred(handler, self, *args)
+        elif kind == PROCESS:
+            return self.application.offloader.run(kind, handler.im_func, *args)
+        else:
+            return self.application.offloader.run(kind, handler, self, *args)
 
 class RTMPServerFactory(protocol.ServerFactory):
     """
     Construct RTMP server protocol.
+
+    Connections not admitted by L{admission} are closed
+    right away, without building protocol.
+
+    @ivar admission: admission control
+    @type admission: L{AdmissionControl}
     """
     protocol = RTMPServerProtocol
+
+    def __init__(self, admission=None):
+        """
+        Constructor.
+
+        @param admission: admission control (if C{None}, built from config)
+        @type admission: L{AdmissionControl}
+        """
+        if admission is None:
+            admission = AdmissionControl(maxConnections=config.getint('RTMP', 'maxConnections'),
+                                         maxPerHost=config.getint('RTMP', 'maxConnectionsPerHost'),
+                                         rate=config.getfloat('RTMP', 'handshakeRate'),
+                                         burst=config.getint('RTMP', 'handshakeBurst'))
+        self.admission = admission
+
+    def buildProtocol(self, addr):
+        """
+        Build protocol for new connection, if it is admitted.
+
+        @param addr: peer address
+        @return: protocol or C{None} if connection is rejected
+        @rtype: L{RTMPServerProtocol}
+        """
+        if self.admission.admit(addr.host) is not None:
+            return None
+
+        p = protocol.ServerFactory.buildProtocol(self, addr)
+        p.peerHost = addr.host
+        return p
+
+    def connectionClosed(self, protocol):
+        """
+        Connection built by this factory was closed.
+
+        @param protocol: protocol of connection
+        @type protocol: L{RTMPServerProtocol}
+        """
+        self.admission.release(protocol.peerHost)
@@ -4,10 +4,17 @@
 
 """
 Status objects - used to send errors and other info to client.
+
+Frequent statuses (connect results, NetStream notifications, invoke
+errors) are sent with L{StatusTemplate}s: fixed part of status object is
+encoded once, only parameters are encoded for each message.
 """
 
 from twisted.python import failure
 
+from fmspy.rtmp import amf0
+from fmspy.rtmp.constants import StatusCodes
+
 class Status(object):
     """
     Status objects are sent as 
@@ -57,3 +64,129 @@ class Status(object):
             kwargs['code'] = fail.code
 
         return Status(**kwargs)
+
+amf0.register_anonymous(Status)
+
+class StatusTemplate(object):
+    """
+    Pre-encoded status object.
+
+    Code, level and (optionally) description of status are encoded once,
+    calling template returns L{amf0.Encoded} status with additional
+    properties spliced in.
+
+    @ivar code: status code
+    @type code: C{str}
+    @ivar level: status level (status/error)
+    @type level: C{str}
+    @ivar description: status description (C{None} if passed with parameters)
+    @type description: C{str}
+    @ivar prefix: encoded object start and fixed properties
+    @type prefix: C{str}
+    @ivar encoded: encoded status without parameters
+    @type encoded: L{amf0.Encoded}
+    """
+
+    def __init__(self, code, level="status", description=None):
+        """
+        Constructor.
+
+        @param code: status code
+        @type code: C{str}
+        @param level: status level (status/error)
+        @type level: C{str}
+        @param description: status description (C{None} if passed with parameters)
+        @type description: C{str}
+        """
+        self.code = code
+        self.level = level
+        self.description = description
+
+        fixed = [('code', code), ('level', level)]
+        if description is not None:
+            fixed.append(('description', description))
+
+        self.prefix = chr(amf0.OBJECT) + amf0.encode_properties(fixed)
+        self.encoded = amf0.Encoded(self.prefix + amf0.OBJECT_TERMINATOR)
+
+    def __call__(self, **kwargs):
+        """
+        Build status.
+
+        Properties which couldn't be encoded by fast codec are
+        returned as L{Status} object.
+
+        @param kwargs: additional properties of status (shouldn't repeat fixed ones)
+        @return: status
+        @rtype: L{amf0.Encoded} or L{Status}
+        """
+        if not kwargs:
+            return self.encoded
+
+        try:
+            return amf0.Encoded(self.prefix + amf0.encode_properties(kwargs.iteritems()) + amf0.OBJECT_TERMINATOR)
+        except (amf0.Unsupported, OverflowError):
+            if self.description is not None:
+                kwargs['description'] = self.description
+            return Status(self.code, self.level, **kwargs)
+
+    def __repr__(self):
+        return "StatusTemplate(code=%r, level=%r, description=%r)" % (self.code, self.level, self.description)
+
+connectSuccess = StatusTemplate(StatusCodes.NC_CONNECT_SUCCESS, "success", "Connect OK")
+playReset = StatusTemplate(StatusCodes.NS_PLAY_RESET)
+playStart = StatusTemplate(StatusCodes.NS_PLAY_START)
+playStop = StatusTemplate(StatusCodes.NS_PLAY_STOP)
+playSwitch = StatusTemplate(StatusCodes.NS_PLAY_SWITCH)
+playStreamNotFound = StatusTemplate(StatusCodes.NS_PLAY_STREAMNOTFOUND, "error")
+playFailed = StatusTemplate(StatusCodes.NS_PLAY_FAILED, "error")
+playPublishNotify = StatusTemplate(StatusCodes.NS_PLAY_PUBLISHNOTIFY)
+playUnpublishNotify = StatusTemplate(StatusCodes.NS_PLAY_UNPUBLISHNOTIFY)
+publishStart = StatusTemplate(StatusCodes.NS_PUBLISH_START)
+publishBadName = StatusTemplate(StatusCodes.NS_PUBLISH_BADNAME, "error")
+unpublishSuccess = StatusTemplate(StatusCodes.NS_UNPUBLISHED_SUCCESS)
+pauseNotify = StatusTemplate(StatusCodes.NS_PAUSE_NOTIFY)
+unpauseNotify = StatusTemplate(StatusCodes.NS_UNPAUSE_NOTIFY)
+seekNotify = StatusTemplate(StatusCodes.NS_SEEK_NOTIFY)
+seekFailed = StatusTemplate(StatusCodes.NS_SEEK_FAILED, "error")
+
+_failureTemplates = {}
+"""
+Templates for invoke errors: code -> L{StatusTemplate}.
+"""
+
+MAX_FAILURE_TEMPLATES = 256
+"""
+Maximum number of cached templates for invoke errors.
+"""
+
+def encode_failure(fail):
+    """
+    Build pre-encoded status from failure.
+
+    Equivalent of L{Status.from_failure}.
+
+    @param fail: failure or exception
+    @type fail: C{Failure}
+    @rtype: L{amf0.Encoded} or L{Status}
+    """
+    if isinstance(fail, failure.Failure):
+        fail = fail.value
+
+    code = getattr(fail, 'code', "NetConnection.Error")
+
+    try:
+        template = _failureTemplates.get(code)
+    except TypeError:
+        return Status.from_failure(fail)
+
+    if template is None:
+        try:
+            template = StatusTemplate(code, "error")
+        except (amf0.Unsupported, OverflowError):
+            return Status.from_failure(fail)
+
+        if len(_failureTemplates) < MAX_FAILURE_TEMPLATES:
+            _failureTemplates[code] = template
+
+    return template(description=repr(fail))
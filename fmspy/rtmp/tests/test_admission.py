@@ -0,0 +1,113 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.rtmp.admission}.
+"""
+
+from twisted.trial import unittest
+from twisted.internet import address
+from twisted.test.proto_helpers import StringTransport
+
+from fmspy.rtmp.admission import TokenBucket, AdmissionControl
+from fmspy.rtmp.protocol.server import RTMPServerFactory
+from fmspy.stats import metrics
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TokenBucketTestCase(unittest.TestCase):
+    """
+    Test case for L{TokenBucket}.
+    """
+
+    def test_consume(self):
+        clock = FakeClock()
+        b = TokenBucket(2, 3, clock)
+        self.failUnless(b.consume())
+        self.failUnless(b.consume())
+        self.failUnless(b.consume())
+        self.failIf(b.consume())
+
+        clock.now = 0.5
+        self.failUnless(b.consume())
+        self.failIf(b.consume())
+
+        clock.now = 100
+        for i in xrange(3):
+            self.failUnless(b.consume())
+        self.failIf(b.consume())
+
+class AdmissionControlTestCase(unittest.TestCase):
+    """
+    Test case for L{AdmissionControl}.
+    """
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_unlimited(self):
+        a = AdmissionControl()
+        for i in xrange(100):
+            self.failUnlessEqual(None, a.admit('1.2.3.4'))
+        self.failUnlessEqual(100, a.connections)
+
+    def test_global(self):
+        a = AdmissionControl(maxConnections=2)
+        self.failUnlessEqual(None, a.admit('1.1.1.1'))
+        self.failUnlessEqual(None, a.admit('2.2.2.2'))
+        self.failUnlessEqual(AdmissionControl.REJECT_GLOBAL, a.admit('3.3.3.3'))
+        a.release('1.1.1.1')
+        self.failUnlessEqual(None, a.admit('3.3.3.3'))
+        self.failUnlessEqual({ '2.2.2.2' : 1, '3.3.3.3' : 1 }, a.hosts)
+
+    def test_host(self):
+        a = AdmissionControl(maxPerHost=2)
+        self.failUnlessEqual(None, a.admit('1.1.1.1'))
+        self.failUnlessEqual(None, a.admit('1.1.1.1'))
+        self.failUnlessEqual(AdmissionControl.REJECT_HOST, a.admit('1.1.1.1'))
+        self.failUnlessEqual(None, a.admit('2.2.2.2'))
+        a.release('1.1.1.1')
+        a.release('1.1.1.1')
+        self.failUnlessEqual({ '2.2.2.2' : 1 }, a.hosts)
+
+        snapshot = metrics.snapshot()['counters']
+        self.failUnlessEqual(1, snapshot['rtmp.rejected'])
+        self.failUnlessEqual(1, snapshot['rtmp.rejected.host'])
+
+    def test_rate(self):
+        clock = FakeClock()
+        a = AdmissionControl(rate=1, burst=2, clock=clock)
+        self.failUnlessEqual(None, a.admit('1.1.1.1'))
+        self.failUnlessEqual(None, a.admit('1.1.1.1'))
+        self.failUnlessEqual(AdmissionControl.REJECT_RATE, a.admit('1.1.1.1'))
+        clock.now = 1
+        self.failUnlessEqual(None, a.admit('1.1.1.1'))
+
+class RTMPServerFactoryTestCase(unittest.TestCase):
+    """
+    Test case for admission in L{RTMPServerFactory}.
+    """
+
+    def test_build(self):
+        f = RTMPServerFactory(AdmissionControl(maxPerHost=1))
+        addr = address.IPv4Address('TCP', '1.2.3.4', 1234)
+
+        p = f.buildProtocol(addr)
+        self.failIfEqual(None, p)
+        self.failUnlessEqual(None, f.buildProtocol(addr))
+
+        p.makeConnection(StringTransport())
+        p.connectionLost(None)
+        self.failUnlessEqual(0, f.admission.connections)
+
+        self.failIfEqual(None, f.buildProtocol(addr))
+
+    def test_config(self):
+        f = RTMPServerFactory()
+        self.failUnless(f.admission.maxConnections > 0)
@@ -0,0 +1,83 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.rtmp.amf0}.
+"""
+
+import datetime
+
+import pyamf
+from twisted.trial import unittest
+
+from fmspy.rtmp import amf0
+from fmspy.rtmp.status import Status
+
+class AMF0TestCase(unittest.TestCase):
+    """
+    Test case for fast AMF0 codec.
+    """
+
+    values = [
+                0, 1, -3, 1.5, 2**40, 5L, True, False, None, pyamf.Undefined,
+                'abc', u'\u0444\u044b\u0432', '', 'x' * 70000, '_result', 'NetConnection.Connect.Success',
+                [], [1, 'a', [None]], (1, 2),
+                {}, { 'a' : 1, 'b' : { 'c' : [True] } }, { 1 : 2 }, { 'code' : 'x' },
+                pyamf.ASObject(a=1), pyamf.MixedArray(a=1), pyamf.MixedArray({ 0 : 'a', 5 : 'b' }),
+             ]
+
+    def pyamf_encode(self, *values):
+        return pyamf.encode(*values, **{ 'encoding' : pyamf.AMF0 }).getvalue()
+
+    def test_encode(self):
+        for value in self.values:
+            self.failUnlessEqual(self.pyamf_encode(value), amf0.encode(value))
+
+        self.failUnlessEqual(self.pyamf_encode(*self.values), amf0.encode(*self.values))
+
+    def test_decode(self):
+        for value in self.values:
+            data = self.pyamf_encode(value)
+            expected = list(pyamf.decode(data, encoding=pyamf.AMF0))
+            result = amf0.decode(data)
+            self.failUnlessEqual(expected, result)
+            self.failUnlessEqual([type(v) for v in expected], [type(v) for v in result])
+
+    def test_status(self):
+        status = Status('NetStream.Play.Start', 'status', 'Started', details='x')
+        self.failUnlessEqual(list(pyamf.decode(self.pyamf_encode(status), encoding=pyamf.AMF0)),
+                             amf0.decode(amf0.encode(status)))
+
+    def test_decode_types(self):
+        (s, obj, arr) = amf0.decode(amf0.encode('_result', { 'code' : 'x' }, pyamf.MixedArray({ '1' : 2 })))
+        self.failUnless(type(s) is unicode)
+        self.failUnless(type(obj) is pyamf.ASObject)
+        self.failUnless(type(obj.keys()[0]) is str)
+        self.failUnlessEqual({ 1 : 2 }, arr)
+
+    def test_fallback(self):
+        date = datetime.datetime(2009, 1, 1)
+        data = amf0.encode('a', date)
+        self.failUnlessEqual(self.pyamf_encode('a', date), data)
+        self.failUnlessEqual([u'a', date], amf0.decode(data))
+
+    def test_fallback_references(self):
+        l = [1]
+        data = self.pyamf_encode({ 'a' : l, 'b' : l })
+        self.failUnlessEqual([{ 'a' : [1], 'b' : [1] }], amf0.decode(data))
+
+    def test_recursive(self):
+        l = []
+        l.append(l)
+        self.failUnlessEqual(self.pyamf_encode(l), amf0.encode(l))
+
+    def test_truncated(self):
+        data = amf0.encode('abc', { 'a' : 1 }, [2.5])
+        for i in xrange(1, len(data)):
+            try:
+                expected = list(pyamf.decode(data[:i], encoding=pyamf.AMF0))
+            except Exception:
+                self.failUnlessRaises(Exception, amf0.decode, data[:i])
+            else:
+                self.failUnlessEqual(expected, amf0.decode(data[:i]))
@@ -9,12 +9,13 @@ Tests for L{fmspy.rtmp.assembly}.
 import unittest
 import struct
 import random
+import copy
 
 from pyamf.util import BufferedByteStream
 
 from fmspy.rtmp.header import RTMPHeader
-from fmspy.rtmp.packets import DataPacket
-from fmspy.rtmp.assembly import RTMPDisassembler, RTMPAssembler
+from fmspy.rtmp.packets import DataPacket, VideoData
+from fmspy.rtmp.assembly import RTMPDisassembler, RTMPAssembler, ReassemblyMemory, ReassemblyLimitError
 
 class RTMPMockDisassembler(RTMPDisassembler):
     """
@@ -25,7 +26,7 @@ class RTMPMockDisassembler(RTMPDisassembler):
         return DataPacket.read(header, buf)
 
     def is_empty(self):
-        return len(self.buffer) == 0
+        return self.buffer is None or len(self.buffer) == 0
 
 class RTMPAssemblyTestCase(unittest.TestCase):
     """
@@ -138,3 +139,132 @@ class RTMPAssemblerTestCase(RTMPAssemblyTestCase):
 
                 buf.seek(0, 0)
                 self.failUnlessEqual(''.join(self.gen_packet("\x02\x91\x06\xe6\x00\x00\x01\x04\x00\x00\x00\x00", ["\xc2"], data, l, chunkSize)), buf.read())
+
+    def test_media(self):
+        buf = BufferedByteStream()
+        a = RTMPAssembler(128, buf)
+
+        packets = []
+        for i in xrange(10):
+            packets.append(DataPacket(header=RTMPHeader(object_id=3, timestamp=i*20, length=0, type=0x08, stream_id=1), data="a" * 100))
+            packets.append(DataPacket(header=RTMPHeader(object_id=3, timestamp=i*40, length=0, type=0x09, stream_id=1), data="v" * 300))
+
+        for packet in packets:
+            a.push_packet(packet)
+
+        # two full headers, two 4 byte headers (first deltas), rest with 1 byte headers
+        # (including continuation chunks of video packets)
+        headers = 12 * 2 + 4 * 2 + 16 + 10 * 2
+        self.failUnlessEqual(headers + 10 * 400, a.bytes)
+
+        buf.seek(0, 0)
+        result = RTMPMockDisassembler(128).push_data(buf.read()).disassemble_packets()
+
+        self.failUnlessEqual([(p.header.timestamp, p.header.type, p.data) for p in packets],
+                             [(p.header.timestamp, p.header.type, p.data) for p in result])
+        self.failUnlessEqual([6, 7] * 10, [p.header.object_id for p in result])
+        self.failUnlessEqual([3, 3] * 10, [p.header.object_id for p in packets])
+
+    def test_passthrough(self):
+        data = ''.join([chr(random.randint(0, 255)) for x in xrange(1000)])
+
+        for inSize in (32, 128, 4096):
+            for outSize in (32, 100, 128, 4096):
+                for length in (1, 32, 100, 128, 129, 1000):
+                    header = RTMPHeader(object_id=5, timestamp=40, length=length, type=0x09, stream_id=1)
+
+                    buf = BufferedByteStream()
+                    RTMPAssembler(inSize, buf).push_packet(DataPacket(header=copy.copy(header), data=data[:length]))
+                    buf.seek(0, 0)
+                    packet = RTMPDisassembler(inSize).push_data(buf.read()).disassemble()
+
+                    self.failUnless(isinstance(packet, VideoData))
+                    self.failUnlessEqual((length + inSize - 1) // inSize, len(packet.segments))
+                    self.failUnlessEqual(data[:length], packet.data)
+
+                    expected = BufferedByteStream()
+                    RTMPAssembler(outSize, expected).push_packet(DataPacket(header=copy.copy(header), data=data[:length]))
+                    result = BufferedByteStream()
+                    a = RTMPAssembler(outSize, result)
+                    a.push_packet(packet)
+
+                    expected.seek(0, 0)
+                    result.seek(0, 0)
+                    self.failUnlessEqual(expected.read(), result.read())
+                    self.failUnlessEqual(len(result), a.bytes)
+
+    def test_timestamps(self):
+        buf = BufferedByteStream()
+        a = RTMPAssembler(128, buf)
+
+        timestamps = [0, 0, 10, 20, 30, 35, 35, 5, 5, 100000, 100010]
+        for timestamp in timestamps:
+            a.push_packet(DataPacket(header=RTMPHeader(object_id=3, timestamp=timestamp, length=0, type=0x14, stream_id=0), data="x"))
+
+        buf.seek(0, 0)
+        self.failUnlessEqual(timestamps, [p.header.timestamp for p in RTMPMockDisassembler(128).push_data(buf.read()).disassemble_packets()])
+
+class ReassemblyLimitsTestCase(unittest.TestCase):
+    """
+    Test case for limits of L{fmspy.rtmp.assembly.RTMPDisassembler}.
+    """
+
+    def assemble(self, *packets):
+        buf = BufferedByteStream()
+        a = RTMPAssembler(128, buf)
+        for packet in packets:
+            a.push_packet(packet)
+        buf.seek(0, 0)
+        return buf.read()
+
+    def packet(self, object_id, type, size):
+        return DataPacket(header=RTMPHeader(object_id=object_id, timestamp=0, length=0, type=type, stream_id=0), data="x" * size)
+
+    def test_packet_size(self):
+        d = RTMPMockDisassembler(128, maxPacketSize=1000, maxPacketSizes={ 0x14 : 100 }, memory=ReassemblyMemory())
+        self.failUnlessEqual(2, len(d.push_data(self.assemble(self.packet(3, 0x14, 100), self.packet(4, 0x09, 1000))).disassemble_packets()))
+
+        d = RTMPMockDisassembler(128, maxPacketSize=1000, maxPacketSizes={ 0x14 : 100 }, memory=ReassemblyMemory())
+        self.failUnlessRaises(ReassemblyLimitError, d.push_data(self.assemble(self.packet(3, 0x14, 101))).disassemble)
+
+        d = RTMPMockDisassembler(128, maxPacketSize=1000, maxPacketSizes={ 0x14 : 100 }, memory=ReassemblyMemory())
+        self.failUnlessRaises(ReassemblyLimitError, d.push_data(self.assemble(self.packet(4, 0x09, 1001))[:12]).disassemble)
+
+    def test_pool(self):
+        memory = ReassemblyMemory()
+        d = RTMPMockDisassembler(128, maxPoolBytes=256, memory=memory)
+        # chunks of two packets interleaved
+        first = RTMPHeader(object_id=4, timestamp=0, length=200, type=0x08, stream_id=0).write() + "a" * 128 + \
+                RTMPHeader(object_id=5, timestamp=0, length=200, type=0x09, stream_id=0).write() + "v" * 128
+        data = first + "\xc4" + "a" * 72 + "\xc5" + "v" * 72
+
+        # first chunks of both packets are held in pool
+        self.failUnlessEqual([], d.push_data(first).disassemble_packets())
+        self.failUnlessEqual(256, d.poolBytes)
+        self.failUnlessEqual(256, memory.bytes)
+
+        self.failUnlessEqual(["a" * 200, "v" * 200], [p.data for p in d.push_data(data[len(first):]).disassemble_packets()])
+        self.failUnlessEqual(0, d.poolBytes)
+        self.failUnlessEqual(0, memory.bytes)
+
+        d = RTMPMockDisassembler(128, maxPoolBytes=255, memory=memory)
+        self.failUnlessRaises(ReassemblyLimitError, d.push_data(data).disassemble_packets)
+
+        d.release()
+        self.failUnlessEqual(0, memory.bytes)
+        self.failUnlessEqual(None, d.push_data(data).disassemble())
+
+    def test_memory(self):
+        memory = ReassemblyMemory(limit=200)
+        data = self.assemble(self.packet(4, 0x08, 200))[:12 + 128]
+
+        d1 = RTMPMockDisassembler(128, memory=memory)
+        d1.push_data(data).disassemble()
+        self.failUnlessEqual(128, memory.bytes)
+
+        d2 = RTMPMockDisassembler(128, memory=memory)
+        self.failUnlessRaises(ReassemblyLimitError, d2.push_data(data).disassemble)
+
+        d1.release()
+        self.failUnlessEqual(0, memory.bytes)
+        self.failUnlessEqual(None, RTMPMockDisassembler(128, memory=memory).push_data(data).disassemble())
@@ -0,0 +1,65 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.rtmp.control}.
+"""
+
+import unittest
+
+from twisted.test.proto_helpers import StringTransport
+
+from fmspy.rtmp import constants, control
+from fmspy.rtmp.assembly import RTMPAssembler, RTMPDisassembler
+from fmspy.rtmp.header import RTMPHeader
+from fmspy.rtmp.packets import Ping, BytesRead, ServerBW, ClientBW, Invoke
+
+class ControlTemplateTestCase(unittest.TestCase):
+    """
+    Test case for L{fmspy.rtmp.control.ControlTemplate}.
+    """
+
+    def encode(self, packet):
+        buf = StringTransport()
+        RTMPAssembler(constants.DEFAULT_CHUNK_SIZE, buf).push_packet(packet)
+        return buf.value()
+
+    def test_pack(self):
+        self.failUnlessEqual(self.encode(BytesRead(100000)), control.bytesRead.pack(False, 100000))
+        self.failUnlessEqual(self.encode(ServerBW(2500000)), control.serverBW.pack(False, 2500000))
+        self.failUnlessEqual(self.encode(ClientBW(2500000, ClientBW.LIMIT_SOFT)), control.clientBW.pack(False, 2500000, ClientBW.LIMIT_SOFT))
+        self.failUnlessEqual(self.encode(Ping(Ping.PING_CLIENT, [137])), control.pings[1].pack(False, Ping.PING_CLIENT, 137))
+        self.failUnlessEqual(self.encode(Ping(Ping.UNKNOWN_8, [0, 1, 5])), control.pings[3].pack(False, Ping.UNKNOWN_8, 0, 1, 5))
+
+    def test_compact(self):
+        self.failUnlessEqual("\xc2\x00\x06\x00\x00\x00\x89", control.pings[1].pack(True, Ping.PING_CLIENT, 137))
+        self.failUnlessEqual("\xc2\x00\x01\x86\xa0", control.bytesRead.pack(True, 100000))
+
+    def test_assembler(self):
+        buf = StringTransport()
+        a = RTMPAssembler(constants.DEFAULT_CHUNK_SIZE, buf)
+        a.push_control(control.pings[1], Ping.PING_CLIENT, 1)
+        a.push_control(control.pings[1], Ping.PING_CLIENT, 2)
+        a.push_control(control.bytesRead, 3)
+        a.push_packet(Ping(Ping.PING_CLIENT, [4]))
+        a.push_control(control.pings[1], Ping.PING_CLIENT, 5)
+        a.push_control(control.pings[1], Ping.PING_CLIENT, 6)
+        a.push_packet(Invoke('test', [None], 1.0, RTMPHeader(object_id=2, timestamp=10, stream_id=0)))
+        a.push_control(control.bytesRead, 7)
+        self.failUnlessEqual(len(buf.value()), a.bytes)
+
+        d = RTMPDisassembler(constants.DEFAULT_CHUNK_SIZE)
+        d.push_data(buf.value())
+        packets = []
+        while True:
+            packet = d.disassemble()
+            if packet is None:
+                break
+            packets.append(packet)
+
+        self.failUnlessEqual([1, 2, 4, 5, 6], [p.data[0] for p in packets if isinstance(p, Ping)])
+        self.failUnlessEqual([3, 7], [p.bytes for p in packets if isinstance(p, BytesRead)])
+        self.failUnlessEqual(['test'], [p.name for p in packets if isinstance(p, Invoke)])
+        self.failUnlessEqual([0] * 6 + [10, 0], [p.header.timestamp for p in packets])
+        self.failUnlessEqual(8, len(packets))
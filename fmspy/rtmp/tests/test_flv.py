@@ -0,0 +1,125 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.rtmp.flv}.
+"""
+
+import unittest
+
+from StringIO import StringIO
+
+from fmspy.rtmp import constants
+from fmspy.rtmp.flv import FLVReader, FLVWriter, FLVIndex, FLVError
+from fmspy.rtmp.header import RTMPHeader
+from fmspy.rtmp.packets import AudioData, VideoData, Notify
+
+class FLVTestCase(unittest.TestCase):
+    """
+    Test case for L{FLVReader} and L{FLVWriter}.
+    """
+
+    def test_roundtrip(self):
+        f = StringIO()
+        w = FLVWriter(f, hasAudio=False)
+        w.write(Notify('onMetaData', ({'duration' : 1.0}, ), RTMPHeader(timestamp=0)))
+        w.write(VideoData(RTMPHeader(timestamp=0, length=4, type=constants.VIDEO_DATA), ['\x17\x01', 'ab']))
+        w.write(AudioData(RTMPHeader(timestamp=0x1234567, length=3, type=constants.AUDIO_DATA), ['\xaf\x01c']))
+
+        r = FLVReader(StringIO(f.getvalue()))
+        self.failIf(r.hasAudio)
+        self.failUnless(r.hasVideo)
+
+        packet = r.next()
+        self.failUnless(isinstance(packet, Notify))
+        self.failUnlessEqual(('onMetaData', ({'duration' : 1.0}, )), (packet.name, tuple(packet.argv)))
+
+        packet = r.next()
+        self.failUnless(isinstance(packet, VideoData))
+        self.failUnless(packet.isKeyframe)
+        self.failUnlessEqual((0, 4, '\x17\x01ab'), (packet.header.timestamp, packet.header.length, packet.data))
+
+        packet = r.next()
+        self.failUnless(isinstance(packet, AudioData))
+        self.failUnlessEqual((0x1234567, '\xaf\x01c'), (packet.header.timestamp, packet.data))
+
+        self.failUnlessEqual(None, r.next())
+
+    def test_truncated(self):
+        f = StringIO()
+        w = FLVWriter(f)
+        w.write(VideoData(RTMPHeader(timestamp=0, length=4, type=constants.VIDEO_DATA), ['\x17\x01ab']))
+
+        self.failUnlessEqual(None, FLVReader(StringIO(f.getvalue()[:-6])).next())
+
+    def test_bad(self):
+        self.failUnlessRaises(FLVError, FLVReader, StringIO('FLX\x01\x05\x00\x00\x00\x09'))
+        self.failUnlessRaises(FLVError, FLVReader, StringIO('FL'))
+
+class FLVIndexTestCase(unittest.TestCase):
+    """
+    Test case for L{FLVIndex}.
+    """
+
+    def write(self, packets):
+        f = StringIO()
+        w = FLVWriter(f)
+        positions = []
+        for packet in packets:
+            positions.append(f.tell())
+            w.write(packet)
+        return (FLVReader(StringIO(f.getvalue())), positions)
+
+    def video(self, timestamp, data):
+        return VideoData(RTMPHeader(timestamp=timestamp, length=len(data), type=constants.VIDEO_DATA), [data])
+
+    def audio(self, timestamp, data):
+        return AudioData(RTMPHeader(timestamp=timestamp, length=len(data), type=constants.AUDIO_DATA), [data])
+
+    def test_scan(self):
+        (r, positions) = self.write([
+                Notify('onMetaData', ({'duration' : 1.0}, ), RTMPHeader(timestamp=0)),
+                self.video(0, '\x17\x00config'),
+                self.audio(0, '\xaf\x00aconfig'),
+                self.video(0, '\x17\x01k0'),
+                self.audio(20, '\xaf\x01a'),
+                self.video(40, '\x27\x01i1'),
+                self.video(80, '\x17\x01k2'),
+            ])
+
+        index = FLVIndex(r)
+        self.failUnlessEqual([0, 80], index.times)
+        self.failUnlessEqual([positions[3], positions[6]], index.positions)
+        self.failUnlessEqual('onMetaData', index.metadata.name)
+        self.failUnlessEqual('\x17\x00config', index.videoConfig.data)
+        self.failUnlessEqual('\xaf\x00aconfig', index.audioConfig.data)
+
+        self.failUnlessEqual(None, index.find(-1))
+        self.failUnlessEqual((0, positions[3]), index.find(79))
+        self.failUnlessEqual((80, positions[6]), index.find(1000))
+
+        r.seek(index.find(80)[1])
+        self.failUnlessEqual('\x17\x01k2', r.next().data)
+
+    def test_metadata(self):
+        keyframes = {'times' : [0.0, 2.5], 'filepositions' : [13.0, 500.0]}
+        (r, positions) = self.write([
+                Notify('onMetaData', ({'keyframes' : keyframes}, ), RTMPHeader(timestamp=0)),
+                self.video(0, '\x17\x00config'),
+                self.video(0, '\x17\x01k0'),
+                self.video(40, '\x17\x01k1'),
+            ])
+
+        index = FLVIndex(r)
+        self.failUnlessEqual([0, 2500], index.times)
+        self.failUnlessEqual([13, 500], index.positions)
+        self.failUnlessEqual('\x17\x00config', index.videoConfig.data)
+
+    def test_audio(self):
+        (r, positions) = self.write([self.audio(i * 500, '\x2f') for i in xrange(6)])
+
+        index = FLVIndex(r)
+        self.failUnlessEqual([0, 1000, 2000], index.times)
+        self.failUnlessEqual([positions[0], positions[2], positions[4]], index.positions)
+        self.failUnlessEqual(None, index.videoConfig)
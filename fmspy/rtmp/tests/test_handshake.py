@@ -0,0 +1,50 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.rtmp.handshake}.
+"""
+
+import os
+
+from twisted.trial import unittest
+
+from fmspy.rtmp import handshake, constants
+
+class DigestTestCase(unittest.TestCase):
+    """
+    Test case for handshake digests.
+    """
+
+    def test_offset(self):
+        data = bytearray(constants.HANDSHAKE_SIZE)
+        data[8:12] = "\x01\x02\x03\x04"
+        data[772:776] = "\xff\xff\xff\xff"
+        self.failUnlessEqual(22, handshake.digest_offset(data, 0))
+        self.failUnlessEqual(1020 % 728 + 776, handshake.digest_offset(data, 1))
+
+    def test_roundtrip(self):
+        for scheme in handshake.SCHEMES:
+            (data, digest) = handshake.make_handshake(handshake.clientDigestKey, scheme, "\x80\x00\x07\x02")
+            self.failUnlessEqual(constants.HANDSHAKE_SIZE, len(data))
+            self.failUnlessEqual("\x80\x00\x07\x02", data[4:8])
+            found = handshake.find_digest(bytearray(data), handshake.clientDigestKey)
+            self.failUnlessEqual(digest, found[1])
+            self.failUnlessEqual(None, handshake.find_digest(bytearray(data), handshake.serverDigestKey))
+
+    def test_no_digest(self):
+        self.failUnlessEqual(None, handshake.find_digest(bytearray(os.urandom(constants.HANDSHAKE_SIZE)), handshake.clientDigestKey))
+
+    def test_response(self):
+        digest = os.urandom(handshake.DIGEST_SIZE)
+        response = handshake.make_response(handshake.serverResponseKey, digest)
+        self.failUnlessEqual(constants.HANDSHAKE_SIZE, len(response))
+        self.failUnless(handshake.verify_response(bytearray(response), handshake.serverResponseKey, digest))
+        self.failIf(handshake.verify_response(bytearray(response), handshake.clientResponseKey, digest))
+        self.failIf(handshake.verify_response(bytearray(response), handshake.serverResponseKey, digest[::-1]))
+
+    def test_key_reuse(self):
+        data = bytearray(os.urandom(constants.HANDSHAKE_SIZE))
+        self.failUnlessEqual(handshake.calculate_digest(data, 100, handshake.clientDigestKey),
+                             handshake.calculate_digest(data, 100, handshake.clientDigestKey))
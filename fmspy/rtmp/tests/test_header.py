@@ -46,6 +46,39 @@ class RTMPHeaderTestCase(unittest.TestCase):
         )            
     ]    
 
+    writeData = [
+        (
+             "\x03\x00\x00\x01\x00\x01\x05\x14\x00\x00\x00\x00",
+             RTMPHeader(3, 1, 261, 0x14, 0),
+             None,
+             0
+        ),
+        (
+             "\xc3",
+             RTMPHeader(3, 2, 261, 0x14, 0),
+             RTMPHeader(3, 1, 261, 0x14, 0),
+             1
+        ),
+        (
+             "\x83\x00\x00\x01",
+             RTMPHeader(3, 2, 261, 0x14, 0),
+             RTMPHeader(3, 1, 261, 0x14, 0),
+             0
+        ),
+        (
+             "\x43\x00\x00\x01\x00\x01\x05\x14",
+             RTMPHeader(3, 2, 261, 0x14, 0),
+             RTMPHeader(3, 1, 261, 0x15, 0),
+             1
+        ),
+        (
+             "\x03\x00\x00\x01\x00\x01\x05\x14\x00\x00\x00\x00",
+             RTMPHeader(3, 1, 261, 0x14, 0),
+             RTMPHeader(3, 2, 261, 0x14, 0),
+             0
+        ),
+    ]
+
     def setUp(self):
         self.h1 = RTMPHeader(3, 1, 261, 0x14, 0)
         self.h2 = RTMPHeader(2, 1, 261, 0x14, 0)
@@ -76,23 +109,36 @@ class RTMPHeaderTestCase(unittest.TestCase):
         h = RTMPHeader(1, 2, 3, 4, 5)
         h.fill(f)
         self.assertEqual(RTMPHeader(1, 2, 3, 4, 5), h)
+        self.assertEqual(2, h.delta)
 
         h = RTMPHeader(1, 2, 3, 4, None)
         h.fill(f)
-        self.assertEqual(RTMPHeader(1, 2, 3, 4, 10), h)
+        self.assertEqual(RTMPHeader(1, 9, 3, 4, 10), h)
+        self.assertEqual(2, h.delta)
 
         h = RTMPHeader(1, 2, 3, None, None)
         h.fill(f)
-        self.assertEqual(RTMPHeader(1, 2, 3, 9, 10), h)
+        self.assertEqual(RTMPHeader(1, 9, 3, 9, 10), h)
 
         h = RTMPHeader(1, 2, None, None, None)
         h.fill(f)
-        self.assertEqual(RTMPHeader(1, 2, 8, 9, 10), h)
+        self.assertEqual(RTMPHeader(1, 9, 8, 9, 10), h)
 
         h = RTMPHeader(1, None, None, None, None)
         h.fill(f)
+        self.assertEqual(RTMPHeader(1, 14, 8, 9, 10), h)
+        self.assertEqual(7, h.delta)
+
+        h = RTMPHeader(1, None, None, None, None)
+        h.fill(f, continuation=True)
         self.assertEqual(RTMPHeader(1, 7, 8, 9, 10), h)
 
+        f.delta = 3
+        h = RTMPHeader(1, None, None, None, None)
+        h.fill(f)
+        self.assertEqual(RTMPHeader(1, 10, 8, 9, 10), h)
+        self.assertEqual(3, h.delta)
+
         h = RTMPHeader(None, None, None, None, None)
         self.failUnlessRaises(AssertionError, h.fill, f)
 
@@ -105,15 +151,23 @@ class RTMPHeaderTestCase(unittest.TestCase):
         self.failUnlessEqual(0, self.h1.diff(self.h3))
         self.failUnlessRaises(AssertionError, self.h1.diff, self.h2)
 
-        self.failUnlessEqual(1, self.h1.diff(RTMPHeader(3, 444, 261, 0x14, 0)))
+        self.failUnlessEqual(1, self.h1.diff(RTMPHeader(3, 0, 261, 0x14, 0)))
+        self.failUnlessEqual(0, self.h1.diff(RTMPHeader(3, 0, 261, 0x14, 0), delta=1))
         self.failUnlessEqual(2, self.h1.diff(RTMPHeader(3, 1, 262, 0x14, 0)))
         self.failUnlessEqual(2, self.h1.diff(RTMPHeader(3, 1, 261, 0x15, 0)))
         self.failUnlessEqual(3, self.h1.diff(RTMPHeader(3, 1, 261, 0x14, 11)))
+        self.failUnlessEqual(3, self.h1.diff(RTMPHeader(3, 444, 261, 0x14, 0)))
 
     def test_write(self):
-        for fixture in self.data:
-            h = copy.copy(fixture[1])
-            h.fill(self.h1)
-
-            self.failUnlessEqual(fixture[0], h.write(previous=fixture[2]))
+        for (data, header, previous, delta) in self.writeData:
+            self.failUnlessEqual(data, header.write(previous=previous, delta=delta))
+
+    def test_write_read(self):
+        for (data, header, previous, delta) in self.writeData:
+            h = RTMPHeader.read(BufferedByteStream(data))
+            if previous is not None:
+                previous = copy.copy(previous)
+                previous.delta = delta
+                h.fill(previous)
+            self.failUnlessEqual(header, h)
 
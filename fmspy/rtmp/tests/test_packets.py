@@ -12,7 +12,10 @@ import pyamf
 from pyamf.util import BufferedByteStream
 
 from fmspy.rtmp.header import RTMPHeader
-from fmspy.rtmp.packets import Packet, DataPacket, Invoke, BytesRead, Ping
+from fmspy.rtmp.packets import Packet, DataPacket, Invoke, Notify, ChunkSize, BytesRead, Ping, ServerBW, ClientBW, packetFactory
+from fmspy.rtmp.packets import MediaPacket, AudioData, VideoData
+from fmspy.rtmp.amf3 import AMF3Codec
+from fmspy.rtmp import constants
 
 class DataPacketTestCase(unittest.TestCase):
     """
@@ -31,6 +34,44 @@ class DataPacketTestCase(unittest.TestCase):
     def test_repr(self):
         self.failUnlessEqual("<DataPacket(header=<RTMPHeader(object_id=3, timestamp=1, length=4, type=0x14, stream_id=0)>, data='aaaa')>", repr(self.p1))
 
+class MediaPacketTestCase(unittest.TestCase):
+    """
+    Test case for L{fmspy.rtmp.packets.AudioData} and L{fmspy.rtmp.packets.VideoData}.
+    """
+
+    def test_video(self):
+        data = [
+                (['\x17\x00\x00\x00\x00'], (VideoData.KEYFRAME, VideoData.AVC, VideoData.AVC_SEQUENCE_HEADER, False, True)),
+                (['\x17', '\x01\x00', '\x00\x00'], (VideoData.KEYFRAME, VideoData.AVC, VideoData.AVC_NALU, True, False)),
+                (['\x27\x01\x00\x00\x00'], (VideoData.INTERFRAME, VideoData.AVC, VideoData.AVC_NALU, False, False)),
+                (['\x12\x00'], (VideoData.KEYFRAME, VideoData.H263, None, True, False)),
+                ([''], (None, None, None, False, False)),
+               ]
+
+        for (segments, expected) in data:
+            p = VideoData(RTMPHeader(5, 0, 0, constants.VIDEO_DATA, 1), segments)
+            self.failUnlessEqual(expected, (p.frameType, p.codec, p.avcPacketType, p.isKeyframe, p.isSequenceHeader))
+
+    def test_audio(self):
+        data = [
+                (['\xaf\x00\x12\x10'], (AudioData.AAC, AudioData.AAC_SEQUENCE_HEADER, True)),
+                (['\xaf', '\x01\x21'], (AudioData.AAC, AudioData.AAC_RAW, False)),
+                (['\x2f\x00'], (AudioData.MP3, None, False)),
+               ]
+
+        for (segments, expected) in data:
+            p = AudioData(RTMPHeader(4, 0, 0, constants.AUDIO_DATA, 1), segments)
+            self.failUnlessEqual(expected, (p.codec, p.aacPacketType, p.isSequenceHeader))
+
+    def test_read(self):
+        p = packetFactory(RTMPHeader(5, 0, 5, constants.VIDEO_DATA, 1), BufferedByteStream('\x17\x01\x00\x00\x00'))
+        self.failUnless(isinstance(p, VideoData))
+        self.failUnless(p.isKeyframe)
+        self.failUnlessEqual(DataPacket(RTMPHeader(5, 0, 5, constants.VIDEO_DATA, 1), '\x17\x01\x00\x00\x00'), p)
+
+        p = packetFactory(RTMPHeader(4, 0, 2, constants.AUDIO_DATA, 1), BufferedByteStream('\xaf\x01'))
+        self.failUnless(isinstance(p, AudioData))
+
 class InvokeTestCase(unittest.TestCase):
     """
     Test case for L{fmspy.rtmp.packets.Invoke}.
@@ -78,6 +119,96 @@ class InvokeTestCase(unittest.TestCase):
             fixture[0]['buf'].seek(0)
             self.failUnlessEqual(fixture[0]['buf'].read(), fixture[1].write())
 
+class FlexItem(object):
+    """
+    Typed object for AMF3 tests.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, FlexItem) and self.name == other.name
+
+pyamf.register_class(FlexItem, 'test.FlexItem')
+
+class FlexMessageTestCase(unittest.TestCase):
+    """
+    Test case for AMF3-encoded L{fmspy.rtmp.packets.Invoke} and L{fmspy.rtmp.packets.Notify}.
+    """
+
+    def setUp(self):
+        self.encoder = AMF3Codec()
+        self.decoder = AMF3Codec()
+
+    def roundtrip(self, packet):
+        data = packet.write(self.encoder)
+        self.assertEqual(len(data), packet.header.length)
+        return packetFactory(packet.header, BufferedByteStream(data), self.decoder)
+
+    def test_invoke(self):
+        items = [FlexItem('a'), FlexItem('b'), FlexItem('a')]
+        packet = Invoke('send', (None, items, 'send'), 3.0, RTMPHeader(object_id=3, timestamp=0, type=constants.FLEX_MESSAGE, stream_id=0))
+        data = packet.write(self.encoder)
+        self.assertEqual("\x00\x02\x00\x04send", data[:8])
+        self.assertEqual(1, data.count('test.FlexItem'))
+
+        for i in xrange(2):
+            result = self.roundtrip(packet)
+            self.assertEqual(Invoke, result.__class__)
+            self.assertEqual('send', result.name)
+            self.assertEqual(3.0, result.id)
+            self.assertEqual(packet.argv, result.argv)
+
+    def test_context_reset(self):
+        packet = Notify('onData', (FlexItem('x'), ), RTMPHeader(object_id=3, timestamp=0, type=constants.FLEX_STREAM, stream_id=1))
+        self.assertEqual(packet.write(self.encoder), packet.write(self.encoder))
+
+    def test_notify(self):
+        packet = Notify('onMetaData', ({ 'width' : 320.0 }, ), RTMPHeader(object_id=4, timestamp=0, type=constants.NOTIFY, stream_id=1))
+        result = self.roundtrip(packet)
+        self.assertEqual(packet, result)
+
+        packet = Notify('onData', ([FlexItem('x'), 'y'], ), RTMPHeader(object_id=4, timestamp=0, type=constants.FLEX_STREAM, stream_id=1))
+        result = self.roundtrip(packet)
+        self.assertEqual(packet, result)
+
+    def test_without_codec(self):
+        packet = Invoke('send', (None, FlexItem('a')), 3.0, RTMPHeader(object_id=3, timestamp=0, type=constants.FLEX_MESSAGE, stream_id=0))
+        result = packetFactory(packet.header, BufferedByteStream(packet.write()))
+        self.assertEqual(packet.argv, result.argv)
+
+class ChunkSizeTestCase(unittest.TestCase):
+    """
+    Test case for L{fmspy.rtmp.packets.ChunkSize}.
+    """
+
+    data = [
+            (
+                { 'header' : RTMPHeader(object_id=2, timestamp=0, length=4, type=0x01, stream_id=0L),
+                  'buf'    : BufferedByteStream('\x00\x00\x10\x00'),
+                },
+                ChunkSize(  size=4096,
+                            header=RTMPHeader(object_id=2, timestamp=0, length=4, type=0x01, stream_id=0L)),
+            ),
+           ]
+
+    def test_eq(self):
+        self.failUnlessEqual(ChunkSize(size=5, header=RTMPHeader(object_id=2)), ChunkSize(size=5, header=RTMPHeader(object_id=2)))
+        self.failIfEqual(ChunkSize(size=6, header=RTMPHeader(object_id=2)), ChunkSize(size=5, header=RTMPHeader(object_id=2)))
+
+    def test_read(self):
+        for fixture in self.data:
+            fixture[0]['buf'].seek(0)
+            self.failUnlessEqual(fixture[1], ChunkSize.read(**fixture[0]))
+            fixture[0]['buf'].seek(0)
+            self.failUnlessEqual(fixture[1], packetFactory(**fixture[0]))
+
+    def test_write(self):
+        for fixture in self.data:
+            fixture[0]['buf'].seek(0)
+            self.failUnlessEqual(fixture[0]['buf'].read(), fixture[1].write())
+
 class BytesReadTestCase(unittest.TestCase):
     """
     Test case for L{fmspy.rtmp.packets.BytesRead}.
@@ -108,6 +239,64 @@ class BytesReadTestCase(unittest.TestCase):
             fixture[0]['buf'].seek(0)
             self.failUnlessEqual(fixture[0]['buf'].read(), fixture[1].write())
 
+class ServerBWTestCase(unittest.TestCase):
+    """
+    Test case for L{fmspy.rtmp.packets.ServerBW}.
+    """
+
+    data = [
+            (
+                { 'header' : RTMPHeader(object_id=2, timestamp=0, length=4, type=0x05, stream_id=0L),
+                  'buf'    : BufferedByteStream('\x00\x26\x25\xa0'),
+                },
+                ServerBW(  bandwidth=2500000,
+                            header=RTMPHeader(object_id=2, timestamp=0, length=4, type=0x05, stream_id=0L)),
+            ),
+           ]
+
+    def test_eq(self):
+        self.failUnlessEqual(ServerBW(5), ServerBW(5))
+        self.failIfEqual(ServerBW(6), ServerBW(5))
+
+    def test_read(self):
+        for fixture in self.data:
+            fixture[0]['buf'].seek(0)
+            self.failUnlessEqual(fixture[1], ServerBW.read(**fixture[0]))
+
+    def test_write(self):
+        for fixture in self.data:
+            fixture[0]['buf'].seek(0)
+            self.failUnlessEqual(fixture[0]['buf'].read(), fixture[1].write())
+
+class ClientBWTestCase(unittest.TestCase):
+    """
+    Test case for L{fmspy.rtmp.packets.ClientBW}.
+    """
+
+    data = [
+            (
+                { 'header' : RTMPHeader(object_id=2, timestamp=0, length=5, type=0x06, stream_id=0L),
+                  'buf'    : BufferedByteStream('\x00\x26\x25\xa0\x02'),
+                },
+                ClientBW(  bandwidth=2500000, limit=ClientBW.LIMIT_DYNAMIC,
+                            header=RTMPHeader(object_id=2, timestamp=0, length=5, type=0x06, stream_id=0L)),
+            ),
+           ]
+
+    def test_eq(self):
+        self.failUnlessEqual(ClientBW(5, 0), ClientBW(5, 0))
+        self.failIfEqual(ClientBW(5, 1), ClientBW(5, 0))
+
+    def test_read(self):
+        for fixture in self.data:
+            fixture[0]['buf'].seek(0)
+            self.failUnlessEqual(fixture[1], ClientBW.read(**fixture[0]))
+
+    def test_write(self):
+        for fixture in self.data:
+            fixture[0]['buf'].seek(0)
+            self.failUnlessEqual(fixture[0]['buf'].read(), fixture[1].write())
+
 class PingTestCase(unittest.TestCase):
     """
     Test case for L{fmspy.rtmp.packets.Ping}.
@@ -0,0 +1,328 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.rtmp.protocol}.
+"""
+
+from twisted.trial import unittest
+from twisted.test.proto_helpers import StringTransport
+
+from fmspy.rtmp.protocol.server import RTMPServerProtocol, _serverHandshake
+from fmspy.rtmp.protocol.client import RTMPClientProtocol, _clientHandshake, _clientDigest
+from fmspy.rtmp.assembly import RTMPAssembler
+from fmspy.rtmp.packets import Ping, BytesRead, ServerBW, ClientBW, DataPacket, AudioData, VideoData, ChunkSize, Invoke
+from fmspy.rtmp.header import RTMPHeader
+from fmspy.rtmp import constants, handshake
+from fmspy import _time
+
+class ProtocolTestCase(unittest.TestCase):
+    """
+    Base test case for RTMP protocols.
+    """
+
+    def setUp(self):
+        self.protocols = []
+
+    def tearDown(self):
+        for p in self.protocols:
+            p.connectionLost(None)
+
+    def connect(self, protocol):
+        protocol.makeConnection(StringTransport())
+        self.protocols.append(protocol)
+        return protocol
+
+    def running(self, protocol):
+        """
+        Connect protocol and complete handshake.
+        """
+        self.connect(protocol)
+        protocol._handshakeComplete()
+        protocol.transport.clear()
+        return protocol
+
+    def encode(self, *packets):
+        buf = StringTransport()
+        a = RTMPAssembler(constants.DEFAULT_CHUNK_SIZE, buf)
+        for packet in packets:
+            a.push_packet(packet)
+        return buf.value()
+
+class RTMPServerProtocolHandshakeTestCase(ProtocolTestCase):
+    """
+    Test case for handshake of L{fmspy.rtmp.protocol.server.RTMPServerProtocol}.
+    """
+
+    def setUp(self):
+        ProtocolTestCase.setUp(self)
+        self.p = self.connect(RTMPServerProtocol())
+        self.c1 = ''.join([chr(i % 256) for i in xrange(constants.HANDSHAKE_SIZE)])
+
+    def test_handshake(self):
+        data = "\x03" + self.c1
+        for pos in xrange(0, len(data), 100):
+            self.failUnlessEqual('', self.p.transport.value())
+            self.p.dataReceived(data[pos:pos+100])
+
+        self.failUnlessEqual(self.p.State.HANDSHAKE_VERIFY, self.p.state)
+        self.failUnlessEqual(_serverHandshake + self.c1, self.p.transport.value())
+        self.p.transport.clear()
+
+        self.p.dataReceived('\x00' * (constants.HANDSHAKE_SIZE - 1))
+        self.failUnlessEqual(self.p.State.HANDSHAKE_VERIFY, self.p.state)
+
+        self.p.dataReceived('\x00' + self.encode(Ping(Ping.PING_CLIENT, [123])))
+        self.failUnlessEqual(self.p.State.RUNNING, self.p.state)
+        self.failUnlessEqual(self.encode(Ping(Ping.PONG_SERVER, [123])), self.p.transport.value())
+
+    def test_handshake_single_chunk(self):
+        self.p.dataReceived("\x03" + self.c1 + '\x00' * constants.HANDSHAKE_SIZE + self.encode(Ping(Ping.PING_CLIENT, [5])))
+        self.failUnlessEqual(self.p.State.RUNNING, self.p.state)
+        self.failUnlessEqual(_serverHandshake + self.c1 + self.encode(Ping(Ping.PONG_SERVER, [5])), self.p.transport.value())
+
+    def test_digest_handshake(self):
+        self.p.dataReceived(_clientHandshake)
+        self.failUnlessEqual(self.p.State.HANDSHAKE_VERIFY, self.p.state)
+
+        data = self.p.transport.value()
+        self.failUnlessEqual(1 + 2 * constants.HANDSHAKE_SIZE, len(data))
+        s1 = bytearray(data[1:constants.HANDSHAKE_SIZE+1])
+        self.failIfEqual(None, handshake.find_digest(s1, handshake.serverDigestKey))
+        self.failUnless(handshake.verify_response(bytearray(data[constants.HANDSHAKE_SIZE+1:]),
+                                                  handshake.serverResponseKey, _clientDigest))
+
+    def test_bad_version(self):
+        self.p.dataReceived("\x06" + self.c1 + '\x00' * 10)
+        self.failUnless(self.p.transport.disconnecting)
+        self.failUnlessEqual('', self.p.transport.value())
+
+class RTMPClientServerHandshakeTestCase(ProtocolTestCase):
+    """
+    Test case for handshake between client and server.
+    """
+
+    def test_handshake(self):
+        server = self.connect(RTMPServerProtocol())
+        client = self.connect(RTMPClientProtocol())
+
+        while client.transport.value() or server.transport.value():
+            data = client.transport.value()
+            client.transport.clear()
+            server.dataReceived(data)
+
+            data = server.transport.value()
+            server.transport.clear()
+            client.dataReceived(data)
+
+        self.failUnlessEqual(server.State.RUNNING, server.state)
+        self.failUnlessEqual(client.State.RUNNING, client.state)
+        self.failUnless(client.digestHandshake)
+
+    def test_simple_server(self):
+        client = self.connect(RTMPClientProtocol())
+        client.transport.clear()
+
+        client.dataReceived(_serverHandshake)
+        self.failIf(client.digestHandshake)
+        self.failUnlessEqual(_serverHandshake[1:], client.transport.value())
+
+        client.dataReceived(_clientHandshake[1:])
+        self.failUnlessEqual(client.State.RUNNING, client.state)
+
+class FlowControlTestCase(ProtocolTestCase):
+    """
+    Test case for window acknowledgement flow control.
+    """
+
+    def setUp(self):
+        ProtocolTestCase.setUp(self)
+        self.p = self.running(RTMPServerProtocol())
+
+    def video(self, size):
+        return DataPacket(RTMPHeader(object_id=5, timestamp=0, type=constants.VIDEO_DATA, stream_id=1), 'x' * size)
+
+    def test_ack(self):
+        self.p.dataReceived(self.encode(ServerBW(40)))
+        self.failUnlessEqual(40, self.p.ackWindow)
+        self.failUnlessEqual('', self.p.transport.value())
+
+        ping = self.encode(Ping(Ping.PING_CLIENT, [1]))
+        self.p.dataReceived(ping)
+        self.failUnlessEqual(self.encode(Ping(Ping.PONG_SERVER, [1])), self.p.transport.value())
+        self.p.transport.clear()
+
+        self.p.dataReceived(ping)
+        self.failUnless(self.p.transport.value().endswith(BytesRead(self.p.bytesReceived).write()))
+        self.failUnlessEqual(self.p.bytesReceived, self.p.ackSent)
+
+    def test_no_acks(self):
+        self.p.outputWindow = 100
+        for i in xrange(10):
+            self.p.pushPacket(self.video(100))
+        self.failIf(self.p.mediaQueue)
+
+    def test_throttle(self):
+        self.p.outputWindow = 300
+        self.p.handleBytesRead(BytesRead(0))
+
+        self.p.pushPacket(self.video(200))
+        self.p.pushPacket(self.video(200))
+        sent = self.p.output.bytes
+        self.p.pushPacket(self.video(200))
+        self.p.pushPacket(self.video(200))
+        self.failUnlessEqual(sent, self.p.output.bytes)
+        self.failUnlessEqual(2, len(self.p.mediaQueue))
+
+        self.p.pushPacket(self.video(200))
+        self.failUnlessEqual(2, len(self.p.mediaQueue))
+
+        self.p.pushPacket(Ping(Ping.PING_CLIENT, [1]))
+        self.failIfEqual(sent, self.p.output.bytes)
+
+        self.p.handleBytesRead(BytesRead(self.p.output.bytes))
+        self.failUnlessEqual(0, len(self.p.mediaQueue))
+        self.failUnlessEqual(0, self.p.mediaQueueBytes)
+
+    def media(self, cls, type, data):
+        data += 'x' * (100 - len(data))
+        return cls(RTMPHeader(object_id=5, timestamp=0, length=len(data), type=type, stream_id=1), [data])
+
+    def queued(self):
+        return [packet.data[:2] for packet in self.p.mediaQueue]
+
+    def test_drop(self):
+        self.p.outputWindow = 300
+        self.p.handleBytesRead(BytesRead(0))
+        self.p.pushPacket(self.video(400))
+
+        keyframe = lambda: self.media(VideoData, constants.VIDEO_DATA, '\x17\x01')
+        interframe = lambda: self.media(VideoData, constants.VIDEO_DATA, '\x27\x01')
+        avcConfig = lambda: self.media(VideoData, constants.VIDEO_DATA, '\x17\x00')
+        aacConfig = lambda: self.media(AudioData, constants.AUDIO_DATA, '\xaf\x00')
+
+        for packet in (keyframe(), interframe(), interframe(), interframe(), avcConfig(), aacConfig()):
+            self.p.pushPacket(packet)
+        # window is full, but configurations are queued
+        self.failUnlessEqual(['\x17\x01', '\x27\x01', '\x27\x01', '\x17\x00', '\xaf\x00'], self.queued())
+
+        # rest of group of pictures is dropped, even if queue is drained
+        while self.p.mediaQueue:
+            self.p.handleBytesRead(BytesRead(self.p.output.bytes))
+        self.p.handleBytesRead(BytesRead(self.p.output.bytes))
+        self.p.pushPacket(interframe())
+        self.failUnlessEqual(set([1]), self.p.skipVideo)
+        self.p.pushPacket(self.video(400))
+        sent = self.p.output.bytes
+        self.p.pushPacket(keyframe())
+        self.failIf(self.p.skipVideo)
+        self.failUnlessEqual(['\x17\x01'], self.queued())
+
+        # new keyframe replaces queued video
+        for packet in (interframe(), interframe(), aacConfig(), interframe(), keyframe()):
+            self.p.pushPacket(packet)
+        self.failUnlessEqual(['\xaf\x00', '\x17\x01'], self.queued())
+        self.failUnlessEqual(200, self.p.mediaQueueBytes)
+        self.failUnlessEqual(sent, self.p.output.bytes)
+
+    def test_ack_rate(self):
+        now = [1000.0]
+        self.patch(_time, 'precise', lambda: now[0])
+
+        # several acknowledgements per second, 1000 bytes every 0.1 s
+        for i in xrange(5):
+            self.p.handleBytesRead(BytesRead(i * 1000))
+            now[0] += 0.1
+        self.failUnlessEqual(None, self.p.ackRate)
+
+        for i in xrange(5, 11):
+            self.p.handleBytesRead(BytesRead(i * 1000))
+            now[0] += 0.1
+        self.failUnlessAlmostEqual(10000.0, self.p.ackRate)
+
+    def test_client_bw(self):
+        self.p._announceWindow(1000)
+        self.p.transport.clear()
+
+        self.p.handleClientBW(ClientBW(5000, ClientBW.LIMIT_HARD))
+        self.failUnlessEqual(5000, self.p.outputWindow)
+        self.failUnlessEqual('', self.p.transport.value())
+
+        self.p.handleClientBW(ClientBW(8000, ClientBW.LIMIT_SOFT))
+        self.failUnlessEqual(5000, self.p.outputWindow)
+
+        self.p.handleClientBW(ClientBW(1000, ClientBW.LIMIT_HARD))
+        self.failUnlessEqual(500, self.p.announcedWindow)
+        self.failUnless(self.p.transport.value().endswith(ServerBW(500).write()))
+
+class ReassemblyLimitTestCase(ProtocolTestCase):
+    """
+    Test case for reassembly limits of protocol.
+    """
+
+    def test_oversized(self):
+        p = self.running(RTMPServerProtocol())
+        data = self.encode(DataPacket(RTMPHeader(object_id=3, timestamp=0, type=constants.INVOKE, stream_id=0), 'x' * 200))
+        p.input.maxPacketSizes = { constants.INVOKE : 100 }
+
+        p.dataReceived(data[:50])
+        self.failUnless(p.transport.disconnecting)
+        self.failUnless(p.input.closed)
+
+        p.dataReceived(data[50:])
+
+class ChunkSizeTestCase(ProtocolTestCase):
+    """
+    Test case for chunk size changes of peer.
+    """
+
+    def test_chunk_size(self):
+        p = self.running(RTMPServerProtocol())
+        received = []
+        p.handleVideoData = received.append
+
+        buf = StringTransport()
+        a = RTMPAssembler(constants.DEFAULT_CHUNK_SIZE, buf)
+        a.push_packet(ChunkSize(4096))
+        a.chunkSize = 4096
+        video = '\x17\x01' + 'x' * 3000
+        a.push_packet(DataPacket(RTMPHeader(object_id=5, timestamp=0, type=constants.VIDEO_DATA, stream_id=1), video))
+
+        p.dataReceived(buf.value())
+        self.failUnlessEqual(4096, p.input.chunkSize)
+        self.failUnlessEqual([video], [packet.data for packet in received])
+        self.failIf(p.transport.disconnecting)
+
+    def test_invalid(self):
+        p = self.running(RTMPServerProtocol())
+        p.dataReceived(self.encode(ChunkSize(0)))
+        self.failUnless(p.transport.disconnecting)
+        self.failUnlessEqual(constants.DEFAULT_CHUNK_SIZE, p.input.chunkSize)
+
+class InvokeReplyTestCase(ProtocolTestCase):
+    """
+    Test case for replies to invokes of peer.
+    """
+
+    def setUp(self):
+        ProtocolTestCase.setUp(self)
+        self.p = self.running(RTMPServerProtocol())
+        self.p.invoke_echo = lambda packet, *args: args[1:]
+        self.p.invoke_fail = lambda packet, *args: 1 / 0
+
+    def invoke(self, name, id):
+        self.p.transport.clear()
+        self.p.dataReceived(self.encode(Invoke(name, (None, 'a'), id, RTMPHeader(object_id=3, timestamp=0, type=constants.INVOKE, stream_id=0))))
+        return self.p.transport.value()
+
+    def test_reply(self):
+        self.failUnlessEqual(self.encode(Invoke('_result', ('a', ), 1, RTMPHeader(object_id=3, timestamp=0, type=constants.INVOKE, stream_id=0))),
+                             self.invoke('echo', 1))
+        self.failUnless(self.invoke('fail', 2))
+        self.failUnlessEqual(1, len(self.flushLoggedErrors(ZeroDivisionError)))
+
+    def test_no_reply(self):
+        self.failUnlessEqual('', self.invoke('echo', 0))
+        self.failUnlessEqual('', self.invoke('fail', 0))
+        self.failUnlessEqual(1, len(self.flushLoggedErrors(ZeroDivisionError)))
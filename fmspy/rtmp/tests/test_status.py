@@ -0,0 +1,69 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.rtmp.status}.
+"""
+
+import datetime
+
+import pyamf
+from twisted.trial import unittest
+from twisted.python import failure
+
+from fmspy.rtmp import amf0, status
+from fmspy.rtmp.amf3 import AMF3Codec
+from fmspy.rtmp.status import Status, StatusTemplate
+
+class StatusTemplateTestCase(unittest.TestCase):
+    """
+    Test case for pre-encoded statuses.
+    """
+
+    def decode(self, data):
+        return list(pyamf.decode(data, encoding=pyamf.AMF0))
+
+    def failUnlessStatus(self, expected, result):
+        self.failUnless(isinstance(result, amf0.Encoded))
+        self.failUnlessEqual(self.decode(amf0.encode(expected)), self.decode(result.data))
+
+    def test_fixed(self):
+        template = StatusTemplate('NetStream.Play.Stop', 'status', 'Stopped')
+        self.failUnless(template() is template())
+        self.failUnlessStatus(Status('NetStream.Play.Stop', 'status', 'Stopped'), template())
+
+    def test_parameters(self):
+        self.failUnlessStatus(Status('NetStream.Play.Start', 'status', 'Started playing test', details='test', clientid=5),
+                              status.playStart(description='Started playing test', details='test', clientid=5))
+        self.failUnlessStatus(Status('NetConnection.Connect.Success', 'success', 'Connect OK', objectEncoding=3),
+                              status.connectSuccess(objectEncoding=3))
+
+    def test_unsupported(self):
+        date = datetime.datetime(2009, 1, 1)
+        result = status.publishStart(description='x', details=date)
+        self.failUnless(isinstance(result, Status))
+        self.failUnlessEqual(('NetStream.Publish.Start', 'status', 'x', date),
+                             (result.code, result.level, result.description, result.details))
+
+    def test_encode(self):
+        date = datetime.datetime(2009, 1, 1)
+        encoded = status.connectSuccess()
+        self.failUnlessEqual(self.decode(amf0.encode('_result', 1, None, Status('NetConnection.Connect.Success', 'success', 'Connect OK'))),
+                             self.decode(amf0.encode('_result', 1, None, encoded)))
+        self.failUnlessEqual(['_result', date, None] + self.decode(encoded.data),
+                             self.decode(amf0.encode('_result', date, None, encoded)))
+
+    def test_amf3(self):
+        encoded = status.connectSuccess()
+        self.failUnlessEqual(['_result', 1, None] + self.decode(encoded.data),
+                             AMF3Codec().decode(AMF3Codec().encode('_result', 1, None, encoded)))
+
+    def test_failure(self):
+        class CodedError(Exception):
+            code = 'App.Error'
+
+        for error in [ValueError('x'), CodedError('y'), failure.Failure(CodedError('z'))]:
+            self.failUnlessStatus(Status.from_failure(error), status.encode_failure(error))
+
+        self.failUnless('App.Error' in status._failureTemplates)
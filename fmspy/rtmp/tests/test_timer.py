@@ -0,0 +1,127 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.rtmp.timer}.
+"""
+
+from twisted.trial import unittest
+from twisted.internet import task
+from twisted.test.proto_helpers import StringTransport
+
+from fmspy.rtmp.timer import TimerWheel
+from fmspy.rtmp.protocol.server import RTMPServerProtocol
+
+class TimerWheelTestCase(unittest.TestCase):
+    """
+    Test case for L{TimerWheel}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.wheel = TimerWheel(tick=1.0, size=8, clock=self.clock)
+        self.fired = []
+
+    def advance(self, seconds):
+        for i in xrange(seconds):
+            self.clock.advance(1)
+
+    def test_fire(self):
+        self.wheel.schedule(3, self.fired.append, 'a')
+        self.wheel.schedule(1, self.fired.append, 'b')
+        self.wheel.schedule(2.5, self.fired.append, 'c')
+
+        self.advance(1)
+        self.failUnlessEqual(['b'], self.fired)
+        self.advance(1)
+        self.failUnlessEqual(['b'], self.fired)
+        self.advance(1)
+        self.failUnlessEqual(['a', 'b', 'c'], sorted(self.fired))
+        self.failUnlessEqual(0, self.wheel.count)
+        self.failUnlessEqual(None, self.wheel.task)
+        self.failUnlessEqual([], self.clock.getDelayedCalls())
+
+    def test_rounds(self):
+        self.wheel.schedule(20, self.fired.append, 'a')
+        self.advance(19)
+        self.failUnlessEqual([], self.fired)
+        self.advance(1)
+        self.failUnlessEqual(['a'], self.fired)
+
+    def test_full_rotation(self):
+        self.wheel.schedule(8, self.fired.append, 'a')
+        self.advance(7)
+        self.failUnlessEqual([], self.fired)
+        self.advance(1)
+        self.failUnlessEqual(['a'], self.fired)
+
+    def test_cancel(self):
+        entry = self.wheel.schedule(2, self.fired.append, 'a')
+        self.wheel.schedule(3, self.fired.append, 'b')
+        self.failUnless(entry.active())
+        entry.cancel()
+        self.failIf(entry.active())
+        entry.cancel()
+        self.failUnlessEqual(1, self.wheel.count)
+        self.advance(3)
+        self.failUnlessEqual(['b'], self.fired)
+        self.failUnlessEqual([], self.clock.getDelayedCalls())
+
+    def test_lag(self):
+        self.wheel.schedule(1, self.fired.append, 'a')
+        self.wheel.schedule(3, self.fired.append, 'b')
+        self.clock.advance(3)
+        self.failUnlessEqual(['a', 'b'], self.fired)
+
+    def test_reschedule(self):
+        def periodic():
+            self.fired.append(self.clock.seconds())
+            if len(self.fired) < 3:
+                self.wheel.schedule(2, periodic)
+
+        self.wheel.schedule(2, periodic)
+        self.advance(10)
+        self.failUnlessEqual([2, 4, 6], self.fired)
+
+    def test_mid_tick(self):
+        self.wheel.schedule(8, self.fired.append, 'x')
+        self.clock.advance(0.5)
+
+        self.wheel.schedule(1, self.fired.append, 'a')
+        self.wheel.schedule(0.5, self.fired.append, 'b')
+        self.wheel.schedule(0.1, self.fired.append, 'c')
+        self.wheel.schedule(1.7, self.fired.append, 'd')
+
+        self.clock.advance(0.5)
+        self.failUnlessEqual(['b', 'c'], sorted(self.fired))
+        self.clock.advance(1)
+        self.failUnlessEqual(['a', 'b', 'c'], sorted(self.fired))
+        self.clock.advance(1)
+        self.failUnlessEqual(['a', 'b', 'c', 'd'], sorted(self.fired))
+
+    def test_error(self):
+        self.wheel.schedule(1, lambda: 1/0)
+        self.wheel.schedule(1, self.fired.append, 'a')
+        self.advance(1)
+        self.failUnlessEqual(['a'], self.fired)
+        self.failUnlessEqual(1, len(self.flushLoggedErrors(ZeroDivisionError)))
+
+class ProtocolTimersTestCase(unittest.TestCase):
+    """
+    Test case for connection timers.
+    """
+
+    def test_handshake_timeout(self):
+        clock = task.Clock()
+        p = RTMPServerProtocol()
+        p.timers = TimerWheel(clock=clock)
+        p.makeConnection(StringTransport())
+
+        clock.advance(p.handshakeTimeoutDelay - 1)
+        self.failIf(p.transport.disconnecting)
+        clock.advance(1)
+        self.failUnless(p.transport.disconnecting)
+
+        p.connectionLost(None)
+        self.failUnlessEqual([], clock.getDelayedCalls())
@@ -0,0 +1,160 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.rtmp.tunnel}.
+"""
+
+from StringIO import StringIO
+
+from twisted.trial import unittest
+from twisted.internet import address, task
+from twisted.web import server
+from twisted.web.test.requesthelper import DummyRequest
+
+from fmspy.rtmp import constants
+from fmspy.rtmp.admission import AdmissionControl
+from fmspy.rtmp.protocol.server import RTMPServerFactory, RTMPServerProtocol, _serverHandshake
+from fmspy.rtmp.timer import TimerWheel
+from fmspy.rtmp.tunnel import RTMPTunnel, TunnelSession, TunnelResource
+
+class RTMPTunnelTestCase(unittest.TestCase):
+    """
+    Test case for L{RTMPTunnel}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.timers = TimerWheel(clock=self.clock)
+        self.patch(RTMPServerProtocol, 'timers', self.timers)
+        self.patch(TunnelSession, 'holdTime', 0)
+        self.admission = AdmissionControl(maxPerHost=1)
+        self.tunnel = RTMPTunnel(RTMPServerFactory(self.admission), clock=self.clock, timers=self.timers)
+        self.resources = dict([(command, TunnelResource(self.tunnel, command)) for command in RTMPTunnel.commands])
+
+    def tearDown(self):
+        for session in self.tunnel.sessions.values():
+            session.close()
+        self.clock.advance(0)
+
+    def request(self, command, path=(), body=''):
+        request = DummyRequest(list(path))
+        request.client = address.IPv4Address('TCP', '10.0.0.1', 5000)
+        request.method = 'POST'
+        request.content = StringIO(body)
+        result = self.resources[command].render(request)
+        if result is not server.NOT_DONE_YET:
+            request.write(result)
+            request.finish()
+        return request
+
+    def reply(self, request):
+        return ''.join(request.written)
+
+    def open(self):
+        request = self.request('open', ['1'])
+        self.failUnlessEqual(['application/x-fcs'], request.responseHeaders.getRawHeaders('content-type'))
+        return self.tunnel.sessions[self.reply(request).strip()]
+
+    def test_open(self):
+        session = self.open()
+        self.failUnless(session.protocol.transport is session)
+        self.failUnless(session.producer is session.protocol)
+        self.failUnlessEqual('10.0.0.1', session.protocol.peerHost)
+
+        # admission control is shared with RTMP server
+        self.failUnlessEqual(503, self.request('open', ['1']).responseCode)
+
+    def test_handshake(self):
+        session = self.open()
+        c1 = ''.join([chr(i % 256) for i in xrange(constants.HANDSHAKE_SIZE)])
+
+        reply = self.reply(self.request('send', [session.id, '1'], "\x03" + c1))
+        self.failUnlessEqual("\x01" + _serverHandshake + c1, reply)
+
+    def test_idle(self):
+        session = self.open()
+
+        delays = [ord(self.reply(self.request('idle', [session.id, str(i)]))) for i in xrange(7)]
+        self.failUnlessEqual([3, 7, 15, 31, 33, 33, 33], delays)
+
+        session.write('abc')
+        session.writeSequence(['de', 'f'])
+        self.failUnlessEqual("\x01abcdef", self.reply(self.request('idle', [session.id, '8'])))
+        self.failUnlessEqual("\x03", self.reply(self.request('idle', [session.id, '9'])))
+
+    def test_hold(self):
+        self.patch(TunnelSession, 'holdTime', 0.5)
+        session = self.open()
+
+        request = self.request('idle', [session.id, '1'])
+        self.failIf(request.finished)
+        session.write('abc')
+        session.write('def')
+        self.clock.advance(0)
+        self.failUnless(request.finished)
+        self.failUnlessEqual("\x01abcdef", self.reply(request))
+
+        request = self.request('idle', [session.id, '2'])
+        self.clock.advance(0.5)
+        self.failUnlessEqual("\x03", self.reply(request))
+
+        # client sends data while poll is held
+        request = self.request('idle', [session.id, '3'])
+        self.request('send', [session.id, '4'], "\x03")
+        self.failUnlessEqual("\x07", self.reply(request))
+
+    def test_producer(self):
+        self.patch(TunnelSession, 'maxPending', 10)
+        session = self.open()
+
+        session.write('x' * 10)
+        self.failUnless(session.protocol.writePaused)
+        self.request('idle', [session.id, '1'])
+        self.failIf(session.protocol.writePaused)
+
+    def test_close(self):
+        session = self.open()
+        protocol = session.protocol
+
+        self.failUnlessEqual("\x00", self.reply(self.request('close', [session.id, '1'])))
+        self.failUnlessEqual({}, self.tunnel.sessions)
+        self.failUnlessEqual(None, protocol.peerHost)
+        self.failUnlessEqual(404, self.request('idle', [session.id, '2']).responseCode)
+
+    def test_loseConnection(self):
+        session = self.open()
+        protocol = session.protocol
+
+        session.write('abc')
+        protocol.transport.loseConnection()
+        session.write('def')
+        self.clock.advance(0)
+        self.failUnlessEqual(None, protocol.peerHost)
+
+        self.failUnlessEqual("\x01abc", self.reply(self.request('idle', [session.id, '1'])))
+        self.failUnlessEqual({}, self.tunnel.sessions)
+
+        # nothing to deliver, session is over right away
+        session = self.open()
+        session.protocol.transport.loseConnection()
+        self.failUnlessEqual({}, self.tunnel.sessions)
+
+    def test_expire(self):
+        self.patch(RTMPServerProtocol, 'handshakeTimeoutDelay', 3 * TunnelSession.timeout)
+        session = self.open()
+
+        self.clock.pump([1] * (TunnelSession.timeout - 1))
+        self.request('idle', [session.id, '1'])
+        self.clock.pump([1] * (TunnelSession.timeout - 1))
+        self.failUnless(session.id in self.tunnel.sessions)
+        self.clock.pump([1] * 2)
+        self.failUnlessEqual({}, self.tunnel.sessions)
+        self.failUnlessEqual(None, session.protocol.peerHost)
+
+    def test_get(self):
+        request = DummyRequest(['1'])
+        self.resources['open'].render(request)
+        self.failUnlessEqual(405, request.responseCode)
+        self.failUnlessEqual({}, self.tunnel.sessions)
@@ -0,0 +1,188 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Hashed timing wheel.
+
+Connection timers (handshake timeouts, keep-alive checks) are
+coarse-grained and numerous, so instead of reactor timer per
+connection they're kept in shared L{TimerWheel}, driven
+by single reactor timer.
+"""
+
+from twisted.internet import reactor, task
+from twisted.python import log
+
+class TimerWheelEntry(object):
+    """
+    Timer scheduled in L{TimerWheel}.
+
+    @ivar slot: slot of wheel holding this timer
+    @type slot: C{set}
+    @ivar rounds: number of full wheel rotations left before firing
+    @type rounds: C{int}
+    """
+
+    __slots__ = ('wheel', 'slot', 'rounds', 'func', 'args')
+
+    def __init__(self, wheel, slot, rounds, func, args):
+        """
+        Constructor.
+        """
+        self.wheel = wheel
+        self.slot = slot
+        self.rounds = rounds
+        self.func = func
+        self.args = args
+
+    def active(self):
+        """
+        Is timer still pending?
+
+        @rtype: C{bool}
+        """
+        return self.slot is not None
+
+    def cancel(self):
+        """
+        Cancel timer.
+        """
+        if self.slot is not None:
+            self.slot.discard(self)
+            self.slot = None
+            self.wheel._removed()
+
+class TimerWheel(object):
+    """
+    Hashed timing wheel.
+
+    Wheel consists of L{size} slots, each slot covers L{tick} seconds.
+    Timer is placed into slot by its expiration time, timers expiring
+    more than one rotation later count remaining rotations. Scheduling
+    and cancellation are O(1), all timers of slot are fired at once.
+
+    Reactor timer is running only while some timers are scheduled.
+
+    @ivar tick: wheel resolution (seconds)
+    @type tick: C{float}
+    @ivar size: number of slots
+    @type size: C{int}
+    @ivar slots: wheel slots (sets of L{TimerWheelEntry})
+    @type slots: C{list}
+    @ivar current: index of current slot
+    @type current: C{int}
+    @ivar count: number of scheduled timers
+    @type count: C{int}
+    """
+
+    def __init__(self, tick=1.0, size=512, clock=reactor):
+        """
+        Constructor.
+
+        @param tick: wheel resolution (seconds)
+        @type tick: C{float}
+        @param size: number of slots
+        @type size: C{int}
+        @param clock: clock used to schedule reactor timer
+        @type clock: C{IReactorTime}
+        """
+        self.tick = tick
+        self.size = size
+        self.slots = [set() for i in xrange(size)]
+        self.current = 0
+        self.count = 0
+        self.clock = clock
+        self.task = None
+
+    def schedule(self, delay, func, *args):
+        """
+        Schedule timer.
+
+        Timer fires no earlier than in L{delay} seconds, and
+        no later than one L{tick} after that. Time passed since
+        last tick of wheel is taken into account, as next tick
+        comes earlier than in one L{tick}.
+
+        @param delay: delay (seconds)
+        @type delay: C{float}
+        @param func: function to call
+        @param args: function arguments
+        @return: scheduled timer (could be cancelled)
+        @rtype: L{TimerWheelEntry}
+        """
+        delay += self._sinceTick()
+        ticks = int(delay / self.tick)
+        if ticks * self.tick < delay or ticks == 0:
+            ticks += 1
+
+        slot = self.slots[(self.current + ticks) % self.size]
+
+        entry = TimerWheelEntry(self, slot, (ticks - 1) // self.size, func, args)
+        slot.add(entry)
+
+        self.count += 1
+        if self.task is None:
+            self.task = task.LoopingCall.withCount(self._advance)
+            self.task.clock = self.clock
+            self.task.start(self.tick, now=False)
+
+        return entry
+
+    def _sinceTick(self):
+        """
+        Time passed since last tick of wheel.
+
+        @rtype: C{float}
+        """
+        if self.task is None or self.task.call is None:
+            # wheel is started now or it is ticking now
+            return 0.0
+
+        left = self.task.call.getTime() - self.clock.seconds()
+        return min(max(self.tick - left, 0.0), self.tick)
+
+    def _removed(self):
+        """
+        Timer was cancelled or fired.
+        """
+        self.count -= 1
+        if self.count == 0 and self.task is not None:
+            self.task.stop()
+            self.task = None
+
+    def _advance(self, ticks):
+        """
+        Reactor timer fired, advance wheel.
+
+        @param ticks: number of ticks passed since last call
+        @type ticks: C{int}
+        """
+        for i in xrange(ticks):
+            if self.task is None:
+                return
+
+            self.current = (self.current + 1) % self.size
+            slot = self.slots[self.current]
+
+            for entry in list(slot):
+                if entry.rounds > 0:
+                    entry.rounds -= 1
+                    continue
+
+                if entry.slot is None:
+                    continue
+
+                slot.discard(entry)
+                entry.slot = None
+                self._removed()
+
+                try:
+                    entry.func(*entry.args)
+                except Exception:
+                    log.err(None, "Error in timer")
+
+timers = TimerWheel()
+"""
+Timer wheel shared by all connections.
+"""
@@ -0,0 +1,433 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+RTMP tunneled over HTTP (RTMPT).
+
+Client opens session with C{POST /open/1}, then polls server with
+C{POST /send/<session>/<seq>} (body carries RTMP bytes from client)
+and C{POST /idle/<session>/<seq>}, C{POST /close/<session>/<seq>}
+finishes session. Each reply carries poll delay (one byte) followed
+by all RTMP bytes queued for client since last poll.
+
+Session is in-memory transport of L{RTMPServerProtocol}, so protocol
+doesn't know it is tunneled.
+"""
+
+import os
+
+from zope.interface import implements
+
+from twisted.internet import error, interfaces, reactor
+from twisted.python import failure, log
+from twisted.web import http, resource, server
+
+from fmspy.rtmp.timer import timers
+from fmspy.stats import metrics
+from fmspy.config import config
+
+class TunnelSession(object):
+    """
+    RTMPT session: transport of RTMP protocol, bytes written by protocol
+    are queued till next poll.
+
+    Poll delay reported to client adapts to traffic: it is minimal while
+    data flows and grows on each empty reply up to L{maxPollDelay}.
+    Idle poll without queued data is held for L{holdTime}, so data
+    written meanwhile is delivered without waiting for next poll.
+
+    @ivar tunnel: tunnel owning session
+    @type tunnel: L{RTMPTunnel}
+    @ivar id: session ID
+    @type id: C{str}
+    @ivar protocol: tunneled protocol
+    @type protocol: L{RTMPServerProtocol}
+    @ivar pending: bytes queued for client
+    @type pending: C{list} of C{str}
+    @ivar pendingBytes: length of L{pending}
+    @type pendingBytes: C{int}
+    @ivar delay: current poll delay
+    @type delay: C{int}
+    @ivar producer: producer registered by protocol
+    @type producer: C{IPushProducer}
+    @ivar waiting: held idle poll (or C{None})
+    @type waiting: C{Request}
+    @ivar expiry: timer closing session if client stops polling
+    @type expiry: L{TimerWheelEntry}
+    """
+    implements(interfaces.ITransport, interfaces.IConsumer)
+
+    timeout = config.getint('RTMPT', 'timeout')
+    """
+    Session is closed if there were no polls for that long (seconds).
+    """
+
+    holdTime = config.getfloat('RTMPT', 'holdTime')
+    """
+    Time to hold idle poll waiting for data (seconds), zero disables holding.
+    """
+
+    maxPollDelay = config.getint('RTMPT', 'maxPollDelay')
+    """
+    Maximum poll delay reported to client.
+    """
+
+    maxPending = config.getint('RTMPT', 'maxPending')
+    """
+    Amount of queued bytes which pauses protocol (bytes).
+    """
+
+    disconnecting = False
+    producer = None
+    producerPaused = False
+    waiting = None
+    holdCall = None
+
+    def __init__(self, tunnel, id, protocol, peer, host):
+        """
+        Constructor.
+
+        @param tunnel: tunnel owning session
+        @type tunnel: L{RTMPTunnel}
+        @param id: session ID
+        @type id: C{str}
+        @param protocol: tunneled protocol
+        @type protocol: L{RTMPServerProtocol}
+        @param peer: address of client
+        @param host: address of server
+        """
+        self.tunnel = tunnel
+        self.id = id
+        self.protocol = protocol
+        self.peer = peer
+        self.host = host
+        self.pending = []
+        self.pendingBytes = 0
+        self.delay = 1
+        self.expiry = tunnel.timers.schedule(self.timeout, self._expired)
+
+    def __repr__(self):
+        return "<TunnelSession(%s, %r)>" % (self.id, self.peer)
+
+    def write(self, data):
+        """
+        Queue bytes for client.
+
+        @param data: bytes
+        @type data: C{str}
+        """
+        if self.disconnecting or not data:
+            return
+
+        self.pending.append(data)
+        self.pendingBytes += len(data)
+
+        if self.producer is not None and not self.producerPaused and self.pendingBytes >= self.maxPending:
+            self.producerPaused = True
+            self.producer.pauseProducing()
+
+        if self.waiting is not None and self.holdCall is not None:
+            # reply once protocol is done writing in this reactor iteration
+            self.holdCall.cancel()
+            self.holdCall = self.tunnel.clock.callLater(0, self._release)
+
+    def writeSequence(self, data):
+        """
+        Queue bytes for client.
+
+        @param data: list of strings
+        @type data: C{list}
+        """
+        for chunk in data:
+            self.write(chunk)
+
+    def loseConnection(self):
+        """
+        Protocol closes connection.
+
+        Bytes already queued are delivered on next poll.
+        """
+        if self.disconnecting:
+            return
+
+        self.disconnecting = True
+        self.tunnel.clock.callLater(0, self._connectionLost, error.ConnectionDone())
+        if self.waiting is not None:
+            self._release()
+        elif not self.pending:
+            self._remove()
+
+    def getPeer(self):
+        return self.peer
+
+    def getHost(self):
+        return self.host
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def poll(self, request, data):
+        """
+        Client poll (C{send} or C{idle} command).
+
+        @param request: HTTP request
+        @type request: C{Request}
+        @param data: bytes sent by client
+        @type data: C{str}
+        @return: reply or C{NOT_DONE_YET} if poll is held
+        """
+        self.expiry.cancel()
+        self.expiry = self.tunnel.timers.schedule(self.timeout, self._expired)
+
+        if self.waiting is not None:
+            self._release()
+
+        if data and not self.disconnecting:
+            self.protocol.dataReceived(data)
+
+        if not data and not self.pending and not self.disconnecting and self.holdTime > 0:
+            self.waiting = request
+            self.holdCall = self.tunnel.clock.callLater(self.holdTime, self._release)
+            request.notifyFinish().addErrback(self._abandoned, request)
+            return server.NOT_DONE_YET
+
+        return self._reply(bool(data))
+
+    def close(self):
+        """
+        Client finishes session (C{close} command).
+        """
+        if self.waiting is not None:
+            self._release()
+        self.pending = []
+        self.pendingBytes = 0
+        self._remove()
+        if not self.disconnecting:
+            self.disconnecting = True
+            self._connectionLost(error.ConnectionDone())
+
+    def _reply(self, active=False):
+        """
+        Build reply to poll: poll delay and queued bytes.
+
+        @param active: did client send any data?
+        @type active: C{bool}
+        @rtype: C{str}
+        """
+        if active or self.pending:
+            self.delay = 1
+        else:
+            self.delay = min(self.delay * 2 + 1, self.maxPollDelay)
+
+        data = chr(self.delay) + "".join(self.pending)
+        self.pending = []
+        self.pendingBytes = 0
+        metrics.increment('rtmpt.polls')
+
+        if self.disconnecting:
+            # last bytes of closed session are delivered
+            self._remove()
+        elif self.producerPaused:
+            self.producerPaused = False
+            if self.producer is not None:
+                self.producer.resumeProducing()
+
+        return data
+
+    def _release(self):
+        """
+        Reply to held poll.
+        """
+        request, self.waiting = self.waiting, None
+        if self.holdCall is not None and self.holdCall.active():
+            self.holdCall.cancel()
+        self.holdCall = None
+
+        data = self._reply()
+        self.tunnel.headers(request)
+        request.setHeader('content-length', str(len(data)))
+        request.write(data)
+        request.finish()
+
+    def _abandoned(self, reason, request):
+        """
+        Client dropped held poll.
+        """
+        if self.waiting is request:
+            self.waiting = None
+            self.holdCall.cancel()
+            self.holdCall = None
+
+    def _expired(self):
+        """
+        Client stopped polling.
+        """
+        self.expiry = None
+        log.msg("RTMPT session %s expired" % self.id)
+        self.close()
+
+    def _remove(self):
+        """
+        Forget session.
+        """
+        if self.expiry is not None:
+            self.expiry.cancel()
+            self.expiry = None
+        self.tunnel.remove(self)
+
+    def _connectionLost(self, reason):
+        """
+        Notify protocol that connection is lost.
+        """
+        self.producer = None
+        self.protocol.connectionLost(failure.Failure(reason))
+
+class RTMPTunnel(object):
+    """
+    RTMPT sessions of HTTP server.
+
+    @ivar factory: factory of tunneled protocols
+    @type factory: L{RTMPServerFactory}
+    @ivar sessions: open sessions by session ID
+    @type sessions: C{dict}
+    @ivar clock: clock for held polls
+    @type clock: C{IReactorTime}
+    @ivar timers: timer wheel for session expiration
+    @type timers: L{TimerWheel}
+    """
+
+    commands = ('open', 'send', 'idle', 'close')
+    """
+    RTMPT commands (top-level URLs of HTTP server).
+    """
+
+    def __init__(self, factory, clock=reactor, timers=timers):
+        """
+        Constructor.
+
+        @param factory: factory of tunneled protocols
+        @type factory: L{RTMPServerFactory}
+        @param clock: clock for held polls
+        @type clock: C{IReactorTime}
+        @param timers: timer wheel for session expiration
+        @type timers: L{TimerWheel}
+        """
+        self.factory = factory
+        self.sessions = {}
+        self.clock = clock
+        self.timers = timers
+
+    def install(self, root):
+        """
+        Attach command resources to root of HTTP server.
+
+        @param root: root resource
+        @type root: C{Resource}
+        """
+        for command in self.commands:
+            root.putChild(command, TunnelResource(self, command))
+
+    def open(self, request):
+        """
+        Open new session.
+
+        @param request: HTTP request
+        @type request: C{Request}
+        @return: session or C{None} if connection isn't admitted
+        @rtype: L{TunnelSession}
+        """
+        peer = request.getClientAddress()
+        protocol = self.factory.buildProtocol(peer)
+        if protocol is None:
+            return None
+
+        id = os.urandom(8).encode('hex')
+        session = TunnelSession(self, id, protocol, peer, request.getHost())
+        self.sessions[id] = session
+        metrics.adjust('rtmpt.sessions', 1)
+
+        protocol.makeConnection(session)
+        return session
+
+    def remove(self, session):
+        """
+        Session is over.
+
+        @param session: session
+        @type session: L{TunnelSession}
+        """
+        if self.sessions.pop(session.id, None) is not None:
+            metrics.adjust('rtmpt.sessions', -1)
+
+    def headers(self, request):
+        """
+        Set headers of reply.
+
+        @param request: HTTP request
+        @type request: C{Request}
+        """
+        request.setHeader('content-type', 'application/x-fcs')
+        request.setHeader('cache-control', 'no-cache')
+        request.setHeader('connection', 'keep-alive')
+
+class TunnelResource(resource.Resource):
+    """
+    RTMPT command: C{/<command>/<session>/<seq>}.
+
+    @ivar tunnel: tunnel
+    @type tunnel: L{RTMPTunnel}
+    @ivar command: command name
+    @type command: C{str}
+    """
+    isLeaf = True
+
+    def __init__(self, tunnel, command):
+        """
+        Constructor.
+
+        @param tunnel: tunnel
+        @type tunnel: L{RTMPTunnel}
+        @param command: command name, one of L{RTMPTunnel.commands}
+        @type command: C{str}
+        """
+        resource.Resource.__init__(self)
+        self.tunnel = tunnel
+        self.command = command
+
+    def render_GET(self, request):
+        request.setResponseCode(http.NOT_ALLOWED)
+        request.setHeader('allow', 'POST')
+        return ''
+
+    def render_POST(self, request):
+        """
+        Execute command.
+        """
+        tunnel = self.tunnel
+
+        if self.command == 'open':
+            session = tunnel.open(request)
+            if session is None:
+                request.setResponseCode(http.SERVICE_UNAVAILABLE)
+                return ''
+            tunnel.headers(request)
+            return session.id + "\n"
+
+        session = tunnel.sessions.get(request.postpath[0] if request.postpath else None)
+        if session is None:
+            return resource.NoResource().render(request)
+
+        if self.command == 'close':
+            session.close()
+            tunnel.headers(request)
+            return "\x00"
+
+        data = request.content.read() if self.command == 'send' else ''
+        result = session.poll(request, data)
+        if result is not server.NOT_DONE_YET:
+            tunnel.headers(request)
+        return result
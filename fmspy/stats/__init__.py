@@ -0,0 +1,12 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Monitoring and load analysis.
+
+Global metrics, per-application and per-room resource accounting.
+"""
+
+from fmspy.stats.metrics import metrics
+from fmspy.stats.accounting import accounting
@@ -0,0 +1,208 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Per-application and per-room resource accounting.
+
+Bytes, packets, invokes and handler CPU time are attributed
+to application and room of each connection, so that noisy
+applications and rooms could be found.
+"""
+
+class Usage(object):
+    """
+    Resources consumed by application or room.
+
+    @ivar name: name of accounted entity
+    @type name: C{str}
+    @ivar clients: number of clients connected now
+    @type clients: C{int}
+    @ivar connects: number of connects so far
+    @type connects: C{int}
+    @ivar bytes_in: payload bytes received from clients
+    @type bytes_in: C{int}
+    @ivar bytes_out: payload bytes sent to clients
+    @type bytes_out: C{int}
+    @ivar packets_in: packets received from clients
+    @type packets_in: C{int}
+    @ivar packets_out: packets sent to clients
+    @type packets_out: C{int}
+    @ivar invokes: number of application invokes
+    @type invokes: C{int}
+    @ivar cpu_time: CPU time spent in application invoke handlers (seconds)
+    @type cpu_time: C{float}
+    """
+
+    fields = ('clients', 'connects', 'bytes_in', 'bytes_out', 'packets_in', 'packets_out', 'invokes', 'cpu_time')
+    """
+    Names of accounted values.
+    """
+
+    def __init__(self, name):
+        """
+        Constructor.
+
+        @param name: name of accounted entity
+        @type name: C{str}
+        """
+        self.name = name
+        self.clients = self.connects = 0
+        self.bytes_in = self.bytes_out = 0
+        self.packets_in = self.packets_out = 0
+        self.invokes = 0
+        self.cpu_time = 0.0
+
+    def __repr__(self):
+        return "<Usage %r>" % self.name
+
+    def received(self, bytes):
+        """
+        Account received packet.
+
+        @param bytes: packet length
+        @type bytes: C{int}
+        """
+        self.packets_in += 1
+        self.bytes_in += bytes
+
+    def sent(self, bytes):
+        """
+        Account sent packet.
+
+        @param bytes: packet length
+        @type bytes: C{int}
+        """
+        self.packets_out += 1
+        self.bytes_out += bytes
+
+    def invoked(self, cpu_time):
+        """
+        Account application invoke.
+
+        @param cpu_time: CPU time spent in handler (seconds)
+        @type cpu_time: C{float}
+        """
+        self.invokes += 1
+        self.cpu_time += cpu_time
+
+    def as_dict(self):
+        """
+        Represent usage as dictionary.
+
+        @rtype: C{dict}
+        """
+        result = dict([(field, getattr(self, field)) for field in self.fields])
+        result['name'] = self.name
+        return result
+
+class ResourceAccounting(object):
+    """
+    Resource accounting for applications and rooms.
+
+    Each connected protocol gets property C{usage}: tuple of
+    L{Usage} objects (application's and room's) which should
+    be updated by protocol.
+
+    @ivar apps: usage of applications, application name -> L{Usage}
+    @type apps: C{dict}
+    @ivar rooms: usage of rooms, "application/room" -> L{Usage}
+    @type rooms: C{dict}
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.apps = {}
+        self.rooms = {}
+
+    def _room_key(self, application, room):
+        """
+        Name of room for accounting purposes.
+
+        @param application: application owning room
+        @type application: L{Application}
+        @param room: room
+        @type room: L{Room}
+        @rtype: C{str}
+        """
+        return "%s/%s" % (application.name(), room.name)
+
+    def enter(self, protocol, application, room):
+        """
+        Client entered room of application.
+
+        @param protocol: client protocol
+        @type protocol: L{RTMPServerProtocol}
+        @param application: application
+        @type application: L{Application}
+        @param room: room
+        @type room: L{Room}
+        """
+        app_name = application.name()
+        room_key = self._room_key(application, room)
+
+        app_usage = self.apps.get(app_name)
+        if app_usage is None:
+            app_usage = self.apps[app_name] = Usage(app_name)
+
+        room_usage = self.rooms.get(room_key)
+        if room_usage is None:
+            room_usage = self.rooms[room_key] = Usage(room_key)
+
+        protocol.usage = (app_usage, room_usage)
+
+        for usage in protocol.usage:
+            usage.clients += 1
+            usage.connects += 1
+
+    def leave(self, protocol):
+        """
+        Client left its room.
+
+        @param protocol: client protocol
+        @type protocol: L{RTMPServerProtocol}
+        """
+        for usage in getattr(protocol, 'usage', ()):
+            usage.clients -= 1
+
+        protocol.usage = ()
+
+    def forget_room(self, application, room):
+        """
+        Room was destroyed, forget its usage.
+
+        @param application: application
+        @type application: L{Application}
+        @param room: room
+        @type room: L{Room}
+        """
+        self.rooms.pop(self._room_key(application, room), None)
+
+    def top(self, field, n=10, level='room'):
+        """
+        Find top consumers of some resource.
+
+        @param field: resource name, one of L{Usage.fields}
+        @type field: C{str}
+        @param n: number of entries to return
+        @type n: C{int}
+        @param level: C{'app'} or C{'room'}
+        @type level: C{str}
+        @return: top L{Usage}s, sorted by resource in descending order
+        @rtype: C{list}
+        """
+        if field not in Usage.fields:
+            raise ValueError(field)
+
+        if level == 'app':
+            usages = self.apps.itervalues()
+        elif level == 'room':
+            usages = self.rooms.itervalues()
+        else:
+            raise ValueError(level)
+
+        return sorted(usages, key=lambda usage: getattr(usage, field), reverse=True)[:n]
+
+accounting = ResourceAccounting()
@@ -0,0 +1,142 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Global server metrics.
+
+Metrics are named counters, gauges and timings, shared
+by all parts of server.
+"""
+
+class Timing(object):
+    """
+    Summary of observed values (usually durations).
+
+    @ivar count: number of observations
+    @type count: C{int}
+    @ivar total: sum of observed values
+    @type total: C{float}
+    @ivar max: maximum observed value
+    @type max: C{float}
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """
+        Add new observation.
+
+        @param value: observed value
+        @type value: C{float}
+        """
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def as_dict(self):
+        """
+        Represent timing as dictionary.
+
+        @rtype: C{dict}
+        """
+        return {
+                'count' : self.count,
+                'total' : self.total,
+                'max' : self.max,
+                'avg' : self.total / self.count if self.count else 0.0,
+               }
+
+class Metrics(object):
+    """
+    Registry of named metrics.
+
+    @ivar counters: monotonic counters, name -> value
+    @type counters: C{dict}
+    @ivar gauges: current values, name -> value
+    @type gauges: C{dict}
+    @ivar timings: observed values, name -> L{Timing}
+    @type timings: C{dict}
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all metrics.
+        """
+        self.counters = {}
+        self.gauges = {}
+        self.timings = {}
+
+    def increment(self, name, value=1):
+        """
+        Increment counter.
+
+        @param name: counter name
+        @type name: C{str}
+        @param value: increment
+        @type value: C{int}
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        """
+        Set gauge value.
+
+        @param name: gauge name
+        @type name: C{str}
+        @param value: current value
+        @type value: C{int} or C{float}
+        """
+        self.gauges[name] = value
+
+    def adjust(self, name, delta):
+        """
+        Change gauge value by delta.
+
+        @param name: gauge name
+        @type name: C{str}
+        @param delta: change of value
+        @type delta: C{int} or C{float}
+        """
+        self.gauges[name] = self.gauges.get(name, 0) + delta
+
+    def observe(self, name, value):
+        """
+        Record observation for timing.
+
+        @param name: timing name
+        @type name: C{str}
+        @param value: observed value
+        @type value: C{float}
+        """
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = Timing()
+        timing.observe(value)
+
+    def snapshot(self):
+        """
+        Get current state of all metrics.
+
+        @rtype: C{dict}
+        """
+        return {
+                'counters' : dict(self.counters),
+                'gauges' : dict(self.gauges),
+                'timings' : dict([(name, timing.as_dict()) for (name, timing) in self.timings.iteritems()]),
+               }
+
+metrics = Metrics()
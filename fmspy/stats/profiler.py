@@ -0,0 +1,189 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Profiling of reactor hot path.
+
+Sampling profiler periodically (on CPU timer signal) records
+stack of reactor thread, samples are dumped in "collapsed stack"
+format suitable for building flamegraphs. Timing spans measure
+explicitly marked methods.
+"""
+
+import os
+import signal
+import time
+
+from twisted.application import service
+from twisted.python import log
+
+from fmspy.stats.metrics import metrics
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler of reactor (main) thread.
+
+    Profiler uses C{ITIMER_PROF} timer, so samples are taken
+    when process consumes CPU.
+
+    @ivar interval: sampling interval (seconds of CPU time)
+    @type interval: C{float}
+    @ivar stacks: number of samples for each collapsed stack
+    @type stacks: C{dict}, C{str} -> C{int}
+    @ivar samples: total number of samples
+    @type samples: C{int}
+    @ivar running: is profiler running?
+    @type running: C{bool}
+    """
+
+    def __init__(self, interval=0.005):
+        """
+        Constructor.
+
+        @param interval: sampling interval (seconds of CPU time)
+        @type interval: C{float}
+        """
+        self.interval = interval
+        self.running = False
+        self.reset()
+
+    def reset(self):
+        """
+        Forget collected samples.
+        """
+        self.stacks = {}
+        self.samples = 0
+
+    def start(self):
+        """
+        Start sampling.
+        """
+        if self.running:
+            return
+
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self.running = True
+
+    def stop(self):
+        """
+        Stop sampling.
+        """
+        if not self.running:
+            return
+
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_IGN)
+        self.running = False
+
+    def _sample(self, signum, frame):
+        """
+        Timer signal handler: record stack of interrupted frame.
+        """
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+
+        stack.reverse()
+        key = ';'.join(stack)
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def collapsed(self):
+        """
+        Dump samples in collapsed stack format.
+
+        Each line contains semicolon-separated stack (root first) and
+        number of samples.
+
+        @rtype: C{str}
+        """
+        return ''.join(["%s %d\n" % (stack, count) for (stack, count) in sorted(self.stacks.iteritems())])
+
+class Spans(object):
+    """
+    Timing spans around explicitly marked methods.
+
+    Duration of each call is observed in global metrics
+    as timing C{span.<name>}. Measurement is performed only
+    when spans are enabled.
+
+    @ivar enabled: are spans measured?
+    @type enabled: C{bool}
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.enabled = False
+
+    def timed(self, name):
+        """
+        Decorator, marking method as timing span.
+
+        @param name: span name
+        @type name: C{str}
+        """
+        metric = 'span.' + name
+
+        def decorator(func):
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+
+                start = time.time()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    metrics.observe(metric, time.time() - start)
+
+            wrapper.__name__ = func.__name__
+            wrapper.__doc__ = func.__doc__
+            return wrapper
+
+        return decorator
+
+class ProfilerService(service.Service):
+    """
+    Service running profiler for whole server lifetime.
+
+    Collapsed stacks are dumped to L{output} on service stop.
+
+    @ivar output: file name for collapsed stacks
+    @type output: C{str}
+    """
+
+    def __init__(self, output=None):
+        """
+        Constructor.
+
+        @param output: file name for collapsed stacks
+        @type output: C{str}
+        """
+        self.output = output
+
+    def startService(self):
+        service.Service.startService(self)
+        spans.enabled = True
+        profiler.start()
+
+    def stopService(self):
+        service.Service.stopService(self)
+        profiler.stop()
+        spans.enabled = False
+
+        if self.output is not None:
+            f = open(self.output, 'w')
+            try:
+                f.write(profiler.collapsed())
+            finally:
+                f.close()
+            log.msg('Profiler samples (%d) dumped to %r.' % (profiler.samples, self.output))
+
+profiler = SamplingProfiler()
+spans = Spans()
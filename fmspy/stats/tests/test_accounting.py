@@ -0,0 +1,76 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.stats.accounting}.
+"""
+
+import unittest
+
+from fmspy.stats.accounting import ResourceAccounting
+from fmspy.application.room import Room
+
+class ApplicationMock(object):
+    """
+    Mock for application.
+    """
+
+    def name(self):
+        return 'app'
+
+class ClientMock(object):
+    """
+    Mock for client protocol.
+    """
+
+class ResourceAccountingTestCase(unittest.TestCase):
+    """
+    Test case for L{fmspy.stats.accounting.ResourceAccounting}.
+    """
+
+    def setUp(self):
+        self.a = ResourceAccounting()
+        self.app = ApplicationMock()
+        self.kitchen = Room(self.app, 'kitchen')
+        self.garage = Room(self.app, 'garage')
+        self.c1 = ClientMock()
+        self.c2 = ClientMock()
+
+    def test_enter_leave(self):
+        self.a.enter(self.c1, self.app, self.kitchen)
+        self.a.enter(self.c2, self.app, self.kitchen)
+
+        self.failUnlessEqual(['app'], self.a.apps.keys())
+        self.failUnlessEqual(['app/kitchen'], self.a.rooms.keys())
+        self.failUnless(self.c1.usage[1] is self.c2.usage[1])
+        self.failUnlessEqual(2, self.a.rooms['app/kitchen'].clients)
+
+        self.a.leave(self.c1)
+        self.failUnlessEqual((), self.c1.usage)
+        self.failUnlessEqual(1, self.a.apps['app'].clients)
+        self.failUnlessEqual(2, self.a.apps['app'].connects)
+
+        self.a.forget_room(self.app, self.kitchen)
+        self.failUnlessEqual({}, self.a.rooms)
+        self.a.forget_room(self.app, self.kitchen)
+
+    def test_top(self):
+        self.a.enter(self.c1, self.app, self.kitchen)
+        self.a.enter(self.c2, self.app, self.garage)
+
+        for usage in self.c1.usage:
+            usage.sent(100)
+            usage.invoked(0.5)
+        for usage in self.c2.usage:
+            usage.sent(200)
+            usage.received(10)
+
+        self.failUnlessEqual(['app/garage', 'app/kitchen'], [usage.name for usage in self.a.top('bytes_out')])
+        self.failUnlessEqual(['app/kitchen'], [usage.name for usage in self.a.top('cpu_time', n=1)])
+        self.failUnlessEqual([{'name' : 'app', 'clients' : 2, 'connects' : 2, 'bytes_in' : 10, 'bytes_out' : 300,
+                                'packets_in' : 1, 'packets_out' : 2, 'invokes' : 1, 'cpu_time' : 0.5}],
+                                [usage.as_dict() for usage in self.a.top('bytes_out', level='app')])
+
+        self.failUnlessRaises(ValueError, self.a.top, 'foo')
+        self.failUnlessRaises(ValueError, self.a.top, 'bytes_out', level='foo')
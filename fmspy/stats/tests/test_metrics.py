@@ -0,0 +1,41 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.stats.metrics}.
+"""
+
+import unittest
+
+from fmspy.stats.metrics import Metrics
+
+class MetricsTestCase(unittest.TestCase):
+    """
+    Test case for L{fmspy.stats.metrics.Metrics}.
+    """
+
+    def setUp(self):
+        self.m = Metrics()
+
+    def test_increment(self):
+        self.m.increment('a')
+        self.m.increment('a', 2)
+        self.m.increment('b')
+        self.failUnlessEqual({'a' : 3, 'b' : 1}, self.m.snapshot()['counters'])
+
+    def test_gauge(self):
+        self.m.gauge('a', 5)
+        self.m.adjust('a', -2)
+        self.m.adjust('b', 1)
+        self.failUnlessEqual({'a' : 3, 'b' : 1}, self.m.snapshot()['gauges'])
+
+    def test_observe(self):
+        self.m.observe('a', 1.0)
+        self.m.observe('a', 3.0)
+        self.failUnlessEqual({'a' : {'count' : 2, 'total' : 4.0, 'max' : 3.0, 'avg' : 2.0}}, self.m.snapshot()['timings'])
+
+    def test_reset(self):
+        self.m.increment('a')
+        self.m.reset()
+        self.failUnlessEqual({'counters' : {}, 'gauges' : {}, 'timings' : {}}, self.m.snapshot())
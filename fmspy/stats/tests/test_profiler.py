@@ -0,0 +1,81 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.stats.profiler}.
+"""
+
+import sys
+import time
+import unittest
+
+from fmspy.stats.profiler import SamplingProfiler, Spans
+from fmspy.stats.metrics import metrics
+
+class SamplingProfilerTestCase(unittest.TestCase):
+    """
+    Test case for L{fmspy.stats.profiler.SamplingProfiler}.
+    """
+
+    def setUp(self):
+        self.p = SamplingProfiler(0.001)
+
+    def tearDown(self):
+        self.p.stop()
+
+    def test_sample(self):
+        def inner():
+            self.p._sample(None, sys._getframe())
+
+        inner()
+        inner()
+
+        self.failUnlessEqual(2, self.p.samples)
+        self.failUnlessEqual(1, len(self.p.stacks))
+
+        line = self.p.collapsed()
+        self.failUnless(line.endswith(";inner (test_profiler.py:%d) 2\n" % inner.func_code.co_firstlineno))
+
+        self.p.reset()
+        self.failUnlessEqual('', self.p.collapsed())
+
+    def test_start_stop(self):
+        self.p.start()
+        self.failUnless(self.p.running)
+
+        start = time.clock()
+        while time.clock() - start < 0.1:
+            pass
+
+        self.p.stop()
+        self.failIf(self.p.running)
+        self.failUnless(self.p.samples > 0)
+
+class SpansTestCase(unittest.TestCase):
+    """
+    Test case for L{fmspy.stats.profiler.Spans}.
+    """
+
+    def setUp(self):
+        metrics.reset()
+        self.s = Spans()
+
+    def tearDown(self):
+        metrics.reset()
+
+    def test_timed(self):
+        @self.s.timed('test')
+        def func(a, b=1):
+            """
+            Doc.
+            """
+            return a + b
+
+        self.failUnlessEqual('func', func.__name__)
+        self.failUnlessEqual(3, func(2))
+        self.failIf('span.test' in metrics.timings)
+
+        self.s.enabled = True
+        self.failUnlessEqual(5, func(2, b=3))
+        self.failUnlessEqual(1, metrics.timings['span.test'].count)
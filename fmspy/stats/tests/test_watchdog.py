@@ -0,0 +1,62 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.stats.watchdog}.
+"""
+
+import unittest
+
+from twisted.internet import task
+
+from fmspy.stats.watchdog import ReactorWatchdog, InvokeWatchdog
+from fmspy.stats.metrics import metrics
+
+class ReactorWatchdogTestCase(unittest.TestCase):
+    """
+    Test case for L{fmspy.stats.watchdog.ReactorWatchdog}.
+    """
+
+    def setUp(self):
+        metrics.reset()
+        self.clock = task.Clock()
+        self.w = ReactorWatchdog(1.0, 0.1, self.clock)
+        self.w.startService()
+
+    def tearDown(self):
+        self.w.stopService()
+        self.failUnlessEqual([], self.clock.getDelayedCalls())
+        metrics.reset()
+
+    def test_lag(self):
+        self.clock.advance(1.0)
+        self.failUnlessEqual(0.0, metrics.gauges['reactor.lag'])
+        self.failIf('reactor.stalls' in metrics.counters)
+
+        self.clock.advance(1.5)
+        self.failUnlessEqual(0.5, metrics.gauges['reactor.lag'])
+        self.failUnlessEqual(1, metrics.counters['reactor.stalls'])
+        self.failUnlessEqual(2, metrics.timings['reactor.lag'].count)
+
+class InvokeWatchdogTestCase(unittest.TestCase):
+    """
+    Test case for L{fmspy.stats.watchdog.InvokeWatchdog}.
+    """
+
+    def setUp(self):
+        metrics.reset()
+        self.w = InvokeWatchdog(0.5)
+
+    def tearDown(self):
+        metrics.reset()
+
+    def test_finish(self):
+        self.w.finish(self.w.start(), 'fast', (1, 2))
+        self.failUnlessEqual(1, metrics.timings['invoke.time'].count)
+        self.failIf('invoke.slow' in metrics.counters)
+
+        self.w.finish(self.w.start() - 1.0, 'slow', ('a' * 1000, ))
+        self.failUnlessEqual(2, metrics.timings['invoke.time'].count)
+        self.failUnlessEqual(1, metrics.counters['invoke.slow'])
+        self.failIf('invoke.slow.slow' in metrics.counters)
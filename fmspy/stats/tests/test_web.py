@@ -0,0 +1,50 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Tests for L{fmspy.stats.web}.
+"""
+
+from twisted.trial import unittest
+from twisted.internet import address
+from twisted.web import resource
+from twisted.web.test.requesthelper import DummyRequest
+
+from fmspy.stats.web import StatsResource
+
+class StatsResourceTestCase(unittest.TestCase):
+    """
+    Test case for access to L{StatsResource}.
+    """
+
+    def setUp(self):
+        self.root = resource.Resource()
+        self.root.putChild('stats', StatsResource())
+
+    def request(self, path, host='127.0.0.1', method='GET', headers={}):
+        request = DummyRequest(path.split('/'))
+        request.method = method
+        request.client = address.IPv4Address('TCP', host, 5000)
+        for (name, value) in headers.items():
+            request.requestHeaders.setRawHeaders(name, [value])
+        result = resource.getChildForRequest(self.root, request).render(request)
+        if isinstance(result, str):
+            request.write(result)
+        return request
+
+    def test_local(self):
+        self.failUnlessEqual(None, self.request('stats').responseCode)
+        self.failUnlessEqual(None, self.request('stats/top').responseCode)
+        self.failUnlessEqual(403, self.request('stats', host='10.0.0.1').responseCode)
+        self.failUnlessEqual(403, self.request('stats/profiler/start', host='10.0.0.1', method='POST').responseCode)
+
+    def test_token(self):
+        self.patch(StatsResource, 'token', 'secret')
+        self.failUnlessEqual(403, self.request('stats').responseCode)
+        self.failUnlessEqual(403, self.request('stats/', host='10.0.0.1', headers={'authorization' : 'Bearer wrong'}).responseCode)
+        self.failUnlessEqual(None, self.request('stats/', host='10.0.0.1', headers={'authorization' : 'Bearer secret'}).responseCode)
+
+    def test_post_only(self):
+        self.failUnlessEqual(405, self.request('stats/profiler/reset').responseCode)
+        self.failUnlessEqual(None, self.request('stats/profiler/reset', method='POST').responseCode)
@@ -0,0 +1,147 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Watchdogs catching code blocking event loop.
+
+Reactor watchdog measures reactor loop lag, invoke watchdog
+measures synchronous execution time of invoke handlers.
+"""
+
+import time
+
+from twisted.application import service
+from twisted.internet import reactor
+from twisted.python import log
+
+from fmspy.stats.metrics import metrics
+
+class ReactorWatchdog(service.Service):
+    """
+    Reactor loop lag watchdog.
+
+    Periodic timer is scheduled every L{interval} seconds, lag is
+    the difference between actual and scheduled time of timer run.
+    Lag is reported as timing and gauge C{reactor.lag}, lags above
+    L{threshold} are logged and counted as C{reactor.stalls}.
+
+    @ivar interval: interval between measurements (seconds)
+    @type interval: C{float}
+    @ivar threshold: lag considered to be a stall (seconds)
+    @type threshold: C{float}
+    @ivar clock: clock used to schedule timers
+    @type clock: C{IReactorTime}
+    """
+
+    def __init__(self, interval=1.0, threshold=0.1, clock=reactor):
+        """
+        Constructor.
+
+        @param interval: interval between measurements (seconds)
+        @type interval: C{float}
+        @param threshold: lag considered to be a stall (seconds)
+        @type threshold: C{float}
+        @param clock: clock used to schedule timers
+        @type clock: C{IReactorTime}
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self.clock = clock
+        self.call = None
+        self.expected = None
+
+    def startService(self):
+        service.Service.startService(self)
+        self._schedule()
+
+    def stopService(self):
+        service.Service.stopService(self)
+        if self.call is not None:
+            self.call.cancel()
+            self.call = None
+
+    def _schedule(self):
+        """
+        Schedule next measurement.
+        """
+        self.expected = self.clock.seconds() + self.interval
+        self.call = self.clock.callLater(self.interval, self._tick)
+
+    def _tick(self):
+        """
+        Timer fired, measure lag.
+        """
+        lag = max(0.0, self.clock.seconds() - self.expected)
+
+        metrics.observe('reactor.lag', lag)
+        metrics.gauge('reactor.lag', lag)
+
+        if lag > self.threshold:
+            metrics.increment('reactor.stalls')
+            log.msg("Reactor stalled for %.3f s" % lag)
+
+        self._schedule()
+
+class InvokeWatchdog(object):
+    """
+    Invoke handlers watchdog.
+
+    Synchronous execution time of each invoke handler is reported
+    as timing C{invoke.time}. Invokes running longer than L{threshold}
+    are logged (with name and arguments summary) and counted as
+    C{invoke.slow}. Invoke names come from clients, so they aren't
+    used as metric names.
+
+    @ivar threshold: execution time considered to be slow (seconds)
+    @type threshold: C{float}
+    """
+
+    summaryLength = 200
+    """
+    Maximum length of arguments summary in log.
+    """
+
+    def __init__(self, threshold=0.05):
+        """
+        Constructor.
+
+        @param threshold: execution time considered to be slow (seconds)
+        @type threshold: C{float}
+        """
+        self.threshold = threshold
+
+    def start(self):
+        """
+        Start measuring invoke.
+
+        @return: start mark, to be passed to L{finish}
+        @rtype: C{float}
+        """
+        return time.time()
+
+    def finish(self, start, name, args):
+        """
+        Invoke handler returned.
+
+        @param start: start mark from L{start}
+        @type start: C{float}
+        @param name: invoke name
+        @type name: C{str}
+        @param args: invoke arguments
+        @type args: C{tuple}
+        """
+        elapsed = time.time() - start
+
+        metrics.observe('invoke.time', elapsed)
+
+        if elapsed > self.threshold:
+            metrics.increment('invoke.slow')
+
+            summary = repr(args)
+            if len(summary) > self.summaryLength:
+                summary = summary[:self.summaryLength] + '...'
+
+            log.msg("Slow invoke %s%s: %.3f s" % (name, summary, elapsed))
+
+invoke_watchdog = InvokeWatchdog()
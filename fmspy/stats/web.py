@@ -0,0 +1,204 @@
+# FMSPy - Copyright (c) 2009 Andrey Smirnov.
+#
+# See COPYRIGHT for details.
+
+"""
+Statistics HTTP endpoint.
+
+Resources are attached to bundled HTTP server
+under C{/stats/}, replies are JSON-encoded.
+
+Statistics are available only to local clients or, if token is
+configured, to clients presenting it (C{Authorization: Bearer <token>}).
+"""
+
+import hmac
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from twisted.web import resource, http
+
+from fmspy.stats.metrics import metrics
+from fmspy.stats.accounting import accounting
+from fmspy.stats.profiler import profiler, spans
+from fmspy.config import config
+
+class JSONResource(resource.Resource):
+    """
+    Resource replying with JSON-encoded data.
+    """
+
+    def render_GET(self, request):
+        """
+        Render resource.
+        """
+        request.setHeader('content-type', 'application/json')
+        try:
+            result = self.data(request)
+        except ValueError, e:
+            request.setResponseCode(http.BAD_REQUEST)
+            result = { 'error' : str(e) }
+
+        return json.dumps(result)
+
+    def data(self, request):
+        """
+        Build data for reply.
+
+        Implemented in descendants.
+
+        @raise ValueError: request is invalid
+        """
+        raise NotImplementedError
+
+class TopResource(JSONResource):
+    """
+    Top resource consumers (applications or rooms).
+
+    Query arguments: C{by} (resource name, see L{Usage.fields}),
+    C{level} (C{app} or C{room}), C{n} (number of entries).
+    """
+    isLeaf = True
+
+    def data(self, request):
+        field = request.args.get('by', ['bytes_out'])[0]
+        level = request.args.get('level', ['room'])[0]
+        n = int(request.args.get('n', [config.getint('Stats', 'top')])[0])
+
+        return [usage.as_dict() for usage in accounting.top(field, n, level)]
+
+class ProfilerActionResource(JSONResource):
+    """
+    Profiler control: start, stop or reset (POST only).
+    """
+    isLeaf = True
+
+    def __init__(self, action):
+        """
+        Constructor.
+
+        @param action: C{'start'}, C{'stop'} or C{'reset'}
+        @type action: C{str}
+        """
+        JSONResource.__init__(self)
+        self.action = action
+
+    def render_GET(self, request):
+        request.setResponseCode(http.NOT_ALLOWED)
+        request.setHeader('allow', 'POST')
+        return ''
+
+    def render_POST(self, request):
+        return JSONResource.render_GET(self, request)
+
+    def data(self, request):
+        if self.action == 'start':
+            spans.enabled = True
+            profiler.start()
+        elif self.action == 'stop':
+            profiler.stop()
+            spans.enabled = False
+        else:
+            profiler.reset()
+
+        return ProfilerResource.status()
+
+class CollapsedStacksResource(resource.Resource):
+    """
+    Profiler samples in collapsed stack format (for flamegraphs).
+    """
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader('content-type', 'text/plain')
+        return profiler.collapsed()
+
+class ProfilerResource(JSONResource):
+    """
+    Sampling profiler status and control.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        JSONResource.__init__(self)
+        for action in ('start', 'stop', 'reset'):
+            self.putChild(action, ProfilerActionResource(action))
+        self.putChild('collapsed', CollapsedStacksResource())
+
+    def getChild(self, name, request):
+        if name == '':
+            return self
+        return JSONResource.getChild(self, name, request)
+
+    @staticmethod
+    def status():
+        """
+        Current profiler status.
+
+        @rtype: C{dict}
+        """
+        return { 'running' : profiler.running, 'spans' : spans.enabled, 'samples' : profiler.samples }
+
+    def data(self, request):
+        return self.status()
+
+class StatsResource(JSONResource):
+    """
+    Root statistics resource, replies with global metrics.
+
+    Access to this resource and its children is checked by L{allowed}.
+    """
+
+    token = config.get('Stats', 'token')
+    """
+    Access token (if empty, only local clients are allowed).
+    """
+
+    localHosts = ('127.0.0.1', '::1')
+    """
+    Addresses of local clients.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        JSONResource.__init__(self)
+        self.putChild('top', TopResource())
+        self.putChild('profiler', ProfilerResource())
+
+    def allowed(self, request):
+        """
+        Is request allowed to access statistics?
+
+        @param request: HTTP request
+        @type request: C{Request}
+        @rtype: C{bool}
+        """
+        if self.token:
+            return hmac.compare_digest(request.getHeader('authorization') or '', 'Bearer ' + self.token)
+
+        return getattr(request.getClientAddress(), 'host', None) in self.localHosts
+
+    def getChildWithDefault(self, name, request):
+        if not self.allowed(request):
+            return resource.ForbiddenResource()
+        return JSONResource.getChildWithDefault(self, name, request)
+
+    def getChild(self, name, request):
+        if name == '':
+            return self
+        return JSONResource.getChild(self, name, request)
+
+    def render(self, request):
+        if not self.allowed(request):
+            return resource.ForbiddenResource().render(request)
+        return JSONResource.render(self, request)
+
+    def data(self, request):
+        return metrics.snapshot()
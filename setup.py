@@ -13,7 +13,8 @@ setup(name='fmspy',
       author_email='me@smira.ru',
       url='http://fmspy.org/',
       keywords='flash rtmp twisted fms',
-      install_requires=['Twisted>=8.1.0', 'pyAMF>=0.4'],
+      install_requires=['Twisted>=18.4.0', 'pyAMF>=0.8.0'],
+      python_requires='>=2.7, <3',
       zip_safe=False,
       license='MIT',
       data_files=[('etc', ['fmspy.cfg']), ('share/examples/echotest', ['examples/echotest/index.html', 'examples/echotest/echo_test.swf']),
@@ -50,7 +51,8 @@ connections, RPC-over-HTTP, object persistence etc.
             'Operating System :: POSIX :: Linux',
             'Operating System :: POSIX :: BSD',
             'Programming Language :: Python',
-            'Programming Language :: Python :: 2.5',
+            'Programming Language :: Python :: 2',
+            'Programming Language :: Python :: 2.7',
             'Topic :: Communications',
             'Topic :: Internet',
             'Topic :: Multimedia :: Sound/Audio',
@@ -60,6 +62,10 @@ connections, RPC-over-HTTP, object persistence etc.
           'fmspy.application',
             'fmspy.application.tests',
           'fmspy.plugins', 
+          'fmspy.stats',
+            'fmspy.stats.tests',
+          'fmspy.hls',
+            'fmspy.hls.tests',
           'fmspy.rtmp', 
               'fmspy.rtmp.protocol', 
               'fmspy.rtmp.tests', 
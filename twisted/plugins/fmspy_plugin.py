@@ -19,7 +19,11 @@ class Options(usage.Options):
     optParameters = [
                         ["rtmp-port", None, 1935, "RTMP port"],
                         ["rtmp-interface", None, '', "RTMP bind address"],
+                        ["profile-output", None, None, "File to dump collapsed stacks of sampling profiler on shutdown"],
                     ]
+    optFlags = [
+                        ["profile", None, "Run sampling profiler of reactor thread"],
+               ]
 
 
 class FMSPyServiceMaker(object):
@@ -47,11 +51,28 @@ class FMSPyServiceMaker(object):
 
         s = service.MultiService()
 
-        h = internet.TCPServer(config.getint('RTMP', 'port'), RTMPServerFactory(), config.getint('RTMP', 'backlog'), config.get('RTMP', 'interface'))
+        rtmpFactory = RTMPServerFactory()
+
+        h = internet.TCPServer(config.getint('RTMP', 'port'), rtmpFactory, config.getint('RTMP', 'backlog'), config.get('RTMP', 'interface'))
         h.setServiceParent(s)
 
         log.msg('RTMP server at port %d.' % config.getint('RTMP', 'port'))
 
+        from fmspy.stats.profiler import profiler, ProfilerService
+
+        profiler.interval = config.getfloat('Stats', 'profileInterval')
+
+        if options['profile']:
+            h = ProfilerService(options['profile-output'])
+            h.setServiceParent(s)
+
+        from fmspy.stats.watchdog import ReactorWatchdog, invoke_watchdog
+
+        invoke_watchdog.threshold = config.getfloat('Stats', 'slowInvokeThreshold')
+
+        h = ReactorWatchdog(config.getfloat('Stats', 'lagInterval'), config.getfloat('Stats', 'lagThreshold'))
+        h.setServiceParent(s)
+
         from fmspy.application import app_factory
 
         def appsLoaded(_):
@@ -83,10 +104,25 @@ class FMSPyServiceMaker(object):
 
                 root.putChild('examples', static.File(examples_path))
 
-                h = internet.TCPServer(config.getint('HTTP', 'port'), server.Site(root))
-                h.setServiceParent(s)
+            if config.getboolean('Stats', 'enabled'):
+                from fmspy.stats.web import StatsResource
+
+                root.putChild('stats', StatsResource())
+
+            if config.getboolean('HLS', 'enabled'):
+                from fmspy.hls.web import HLSResource
+
+                root.putChild('hls', HLSResource(config.get('HLS', 'directory')))
+
+            if config.getboolean('RTMPT', 'enabled'):
+                from fmspy.rtmp.tunnel import RTMPTunnel
+
+                RTMPTunnel(rtmpFactory).install(root)
+
+            h = internet.TCPServer(config.getint('HTTP', 'port'), server.Site(root))
+            h.setServiceParent(s)
 
-                log.msg('HTTP server at port %d.' % config.getint('HTTP', 'port'))
+            log.msg('HTTP server at port %d.' % config.getint('HTTP', 'port'))
 
         log.removeObserver(observer.emit)
 